@@ -45,6 +45,14 @@ def create_app():
     except Exception as e:
         print(f"⚠️ Erro ao inicializar banco: {e}")
     
+    # Detecção do tenant (subdomínio, headers, API key ou usuário do JWT)
+    try:
+        from src.middleware.tenant_middleware import TenantMiddleware
+        TenantMiddleware(app)
+        print("✅ Middleware de tenant configurado")
+    except Exception as e:
+        print(f"⚠️ Erro ao configurar middleware de tenant: {e}")
+    
     # Registrar blueprints PRIMEIRO
     try:
         from src.routes import register_blueprints
@@ -122,7 +130,101 @@ def create_app():
         print("✅ Serviços inicializados")
     except Exception as e:
         print(f"⚠️ Erro ao inicializar serviços: {e}")
-    
+
+    # Iniciar workers em segundo plano
+    try:
+        from src.services.reminder_service import init_reminder_scheduler
+        if init_reminder_scheduler(app):
+            print("✅ Agendador de lembretes iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar agendador de lembretes: {e}")
+
+    try:
+        from src.services.email_outbox_service import init_email_outbox_worker
+        if init_email_outbox_worker(app):
+            print("✅ Worker da outbox de emails iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar worker da outbox de emails: {e}")
+
+    try:
+        from src.services.chat_outbox_service import init_chat_outbox_worker
+        if init_chat_outbox_worker(app):
+            print("✅ Worker da fila de mensagens do chatbot iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar worker da fila de mensagens do chatbot: {e}")
+
+    try:
+        from src.services.ai_gateway import init_ai_gateway
+        from src.services.chat_ai_responder import chat_ai_responder
+        init_ai_gateway(app)
+        chat_ai_responder.init_app(app)
+        print("✅ Gateway de IA iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar gateway de IA: {e}")
+
+    try:
+        from src.services.chat_broadcast_service import init_chat_broadcast_worker
+        if init_chat_broadcast_worker(app):
+            print("✅ Worker de envios em massa do WhatsApp iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar worker de envios em massa: {e}")
+
+    try:
+        from src.services.call_event_service import init_call_event_hub
+        if init_call_event_hub(app):
+            print("✅ Hub de eventos de chamada iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar hub de eventos de chamada: {e}")
+
+    try:
+        from src.services.wallboard_service import init_wallboard
+        if init_wallboard(app):
+            print("✅ Painel do call center iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar painel do call center: {e}")
+
+    try:
+        from src.services.cdr_sync_service import init_cdr_sync_worker
+        if init_cdr_sync_worker(app):
+            print("✅ Worker de sincronização de CDRs iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar worker de sincronização de CDRs: {e}")
+
+    try:
+        from src.services.chat_message_search import init_chat_message_search
+        if init_chat_message_search(app):
+            print("✅ Busca de mensagens do chatbot iniciada")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar busca de mensagens do chatbot: {e}")
+
+    try:
+        from src.services.chat_session_store import init_chat_session_store
+        if init_chat_session_store(app):
+            print("✅ Cache de estado das conversas iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar cache de estado das conversas: {e}")
+
+    try:
+        from src.services.flow_webhook_executor import flow_webhook_executor
+        flow_webhook_executor.init_app(app)
+        print("✅ Executor de webhooks dos fluxos iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar executor de webhooks dos fluxos: {e}")
+
+    try:
+        from src.services.chat_webhook_service import init_chat_webhook_processor
+        if init_chat_webhook_processor(app):
+            print("✅ Processador de webhooks do chatbot iniciado")
+    except Exception as e:
+        print(f"⚠️ Erro ao iniciar processador de webhooks do chatbot: {e}")
+
+    try:
+        from src.services.conversation_counter_service import init_conversation_counter_reconciler
+        if init_conversation_counter_reconciler(app):
+            print("✅ Reconciliação de contadores de conversas agendada")
+    except Exception as e:
+        print(f"⚠️ Erro ao agendar reconciliação de contadores de conversas: {e}")
+
     return app
 
 if __name__ == '__main__':
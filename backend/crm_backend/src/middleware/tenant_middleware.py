@@ -82,6 +82,11 @@ class TenantMiddleware:
         if tenant:
             return tenant
         
+        # 5. Tenant do usuário autenticado (JWT)
+        tenant = self.detect_by_jwt_user()
+        if tenant:
+            return tenant
+        
         return None
     
     def detect_by_subdomain(self) -> Optional[Tenant]:
@@ -169,6 +174,25 @@ class TenantMiddleware:
             logger.error(f"Erro ao detectar tenant por API key: {e}")
             return None
     
+    def detect_by_jwt_user(self) -> Optional[Tenant]:
+        """Detecta tenant pelo usuário do token JWT"""
+        try:
+            from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+            
+            verify_jwt_in_request(optional=True)
+            user_id = get_jwt_identity()
+            if not user_id:
+                return None
+            
+            user = User.query.get(user_id)
+            if user and user.tenant_id:
+                return Tenant.query.get(user.tenant_id)
+            return None
+            
+        except Exception as e:
+            logger.debug(f"Tenant não identificado pelo JWT: {e}")
+            return None
+    
     def is_system_route(self) -> bool:
         """Verifica se é uma rota de sistema que não precisa de tenant"""
         system_routes = [
@@ -79,7 +79,7 @@ except Exception as e:
                 setattr(self, key, value)
 
 try:
-    from .task import Task, TaskComment, TaskTimeLog, TaskTemplate, ActivitySummary
+    from .task import Task, TaskComment, TaskTimeLog, ActivitySummary
     logger.info("✅ Modelos Task importados")
 except Exception as e:
     logger.error(f"❌ Erro ao importar Task: {e}")
@@ -100,11 +100,6 @@ except Exception as e:
             for key, value in kwargs.items():
                 setattr(self, key, value)
     
-    class TaskTemplate:
-        def __init__(self, **kwargs):
-            for key, value in kwargs.items():
-                setattr(self, key, value)
-    
     class ActivitySummary:
         def __init__(self, **kwargs):
             for key, value in kwargs.items():
@@ -114,7 +109,7 @@ except Exception as e:
 __all__ = [
     'User', 'Lead', 'Permission', 'Role',
     'Pipeline', 'PipelineStage', 'Opportunity', 'Product',
-    'Task', 'TaskComment', 'TaskTimeLog', 'TaskTemplate', 'ActivitySummary'
+    'Task', 'TaskComment', 'TaskTimeLog', 'ActivitySummary'
 ]
 
 logger.info(f"🎉 Módulo de modelos inicializado com {len(__all__)} classes")
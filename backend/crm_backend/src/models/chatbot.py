@@ -1,9 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, case, inspect, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 from src.models.user import db
 from datetime import datetime
 import uuid
 import json
 
+MESSAGE_PREVIEW_LENGTH = 255
+
 class ChatFlow(db.Model):
     """Fluxos de conversa estilo Typebot."""
     __tablename__ = 'chat_flows'
@@ -62,10 +67,12 @@ class ChatConversation(db.Model):
     __tablename__ = 'chat_conversations'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))
     
     # Identificação do contato
     phone_number = db.Column(db.String(20), nullable=False)  # Número do WhatsApp
     contact_name = db.Column(db.String(255))  # Nome do contato
+    integration_id = db.Column(db.String(36), db.ForeignKey('chat_integrations.id'))  # Número pelo qual o contato escreveu
     
     # Relacionamento com lead (se existir)
     lead_id = db.Column(db.String(36), db.ForeignKey('leads.id'))
@@ -74,6 +81,9 @@ class ChatConversation(db.Model):
     flow_id = db.Column(db.String(36), db.ForeignKey('chat_flows.id'))
     current_step = db.Column(db.String(100))  # Etapa atual do fluxo
     flow_variables = db.Column(db.JSON, default=dict)  # Variáveis coletadas no fluxo
+    flow_pending_token = db.Column(db.String(36))  # Webhook em andamento na etapa atual
+    flow_pending_since = db.Column(db.DateTime)
+    flow_state_version = db.Column(db.Integer, default=0, nullable=False)  # Gravações do estado do fluxo
     
     # Status da conversa
     status = db.Column(db.String(50), default='active')  # active, paused, completed, transferred
@@ -85,10 +95,29 @@ class ChatConversation(db.Model):
     language = db.Column(db.String(10), default='pt-BR')  # Idioma da conversa
     timezone = db.Column(db.String(50), default='America/Sao_Paulo')  # Fuso horário
     
+    # Fila de saída (envio ordenado por conversa)
+    outbound_sequence = db.Column(db.Integer, default=0, nullable=False)  # Última sequência atribuída
+    outbox_lease_owner = db.Column(db.String(100))  # Worker que está enviando
+    outbox_lease_expires_at = db.Column(db.DateTime)
+    
+    # Contadores desnormalizados (mantidos a cada flush de ChatMessage)
+    message_count = db.Column(db.Integer, default=0, nullable=False)  # Número total de mensagens
+    unread_count = db.Column(db.Integer, default=0, nullable=False)  # Recebidas e não lidas
+    last_message_id = db.Column(db.String(36))
+    last_message_preview = db.Column(db.String(MESSAGE_PREVIEW_LENGTH))
+    last_message_direction = db.Column(db.String(20))
+    last_message_at = db.Column(db.DateTime)
+    
+    # Contexto da IA (resumo incremental das mensagens fora da janela)
+    context_summary = db.Column(db.Text)
+    context_summary_until = db.Column(db.DateTime)  # created_at da última mensagem resumida
+    
     # Metadados
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
     ended_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_sequence = db.Column(db.BigInteger, default=0, nullable=False)  # Sequência de alterações do tenant (sincronização)
     
     # Relacionamentos
     lead = db.relationship('Lead', backref='chat_conversations')
@@ -98,23 +127,27 @@ class ChatConversation(db.Model):
     @property
     def last_message(self):
         """Última mensagem da conversa."""
-        return self.messages.order_by(ChatMessage.created_at.desc()).first()
+        return ChatMessage.query.get(self.last_message_id) if self.last_message_id else None
     
-    @property
-    def message_count(self):
-        """Número total de mensagens."""
-        return self.messages.count()
+    __table_args__ = (
+        db.Index('ix_chat_conversations_inbox', 'tenant_id', 'status', 'last_activity'),
+        db.Index('ix_chat_conversations_tenant_activity', 'tenant_id', 'last_activity'),
+        db.Index('ix_chat_conversations_tenant_updated', 'tenant_id', 'updated_at'),
+        db.Index('ix_chat_conversations_tenant_sequence', 'tenant_id', 'change_sequence'),
+    )
     
-    @property
-    def unread_count(self):
-        """Número de mensagens não lidas."""
-        return self.messages.filter_by(is_read=False, direction='incoming').count()
+    @classmethod
+    def inbox_options(cls):
+        """Carrega lead, fluxo e atendente na mesma consulta da listagem."""
+        return (joinedload(cls.lead), joinedload(cls.flow), joinedload(cls.assignee))
     
     def to_dict(self, include_messages=False):
         data = {
             'id': self.id,
+            'tenant_id': self.tenant_id,
             'phone_number': self.phone_number,
             'contact_name': self.contact_name,
+            'integration_id': self.integration_id,
             'lead_id': self.lead_id,
             'flow_id': self.flow_id,
             'current_step': self.current_step,
@@ -128,8 +161,9 @@ class ChatConversation(db.Model):
             'started_at': self.started_at.isoformat() if self.started_at else None,
             'last_activity': self.last_activity.isoformat() if self.last_activity else None,
             'ended_at': self.ended_at.isoformat() if self.ended_at else None,
-            'message_count': self.message_count,
-            'unread_count': self.unread_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'message_count': self.message_count or 0,
+            'unread_count': self.unread_count or 0,
             'lead': {
                 'id': self.lead.id,
                 'name': self.lead.name,
@@ -144,7 +178,12 @@ class ChatConversation(db.Model):
                 'id': self.assignee.id,
                 'name': f"{self.assignee.first_name} {self.assignee.last_name}"
             } if self.assignee else None,
-            'last_message': self.last_message.to_dict() if self.last_message else None
+            'last_message': {
+                'id': self.last_message_id,
+                'content': self.last_message_preview,
+                'direction': self.last_message_direction,
+                'created_at': self.last_message_at.isoformat() if self.last_message_at else None
+            } if self.last_message_id else None
         }
         
         if include_messages:
@@ -181,7 +220,14 @@ class ChatMessage(db.Model):
     
     # Metadados externos (WhatsApp, etc.)
     external_id = db.Column(db.String(255))  # ID da mensagem no sistema externo
-    external_status = db.Column(db.String(50))  # Status no sistema externo
+    external_status = db.Column(db.String(50))  # pending, sent, delivered, read, failed
+    
+    # Fila de saída
+    sequence = db.Column(db.Integer)  # Ordem de envio dentro da conversa
+    payload = db.Column(db.JSON)  # Botões/seções de mensagens interativas
+    send_attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    send_error = db.Column(db.Text)
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -190,6 +236,13 @@ class ChatMessage(db.Model):
     # Relacionamentos
     sender = db.relationship('User', backref='sent_messages')
     
+    __table_args__ = (
+        db.Index('ix_chat_messages_outbox', 'direction', 'external_status', 'next_attempt_at'),
+        db.Index('ix_chat_messages_conversation_sequence', 'conversation_id', 'sequence'),
+        db.Index('ix_chat_messages_external_id', 'external_id'),
+        db.Index('ix_chat_messages_conversation_created', 'conversation_id', 'created_at'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -208,6 +261,9 @@ class ChatMessage(db.Model):
             'ai_confidence': self.ai_confidence,
             'external_id': self.external_id,
             'external_status': self.external_status,
+            'sequence': self.sequence,
+            'send_attempts': self.send_attempts,
+            'send_error': self.send_error,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'sender': {
@@ -216,11 +272,134 @@ class ChatMessage(db.Model):
             } if self.sender else None
         }
 
+def _update_conversation_counters(session, flush_context):
+    """
+    Atualiza os contadores das conversas a partir das mensagens deste flush
+
+    Executado em after_flush: new/dirty/deleted e o histórico dos atributos
+    ainda refletem o estado anterior ao flush, e as mensagens novas já têm
+    created_at preenchido.
+    """
+    changes = {}  # conversation_id -> {'count', 'unread', 'last'}
+
+    def change(conversation_id):
+        return changes.setdefault(conversation_id, {'count': 0, 'unread': 0, 'last': None})
+
+    for obj in session.new:
+        if isinstance(obj, ChatMessage) and obj.conversation_id:
+            item = change(obj.conversation_id)
+            item['count'] += 1
+            if obj.direction == 'incoming' and not obj.is_read:
+                item['unread'] += 1
+            if item['last'] is None or (obj.created_at or datetime.min) >= (item['last'].created_at or datetime.min):
+                item['last'] = obj
+
+    for obj in session.dirty:
+        if isinstance(obj, ChatMessage) and obj.direction == 'incoming':
+            history = inspect(obj).attrs.is_read.history
+            if history.has_changes():
+                was_read = bool(history.deleted[0]) if history.deleted else False
+                if was_read != bool(obj.is_read):
+                    change(obj.conversation_id)['unread'] += -1 if obj.is_read else 1
+
+    for obj in session.deleted:
+        if isinstance(obj, ChatMessage):
+            item = change(obj.conversation_id)
+            item['count'] -= 1
+            if obj.direction == 'incoming' and not obj.is_read:
+                item['unread'] -= 1
+
+    # Conversas alteradas pelo ORM (criadas, atribuídas, encerradas...)
+    touched = set(changes)
+    for obj in session.new:
+        if isinstance(obj, ChatConversation):
+            touched.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, ChatConversation) and session.is_modified(obj, include_collections=False):
+            touched.add(obj.id)
+    if touched:
+        stamp_conversation_changes(session.connection(), touched)
+
+    if not changes:
+        return
+
+    table = ChatConversation.__table__
+    connection = session.connection()
+    now = datetime.utcnow()
+    for conversation_id, item in changes.items():
+        values = {'updated_at': now}
+        if item['count']:
+            values['message_count'] = table.c.message_count + item['count']
+        if item['unread']:
+            unread = table.c.unread_count + item['unread']
+            values['unread_count'] = case((unread < 0, 0), else_=unread)
+        connection.execute(table.update().where(table.c.id == conversation_id).values(**values))
+
+        last = item['last']
+        if last is not None:
+            # Só substitui a última mensagem se esta for mais recente
+            created_at = last.created_at or datetime.utcnow()
+            connection.execute(
+                table.update()
+                .where(table.c.id == conversation_id)
+                .where(or_(table.c.last_message_at.is_(None), table.c.last_message_at <= created_at))
+                .values(
+                    last_message_id=last.id,
+                    last_message_preview=(last.content or '')[:MESSAGE_PREVIEW_LENGTH],
+                    last_message_direction=last.direction,
+                    last_message_at=created_at,
+                    last_activity=created_at
+                )
+            )
+
+
+def stamp_conversation_changes(connection, conversation_ids) -> None:
+    """
+    Grava nas conversas o próximo valor da sequência de alterações do tenant
+
+    O UPDATE no contador do tenant mantém a linha bloqueada até o commit, então
+    transações concorrentes recebem valores na ordem em que confirmam e uma
+    alteração confirmada depois nunca fica abaixo de um token já entregue.
+    """
+    table = ChatConversation.__table__
+    by_tenant = {}
+    for conversation_id, tenant_id in connection.execute(
+        select(table.c.id, table.c.tenant_id).where(table.c.id.in_(list(conversation_ids)))
+    ):
+        by_tenant.setdefault(tenant_id or '', []).append(conversation_id)
+
+    counters = ChatSyncSequence.__table__
+    for tenant_id, ids in by_tenant.items():
+        increment = counters.update().where(counters.c.tenant_id == tenant_id) \
+            .values(last_value=counters.c.last_value + 1)
+        if not connection.execute(increment).rowcount:
+            try:
+                with connection.begin_nested():
+                    connection.execute(counters.insert().values(tenant_id=tenant_id, last_value=1))
+            except IntegrityError:
+                connection.execute(increment)  # Criado por outra transação
+        sequence = connection.execute(
+            select(counters.c.last_value).where(counters.c.tenant_id == tenant_id)
+        ).scalar()
+        connection.execute(table.update().where(table.c.id.in_(ids)).values(change_sequence=sequence))
+
+
+event.listen(Session, 'after_flush', _update_conversation_counters)
+
+
+class ChatSyncSequence(db.Model):
+    """Última sequência de alteração de conversas por tenant (tokens de sincronização)"""
+    __tablename__ = 'chat_sync_sequences'
+    
+    tenant_id = db.Column(db.String(36), primary_key=True)  # '' para conversas sem tenant
+    last_value = db.Column(db.BigInteger, default=0, nullable=False)
+
 class ChatIntegration(db.Model):
     """Configurações de integração (WhatsApp, Evolution API, etc.)."""
     __tablename__ = 'chat_integrations'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))  # Tenant dono do número (obrigatório para receber webhooks)
     name = db.Column(db.String(255), nullable=False)  # Nome da integração
     provider = db.Column(db.String(100), nullable=False)  # whatsapp_business, evolution_api, etc.
     
@@ -255,6 +434,7 @@ class ChatIntegration(db.Model):
     def to_dict(self):
         return {
             'id': self.id,
+            'tenant_id': self.tenant_id,
             'name': self.name,
             'provider': self.provider,
             'api_url': self.api_url,
@@ -275,6 +455,54 @@ class ChatIntegration(db.Model):
             } if self.creator else None
         }
 
+class ChatWebhookEvent(db.Model):
+    """Evento bruto recebido dos webhooks (buffer de entrada)."""
+    __tablename__ = 'chat_webhook_events'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    integration_id = db.Column(db.String(36), db.ForeignKey('chat_integrations.id'))
+    tenant_id = db.Column(db.String(36))
+    provider = db.Column(db.String(100), nullable=False)  # whatsapp_business, evolution_api
+    
+    # Identificação do evento
+    external_id = db.Column(db.String(255), nullable=False)  # ID da mensagem (ou ID:status para recibos)
+    event_type = db.Column(db.String(20), nullable=False)  # message, status
+    phone_number = db.Column(db.String(20))  # Contato (agrupa o processamento por conversa)
+    payload = db.Column(db.JSON, nullable=False)  # Evento normalizado + dados brutos
+    occurred_at = db.Column(db.DateTime)  # Timestamp informado pelo provedor
+    
+    # Processamento
+    status = db.Column(db.String(20), default='pending')  # pending, processing, processed, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'external_id', name='uq_chat_webhook_events_external'),
+        db.Index('ix_chat_webhook_events_status_received', 'status', 'received_at'),
+        db.Index('ix_chat_webhook_events_phone', 'phone_number', 'status'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'integration_id': self.integration_id,
+            'provider': self.provider,
+            'external_id': self.external_id,
+            'event_type': self.event_type,
+            'phone_number': self.phone_number,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'occurred_at': self.occurred_at.isoformat() if self.occurred_at else None,
+            'received_at': self.received_at.isoformat() if self.received_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
 class ChatAIConfig(db.Model):
     """Configurações da IA (OpenAI)."""
     __tablename__ = 'chat_ai_config'
@@ -291,6 +519,8 @@ class ChatAIConfig(db.Model):
     # Prompt do sistema
     system_prompt = db.Column(db.Text, nullable=False)  # Prompt base do sistema
     context_window = db.Column(db.Integer, default=10)  # Janela de contexto (mensagens)
+    context_token_budget = db.Column(db.Integer, default=3000)  # Máximo de tokens do prompt (sistema + resumo + janela)
+    summary_max_tokens = db.Column(db.Integer, default=300)  # Tamanho máximo do resumo acumulado
     
     # Configurações de comportamento
     fallback_enabled = db.Column(db.Boolean, default=True)  # IA como fallback
@@ -322,6 +552,8 @@ class ChatAIConfig(db.Model):
             'temperature': self.temperature,
             'system_prompt': self.system_prompt,
             'context_window': self.context_window,
+            'context_token_budget': self.context_token_budget,
+            'summary_max_tokens': self.summary_max_tokens,
             'fallback_enabled': self.fallback_enabled,
             'auto_handoff': self.auto_handoff,
             'handoff_keywords': self.handoff_keywords,
@@ -338,3 +570,194 @@ class ChatAIConfig(db.Model):
             } if self.creator else None
         }
 
+
+class ChatAIUsage(db.Model):
+    """Consumo de tokens das chamadas à IA (gravado em lote)."""
+    __tablename__ = 'chat_ai_usage'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))
+    conversation_id = db.Column(db.String(36))
+    model = db.Column(db.String(100))
+    
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Integer)
+    success = db.Column(db.Boolean, default=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_chat_ai_usage_tenant_created', 'tenant_id', 'created_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'conversation_id': self.conversation_id,
+            'model': self.model,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'latency_ms': self.latency_ms,
+            'success': self.success,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ChatKnowledgeEntry(db.Model):
+    """Pergunta frequente da base de conhecimento do chatbot (por tenant)."""
+    __tablename__ = 'chat_knowledge_entries'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))
+    
+    question = db.Column(db.Text, nullable=False)  # Pergunta principal
+    alternatives = db.Column(db.JSON, default=list)  # Outras formas de perguntar
+    answer = db.Column(db.Text, nullable=False)  # Resposta enviada ao contato
+    tags = db.Column(db.JSON, default=list)
+    
+    is_active = db.Column(db.Boolean, default=True)
+    hits = db.Column(db.Integer, default=0)  # Respostas dadas por esta entrada
+    
+    created_by = db.Column(db.String(36), db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_chat_knowledge_entries_tenant', 'tenant_id', 'is_active'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'question': self.question,
+            'alternatives': self.alternatives or [],
+            'answer': self.answer,
+            'tags': self.tags or [],
+            'is_active': self.is_active,
+            'hits': self.hits,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ChatBroadcast(db.Model):
+    """Envio em massa de template do WhatsApp para um segmento de leads."""
+    __tablename__ = 'chat_broadcasts'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))
+    name = db.Column(db.String(255), nullable=False)
+    integration_id = db.Column(db.String(36), db.ForeignKey('chat_integrations.id'), nullable=False)
+    
+    # Mensagem
+    template_name = db.Column(db.String(255))  # Template aprovado (WhatsApp Cloud API)
+    template_language = db.Column(db.String(20), default='pt_BR')
+    template_parameters = db.Column(db.JSON, default=list)  # Parâmetros do corpo, com variáveis {nome}
+    message_text = db.Column(db.Text)  # Texto livre (Evolution API)
+    
+    # Público
+    audience = db.Column(db.JSON, default=dict)  # Filtro: tags, status, source, owner_id
+    audience_cursor = db.Column(db.String(36))  # Último lead lido (retomada da seleção)
+    audience_complete = db.Column(db.Boolean, default=False)
+    
+    # Envio
+    messaging_tier = db.Column(db.String(20), default='tier_1k')  # Limite diário de contatos da Meta
+    rate_per_second = db.Column(db.Float)  # Sem valor: CHAT_BROADCAST_RATE_PER_SECOND
+    status = db.Column(db.String(20), default='draft')  # draft, running, paused, completed, cancelled
+    last_error = db.Column(db.Text)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    
+    # Contadores (atualizados em lote a partir dos destinatários)
+    total_recipients = db.Column(db.Integer, default=0, nullable=False)
+    sent_count = db.Column(db.Integer, default=0, nullable=False)
+    delivered_count = db.Column(db.Integer, default=0, nullable=False)
+    read_count = db.Column(db.Integer, default=0, nullable=False)
+    failed_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Metadados
+    created_by = db.Column(db.String(36), db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_chat_broadcasts_tenant_created', 'tenant_id', 'created_at'),
+        db.Index('ix_chat_broadcasts_status', 'status'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'name': self.name,
+            'integration_id': self.integration_id,
+            'template_name': self.template_name,
+            'template_language': self.template_language,
+            'template_parameters': self.template_parameters or [],
+            'message_text': self.message_text,
+            'audience': self.audience or {},
+            'audience_complete': bool(self.audience_complete),
+            'messaging_tier': self.messaging_tier,
+            'rate_per_second': self.rate_per_second,
+            'status': self.status,
+            'last_error': self.last_error,
+            'total_recipients': self.total_recipients or 0,
+            'sent_count': self.sent_count or 0,
+            'delivered_count': self.delivered_count or 0,
+            'read_count': self.read_count or 0,
+            'failed_count': self.failed_count or 0,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class ChatBroadcastRecipient(db.Model):
+    """Destinatário de um envio em massa (progresso e recibos)."""
+    __tablename__ = 'chat_broadcast_recipients'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    broadcast_id = db.Column(db.String(36), db.ForeignKey('chat_broadcasts.id'), nullable=False)
+    lead_id = db.Column(db.String(36))
+    phone_number = db.Column(db.String(20), nullable=False)  # Só dígitos
+    variables = db.Column(db.JSON, default=dict)  # Dados do lead para os parâmetros do template
+    
+    status = db.Column(db.String(20), default='pending')  # pending, sent, delivered, read, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    external_id = db.Column(db.String(255))  # ID da mensagem no provedor
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    delivered_at = db.Column(db.DateTime)
+    read_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('broadcast_id', 'phone_number', name='uq_chat_broadcast_recipients_phone'),
+        db.Index('ix_chat_broadcast_recipients_status', 'broadcast_id', 'status'),
+        db.Index('ix_chat_broadcast_recipients_external', 'external_id'),
+        db.Index('ix_chat_broadcast_recipients_sent', 'sent_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'broadcast_id': self.broadcast_id,
+            'lead_id': self.lead_id,
+            'phone_number': self.phone_number,
+            'status': self.status,
+            'attempts': self.attempts,
+            'external_id': self.external_id,
+            'error': self.error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
+            'read_at': self.read_at.isoformat() if self.read_at else None
+        }
@@ -0,0 +1,53 @@
+"""
+Modelo da caixa de saída de emails (outbox transacional)
+"""
+from src.models.user import db
+from datetime import datetime
+import uuid
+
+class EmailOutbox(db.Model):
+    """Email pendente de envio, gravado na mesma transação da alteração de negócio"""
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36))
+    user_id = db.Column(db.String(36))  # Usuário em nome de quem o email foi enviado (vazio: sistema)
+    
+    # Mensagem
+    to_email = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    subject = db.Column(db.String(500), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    is_html = db.Column(db.Boolean, default=True)
+    
+    # Controle de envio
+    status = db.Column(db.String(20), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_tenant_status', 'tenant_id', 'status'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'to_email': self.to_email,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
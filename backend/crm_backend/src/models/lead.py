@@ -1,12 +1,10 @@
 """
 Modelo para Leads
 """
-from flask_sqlalchemy import SQLAlchemy
+from src.models.user import db
 from datetime import datetime
 import uuid
 
-db = SQLAlchemy()
-
 class Lead(db.Model):
     """Modelo para Leads"""
     __tablename__ = 'leads'
@@ -67,3 +65,35 @@ class Lead(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+class LeadPhone(db.Model):
+    """Índice dos telefones dos leads normalizados (E.164) para identificação de chamadas e conversas"""
+    __tablename__ = 'lead_phones'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36), nullable=False)
+    lead_id = db.Column(db.String(36), db.ForeignKey('leads.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # phone, whatsapp
+    number = db.Column(db.String(20), nullable=False)  # E.164, ex.: +5511999999999
+    match_key = db.Column(db.String(20), nullable=False)  # Número sem o 9º dígito (ver phone_index_service)
+    
+    __table_args__ = (
+        db.UniqueConstraint('lead_id', 'kind', name='uq_lead_phones_lead_kind'),
+        db.Index('ix_lead_phones_tenant_key', 'tenant_id', 'match_key'),
+    )
+    
+    def to_dict(self):
+        return {
+            'lead_id': self.lead_id,
+            'kind': self.kind,
+            'number': self.number
+        }
+
+
+class LeadPhoneVersion(db.Model):
+    """Versão do índice de telefones por tenant (invalida os mapas em memória dos outros processos)"""
+    __tablename__ = 'lead_phone_versions'
+    
+    tenant_id = db.Column(db.String(36), primary_key=True)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
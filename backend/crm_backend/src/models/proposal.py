@@ -3,7 +3,6 @@ from src.models.user import db
 from datetime import datetime
 import uuid
 import json
-import re
 
 class ProposalTemplate(db.Model):
     """Template de proposta com variáveis dinâmicas."""
@@ -37,32 +36,26 @@ class ProposalTemplate(db.Model):
     proposals = db.relationship('Proposal', backref='template', lazy='dynamic')
     
     def get_variables_from_content(self):
-        """Extrai variáveis do conteúdo usando regex."""
-        pattern = r'\{([^}]+)\}'
-        variables = re.findall(pattern, self.content)
-        if self.subject:
-            variables.extend(re.findall(pattern, self.subject))
-        if self.footer_text:
-            variables.extend(re.findall(pattern, self.footer_text))
+        """Extrai variáveis do conteúdo, assunto e rodapé."""
+        from src.services.template_engine import compile_template
+
+        variables = []
+        for text in (self.content, self.subject, self.footer_text):
+            if text:
+                variables.extend(compile_template(text).variables)
         return list(set(variables))
     
     def render_content(self, variables_data):
-        """Renderiza o conteúdo substituindo as variáveis."""
-        content = self.content
-        subject = self.subject or ""
-        footer = self.footer_text or ""
-        
-        for var_name, var_value in variables_data.items():
-            placeholder = f"{{{var_name}}}"
-            content = content.replace(placeholder, str(var_value or ""))
-            subject = subject.replace(placeholder, str(var_value or ""))
-            footer = footer.replace(placeholder, str(var_value or ""))
-        
-        return {
-            'content': content,
-            'subject': subject,
-            'footer': footer
-        }
+        """Renderiza o conteúdo substituindo as variáveis (uma passada por campo)."""
+        from src.services.template_engine import render_fields
+
+        rendered, missing = render_fields({
+            'content': self.content,
+            'subject': self.subject,
+            'footer': self.footer_text
+        }, variables_data, none_as_empty=True)
+        rendered['missing_variables'] = missing
+        return rendered
     
     def to_dict(self):
         return {
@@ -1,12 +1,10 @@
 """
 Modelos para Tarefas e Atividades
 """
-from flask_sqlalchemy import SQLAlchemy
+from src.models.user import db
 from datetime import datetime
 import uuid
 
-db = SQLAlchemy()
-
 class Task(db.Model):
     """Modelo para Tarefas"""
     __tablename__ = 'tasks'
@@ -21,8 +19,14 @@ class Task(db.Model):
     
     # Datas
     due_date = db.Column(db.DateTime)
+    due_time = db.Column(db.Time)
     completed_at = db.Column(db.DateTime)
     
+    # Lembretes
+    reminder_minutes = db.Column(db.Integer)  # Minutos antes do vencimento
+    email_reminder = db.Column(db.Boolean, default=True)
+    sms_reminder = db.Column(db.Boolean, default=False)
+    
     # Relacionamentos
     assigned_to = db.Column(db.String(36), nullable=False)  # Usuário responsável
     created_by = db.Column(db.String(36), nullable=False)  # Quem criou
@@ -54,12 +58,61 @@ class TimeLog(db.Model):
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     description = db.Column(db.String(500))
-    hours = db.Column(db.Decimal(4, 2), nullable=False)
+    hours = db.Column(db.Numeric(4, 2), nullable=False)
     date = db.Column(db.Date, nullable=False)
     task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=False)
     user_id = db.Column(db.String(36), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class TaskTimeLog(db.Model):
+    """Registro de tempo trabalhado em uma tarefa (intervalo início/fim)"""
+    __tablename__ = 'task_time_logs'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=False)
+    
+    # Desnormalizados da tarefa para agregações sem join
+    tenant_id = db.Column(db.String(36))
+    lead_id = db.Column(db.String(36))
+    
+    # Intervalo
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime)
+    duration_minutes = db.Column(db.Integer, default=0)
+    work_date = db.Column(db.Date)  # Dia do início, usado nos timesheets
+    
+    description = db.Column(db.String(500))
+    logged_by = db.Column(db.String(36), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_task_time_logs_tenant_user_date', 'tenant_id', 'logged_by', 'work_date'),
+        db.Index('ix_task_time_logs_task', 'task_id'),
+        db.Index('ix_task_time_logs_lead', 'lead_id'),
+    )
+    
+    def calculate_duration(self):
+        """Calcula a duração em minutos a partir do intervalo"""
+        if self.start_time:
+            self.work_date = self.start_time.date()
+        if self.start_time and self.end_time:
+            self.duration_minutes = max(int((self.end_time - self.start_time).total_seconds() // 60), 0)
+        return self.duration_minutes
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'lead_id': self.lead_id,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'duration_minutes': self.duration_minutes,
+            'work_date': self.work_date.isoformat() if self.work_date else None,
+            'description': self.description,
+            'logged_by': self.logged_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class Activity(db.Model):
     """Modelo para Atividades/Histórico"""
     __tablename__ = 'activities'
@@ -77,5 +130,98 @@ class Activity(db.Model):
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     scheduled_at = db.Column(db.DateTime)  # Para atividades agendadas
 
+
+class TaskReminder(db.Model):
+    """Índice persistente de lembretes de tarefas (um registro por canal)"""
+    __tablename__ = 'task_reminders'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    task_id = db.Column(db.String(36), db.ForeignKey('tasks.id'), nullable=False)
+    tenant_id = db.Column(db.String(36))
+    channel = db.Column(db.String(10), nullable=False)  # email, sms
+    
+    # Agendamento
+    due_at = db.Column(db.DateTime, nullable=False)  # Momento de disparo do lembrete
+    status = db.Column(db.String(20), default='pending')  # pending, leased, sent, cancelled, failed
+    
+    # Lease entre workers (evita envio duplicado)
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    
+    # Resultado
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('task_id', 'channel', name='uq_task_reminders_task_channel'),
+        db.Index('ix_task_reminders_status_due_at', 'status', 'due_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'channel': self.channel,
+            'due_at': self.due_at.isoformat() if self.due_at else None,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+class ActivitySummary(db.Model):
+    """Contadores diários de atividade por usuário (mantidos incrementalmente)"""
+    __tablename__ = 'activity_summaries'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), nullable=False)
+    tenant_id = db.Column(db.String(36))
+    date = db.Column(db.Date, nullable=False)
+    
+    # Contadores
+    tasks_created = db.Column(db.Integer, default=0, nullable=False)
+    tasks_completed = db.Column(db.Integer, default=0, nullable=False)
+    time_logged_minutes = db.Column(db.Integer, default=0, nullable=False)
+    calls = db.Column(db.Integer, default=0, nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+    emails = db.Column(db.Integer, default=0, nullable=False)
+    meetings = db.Column(db.Integer, default=0, nullable=False)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'date', name='uq_activity_summaries_user_date'),
+        db.Index('ix_activity_summaries_tenant_date', 'tenant_id', 'date'),
+    )
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'tenant_id': self.tenant_id,
+            'date': self.date.isoformat() if self.date else None,
+            'tasks_created': self.tasks_created,
+            'tasks_completed': self.tasks_completed,
+            'time_logged_minutes': self.time_logged_minutes,
+            'calls': self.calls,
+            'messages': self.messages,
+            'emails': self.emails,
+            'meetings': self.meetings
+        }
+
+class CalendarFeedState(db.Model):
+    """Versão das tarefas de um usuário para o feed iCalendar (ETag)"""
+    __tablename__ = 'calendar_feed_states'
+    
+    user_id = db.Column(db.String(36), primary_key=True)
+    feed_token = db.Column(db.String(64), unique=True, nullable=False)  # Token secreto da URL do feed
+    version = db.Column(db.Integer, default=1, nullable=False)  # Incrementada a cada alteração de tarefa
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
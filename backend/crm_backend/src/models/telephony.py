@@ -1,49 +1,151 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.user import db
 from datetime import datetime
-
-db = SQLAlchemy()
+import uuid
 
 class Call(db.Model):
+    """Registro de chamada (CDR)."""
     __tablename__ = 'calls'
-    id = db.Column(db.Integer, primary_key=True)
-    lead_id = db.Column(db.Integer, db.ForeignKey('leads.id'), nullable=True)
-    opportunity_id = db.Column(db.Integer, db.ForeignKey('opportunities.id'), nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36), nullable=False)
+    lead_id = db.Column(db.String(36), db.ForeignKey('leads.id'), nullable=True)
+    opportunity_id = db.Column(db.String(36), nullable=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)  # Atendente (vazio se não atendida)
     phone_number = db.Column(db.String(20), nullable=False)
     direction = db.Column(db.String(10), nullable=False)  # 'inbound' or 'outbound'
+    queue = db.Column(db.String(50), nullable=True)  # Fila de atendimento do PABX
     duration = db.Column(db.Integer, nullable=True)  # in seconds
     status = db.Column(db.String(20), nullable=False)  # 'completed', 'missed', 'failed', 'in_progress'
-    start_time = db.Column(db.DateTime, default=datetime.utcnow)
+    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    answered_at = db.Column(db.DateTime, nullable=True)
     end_time = db.Column(db.DateTime, nullable=True)
     recording_url = db.Column(db.String(255), nullable=True)
-    external_call_id = db.Column(db.String(50), unique=True, nullable=True) # ID from PABX API
+    external_call_id = db.Column(db.String(50), nullable=True) # ID from PABX API
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Histórico paginado por (start_time DESC, id DESC) dentro do tenant
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'external_call_id', name='uq_calls_tenant_external'),
+        db.Index('ix_calls_tenant_start', 'tenant_id', 'start_time', 'id'),
+        db.Index('ix_calls_tenant_user_start', 'tenant_id', 'user_id', 'start_time', 'id'),
+        db.Index('ix_calls_tenant_phone', 'tenant_id', 'phone_number', 'start_time'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
+            'tenant_id': self.tenant_id,
             'lead_id': self.lead_id,
             'opportunity_id': self.opportunity_id,
             'user_id': self.user_id,
             'phone_number': self.phone_number,
             'direction': self.direction,
+            'queue': self.queue,
             'duration': self.duration,
             'status': self.status,
             'start_time': self.start_time.isoformat() if self.start_time else None,
+            'answered_at': self.answered_at.isoformat() if self.answered_at else None,
             'end_time': self.end_time.isoformat() if self.end_time else None,
             'recording_url': self.recording_url,
             'external_call_id': self.external_call_id,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class CdrSyncState(db.Model):
+    """Configuração do PABX por tenant: sincronização de CDRs (high-watermark) e token do webhook de eventos."""
+    __tablename__ = 'cdr_sync_states'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36), nullable=False, unique=True)
+    api_url = db.Column(db.String(255), nullable=True)  # Vazio: JTTELECOM_PABX_URL
+    auth_user = db.Column(db.String(100), nullable=True)  # Vazio: JTTELECOM_PABX_AUTH_USER
+    auth_token = db.Column(db.String(255), nullable=True)  # Vazio: JTTELECOM_PABX_AUTH_TOKEN
+    webhook_token = db.Column(db.String(100), nullable=True)  # Token do webhook de eventos de chamada
+    is_active = db.Column(db.Boolean, default=True)
+    cursor_time = db.Column(db.DateTime, nullable=True)  # Início da chamada mais recente já importada
+    last_sync_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    imported_count = db.Column(db.Integer, default=0)
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'api_url': self.api_url,
+            'auth_user': self.auth_user,
+            'has_auth_token': bool(self.auth_token),
+            'has_webhook_token': bool(self.webhook_token),
+            'is_active': self.is_active,
+            'cursor_time': self.cursor_time.isoformat() if self.cursor_time else None,
+            'last_sync_at': self.last_sync_at.isoformat() if self.last_sync_at else None,
+            'last_error': self.last_error,
+            'imported_count': self.imported_count or 0
+        }
+
+class CallEvent(db.Model):
+    """Log compacto, somente inserção, dos eventos do PABX: chamadas (dialing, ringing, answered, hangup) e operadores (login, pause...)."""
+    __tablename__ = 'call_events'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    tenant_id = db.Column(db.String(36), nullable=False)
+    call_id = db.Column(db.String(36), nullable=True)
+    external_call_id = db.Column(db.String(50), nullable=True)
+    event_type = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.String(36), nullable=True)
+    extension = db.Column(db.String(20), nullable=True)
+    phone_number = db.Column(db.String(20), nullable=True)
+    direction = db.Column(db.String(10), nullable=True)
+    queue = db.Column(db.String(50), nullable=True)
+    reason = db.Column(db.String(100), nullable=True)  # Motivo da pausa do operador
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tenant_id': self.tenant_id,
+            'call_id': self.call_id,
+            'external_call_id': self.external_call_id,
+            'event_type': self.event_type,
+            'user_id': self.user_id,
+            'extension': self.extension,
+            'phone_number': self.phone_number,
+            'direction': self.direction,
+            'queue': self.queue,
+            'reason': self.reason,
+            'occurred_at': self.occurred_at.isoformat() if self.occurred_at else None
+        }
+
+class TelephonyExtension(db.Model):
+    """Ramal do PABX associado a um usuário do CRM."""
+    __tablename__ = 'telephony_extensions'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    tenant_id = db.Column(db.String(36), nullable=False)
+    extension = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'extension', name='uq_telephony_extensions_tenant_extension'),
+        db.Index('ix_telephony_extensions_user', 'user_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'extension': self.extension,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class CallLog(db.Model):
     __tablename__ = 'call_logs'
     id = db.Column(db.Integer, primary_key=True)
-    call_id = db.Column(db.Integer, db.ForeignKey('calls.id'), nullable=False)
+    call_id = db.Column(db.String(36), db.ForeignKey('calls.id'), nullable=False, index=True)
     event_type = db.Column(db.String(50), nullable=False)  # 'dialing', 'ringing', 'answered', 'hangup', 'error'
     event_data = db.Column(db.JSON, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -58,4 +160,3 @@ class CallLog(db.Model):
             'event_data': self.event_data,
             'timestamp': self.timestamp.isoformat()
         }
-
@@ -2,6 +2,7 @@ from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, JSON, F
 from sqlalchemy.orm import relationship
 from src.models.user import db
 from datetime import datetime, date
+from typing import Dict, Any
 import uuid
 import enum
 
@@ -123,7 +124,8 @@ class Tenant(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relacionamentos
-    users = db.relationship('User', backref='tenant', cascade='all, delete-orphan')
+    users = db.relationship('User', primaryjoin='Tenant.id == foreign(User.tenant_id)', backref='tenant',
+                            cascade='all, delete-orphan')
     subscriptions = db.relationship('TenantSubscription', backref='tenant', cascade='all, delete-orphan')
     usage_logs = db.relationship('TenantUsageLog', backref='tenant', cascade='all, delete-orphan')
     
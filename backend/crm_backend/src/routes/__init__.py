@@ -81,6 +81,15 @@ def register_blueprints(app):
     except Exception as e:
         logger.error(f"❌ Erro ao registrar chatbot: {e}")
     
+    try:
+        # Importar e registrar blueprint de webhooks do WhatsApp
+        from .chat_webhooks import chat_webhooks_bp
+        app.register_blueprint(chat_webhooks_bp)
+        logger.info("✅ Blueprint chat_webhooks registrado")
+        registered_count += 1
+    except Exception as e:
+        logger.error(f"❌ Erro ao registrar chat_webhooks: {e}")
+    
     try:
         # Importar e registrar blueprint de telefonia
         from .telephony import telephony_bp
@@ -108,6 +117,15 @@ def register_blueprints(app):
     except Exception as e:
         logger.error(f"❌ Erro ao registrar tasks: {e}")
     
+    try:
+        # Importar e registrar blueprint de calendário (feed iCalendar)
+        from .calendar import calendar_bp
+        app.register_blueprint(calendar_bp)
+        logger.info("✅ Blueprint calendar registrado")
+        registered_count += 1
+    except Exception as e:
+        logger.error(f"❌ Erro ao registrar calendar: {e}")
+    
     try:
         # Importar e registrar blueprint de clientes
         from .clients import clients_bp
@@ -142,9 +160,11 @@ def get_available_routes():
         {'path': '/dashboard', 'methods': ['GET'], 'description': 'Dashboard'},
         {'path': '/contracts', 'methods': ['GET', 'POST'], 'description': 'Contratos'},
         {'path': '/chatbot', 'methods': ['GET', 'POST'], 'description': 'Chatbot'},
+        {'path': '/webhooks', 'methods': ['GET', 'POST'], 'description': 'Webhooks do WhatsApp'},
         {'path': '/telephony', 'methods': ['GET', 'POST'], 'description': 'Telefonia'},
         {'path': '/automation', 'methods': ['GET', 'POST'], 'description': 'Automação'},
         {'path': '/tasks', 'methods': ['GET', 'POST'], 'description': 'Tarefas'},
+        {'path': '/calendar', 'methods': ['GET', 'POST'], 'description': 'Feed iCalendar de tarefas'},
         {'path': '/clients', 'methods': ['GET', 'POST'], 'description': 'Clientes'},
         {'path': '/users', 'methods': ['GET', 'POST'], 'description': 'Usuários'},
         {'path': '/admin', 'methods': ['GET', 'POST'], 'description': 'Administração'},
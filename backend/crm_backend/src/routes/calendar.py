@@ -0,0 +1,74 @@
+from flask import Blueprint, jsonify, request, Response, url_for
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import timezone
+import logging
+
+from src.services.calendar_feed_service import calendar_feed_service
+
+calendar_bp = Blueprint("calendar", __name__)
+logger = logging.getLogger(__name__)
+
+@calendar_bp.route("/calendar/feed/<feed_token>.ics", methods=["GET"])
+def get_calendar_feed(feed_token):
+    """Feed iCalendar das tarefas do usuário (autenticado pelo token da URL)"""
+    try:
+        resolved = calendar_feed_service.resolve_token(feed_token)
+        if not resolved:
+            return jsonify({"error": "Feed não encontrado"}), 404
+        
+        user_id, version, changed_at = resolved
+        etag = calendar_feed_service.etag_for(user_id, version)
+        last_modified = changed_at.replace(microsecond=0, tzinfo=timezone.utc) if changed_at else None
+        
+        headers = {
+            "ETag": f'"{etag}"',
+            "Cache-Control": "private, max-age=300"
+        }
+        if last_modified:
+            headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+        
+        # Validação condicional antes de gerar qualquer conteúdo
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            if etag in [tag.strip().strip('"').replace('W/"', '') for tag in if_none_match.split(",")]:
+                return Response(status=304, headers=headers)
+        elif request.headers.get("If-Modified-Since") and last_modified:
+            try:
+                if parsedate_to_datetime(request.headers["If-Modified-Since"]) >= last_modified:
+                    return Response(status=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+        
+        feed = calendar_feed_service.get_feed(user_id, version, changed_at)
+        return Response(feed["body"], status=200, headers=headers, mimetype="text/calendar; charset=utf-8")
+        
+    except Exception as e:
+        logger.error(f"Erro ao gerar feed iCalendar: {e}")
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+@calendar_bp.route("/calendar/feed-url", methods=["GET"])
+@jwt_required()
+def get_calendar_feed_url():
+    """URL do feed iCalendar do usuário logado"""
+    try:
+        state = calendar_feed_service.get_or_create_state(get_jwt_identity())
+        return jsonify({
+            "url": url_for("calendar.get_calendar_feed", feed_token=state.feed_token, _external=True)
+        }), 200
+    except Exception as e:
+        logger.error(f"Erro ao obter URL do feed: {e}")
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+@calendar_bp.route("/calendar/feed-url/rotate", methods=["POST"])
+@jwt_required()
+def rotate_calendar_feed_url():
+    """Gera um novo token para o feed (invalida a URL anterior)"""
+    try:
+        state = calendar_feed_service.get_or_create_state(get_jwt_identity(), rotate=True)
+        return jsonify({
+            "url": url_for("calendar.get_calendar_feed", feed_token=state.feed_token, _external=True)
+        }), 200
+    except Exception as e:
+        logger.error(f"Erro ao rotacionar URL do feed: {e}")
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
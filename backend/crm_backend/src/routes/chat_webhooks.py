@@ -0,0 +1,91 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+import hmac
+import logging
+
+from src.models.user import db
+from src.services import chat_webhook_service
+from src.services.chat_webhook_service import chat_webhook_ingestor
+# Importação opcional de flasgger
+try:
+    from flasgger import swag_from
+except ImportError:
+    # Fallback se flasgger não estiver disponível
+    def swag_from(spec):
+        def decorator(func):
+            return func
+        return decorator
+
+chat_webhooks_bp = Blueprint("chat_webhooks", __name__)
+logger = logging.getLogger(__name__)
+
+
+def _receive(integration_id, provider):
+    """Valida e grava os eventos; o processamento fica com o worker"""
+    integration = chat_webhook_ingestor.get_integration(integration_id)
+    if not integration or integration['provider'] != provider:
+        return jsonify({"error": "Integração não encontrada"}), 404
+
+    if not chat_webhook_ingestor.verify_signature(integration, request.get_data(cache=True), request.headers):
+        logger.warning(f"Webhook da integração {integration_id} recusado: assinatura inválida ou ausente")
+        return jsonify({"error": "Assinatura inválida"}), 401
+
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({"error": "Payload inválido"}), 400
+
+    try:
+        result = chat_webhook_ingestor.ingest(integration, payload)
+    except Exception as e:
+        # Erro ao gravar: o provedor reenvia o webhook
+        logger.error(f"Erro ao gravar webhook da integração {integration_id}: {e}")
+        return jsonify({"error": "Erro ao registrar eventos"}), 500
+
+    return jsonify(result), 200
+
+
+@chat_webhooks_bp.route("/webhooks/whatsapp/<integration_id>", methods=["GET"])
+def verify_whatsapp_webhook(integration_id):
+    """Verificação do webhook pela WhatsApp Cloud API (hub.challenge)"""
+    integration = chat_webhook_ingestor.get_integration(integration_id)
+    token = request.args.get('hub.verify_token', '')
+
+    if (integration and integration['provider'] == 'whatsapp_business'
+            and request.args.get('hub.mode') == 'subscribe'
+            and integration.get('webhook_token')
+            and hmac.compare_digest(token, integration['webhook_token'])):
+        return request.args.get('hub.challenge', ''), 200
+
+    return jsonify({"error": "Token de verificação inválido"}), 403
+
+
+@chat_webhooks_bp.route("/webhooks/whatsapp/<integration_id>", methods=["POST"])
+def receive_whatsapp_webhook(integration_id):
+    """Eventos da WhatsApp Cloud API (mensagens e status de entrega)"""
+    return _receive(integration_id, 'whatsapp_business')
+
+
+@chat_webhooks_bp.route("/webhooks/evolution/<integration_id>", methods=["POST"])
+def receive_evolution_webhook(integration_id):
+    """Eventos da Evolution API (messages.upsert e messages.update)"""
+    return _receive(integration_id, 'evolution_api')
+
+
+@chat_webhooks_bp.route("/webhooks/stats", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Estatísticas dos webhooks do WhatsApp',
+    'description': 'Eventos recebidos, aceitos, duplicados e situação do processamento',
+    'responses': {200: {'description': 'Estatísticas retornadas com sucesso'}}
+})
+def get_webhook_stats():
+    """Get inbound webhook stats"""
+    try:
+        processor = chat_webhook_service.chat_webhook_processor
+        if processor is None:
+            return jsonify({"running": False, "ingest": chat_webhook_ingestor.get_stats()}), 200
+        return jsonify(processor.get_stats()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
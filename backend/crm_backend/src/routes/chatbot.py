@@ -1,7 +1,20 @@
 from flask import Blueprint, jsonify, request
+from datetime import datetime
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import User, db
-from src.models.chatbot import ChatFlow, ChatConversation, ChatMessage
+from src.models.chatbot import ChatFlow, ChatConversation, ChatMessage, ChatKnowledgeEntry, ChatBroadcast
+from src.middleware.tenant_middleware import require_tenant, get_current_tenant_id
+from src.services.http_client import get_http_client
+from src.services.ai_gateway import get_ai_gateway
+from src.services import chat_broadcast_service
+from src.services.chat_message_search import chat_message_search
+from src.services.chat_session_store import chat_session_store
+from src.services.flow_webhook_executor import flow_webhook_executor
+from src.services import chat_outbox_service
+from src.services.chat_outbox_service import enqueue_chat_message
+from src.services.chat_inbox_service import chat_inbox_service
+from src.services.conversation_counter_service import conversation_counter_reconciler, mark_conversation_read
+from src.services.knowledge_base_service import knowledge_base_service
 # Importação opcional de flasgger
 try:
     from flasgger import swag_from
@@ -16,10 +29,21 @@ chatbot_bp = Blueprint("chatbot", __name__)
 
 @chatbot_bp.route("/", methods=["GET"])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Chatbot'],
     'summary': 'Listar conversas do chatbot',
-    'description': 'Retorna uma lista de conversas do chatbot',
+    'description': 'Caixa de entrada ordenada por última atividade, paginada por cursor. '
+                   'Com changed_since, devolve apenas as conversas alteradas desde o token informado.',
+    'parameters': [
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'default': 50},
+        {'name': 'cursor', 'in': 'query', 'type': 'string', 'description': 'next_cursor da página anterior'},
+        {'name': 'changed_since', 'in': 'query', 'type': 'string', 'description': 'sync_token da última leitura'},
+        {'name': 'status', 'in': 'query', 'type': 'string', 'description': 'Um ou mais status separados por vírgula'},
+        {'name': 'assigned_to', 'in': 'query', 'type': 'string', 'description': 'ID do atendente, "me" ou "none"'},
+        {'name': 'human_takeover', 'in': 'query', 'type': 'boolean'},
+        {'name': 'unread', 'in': 'query', 'type': 'boolean'}
+    ],
     'responses': {
         200: {
             'description': 'Lista de conversas retornada com sucesso',
@@ -29,33 +53,48 @@ chatbot_bp = Blueprint("chatbot", __name__)
                     'conversations': {
                         'type': 'array',
                         'items': {'$ref': '#/definitions/ChatConversation'}
-                    }
+                    },
+                    'next_cursor': {'type': 'string'},
+                    'has_more': {'type': 'boolean'},
+                    'sync_token': {'type': 'string'}
                 }
             }
-        }
+        },
+        400: {'description': 'Cursor inválido'}
     }
 })
 def get_conversations():
     """Get chatbot conversations"""
     try:
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        tenant_id = get_current_tenant_id()
         
-        if not user:
-            return jsonify({"error": "Usuário não encontrado"}), 404
+        def as_bool(name):
+            value = request.args.get(name)
+            return None if value is None else value.lower() in ('1', 'true', 'yes')
         
-        conversations = ChatConversation.query.filter_by(tenant_id=user.tenant_id).all()
+        assigned_to = request.args.get('assigned_to')
+        filters = {
+            'status': [s for s in request.args.get('status', '').split(',') if s] or None,
+            'assigned_to': current_user_id if assigned_to == 'me' else assigned_to,
+            'human_takeover': as_bool('human_takeover'),
+            'unread': as_bool('unread')
+        }
+        limit = request.args.get('limit', 50, type=int)
         
-        conversations_data = []
-        for conv in conversations:
-            conversations_data.append({
-                "id": conv.id,
-                "title": conv.title,
-                "status": conv.status,
-                "created_at": conv.created_at.isoformat() if conv.created_at else None
-            })
+        try:
+            if request.args.get('changed_since'):
+                result = chat_inbox_service.list_changes(
+                    tenant_id, request.args['changed_since'], filters, limit=limit
+                )
+            else:
+                result = chat_inbox_service.list_inbox(
+                    tenant_id, filters, limit=limit, cursor=request.args.get('cursor')
+                )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        return jsonify({"conversations": conversations_data}), 200
+        return jsonify(result), 200
         
     except Exception as e:
         return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
@@ -121,3 +160,578 @@ def send_message():
     except Exception as e:
         return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
 
+
+@chatbot_bp.route("/integrations/http-metrics", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Métricas das integrações HTTP',
+    'description': 'Requisições, erros, retries, espera por limite de taxa e latência média por host',
+    'responses': {
+        200: {'description': 'Métricas retornadas com sucesso'}
+    }
+})
+def get_integration_http_metrics():
+    """Get HTTP metrics of messaging integrations"""
+    try:
+        return jsonify({"hosts": get_http_client().get_metrics()}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/ai/stats", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Estatísticas do gateway de IA',
+    'description': 'Chamadas, pedidos coalescidos, timeouts, chamadas ativas e consumo pendente de gravação',
+    'responses': {
+        200: {'description': 'Estatísticas retornadas com sucesso'}
+    }
+})
+def get_ai_gateway_stats():
+    """Get AI gateway stats"""
+    try:
+        return jsonify(get_ai_gateway().get_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/flow-webhooks/stats", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Estatísticas dos webhooks dos fluxos',
+    'description': 'Chamadas, erros, acertos de cache, chamadas recusadas e estado dos circuitos por URL',
+    'responses': {
+        200: {'description': 'Estatísticas retornadas com sucesso'}
+    }
+})
+def get_flow_webhook_stats():
+    """Get flow webhook executor stats"""
+    try:
+        return jsonify(flow_webhook_executor.get_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/chat-sessions/stats", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Estatísticas do cache de estado das conversas',
+    'description': 'Conversas em cache, gravações pendentes, lotes gravados e conflitos',
+    'responses': {
+        200: {'description': 'Estatísticas retornadas com sucesso'}
+    }
+})
+def get_chat_session_stats():
+    """Get chat session store stats"""
+    try:
+        return jsonify(chat_session_store.get_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/conversations/<conversation_id>/messages", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Enviar mensagem para o contato',
+    'description': 'Enfileira a mensagem para envio assíncrono, em ordem, pelo WhatsApp',
+    'responses': {
+        202: {'description': 'Mensagem enfileirada'},
+        400: {'description': 'Mensagem é obrigatória'},
+        404: {'description': 'Conversa não encontrada'}
+    }
+})
+def enqueue_conversation_message(conversation_id):
+    """Queue an outgoing message for a conversation"""
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json() or {}
+
+        if not data.get('content'):
+            return jsonify({"error": "Mensagem é obrigatória"}), 400
+
+        if not ChatConversation.query.filter_by(id=conversation_id, tenant_id=get_current_tenant_id()).first():
+            return jsonify({"error": "Conversa não encontrada"}), 404
+
+        message = enqueue_chat_message(
+            conversation_id,
+            data['content'],
+            message_type=data.get('message_type', 'text'),
+            sender_type='human',
+            sender_id=current_user_id,
+            payload=data.get('payload')
+        )
+        db.session.commit()
+
+        return jsonify({"message": message.to_dict()}), 202
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/outbox/stats", methods=["GET"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Estatísticas da fila de mensagens',
+    'responses': {200: {'description': 'Estatísticas retornadas com sucesso'}}
+})
+def get_outbox_stats():
+    """Get outbound message queue stats"""
+    try:
+        worker = chat_outbox_service.chat_outbox_worker
+        if worker is None:
+            return jsonify({"running": False}), 200
+        return jsonify(worker.get_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/conversations/<conversation_id>/read", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Marcar conversa como lida',
+    'responses': {
+        200: {'description': 'Mensagens marcadas como lidas'},
+        404: {'description': 'Conversa não encontrada'}
+    }
+})
+def mark_conversation_as_read(conversation_id):
+    """Mark all incoming messages of a conversation as read"""
+    try:
+        if not ChatConversation.query.filter_by(id=conversation_id, tenant_id=get_current_tenant_id()).first():
+            return jsonify({"error": "Conversa não encontrada"}), 404
+
+        updated = mark_conversation_read(conversation_id)
+        db.session.commit()
+
+        return jsonify({"updated": updated, "unread_count": 0}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/conversations/counters/reconcile", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Reconciliar contadores das conversas',
+    'description': 'Recalcula total, não lidas e última mensagem a partir das mensagens do tenant',
+    'responses': {
+        200: {'description': 'Conversas verificadas e corrigidas'},
+        403: {'description': 'Permissão chatbot:manage necessária'}
+    }
+})
+def reconcile_conversation_counters():
+    """Recompute denormalized conversation counters"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    data = request.get_json(silent=True) or {}
+    conversation_ids = data.get('conversation_ids')
+    if conversation_ids is not None and not isinstance(conversation_ids, list):
+        return jsonify({"error": "conversation_ids deve ser uma lista"}), 400
+    result = conversation_counter_reconciler.reconcile(conversation_ids, tenant_id=get_current_tenant_id())
+    return jsonify(result), 200 if result['success'] else 500
+
+
+@chatbot_bp.route("/knowledge", methods=["GET"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Listar base de conhecimento',
+    'responses': {200: {'description': 'Entradas retornadas com sucesso'}}
+})
+def list_knowledge_entries():
+    """List knowledge base entries of the tenant"""
+    try:
+        entries = ChatKnowledgeEntry.query.filter_by(tenant_id=get_current_tenant_id()) \
+            .order_by(ChatKnowledgeEntry.created_at.desc()).all()
+        return jsonify({"entries": [entry.to_dict() for entry in entries]}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/knowledge", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Criar entrada da base de conhecimento',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['question', 'answer'],
+                'properties': {
+                    'question': {'type': 'string'},
+                    'alternatives': {'type': 'array', 'items': {'type': 'string'}},
+                    'answer': {'type': 'string'},
+                    'tags': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        }
+    ],
+    'responses': {
+        201: {'description': 'Entrada criada'},
+        400: {'description': 'Pergunta e resposta são obrigatórias'},
+        403: {'description': 'Permissão chatbot:manage necessária'}
+    }
+})
+def create_knowledge_entry():
+    """Create a knowledge base entry"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    try:
+        data = request.get_json() or {}
+        if not data.get('question') or not data.get('answer'):
+            return jsonify({"error": "Pergunta e resposta são obrigatórias"}), 400
+
+        tenant_id = get_current_tenant_id()
+        entry = ChatKnowledgeEntry(
+            tenant_id=tenant_id,
+            question=data['question'],
+            alternatives=data.get('alternatives') or [],
+            answer=data['answer'],
+            tags=data.get('tags') or [],
+            created_by=get_jwt_identity()
+        )
+        db.session.add(entry)
+        db.session.commit()
+        knowledge_base_service.invalidate(tenant_id)
+
+        return jsonify({"entry": entry.to_dict()}), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/knowledge/<entry_id>", methods=["PUT"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Atualizar entrada da base de conhecimento',
+    'responses': {
+        200: {'description': 'Entrada atualizada'},
+        403: {'description': 'Permissão chatbot:manage necessária'},
+        404: {'description': 'Entrada não encontrada'}
+    }
+})
+def update_knowledge_entry(entry_id):
+    """Update a knowledge base entry"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    try:
+        tenant_id = get_current_tenant_id()
+        entry = ChatKnowledgeEntry.query.filter_by(id=entry_id, tenant_id=tenant_id).first()
+        if not entry:
+            return jsonify({"error": "Entrada não encontrada"}), 404
+
+        data = request.get_json() or {}
+        for field in ('question', 'alternatives', 'answer', 'tags', 'is_active'):
+            if field in data:
+                setattr(entry, field, data[field])
+        db.session.commit()
+        knowledge_base_service.invalidate(tenant_id)
+
+        return jsonify({"entry": entry.to_dict()}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/knowledge/<entry_id>", methods=["DELETE"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Excluir entrada da base de conhecimento',
+    'responses': {
+        200: {'description': 'Entrada excluída'},
+        403: {'description': 'Permissão chatbot:manage necessária'},
+        404: {'description': 'Entrada não encontrada'}
+    }
+})
+def delete_knowledge_entry(entry_id):
+    """Delete a knowledge base entry"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    try:
+        tenant_id = get_current_tenant_id()
+        entry = ChatKnowledgeEntry.query.filter_by(id=entry_id, tenant_id=tenant_id).first()
+        if not entry:
+            return jsonify({"error": "Entrada não encontrada"}), 404
+
+        db.session.delete(entry)
+        db.session.commit()
+        knowledge_base_service.invalidate(tenant_id)
+
+        return jsonify({"message": "Entrada excluída com sucesso"}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/knowledge/search", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Testar busca na base de conhecimento',
+    'description': 'Entradas mais parecidas com o texto e a similaridade de cada uma (0 a 1)',
+    'responses': {200: {'description': 'Resultados da busca'}}
+})
+def search_knowledge_base():
+    """Search the knowledge base"""
+    try:
+        data = request.get_json() or {}
+        results = knowledge_base_service.search(get_current_tenant_id(), data.get('text', ''), k=int(data.get('k', 3)))
+        return jsonify({"results": results}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/broadcasts", methods=["GET"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Listar envios em massa',
+    'parameters': [
+        {'name': 'status', 'in': 'query', 'type': 'string', 'description': 'draft, running, paused, completed, cancelled'}
+    ],
+    'responses': {200: {'description': 'Envios retornados com sucesso'}}
+})
+def list_broadcasts():
+    """List WhatsApp broadcasts of the tenant"""
+    try:
+        query = ChatBroadcast.query.filter_by(tenant_id=get_current_tenant_id())
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        broadcasts = query.order_by(ChatBroadcast.created_at.desc()).limit(100).all()
+        return jsonify({"broadcasts": [broadcast.to_dict() for broadcast in broadcasts]}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/broadcasts", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Criar envio em massa',
+    'description': 'Cria um envio em rascunho; use /broadcasts/<id>/start para iniciar',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['name', 'integration_id'],
+                'properties': {
+                    'name': {'type': 'string'},
+                    'integration_id': {'type': 'string'},
+                    'template_name': {'type': 'string', 'description': 'Template aprovado (API oficial)'},
+                    'template_language': {'type': 'string', 'example': 'pt_BR'},
+                    'template_parameters': {'type': 'array', 'items': {'type': 'string'},
+                                            'description': 'Parâmetros do corpo, ex.: ["{name}"]'},
+                    'message_text': {'type': 'string', 'description': 'Texto (Evolution API)'},
+                    'audience': {'type': 'object', 'description': 'tags, match (any/all), status, source, owner_id'},
+                    'messaging_tier': {'type': 'string', 'enum': list(chat_broadcast_service.TIER_LIMITS)},
+                    'rate_per_second': {'type': 'number'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        201: {'description': 'Envio criado'},
+        400: {'description': 'Dados inválidos'},
+        403: {'description': 'Permissão chatbot:manage necessária'}
+    }
+})
+def create_broadcast():
+    """Create a WhatsApp broadcast"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    result = chat_broadcast_service.create_broadcast(get_current_tenant_id(), request.get_json() or {},
+                                                     get_jwt_identity())
+    if not result['success']:
+        return jsonify({"error": result['error']}), 400
+    return jsonify({"broadcast": result['broadcast']}), 201
+
+
+@chatbot_bp.route("/broadcasts/audience-preview", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Contar o público de um envio em massa',
+    'description': 'Números distintos que receberiam o envio com o filtro informado',
+    'responses': {200: {'description': 'Quantidade de destinatários'}}
+})
+def preview_broadcast_audience():
+    """Count the audience of a broadcast filter"""
+    try:
+        data = request.get_json() or {}
+        count = chat_broadcast_service.count_audience(get_current_tenant_id(), data.get('audience') or {})
+        return jsonify({"recipients": count}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/broadcasts/<broadcast_id>", methods=["GET"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Obter envio em massa',
+    'description': 'Status, progresso e contadores de entrega/leitura',
+    'responses': {
+        200: {'description': 'Envio retornado com sucesso'},
+        404: {'description': 'Envio não encontrado'}
+    }
+})
+def get_broadcast(broadcast_id):
+    """Get a WhatsApp broadcast"""
+    try:
+        broadcast = ChatBroadcast.query.filter_by(id=broadcast_id, tenant_id=get_current_tenant_id()).first()
+        if not broadcast:
+            return jsonify({"error": "Envio não encontrado"}), 404
+        return jsonify({"broadcast": broadcast.to_dict()}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/broadcasts/<broadcast_id>/<action>", methods=["POST"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Iniciar, pausar, retomar ou cancelar envio em massa',
+    'parameters': [
+        {'name': 'action', 'in': 'path', 'type': 'string', 'required': True,
+         'enum': list(chat_broadcast_service.STATUS_TRANSITIONS)}
+    ],
+    'responses': {
+        200: {'description': 'Status alterado'},
+        400: {'description': 'Ação inválida para o status atual'},
+        403: {'description': 'Permissão chatbot:manage necessária'}
+    }
+})
+def change_broadcast_status(broadcast_id, action):
+    """Start, pause, resume or cancel a WhatsApp broadcast"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    result = chat_broadcast_service.change_broadcast_status(broadcast_id, get_current_tenant_id(), action)
+    if not result['success']:
+        return jsonify({"error": result['error']}), 400
+    return jsonify({"broadcast": result['broadcast']}), 200
+
+
+@chatbot_bp.route("/messages/search", methods=["GET"])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Buscar mensagens das conversas',
+    'description': 'Busca textual nas mensagens do tenant, das mais recentes para as mais antigas. '
+                   'Por padrão só os meses recentes são consultados',
+    'parameters': [
+        {'name': 'q', 'in': 'query', 'type': 'string', 'required': True},
+        {'name': 'months', 'in': 'query', 'type': 'integer', 'description': 'Meses consultados, contando o atual'},
+        {'name': 'conversation_id', 'in': 'query', 'type': 'string'},
+        {'name': 'before', 'in': 'query', 'type': 'string', 'description': 'Paginação: created_at da última mensagem'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'default': 50}
+    ],
+    'responses': {
+        200: {'description': 'Mensagens encontradas'},
+        400: {'description': 'Parâmetros inválidos'}
+    }
+})
+def search_messages():
+    """Full-text search over chat messages"""
+    try:
+        text = (request.args.get('q') or '').strip()
+        if not text:
+            return jsonify({"error": "Texto da busca é obrigatório"}), 400
+        try:
+            before = datetime.fromisoformat(request.args['before']) if request.args.get('before') else None
+            months = int(request.args['months']) if request.args.get('months') else None
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({"error": "Parâmetros inválidos"}), 400
+
+        results = chat_message_search.search(get_current_tenant_id(), text, months=months, limit=limit,
+                                             conversation_id=request.args.get('conversation_id'), before=before)
+        return jsonify({"messages": results, "count": len(results)}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+
+@chatbot_bp.route("/messages/search/backfill", methods=["POST"])
+@jwt_required()
+@swag_from({
+    'tags': ['Chatbot'],
+    'summary': 'Indexar mensagens antigas para a busca',
+    'description': 'Indexa as mensagens já gravadas dos últimos meses (todos os tenants)',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'properties': {'months': {'type': 'integer', 'example': 3}}
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Mensagens indexadas'},
+        403: {'description': 'Permissão chatbot:manage necessária'}
+    }
+})
+def backfill_message_search():
+    """Index existing chat messages"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("chatbot:manage"):
+        return jsonify({"error": "Permissão chatbot:manage necessária"}), 403
+
+    try:
+        data = request.get_json(silent=True) or {}
+        months = data.get('months')
+        if months is not None and (not isinstance(months, int) or months < 1):
+            return jsonify({"error": "months deve ser um inteiro positivo"}), 400
+        indexed = chat_message_search.backfill(months=data.get('months'))
+        return jsonify({"indexed": indexed}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
@@ -1,8 +1,13 @@
 from flask import Blueprint, jsonify
 from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, date, timedelta
 import logging
 
+from src.middleware.tenant_middleware import require_tenant, get_current_tenant_id
+from src.models.user import User
+from src.services.activity_summary_service import activity_summary_service
+
 dashboard_bp = Blueprint('dashboard', __name__)
 logger = logging.getLogger(__name__)
 
@@ -14,7 +19,10 @@ def dashboard_info():
         "description": "Dashboard com estatísticas do CRM",
         "endpoints": [
             {"path": "/overview", "method": "GET", "description": "Visão geral"},
-            {"path": "/stats", "method": "GET", "description": "Estatísticas"}
+            {"path": "/stats", "method": "GET", "description": "Estatísticas"},
+            {"path": "/team-performance", "method": "GET", "description": "Performance da equipe"},
+            {"path": "/users/<user_id>/performance", "method": "GET", "description": "Performance do usuário"},
+            {"path": "/activity-summaries/backfill", "method": "POST", "description": "Recalcular resumos de atividade"}
         ]
     })
 
@@ -51,3 +59,58 @@ def get_stats():
         }
     })
 
+
+def _parse_period():
+    """Lê o período da query string (start_date/end_date ou days)"""
+    end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else date.today()
+    if request.args.get('start_date'):
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+    else:
+        start_date = end_date - timedelta(days=request.args.get('days', 30, type=int) - 1)
+    return start_date, end_date
+
+@dashboard_bp.route('/team-performance', methods=['GET'])
+@jwt_required()
+@require_tenant
+def get_team_performance():
+    """Performance da equipe a partir dos resumos diários de atividade"""
+    try:
+        start_date, end_date = _parse_period()
+        return jsonify(activity_summary_service.get_team_performance(get_current_tenant_id(), start_date, end_date))
+    except ValueError:
+        return jsonify({"error": "Período inválido. Use o formato YYYY-MM-DD"}), 400
+    except Exception as e:
+        logger.error(f"Erro ao obter performance da equipe: {e}")
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+@dashboard_bp.route('/users/<user_id>/performance', methods=['GET'])
+@jwt_required()
+@require_tenant
+def get_user_performance(user_id):
+    """Performance de um usuário a partir dos resumos diários de atividade"""
+    try:
+        start_date, end_date = _parse_period()
+        return jsonify(activity_summary_service.get_user_performance(get_current_tenant_id(), user_id,
+                                                                     start_date, end_date))
+    except ValueError:
+        return jsonify({"error": "Período inválido. Use o formato YYYY-MM-DD"}), 400
+    except Exception as e:
+        logger.error(f"Erro ao obter performance do usuário: {e}")
+        return jsonify({"error": f"Erro interno do servidor: {str(e)}"}), 500
+
+@dashboard_bp.route('/activity-summaries/backfill', methods=['POST'])
+@jwt_required()
+@require_tenant
+def backfill_activity_summaries():
+    """Recalcula os resumos de atividade do tenant a partir do histórico"""
+    current_user = User.query.get(get_jwt_identity())
+    if not current_user or not current_user.has_permission("reports:manage"):
+        return jsonify({"error": "Permissão reports:manage necessária"}), 403
+    
+    try:
+        start_date, end_date = _parse_period()
+    except ValueError:
+        return jsonify({"error": "Período inválido. Use o formato YYYY-MM-DD"}), 400
+    
+    result = activity_summary_service.backfill(start_date, end_date, tenant_id=get_current_tenant_id())
+    return jsonify(result), 200 if result.get('success') else 500
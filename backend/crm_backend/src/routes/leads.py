@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
 
 # Importação opcional de flasgger
 try:
@@ -10,6 +11,8 @@ except ImportError:
             return func
         return decorator
 
+from src.services.validators import validate_rows_bulk
+
 leads_bp = Blueprint("leads", __name__)
 
 @leads_bp.route("/", methods=["GET"])
@@ -195,3 +198,46 @@ def delete_lead(lead_id):
     """Deletar lead"""
     return jsonify({'message': f'Lead {lead_id} deletado com sucesso'}), 200
 
+@leads_bp.route("/import/validate", methods=["POST"])
+@jwt_required()
+@swag_from({
+    "tags": ["Leads"],
+    "summary": "Validar importação de leads",
+    "description": "Valida CPF/CNPJ (dígitos verificadores), telefone e email das linhas e devolve os dados normalizados",
+    "parameters": [
+        {
+            "name": "body",
+            "in": "body",
+            "required": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "rows": {"type": "array", "items": {"type": "object"}}
+                }
+            }
+        }
+    ],
+    "responses": {
+        "200": {"description": "Resultado da validação"},
+        "400": {"description": "Corpo ou linhas em formato inválido"}
+    }
+})
+def validate_lead_import():
+    """Validar linhas de importação de leads"""
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Corpo da requisição deve ser um objeto JSON'}), 400
+        rows = data.get('rows') or []
+        
+        if not isinstance(rows, list):
+            return jsonify({'error': 'rows deve ser uma lista'}), 400
+        
+        malformed = [index for index, row in enumerate(rows) if not isinstance(row, dict)]
+        if malformed:
+            return jsonify({'error': 'Cada linha deve ser um objeto', 'invalid_rows': malformed}), 400
+        
+        return jsonify(validate_rows_bulk(rows)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,7 +1,12 @@
 from flask import Blueprint, jsonify, request
-from datetime import datetime
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, date, timedelta
 import logging
 
+from src.middleware.tenant_middleware import require_tenant, get_current_tenant_id
+from src.models.user import User
+from src.services.timesheet_service import timesheet_service
+
 tasks_bp = Blueprint("tasks", __name__)
 logger = logging.getLogger(__name__)
 
@@ -86,3 +91,74 @@ def delete_task(task_id):
     """Deletar tarefa"""
     return jsonify({"message": f"Tarefa {task_id} deletada com sucesso"})
 
+
+def _can_manage_timesheets():
+    """Usuário autenticado pode ver e registrar o tempo de outros usuários"""
+    current_user = User.query.get(get_jwt_identity())
+    return bool(current_user and current_user.has_permission("timesheets:manage"))
+
+@tasks_bp.route("/time-logs/bulk", methods=["POST"])
+@jwt_required()
+@require_tenant
+def bulk_add_time_logs():
+    """Registrar vários intervalos de tempo de uma vez"""
+    data = request.get_json() or {}
+    entries = data.get("entries") or []
+    
+    if not entries:
+        return jsonify({"success": False, "message": "Nenhum registro informado"}), 400
+    
+    # Registrar tempo em nome de outros usuários exige permissão
+    current_user_id = get_jwt_identity()
+    on_behalf = any(isinstance(e, dict) and e.get("logged_by") not in (None, current_user_id) for e in entries)
+    if on_behalf and not _can_manage_timesheets():
+        return jsonify({"success": False, "message": "Sem permissão para registrar tempo de outros usuários"}), 403
+    
+    result = timesheet_service.bulk_add_time_logs(
+        entries, current_user_id, get_current_tenant_id(),
+        allow_overlap=data.get("allow_overlap", False),
+        allow_other_users=on_behalf
+    )
+    return jsonify(result), 201 if result.get("success") else 400
+
+@tasks_bp.route("/time-logs/summary", methods=["GET"])
+@jwt_required()
+@require_tenant
+def time_logs_summary():
+    """Totais de tempo agrupados por usuário, tarefa, lead, dia ou semana"""
+    try:
+        end_date = datetime.strptime(request.args["end_date"], "%Y-%m-%d").date() if request.args.get("end_date") else date.today()
+        start_date = datetime.strptime(request.args["start_date"], "%Y-%m-%d").date() if request.args.get("start_date") else end_date - timedelta(days=29)
+    except ValueError:
+        return jsonify({"success": False, "message": "Período inválido. Use o formato YYYY-MM-DD"}), 400
+    
+    user_ids = [u for u in request.args.get("user_ids", "").split(",") if u]
+    
+    # Sem timesheets:manage o usuário vê apenas o próprio tempo
+    if not _can_manage_timesheets():
+        if any(u != get_jwt_identity() for u in user_ids):
+            return jsonify({"success": False, "message": "Permissão timesheets:manage necessária"}), 403
+        user_ids = [get_jwt_identity()]
+    
+    result = timesheet_service.aggregate(
+        get_current_tenant_id(), start_date, end_date,
+        group_by=request.args.get("group_by", "user"),
+        user_ids=user_ids or None
+    )
+    return jsonify(result), 200 if result.get("success") else 400
+
+@tasks_bp.route("/timesheets", methods=["GET"])
+@jwt_required()
+@require_tenant
+def weekly_timesheets():
+    """Timesheets semanais de um ou mais usuários"""
+    try:
+        week_start = datetime.strptime(request.args["week_start"], "%Y-%m-%d").date() if request.args.get("week_start") else date.today()
+    except ValueError:
+        return jsonify({"success": False, "message": "Data inválida. Use o formato YYYY-MM-DD"}), 400
+    
+    user_ids = [u for u in request.args.get("user_ids", "").split(",") if u] or [get_jwt_identity()]
+    if any(u != get_jwt_identity() for u in user_ids) and not _can_manage_timesheets():
+        return jsonify({"success": False, "message": "Permissão timesheets:manage necessária"}), 403
+    
+    return jsonify(timesheet_service.get_weekly_timesheets(get_current_tenant_id(), week_start, user_ids))
@@ -1,7 +1,21 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.services.telephony_service import TelephonyService
+from src.services.cdr_sync_service import cdr_sync_worker, import_cdr_csv
+from src.services.phone_index_service import phone_index
+from src.services.call_event_service import (
+    AGENT_EVENT_TYPES, call_event_hub, ingest_call_events, record_operator_event, active_calls, format_sse
+)
+from src.services.wallboard_service import wallboard
+from src.models.telephony import CdrSyncState, TelephonyExtension, db
+from src.models.lead import Lead
+from src.models.user import User
+import hmac
+from src.middleware.tenant_middleware import require_tenant, get_current_tenant_id
+from datetime import datetime
 import logging
+import os
+import time
 # Importação opcional de flasgger
 try:
     from flasgger import swag_from
@@ -15,11 +29,36 @@ except ImportError:
 telephony_bp = Blueprint('telephony', __name__)
 logger = logging.getLogger(__name__)
 
+
+def _require_telephony_admin():
+    """Resposta 403 se o usuário autenticado não puder administrar a telefonia"""
+    user = User.query.get(get_jwt_identity())
+    if not user or not user.has_permission('telephony:manage'):
+        return jsonify({
+            'success': False,
+            'error': 'Permissão telephony:manage necessária'
+        }), 403
+    return None
+
+
+def _tenant_user(user_id, tenant_id):
+    """Usuário ativo do tenant (None se não existir, estiver inativo ou for de outro tenant)"""
+    user = User.query.get(user_id)
+    if not user or not user.is_active:
+        return None
+    user_tenant_id = getattr(user, 'tenant_id', None)
+    if user_tenant_id and user_tenant_id != tenant_id:
+        return None
+    return user
+
 # Inicializar serviço
 telephony_service = TelephonyService()
 
+WALLBOARD_PUSH_SECONDS = float(os.getenv('WALLBOARD_PUSH_SECONDS', '1'))
+
 @telephony_bp.route('/call', methods=['POST'])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Telefonia'],
     'security': [{'BearerAuth': []}],
@@ -64,7 +103,8 @@ def make_call():
         lead_id = data.get('lead_id')
         from_number = '+5511999999999'  # Número da empresa
         
-        result = telephony_service.make_call(from_number, to_number, user_id, lead_id)
+        result = telephony_service.make_call(from_number, to_number, user_id, lead_id,
+                                             tenant_id=get_current_tenant_id())
         
         return jsonify(result), 200 if result.get('success') else 500
         
@@ -77,10 +117,12 @@ def make_call():
 
 @telephony_bp.route('/history', methods=['GET'])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Telefonia'],
     'security': [{'BearerAuth': []}],
     'summary': 'Obter histórico de chamadas',
+    'description': 'Chamadas do tenant, mais recentes primeiro, paginadas por cursor. Sem telephony:manage, apenas as chamadas do próprio atendente',
     'parameters': [
         {
             'name': 'limit',
@@ -88,11 +130,21 @@ def make_call():
             'type': 'integer',
             'default': 50,
             'description': 'Limite de registros'
-        }
+        },
+        {'name': 'cursor', 'in': 'query', 'type': 'string', 'description': 'next_cursor da página anterior'},
+        {'name': 'start_date', 'in': 'query', 'type': 'string', 'description': 'Início do período (ISO 8601)'},
+        {'name': 'end_date', 'in': 'query', 'type': 'string', 'description': 'Fim do período (ISO 8601, exclusivo)'},
+        {'name': 'status', 'in': 'query', 'type': 'string', 'description': 'Um ou mais status separados por vírgula'},
+        {'name': 'direction', 'in': 'query', 'type': 'string', 'enum': ['inbound', 'outbound']},
+        {'name': 'user_id', 'in': 'query', 'type': 'string', 'description': 'ID do atendente ou "me"'},
+        {'name': 'phone_number', 'in': 'query', 'type': 'string'}
     ],
     'responses': {
         200: {
             'description': 'Histórico obtido com sucesso'
+        },
+        400: {
+            'description': 'Parâmetros inválidos'
         }
     }
 })
@@ -100,12 +152,40 @@ def get_call_history():
     """Obter histórico de chamadas"""
     try:
         user_id = get_jwt_identity()
-        tenant_id = request.headers.get('X-Tenant-ID', 'default')
-        limit = int(request.args.get('limit', 50))
+        limit = request.args.get('limit', 50, type=int)
         
-        result = telephony_service.get_call_history(user_id, tenant_id, limit)
+        try:
+            start_date = request.args.get('start_date')
+            end_date = request.args.get('end_date')
+            filters = {
+                'start_date': datetime.fromisoformat(start_date) if start_date else None,
+                'end_date': datetime.fromisoformat(end_date) if end_date else None,
+                'status': [s for s in request.args.get('status', '').split(',') if s] or None,
+                'direction': request.args.get('direction'),
+                'user_id': user_id if request.args.get('user_id') == 'me' else request.args.get('user_id'),
+                'phone_number': request.args.get('phone_number')
+            }
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Data inválida'
+            }), 400
         
-        return jsonify(result), 200 if result.get('success') else 500
+        # Sem telephony:manage o atendente vê apenas as próprias chamadas (ramais mapeados a ele)
+        if _require_telephony_admin() is not None:
+            if filters['user_id'] not in (None, user_id):
+                return jsonify({
+                    'success': False,
+                    'error': 'Permissão telephony:manage necessária'
+                }), 403
+            filters['user_id'] = user_id
+        
+        result = telephony_service.get_call_history(get_current_tenant_id(), filters, limit,
+                                                    cursor=request.args.get('cursor'))
+        
+        if not result.get('success'):
+            return jsonify(result), 400 if result.get('error') == 'Cursor inválido' else 500
+        return jsonify(result), 200
         
     except Exception as e:
         logger.error(f"Erro ao obter histórico: {e}")
@@ -116,6 +196,7 @@ def get_call_history():
 
 @telephony_bp.route('/call/<call_id>', methods=['GET'])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Telefonia'],
     'security': [{'BearerAuth': []}],
@@ -138,9 +219,11 @@ def get_call_history():
 def get_call_details(call_id):
     """Obter detalhes da chamada"""
     try:
-        result = telephony_service.get_call_details(call_id)
+        result = telephony_service.get_call_details(call_id, get_current_tenant_id())
         
-        return jsonify(result), 200 if result.get('success') else 500
+        if not result.get('success'):
+            return jsonify(result), 404 if result.get('error') == 'Chamada não encontrada' else 500
+        return jsonify(result), 200
         
     except Exception as e:
         logger.error(f"Erro ao obter detalhes: {e}")
@@ -151,6 +234,7 @@ def get_call_details(call_id):
 
 @telephony_bp.route('/call/<call_id>/notes', methods=['PUT'])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Telefonia'],
     'security': [{'BearerAuth': []}],
@@ -189,9 +273,11 @@ def update_call_notes(call_id):
         user_id = get_jwt_identity()
         notes = data.get('notes')
         
-        result = telephony_service.update_call_notes(call_id, notes, user_id)
+        result = telephony_service.update_call_notes(call_id, notes, user_id, get_current_tenant_id())
         
-        return jsonify(result), 200 if result.get('success') else 500
+        if not result.get('success'):
+            return jsonify(result), 404 if result.get('error') == 'Chamada não encontrada' else 500
+        return jsonify(result), 200
         
     except Exception as e:
         logger.error(f"Erro ao atualizar anotações: {e}")
@@ -202,6 +288,7 @@ def update_call_notes(call_id):
 
 @telephony_bp.route('/status', methods=['GET'])
 @jwt_required()
+@require_tenant
 @swag_from({
     'tags': ['Telefonia'],
     'security': [{'BearerAuth': []}],
@@ -217,7 +304,7 @@ def get_phone_status():
     try:
         user_id = get_jwt_identity()
         
-        result = telephony_service.get_phone_status(user_id)
+        result = telephony_service.get_phone_status(user_id, get_current_tenant_id())
         
         return jsonify(result), 200 if result.get('success') else 500
         
@@ -228,3 +315,693 @@ def get_phone_status():
             'error': str(e)
         }), 500
 
+@telephony_bp.route('/cdr-sync', methods=['GET'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Status da sincronização de CDRs',
+    'description': 'Configuração, posição já importada e último erro da sincronização com o PABX',
+    'responses': {
+        200: {
+            'description': 'Status obtido com sucesso'
+        }
+    }
+})
+def get_cdr_sync():
+    """Status da sincronização de CDRs"""
+    try:
+        state = CdrSyncState.query.filter_by(tenant_id=get_current_tenant_id()).first()
+        return jsonify({
+            'success': True,
+            'sync': state.to_dict() if state else None,
+            'worker': cdr_sync_worker.get_stats()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao obter sincronização de CDRs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/cdr-sync', methods=['PUT'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Configurar sincronização de CDRs',
+    'description': 'Campos vazios usam as credenciais globais (JTTELECOM_PABX_URL, JTTELECOM_PABX_AUTH_USER, '
+                   'JTTELECOM_PABX_AUTH_TOKEN)',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'api_url': {'type': 'string'},
+                    'auth_user': {'type': 'string'},
+                    'auth_token': {'type': 'string'},
+                    'webhook_token': {'type': 'string', 'description': 'Token do webhook de eventos de chamada'},
+                    'is_active': {'type': 'boolean'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Sincronização configurada'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        }
+    }
+})
+def configure_cdr_sync():
+    """Configurar sincronização de CDRs"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    try:
+        data = request.get_json() or {}
+        tenant_id = get_current_tenant_id()
+        state = CdrSyncState.query.filter_by(tenant_id=tenant_id).first()
+        if not state:
+            state = CdrSyncState(tenant_id=tenant_id)
+            db.session.add(state)
+        
+        for field in ('api_url', 'auth_user', 'auth_token', 'webhook_token', 'is_active'):
+            if field in data:
+                setattr(state, field, data[field])
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'sync': state.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao configurar sincronização de CDRs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/cdr-sync/run', methods=['POST'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Sincronizar CDRs agora',
+    'description': 'Importa as chamadas novas do PABX sem esperar o próximo ciclo do worker',
+    'responses': {
+        200: {
+            'description': 'Sincronização concluída'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        },
+        404: {
+            'description': 'Sincronização não configurada'
+        }
+    }
+})
+def run_cdr_sync():
+    """Sincronizar CDRs agora"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    try:
+        state = CdrSyncState.query.filter_by(tenant_id=get_current_tenant_id()).first()
+        if not state:
+            return jsonify({
+                'success': False,
+                'error': 'Sincronização de CDRs não configurada'
+            }), 404
+        
+        result = cdr_sync_worker.sync_state(state)
+        
+        return jsonify(result), 200 if result.get('success') else 502
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao sincronizar CDRs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/cdr/import', methods=['POST'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Importar CSV de CDRs',
+    'description': 'Importa um arquivo CSV exportado do PABX; chamadas já importadas são atualizadas',
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {
+            'name': 'file',
+            'in': 'formData',
+            'type': 'file',
+            'required': True
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Arquivo importado'
+        },
+        400: {
+            'description': 'Arquivo não enviado'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        }
+    }
+})
+def import_cdr_file():
+    """Importar CSV de CDRs"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({
+            'success': False,
+            'error': 'Arquivo é obrigatório'
+        }), 400
+    
+    result = import_cdr_csv(get_current_tenant_id(), upload.read())
+    
+    return jsonify(result), 200 if result.get('success') else 500
+
+@telephony_bp.route('/screen-pop', methods=['GET'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Identificar lead pelo número',
+    'description': 'Lead do número da chamada recebida (aceita máscara, DDI e número com ou sem o 9º dígito)',
+    'parameters': [
+        {
+            'name': 'number',
+            'in': 'query',
+            'type': 'string',
+            'required': True,
+            'description': 'Número de quem ligou'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Lead encontrado (lead nulo se o número não for de nenhum lead)'
+        },
+        400: {
+            'description': 'Número não informado'
+        }
+    }
+})
+def screen_pop():
+    """Identificar lead pelo número"""
+    try:
+        number = request.args.get('number')
+        if not number:
+            return jsonify({
+                'success': False,
+                'error': 'Número é obrigatório'
+            }), 400
+        
+        lead_ids = phone_index.find_lead_ids(get_current_tenant_id(), number)
+        lead = Lead.query.get(lead_ids[0]) if lead_ids else None
+        
+        return jsonify({
+            'success': True,
+            'lead': lead.to_dict() if lead else None,
+            'other_lead_ids': lead_ids[1:]
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao identificar lead: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/phone-index/rebuild', methods=['POST'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Recriar índice de telefones dos leads',
+    'description': 'Necessário na primeira ativação e após importações de leads feitas fora da aplicação',
+    'responses': {
+        200: {
+            'description': 'Índice recriado'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        }
+    }
+})
+def rebuild_phone_index():
+    """Recriar índice de telefones dos leads"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    try:
+        indexed = phone_index.rebuild(get_current_tenant_id())
+        
+        return jsonify({
+            'success': True,
+            'indexed': indexed,
+            'stats': phone_index.get_stats()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao recriar índice de telefones: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/webhook/call-status/<tenant_id>', methods=['POST'])
+def receive_call_events(tenant_id):
+    """Eventos de chamada do PABX (um evento ou lista de eventos)"""
+    state = CdrSyncState.query.filter_by(tenant_id=tenant_id).first()
+    token = request.headers.get('X-Webhook-Token') or request.args.get('token', '')
+    if not state or not state.webhook_token or not hmac.compare_digest(token, state.webhook_token):
+        return jsonify({
+            'success': False,
+            'error': 'Token inválido'
+        }), 401
+    
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({
+            'success': False,
+            'error': 'Payload inválido'
+        }), 400
+    
+    result = ingest_call_events(tenant_id, payload if isinstance(payload, list) else [payload])
+    
+    return jsonify(result), 200 if result.get('success') else 500
+
+@telephony_bp.route('/events/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Eventos de chamada em tempo real (SSE)',
+    'description': 'Stream text/event-stream: "snapshot" com as chamadas em andamento e depois um evento "call" '
+                   'por mudança de estado. Para EventSource, o token pode ir no parâmetro jwt',
+    'parameters': [
+        {
+            'name': 'scope',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['agent', 'supervisor'],
+            'default': 'agent',
+            'description': 'agent: chamadas do usuário; supervisor: todas do tenant (permissão calls:monitor)'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Stream de eventos'
+        },
+        403: {
+            'description': 'Sem permissão para acompanhar todas as chamadas'
+        }
+    }
+})
+def stream_call_events():
+    """Eventos de chamada em tempo real"""
+    user_id = get_jwt_identity()
+    tenant_id = get_current_tenant_id()
+    
+    if request.args.get('scope') == 'supervisor':
+        user = User.query.get(user_id)
+        if not user or not user.has_permission('calls:monitor'):
+            return jsonify({
+                'success': False,
+                'error': 'Permissão calls:monitor necessária'
+            }), 403
+        user_id = None
+    
+    subscriber = call_event_hub.subscribe(tenant_id, user_id)
+    try:
+        snapshot = active_calls(tenant_id, user_id)
+    except Exception:
+        call_event_hub.unsubscribe(subscriber)
+        raise
+    finally:
+        db.session.close()  # A conexão com o banco não fica presa durante o stream
+    
+    def generate():
+        try:
+            yield 'retry: 2000\n\n'
+            yield format_sse('snapshot', {'calls': snapshot})
+            while True:
+                events = subscriber.take(timeout=15)
+                if events is None:
+                    break
+                if not events:
+                    yield ': keep-alive\n\n'
+                    continue
+                for event in events:
+                    yield format_sse('call', event, event.get('id'))
+        finally:
+            call_event_hub.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@telephony_bp.route('/extensions', methods=['GET'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Listar ramais associados a usuários',
+    'responses': {
+        200: {
+            'description': 'Ramais obtidos com sucesso'
+        }
+    }
+})
+def list_extensions():
+    """Listar ramais associados a usuários"""
+    try:
+        extensions = TelephonyExtension.query.filter_by(tenant_id=get_current_tenant_id()) \
+            .order_by(TelephonyExtension.extension.asc()).all()
+        
+        return jsonify({
+            'success': True,
+            'extensions': [extension.to_dict() for extension in extensions]
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Erro ao listar ramais: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/extensions/<extension>', methods=['PUT'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Associar ramal a um usuário',
+    'description': 'Os eventos de chamada do ramal passam a ser entregues a esse usuário',
+    'parameters': [
+        {
+            'name': 'extension',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {'type': 'string'}
+                },
+                'required': ['user_id']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Ramal associado'
+        },
+        400: {
+            'description': 'Usuário não informado'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        },
+        404: {
+            'description': 'Usuário não encontrado no tenant'
+        }
+    }
+})
+def assign_extension(extension):
+    """Associar ramal a um usuário"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    try:
+        data = request.get_json() or {}
+        if not data.get('user_id'):
+            return jsonify({
+                'success': False,
+                'error': 'Usuário é obrigatório'
+            }), 400
+        
+        tenant_id = get_current_tenant_id()
+        if not _tenant_user(data['user_id'], tenant_id):
+            return jsonify({
+                'success': False,
+                'error': 'Usuário não encontrado'
+            }), 404
+        
+        mapping = TelephonyExtension.query.filter_by(tenant_id=tenant_id, extension=extension).first()
+        if not mapping:
+            mapping = TelephonyExtension(tenant_id=tenant_id, extension=extension)
+            db.session.add(mapping)
+        mapping.user_id = data['user_id']
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'extension': mapping.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao associar ramal: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/extensions/<extension>', methods=['DELETE'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Remover associação do ramal',
+    'responses': {
+        200: {
+            'description': 'Associação removida'
+        },
+        403: {
+            'description': 'Permissão telephony:manage necessária'
+        }
+    }
+})
+def remove_extension(extension):
+    """Remover associação do ramal"""
+    denied = _require_telephony_admin()
+    if denied:
+        return denied
+    
+    try:
+        TelephonyExtension.query.filter_by(tenant_id=get_current_tenant_id(), extension=extension).delete()
+        db.session.commit()
+        
+        return jsonify({
+            'success': True
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao remover ramal: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@telephony_bp.route('/operators/<user_id>/<action>', methods=['POST'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Login, logout e pausa do operador',
+    'description': 'Registra o estado do operador (usuário com ramal associado) no log de eventos e no painel. '
+                   'Outros operadores exigem a permissão calls:monitor',
+    'parameters': [
+        {
+            'name': 'user_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'action',
+            'in': 'path',
+            'type': 'string',
+            'enum': ['login', 'logout', 'pause', 'unpause'],
+            'required': True
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'reason': {'type': 'string', 'description': 'Motivo da pausa'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Estado do operador registrado'
+        },
+        403: {
+            'description': 'Sem permissão para alterar outro operador'
+        },
+        404: {
+            'description': 'Usuário sem ramal associado no tenant'
+        }
+    }
+})
+def operator_action(user_id, action):
+    """Login, logout e pausa do operador"""
+    if action not in AGENT_EVENT_TYPES:
+        return jsonify({
+            'success': False,
+            'error': f'Ação inválida: {action}'
+        }), 400
+    
+    current_user_id = get_jwt_identity()
+    tenant_id = get_current_tenant_id()
+    if user_id != current_user_id:
+        user = User.query.get(current_user_id)
+        if not user or not user.has_permission('calls:monitor'):
+            return jsonify({
+                'success': False,
+                'error': 'Permissão calls:monitor necessária'
+            }), 403
+    
+    extension = TelephonyExtension.query.filter_by(tenant_id=tenant_id, user_id=user_id).first()
+    if not extension:
+        return jsonify({
+            'success': False,
+            'error': 'Operador sem ramal associado'
+        }), 404
+    
+    data = request.get_json(silent=True) or {}
+    result = record_operator_event(tenant_id, user_id, action, data.get('reason'), extension.extension)
+    
+    return jsonify(result), 200 if result.get('success') else 500
+
+@telephony_bp.route('/wallboard', methods=['GET'])
+@jwt_required()
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Painel do call center',
+    'description': 'Métricas da janela corrente por fila e operador (chamadas em espera, ASR, ACD, nível de '
+                   'serviço, tempo em pausa, chamadas por hora), calculadas em memória',
+    'responses': {
+        200: {
+            'description': 'Snapshot do painel'
+        },
+        403: {
+            'description': 'Sem permissão para acompanhar o call center'
+        }
+    }
+})
+def get_wallboard():
+    """Painel do call center"""
+    user = User.query.get(get_jwt_identity())
+    if not user or not user.has_permission('calls:monitor'):
+        return jsonify({
+            'success': False,
+            'error': 'Permissão calls:monitor necessária'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'wallboard': wallboard.snapshot(get_current_tenant_id())
+    }), 200
+
+@telephony_bp.route('/wallboard/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+@require_tenant
+@swag_from({
+    'tags': ['Telefonia'],
+    'security': [{'BearerAuth': []}],
+    'summary': 'Painel do call center em tempo real (SSE)',
+    'description': 'Stream text/event-stream: "snapshot" com o painel completo e depois eventos "delta" só com os '
+                   'totais, filas e operadores alterados (null: removido), no máximo um por WALLBOARD_PUSH_SECONDS',
+    'responses': {
+        200: {
+            'description': 'Stream do painel'
+        },
+        403: {
+            'description': 'Sem permissão para acompanhar o call center'
+        }
+    }
+})
+def stream_wallboard():
+    """Painel do call center em tempo real"""
+    tenant_id = get_current_tenant_id()
+    user = User.query.get(get_jwt_identity())
+    if not user or not user.has_permission('calls:monitor'):
+        return jsonify({
+            'success': False,
+            'error': 'Permissão calls:monitor necessária'
+        }), 403
+    
+    snapshot = wallboard.snapshot(tenant_id)
+    db.session.close()  # A conexão com o banco não fica presa durante o stream
+    
+    def generate():
+        last = snapshot
+        last_sent = time.monotonic()
+        yield 'retry: 2000\n\n'
+        yield format_sse('snapshot', last, last['version'])
+        while True:
+            # Saídas da janela não geram evento: o painel é relido ao menos a cada 5s
+            wallboard.wait_for_change(tenant_id, last['version'], timeout=5)
+            elapsed = time.monotonic() - last_sent
+            if elapsed < WALLBOARD_PUSH_SECONDS:
+                time.sleep(WALLBOARD_PUSH_SECONDS - elapsed)  # Agrupa rajadas de eventos em um delta
+            
+            current = wallboard.snapshot(tenant_id)
+            changes = wallboard.delta(last, current)
+            last = current
+            if changes:
+                last_sent = time.monotonic()
+                yield format_sse('delta', changes, current['version'])
+            elif time.monotonic() - last_sent >= 15:
+                last_sent = time.monotonic()
+                yield ': keep-alive\n\n'
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
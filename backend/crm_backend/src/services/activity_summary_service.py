@@ -0,0 +1,306 @@
+"""
+Rollup incremental de atividades por usuário e dia (ActivitySummary)
+
+Os eventos de domínio (tarefa criada/concluída, tempo registrado, chamadas,
+mensagens, emails e reuniões) incrementam contadores na tabela
+activity_summaries dentro da transação de quem gera o evento. As telas de
+performance leem apenas essas linhas de resumo.
+
+Pontos de gravação: TaskService (tarefas), timesheet_service (tempo),
+telephony_service/call_event_service (chamadas do usuário: discadas pelo CRM
+ou encerradas pelo PABX com atendente), chat_outbox_service (mensagens de
+atendentes), email_outbox_service (emails enviados em nome de um usuário) e
+o flush de novas Activity do tipo reunião.
+O backfill recompõe os mesmos contadores a partir dessas tabelas.
+"""
+import logging
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ClauseElement
+
+from src.models.task import Task, TaskTimeLog, Activity, ActivitySummary, db
+
+logger = logging.getLogger(__name__)
+
+# Evento de domínio -> coluna do resumo
+EVENT_COUNTERS = {
+    'task_created': 'tasks_created',
+    'task_completed': 'tasks_completed',
+    'time_logged': 'time_logged_minutes',
+    'call': 'calls',
+    'message': 'messages',
+    'email': 'emails',
+    'meeting': 'meetings'
+}
+
+SUMMARY_COUNTERS = list(dict.fromkeys(EVENT_COUNTERS.values()))
+
+# Tipos de Activity contabilizados no resumo
+ACTIVITY_TYPE_COUNTERS = {
+    'call': 'calls',
+    'email': 'emails',
+    'meeting': 'meetings'
+}
+
+
+class ActivitySummaryService:
+    """Serviço de manutenção e consulta dos resumos de atividade"""
+
+    def record_event(self, event_type: str, user_id: str, tenant_id: str = None,
+                     occurred_at: datetime = None, amount: int = 1) -> bool:
+        """
+        Incrementa o contador do evento no resumo do dia (sem commit)
+
+        Args:
+            event_type: Chave de EVENT_COUNTERS
+            user_id: Usuário que realizou a atividade
+            tenant_id: Tenant do usuário
+            occurred_at: Momento do evento (padrão: agora)
+            amount: Incremento (minutos para time_logged)
+        """
+        column = EVENT_COUNTERS.get(event_type)
+        if not column or not user_id or not amount:
+            return False
+
+        day = (occurred_at or datetime.utcnow()).date()
+        summary = self._get_or_create(user_id, day, tenant_id)
+
+        # Incremento atômico no banco, sem ler-modificar-gravar
+        pending = summary.__dict__.get(column)
+        if inspect(summary).pending:
+            # Linha criada dentro de um flush (ex.: reuniões) ainda não foi inserida
+            setattr(summary, column, (pending or 0) + int(amount))
+        elif isinstance(pending, ClauseElement):
+            # Já há um incremento pendente nesta transação: acumula
+            setattr(summary, column, pending + int(amount))
+        else:
+            setattr(summary, column, getattr(ActivitySummary, column) + int(amount))
+        return True
+
+    def _get_or_create(self, user_id: str, day: date, tenant_id: str = None) -> ActivitySummary:
+        summary = ActivitySummary.query.filter_by(user_id=user_id, date=day).first()
+        if summary:
+            if tenant_id and not summary.tenant_id:
+                summary.tenant_id = tenant_id
+            return summary
+
+        try:
+            with db.session.begin_nested():
+                summary = ActivitySummary(user_id=user_id, tenant_id=tenant_id, date=day,
+                                          **{c: 0 for c in SUMMARY_COUNTERS})
+                db.session.add(summary)
+        except IntegrityError:
+            # Outro processo criou a linha do dia ao mesmo tempo
+            summary = ActivitySummary.query.filter_by(user_id=user_id, date=day).first()
+
+        return summary
+
+    # ==================== BACKFILL ====================
+
+    def backfill(self, start_date: date, end_date: date = None, tenant_id: str = None,
+                 batch_days: int = 7) -> Dict[str, Any]:
+        """
+        Recalcula os resumos a partir do histórico, em lotes de dias
+
+        Cada lote agrega as tabelas de origem com GROUP BY e sobrescreve os
+        contadores do período, então pode ser executado novamente com segurança.
+        """
+        end_date = end_date or date.today()
+        batches = 0
+        rows = 0
+
+        try:
+            current = start_date
+            while current <= end_date:
+                batch_end = min(current + timedelta(days=batch_days - 1), end_date)
+                rows += self._backfill_range(current, batch_end, tenant_id)
+                db.session.commit()
+                batches += 1
+                current = batch_end + timedelta(days=1)
+
+            logger.info(f"Backfill de resumos concluído: {batches} lotes, {rows} linhas")
+            return {'success': True, 'batches': batches, 'rows': rows}
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro no backfill de resumos de atividade: {e}")
+            return {'success': False, 'message': str(e), 'batches': batches}
+
+    def _backfill_range(self, start: date, end: date, tenant_id: str = None) -> int:
+        start_dt = datetime.combine(start, datetime.min.time())
+        end_dt = datetime.combine(end + timedelta(days=1), datetime.min.time())
+
+        totals: Dict[tuple, Dict[str, int]] = {}
+        tenants: Dict[str, str] = {}
+
+        def add(user_id, day, tenant, column, value):
+            if not user_id or day is None:
+                return
+            if isinstance(day, str):
+                day = date.fromisoformat(day)
+            elif isinstance(day, datetime):
+                day = day.date()
+            key = (user_id, day)
+            totals.setdefault(key, {c: 0 for c in SUMMARY_COUNTERS})[column] += int(value or 0)
+            if tenant:
+                tenants[user_id] = tenant
+
+        # Tarefas criadas
+        query = db.session.query(Task.created_by, func.date(Task.created_at), Task.tenant_id, func.count(Task.id)) \
+            .filter(Task.created_at >= start_dt, Task.created_at < end_dt)
+        if tenant_id:
+            query = query.filter(Task.tenant_id == tenant_id)
+        for user_id, day, tenant, count in query.group_by(Task.created_by, func.date(Task.created_at), Task.tenant_id):
+            add(user_id, day, tenant, 'tasks_created', count)
+
+        # Tarefas concluídas
+        query = db.session.query(Task.assigned_to, func.date(Task.completed_at), Task.tenant_id, func.count(Task.id)) \
+            .filter(Task.completed_at >= start_dt, Task.completed_at < end_dt)
+        if tenant_id:
+            query = query.filter(Task.tenant_id == tenant_id)
+        for user_id, day, tenant, count in query.group_by(Task.assigned_to, func.date(Task.completed_at), Task.tenant_id):
+            add(user_id, day, tenant, 'tasks_completed', count)
+
+        # Tempo registrado
+        query = db.session.query(TaskTimeLog.logged_by, TaskTimeLog.work_date, TaskTimeLog.tenant_id,
+                                 func.sum(TaskTimeLog.duration_minutes)) \
+            .filter(TaskTimeLog.work_date >= start, TaskTimeLog.work_date <= end)
+        if tenant_id:
+            query = query.filter(TaskTimeLog.tenant_id == tenant_id)
+        for user_id, day, tenant, minutes in query.group_by(TaskTimeLog.logged_by, TaskTimeLog.work_date, TaskTimeLog.tenant_id):
+            add(user_id, day, tenant, 'time_logged_minutes', minutes)
+
+        # Chamadas do usuário (discadas ou atendidas)
+        from src.models.telephony import Call
+        query = db.session.query(Call.user_id, func.date(Call.start_time), Call.tenant_id, func.count(Call.id)) \
+            .filter(Call.start_time >= start_dt, Call.start_time < end_dt, Call.user_id.isnot(None),
+                    (Call.direction == 'outbound') | Call.answered_at.isnot(None) | (Call.status == 'completed'))
+        if tenant_id:
+            query = query.filter(Call.tenant_id == tenant_id)
+        for user_id, day, tenant, count in query.group_by(Call.user_id, func.date(Call.start_time), Call.tenant_id):
+            add(user_id, day, tenant, 'calls', count)
+
+        # Emails enviados em nome do usuário
+        from src.models.email_outbox import EmailOutbox
+        query = db.session.query(EmailOutbox.user_id, func.date(EmailOutbox.created_at), EmailOutbox.tenant_id,
+                                 func.count(EmailOutbox.id)) \
+            .filter(EmailOutbox.created_at >= start_dt, EmailOutbox.created_at < end_dt, EmailOutbox.user_id.isnot(None))
+        if tenant_id:
+            query = query.filter(EmailOutbox.tenant_id == tenant_id)
+        for user_id, day, tenant, count in query.group_by(EmailOutbox.user_id, func.date(EmailOutbox.created_at),
+                                                          EmailOutbox.tenant_id):
+            add(user_id, day, tenant, 'emails', count)
+
+        # Chamadas, emails e reuniões registrados como Activity
+        query = db.session.query(Activity.user_id, func.date(Activity.created_at), Activity.tenant_id,
+                                 Activity.type, func.count(Activity.id)) \
+            .filter(Activity.created_at >= start_dt, Activity.created_at < end_dt,
+                    Activity.type.in_(list(ACTIVITY_TYPE_COUNTERS.keys())))
+        if tenant_id:
+            query = query.filter(Activity.tenant_id == tenant_id)
+        for user_id, day, tenant, activity_type, count in query.group_by(
+                Activity.user_id, func.date(Activity.created_at), Activity.tenant_id, Activity.type):
+            add(user_id, day, tenant, ACTIVITY_TYPE_COUNTERS[activity_type], count)
+
+        # Mensagens enviadas por atendentes
+        try:
+            from src.models.chatbot import ChatConversation, ChatMessage
+            query = db.session.query(ChatMessage.sender_id, func.date(ChatMessage.created_at), ChatConversation.tenant_id,
+                                     func.count(ChatMessage.id)) \
+                .join(ChatConversation, ChatConversation.id == ChatMessage.conversation_id) \
+                .filter(ChatMessage.created_at >= start_dt, ChatMessage.created_at < end_dt,
+                        ChatMessage.direction == 'outgoing', ChatMessage.sender_id.isnot(None))
+            if tenant_id:
+                query = query.filter(ChatConversation.tenant_id == tenant_id)
+            for user_id, day, tenant, count in query.group_by(ChatMessage.sender_id, func.date(ChatMessage.created_at),
+                                                              ChatConversation.tenant_id):
+                add(user_id, day, tenant, 'messages', count)
+        except Exception as e:
+            logger.warning(f"Backfill de mensagens ignorado: {e}")
+
+        # Sobrescreve os contadores do período
+        query = ActivitySummary.query.filter(ActivitySummary.date >= start, ActivitySummary.date <= end)
+        if tenant_id:
+            query = query.filter(ActivitySummary.tenant_id == tenant_id)
+        existing = {(s.user_id, s.date): s for s in query.all()}
+
+        for key, counters in totals.items():
+            summary = existing.pop(key, None)
+            if not summary:
+                summary = ActivitySummary(user_id=key[0], date=key[1])
+                db.session.add(summary)
+            summary.tenant_id = summary.tenant_id or tenants.get(key[0])
+            for column, value in counters.items():
+                setattr(summary, column, value)
+
+        # Dias sem atividade na origem ficam zerados
+        for summary in existing.values():
+            for column in SUMMARY_COUNTERS:
+                setattr(summary, column, 0)
+
+        return len(totals)
+
+    # ==================== CONSULTAS ====================
+
+    def get_user_performance(self, tenant_id: str, user_id: str, start_date: date,
+                             end_date: date = None) -> Dict[str, Any]:
+        """Totais e série diária de um usuário do tenant no período"""
+        end_date = end_date or date.today()
+
+        rows = ActivitySummary.query.filter(
+            ActivitySummary.tenant_id == tenant_id,
+            ActivitySummary.user_id == user_id,
+            ActivitySummary.date >= start_date,
+            ActivitySummary.date <= end_date
+        ).order_by(ActivitySummary.date.asc()).all()
+
+        totals = {c: sum(getattr(r, c) or 0 for r in rows) for c in SUMMARY_COUNTERS}
+
+        return {
+            'user_id': user_id,
+            'period': {'start': start_date.isoformat(), 'end': end_date.isoformat()},
+            'totals': totals,
+            'daily': [r.to_dict() for r in rows]
+        }
+
+    def get_team_performance(self, tenant_id: str, start_date: date, end_date: date = None) -> Dict[str, Any]:
+        """Totais por usuário do tenant no período (uma consulta agrupada)"""
+        end_date = end_date or date.today()
+
+        columns = [func.coalesce(func.sum(getattr(ActivitySummary, c)), 0).label(c) for c in SUMMARY_COUNTERS]
+        rows = db.session.query(ActivitySummary.user_id, *columns).filter(
+            ActivitySummary.tenant_id == tenant_id,
+            ActivitySummary.date >= start_date,
+            ActivitySummary.date <= end_date
+        ).group_by(ActivitySummary.user_id).all()
+
+        by_user = [dict(zip(['user_id'] + SUMMARY_COUNTERS, [row[0]] + [int(v) for v in row[1:]])) for row in rows]
+        totals = {c: sum(u[c] for u in by_user) for c in SUMMARY_COUNTERS}
+
+        return {
+            'tenant_id': tenant_id,
+            'period': {'start': start_date.isoformat(), 'end': end_date.isoformat()},
+            'active_users': len(by_user),
+            'totals': totals,
+            'by_user': by_user
+        }
+
+
+# Instância global
+activity_summary_service = ActivitySummaryService()
+
+
+# ==================== REUNIÕES ====================
+
+def _record_new_meetings(session, flush_context, instances):
+    """Contabiliza as reuniões (Activity tipo meeting) inseridas neste flush"""
+    for obj in list(session.new):
+        if isinstance(obj, Activity) and obj.type == 'meeting':
+            activity_summary_service.record_event('meeting', obj.user_id, obj.tenant_id, obj.created_at)
+
+
+event.listen(Session, 'before_flush', _record_new_meetings)
@@ -0,0 +1,207 @@
+"""
+Janela de contexto das respostas da IA com orçamento de tokens
+
+O prompt de cada resposta é: prompt do sistema + resumo acumulado da conversa
++ as últimas N mensagens que couberem no orçamento (ChatAIConfig). O resumo
+fica gravado na conversa (context_summary, até context_summary_until) e é
+atualizado de forma incremental: quando mensagens suficientes saem da janela,
+apenas elas são resumidas junto com o resumo anterior. Assim o tamanho do
+prompt não cresce com a duração da conversa.
+
+A contagem de tokens é uma estimativa local (sem tokenizer externo), que
+tende a superestimar para manter a margem de segurança.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from src.models.chatbot import ChatConversation, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Papel e separadores de cada mensagem no formato de chat
+SUMMARY_HEADER = "Resumo da conversa até aqui:"
+
+_PIECES_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Estimativa de tokens: ~4 caracteres por token em cada palavra, mínimo 1"""
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 4 for piece in _PIECES_RE.findall(text))
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_tokens(message.get('content')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Corta o texto (pelo início, mantendo o final) para caber no limite"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for match in reversed(list(_PIECES_RE.finditer(text))):
+        cost = 1 + (len(match.group()) - 1) // 4
+        if used + cost > max_tokens:
+            return text[match.end():].lstrip()
+        used += cost
+    return text
+
+
+def fit_messages(chat_messages: List[Dict[str, str]], token_budget: int) -> List[Dict[str, str]]:
+    """
+    Mantém as mensagens de sistema iniciais e as mais recentes que couberem no orçamento
+
+    A última mensagem sempre entra (cortada, se necessário).
+    """
+    head = []
+    for message in chat_messages:
+        if message.get('role') != 'system':
+            break
+        head.append(message)
+    body = chat_messages[len(head):]
+
+    available = token_budget - sum(message_tokens(m) for m in head)
+    kept = []
+    for message in reversed(body):
+        cost = message_tokens(message)
+        if cost > available:
+            if not kept:
+                content = truncate_to_tokens(message.get('content', ''), max(available - MESSAGE_OVERHEAD_TOKENS, 1))
+                kept.append({**message, 'content': content})
+            break
+        kept.append(message)
+        available -= cost
+
+    return head + list(reversed(kept))
+
+
+class ContextPlan:
+    """Contexto de uma resposta: janela recente, resumo e mensagens a resumir"""
+
+    def __init__(self, builder: 'ConversationContextBuilder', system_prompt: str, summary: Optional[str],
+                 summary_until: Optional[datetime], candidates: List[Dict[str, Any]],
+                 to_fold: List[Dict[str, Any]]):
+        self.builder = builder
+        self.system_prompt = system_prompt or ''
+        self.summary = summary
+        self.summary_until = summary_until
+        self.candidates = candidates  # Mais recentes primeiro
+        self.to_fold = to_fold  # Mais antigas primeiro
+        self.recent: List[Dict[str, Any]] = []
+        self._fit()
+
+    @property
+    def needs_summary(self) -> bool:
+        return bool(self.to_fold)
+
+    @property
+    def fold_until(self) -> Optional[datetime]:
+        return self.to_fold[-1]['created_at'] if self.to_fold else None
+
+    def _system_message(self) -> Dict[str, str]:
+        content = self.system_prompt
+        if self.summary:
+            content = f"{content}\n\n{SUMMARY_HEADER}\n{self.summary}" if content else f"{SUMMARY_HEADER}\n{self.summary}"
+        return {'role': 'system', 'content': content}
+
+    def _fit(self):
+        chat = [self._system_message()] + [
+            {'role': 'user' if m['direction'] == 'incoming' else 'assistant', 'content': m['content']}
+            for m in reversed(self.candidates)
+        ]
+        self.chat_messages = fit_messages(chat, self.builder.token_budget)
+        self.recent = self.candidates[:len(self.chat_messages) - 1][::-1]
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Mensagens no formato de chat para a chamada à IA"""
+        return self.chat_messages
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(message_tokens(m) for m in self.chat_messages)
+
+    def summary_messages(self) -> List[Dict[str, str]]:
+        """Pedido de resumo: resumo anterior + mensagens que saíram da janela"""
+        lines = [f"{'Cliente' if m['direction'] == 'incoming' else 'Atendente'}: {m['content']}" for m in self.to_fold]
+        previous = self.summary or '(sem resumo anterior)'
+        return [
+            {'role': 'system', 'content': (
+                "Atualize o resumo de uma conversa de atendimento por WhatsApp. Escreva em português, "
+                f"em no máximo {self.builder.summary_max_tokens * 3 // 4} palavras, mantendo nome e dados do "
+                "cliente, produtos de interesse, pedidos feitos e pendências. Responda apenas com o resumo."
+            )},
+            {'role': 'user', 'content': f"Resumo anterior:\n{previous}\n\nNovas mensagens:\n" + "\n".join(lines)}
+        ]
+
+    def apply_summary(self, summary: str):
+        """Usa o novo resumo e recalcula a janela (o resumo também consome orçamento)"""
+        self.summary = truncate_to_tokens(summary.strip(), self.builder.summary_max_tokens)
+        self.summary_until = self.fold_until
+        self.to_fold = []
+        self._fit()
+
+
+class ConversationContextBuilder:
+    """Monta o contexto das respostas a partir da conversa e da configuração da IA"""
+
+    def __init__(self, token_budget: int = 3000, max_turns: int = 10, summary_max_tokens: int = 300,
+                 fold_batch: int = 40):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.fold_batch = fold_batch
+        # Só resume quando sai da janela um bloco razoável (evita uma chamada de resumo por mensagem)
+        self.fold_threshold = max(4, max_turns // 2)
+
+    @classmethod
+    def from_config(cls, config) -> 'ConversationContextBuilder':
+        return cls(
+            token_budget=config.context_token_budget or 3000,
+            max_turns=config.context_window or 10,
+            summary_max_tokens=config.summary_max_tokens or 300
+        )
+
+    def _unsummarized(self, conversation: ChatConversation):
+        query = ChatMessage.query.filter(ChatMessage.conversation_id == conversation.id)
+        if conversation.context_summary_until:
+            query = query.filter(ChatMessage.created_at > conversation.context_summary_until)
+        return query
+
+    @staticmethod
+    def _as_dict(message: ChatMessage) -> Dict[str, Any]:
+        return {'direction': message.direction, 'content': message.content or '', 'created_at': message.created_at}
+
+    def build(self, conversation: ChatConversation, system_prompt: str) -> ContextPlan:
+        """Lê apenas as últimas N mensagens e, se houver, o bloco seguinte a resumir"""
+        candidates = [self._as_dict(m) for m in self._unsummarized(conversation)
+                      .order_by(ChatMessage.created_at.desc()).limit(self.max_turns).all()]
+
+        to_fold = []
+        if len(candidates) == self.max_turns:
+            oldest_kept = candidates[-1]['created_at']
+            to_fold = [self._as_dict(m) for m in self._unsummarized(conversation)
+                       .filter(ChatMessage.created_at < oldest_kept)
+                       .order_by(ChatMessage.created_at.asc()).limit(self.fold_batch).all()]
+            if len(to_fold) < self.fold_threshold:
+                to_fold = []
+
+        return ContextPlan(self, system_prompt, conversation.context_summary,
+                           conversation.context_summary_until, candidates, to_fold)
+
+
+def store_summary(conversation_id: str, plan: ContextPlan, previous_until: Optional[datetime]) -> bool:
+    """
+    Grava o resumo atualizado na conversa (sem commit)
+
+    Só grava se ninguém atualizou o resumo desde a leitura (previous_until).
+    """
+    condition = ChatConversation.context_summary_until.is_(None) if previous_until is None \
+        else ChatConversation.context_summary_until == previous_until
+    updated = ChatConversation.query.filter(ChatConversation.id == conversation_id, condition).update({
+        'context_summary': plan.summary,
+        'context_summary_until': plan.summary_until
+    }, synchronize_session=False)
+    return bool(updated)
@@ -0,0 +1,344 @@
+"""
+Gateway assíncrono para as chamadas à OpenAI
+
+Todas as chamadas rodam em um único event loop em thread própria, com o
+cliente assíncrono do SDK (conexões reaproveitadas). Um semáforo global e um
+por tenant limitam as chamadas simultâneas, pedidos idênticos em andamento
+compartilham a mesma chamada e cada pedido tem tempo limite; quando todos os
+interessados desistem (timeout ou cancelamento), a chamada é cancelada. O
+consumo de tokens é acumulado em memória e gravado em lote.
+
+Threads síncronas (rotas Flask, workers) usam complete(); código assíncrono
+usa complete_async(), de qualquer event loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import openai
+
+from src.models.chatbot import ChatAIUsage, db
+
+logger = logging.getLogger(__name__)
+
+
+class AIUsageRecorder:
+    """Acumula o consumo das chamadas e grava em lote em chat_ai_usage"""
+
+    def __init__(self, batch_size: int = 200, flush_seconds: float = 5.0, max_buffer: int = 50000):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.app = None
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dropped = 0
+
+    def record(self, tenant_id: Optional[str], conversation_id: Optional[str], model: str,
+               usage: Optional[Dict[str, int]], latency_ms: int, success: bool):
+        usage = usage or {}
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self._dropped += 1
+            self._buffer.append({
+                'id': str(uuid.uuid4()),
+                'tenant_id': tenant_id,
+                'conversation_id': conversation_id,
+                'model': model,
+                'prompt_tokens': usage.get('prompt_tokens', 0),
+                'completion_tokens': usage.get('completion_tokens', 0),
+                'total_tokens': usage.get('total_tokens', 0),
+                'latency_ms': latency_ms,
+                'success': success,
+                'created_at': datetime.utcnow()
+            })
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        """Grava o que está acumulado (requer contexto da aplicação)"""
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        if not rows:
+            return 0
+
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                db.session.execute(ChatAIUsage.__table__.insert(), rows[start:start + self.batch_size])
+            db.session.commit()
+            return len(rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao gravar consumo da IA ({len(rows)} registros): {e}")
+            with self._lock:
+                # Devolve para a próxima tentativa, respeitando o limite do buffer
+                self._buffer.extendleft(reversed(rows[:self.max_buffer - len(self._buffer)]))
+            return 0
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def start(self, app):
+        if self._thread and self._thread.is_alive():
+            return
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ai-usage', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.flush()
+                finally:
+                    db.session.remove()
+            if self._stop.is_set():
+                break
+
+
+class AIGateway:
+    """Chamadas assíncronas à OpenAI com limites de concorrência e coalescência"""
+
+    def __init__(self, max_concurrency: int = 200, tenant_concurrency: int = 20,
+                 timeout_seconds: float = 30.0, base_url: str = None, recorder: AIUsageRecorder = None):
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.base_url = base_url
+        self.recorder = recorder or AIUsageRecorder()
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Estruturas abaixo só são usadas dentro do event loop do gateway
+        self._clients: Dict[tuple, Any] = {}
+        self._global_semaphore = None
+        self._tenant_semaphores: Dict[str, asyncio.BoundedSemaphore] = {}
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._stats = {'requests': 0, 'calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0, 'active': 0}
+
+    # ==================== EVENT LOOP ====================
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._global_semaphore = asyncio.BoundedSemaphore(self.max_concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name='ai-gateway', daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+        return self._loop
+
+    def shutdown(self):
+        """Encerra o event loop (chamadas em andamento são canceladas)"""
+        loop = self._loop
+        if loop is None:
+            return
+        self._loop = None
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    # ==================== API ====================
+
+    @staticmethod
+    def build_messages(messages: List[Dict], system_prompt: str = None) -> List[Dict[str, str]]:
+        """Converte mensagens da conversa (direction/content) para o formato de chat"""
+        chat_messages = []
+        if system_prompt:
+            chat_messages.append({"role": "system", "content": system_prompt})
+        for msg in messages:
+            if 'role' in msg:
+                chat_messages.append({"role": msg['role'], "content": msg.get("content", "")})
+            else:
+                role = "user" if msg.get("direction") == "incoming" else "assistant"
+                chat_messages.append({"role": role, "content": msg.get("content", "")})
+        return chat_messages
+
+    def submit(self, api_key: str, model: str, messages: List[Dict[str, str]], max_tokens: int = 1000,
+               temperature: float = 0.7, tenant_id: str = None, conversation_id: str = None,
+               timeout: float = None, base_url: str = None) -> Future:
+        """
+        Agenda a chamada no event loop do gateway
+
+        Returns:
+            Future (concurrent.futures) com o resultado; cancelá-lo cancela o pedido
+        """
+        coroutine = self._request(
+            api_key, model, messages, max_tokens, temperature, tenant_id, conversation_id,
+            timeout if timeout is not None else self.timeout_seconds, base_url or self.base_url
+        )
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def complete(self, *args, **kwargs) -> Dict[str, Any]:
+        """Versão bloqueante de submit(), para threads síncronas"""
+        future = self.submit(*args, **kwargs)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def complete_async(self, *args, **kwargs) -> Dict[str, Any]:
+        """Aguarda a chamada a partir de qualquer event loop"""
+        future = self.submit(*args, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    # ==================== EXECUÇÃO (no event loop do gateway) ====================
+
+    def _client(self, api_key: str, base_url: Optional[str]):
+        key = (api_key, base_url)
+        client = self._clients.get(key)
+        if client is None:
+            # Os retries ficam com o SDK; o tempo limite total é controlado pelo gateway
+            client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=2)
+            self._clients[key] = client
+        return client
+
+    def _tenant_semaphore(self, tenant_id: Optional[str]) -> asyncio.BoundedSemaphore:
+        key = tenant_id or '_global'
+        semaphore = self._tenant_semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._tenant_semaphores[key] = asyncio.BoundedSemaphore(self.tenant_concurrency)
+        return semaphore
+
+    @staticmethod
+    def _request_key(api_key, base_url, model, messages, max_tokens, temperature, tenant_id) -> str:
+        raw = json.dumps([api_key, base_url, model, messages, max_tokens, temperature, tenant_id],
+                         sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def _request(self, api_key, model, messages, max_tokens, temperature, tenant_id,
+                       conversation_id, timeout, base_url) -> Dict[str, Any]:
+        """Junta-se à chamada idêntica em andamento ou inicia uma nova"""
+        self._stats['requests'] += 1
+        key = self._request_key(api_key, base_url, model, messages, max_tokens, temperature, tenant_id)
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.get_running_loop().create_task(self._call(
+                api_key, base_url, model, messages, max_tokens, temperature, tenant_id, conversation_id
+            ))
+            entry = {'task': task, 'waiters': 0}
+            self._inflight[key] = entry
+            task.add_done_callback(lambda _, key=key, entry=entry: self._inflight.pop(key, None)
+                                   if self._inflight.get(key) is entry else None)
+        else:
+            self._stats['coalesced'] += 1
+
+        entry['waiters'] += 1
+        try:
+            # shield: o timeout de um interessado não cancela a chamada dos demais
+            return dict(await asyncio.wait_for(asyncio.shield(entry['task']), timeout))
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            return {"success": False, "error": f"Tempo limite de {timeout}s excedido", "timeout": True}
+        finally:
+            entry['waiters'] -= 1
+            if entry['waiters'] == 0 and not entry['task'].done():
+                entry['task'].cancel()
+
+    async def _call(self, api_key, base_url, model, messages, max_tokens, temperature,
+                    tenant_id, conversation_id) -> Dict[str, Any]:
+        async with self._global_semaphore, self._tenant_semaphore(tenant_id):
+            self._stats['calls'] += 1
+            self._stats['active'] += 1
+            started = time.monotonic()
+            try:
+                response = await self._client(api_key, base_url).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+                usage = {
+                    "prompt_tokens": response.usage.prompt_tokens,
+                    "completion_tokens": response.usage.completion_tokens,
+                    "total_tokens": response.usage.total_tokens
+                } if response.usage else {}
+                result = {"success": True, "response": response.choices[0].message.content, "usage": usage}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats['errors'] += 1
+                result = {"success": False, "error": str(e)}
+            finally:
+                self._stats['active'] -= 1
+
+            self.recorder.record(tenant_id, conversation_id, model, result.get('usage'),
+                                 int((time.monotonic() - started) * 1000), result['success'])
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._loop is not None,
+            'max_concurrency': self.max_concurrency,
+            'tenant_concurrency': self.tenant_concurrency,
+            'inflight': len(self._inflight),
+            'usage_pending': self.recorder.pending(),
+            **self._stats
+        }
+
+
+_ai_gateway = None
+_ai_gateway_lock = threading.Lock()
+
+
+def get_ai_gateway() -> AIGateway:
+    """Obtém o gateway compartilhado"""
+    global _ai_gateway
+    if _ai_gateway is None:
+        with _ai_gateway_lock:
+            if _ai_gateway is None:
+                _ai_gateway = AIGateway(
+                    max_concurrency=int(os.getenv('AI_MAX_CONCURRENCY', '200')),
+                    tenant_concurrency=int(os.getenv('AI_TENANT_CONCURRENCY', '20')),
+                    timeout_seconds=float(os.getenv('AI_TIMEOUT_SECONDS', '30')),
+                    base_url=os.getenv('OPENAI_BASE_URL') or None
+                )
+    return _ai_gateway
+
+
+def init_ai_gateway(app) -> bool:
+    """Inicia a gravação em lote do consumo da IA"""
+    get_ai_gateway().recorder.start(app)
+    return True
@@ -1,9 +1,14 @@
 """
 Serviço de Analytics e Relatórios
 """
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 import logging
 
+from sqlalchemy import func, table, column
+
+from src.models.user import User, db
+from src.services.activity_summary_service import activity_summary_service
+
 logger = logging.getLogger(__name__)
 
 class AnalyticsService:
@@ -97,27 +102,60 @@ class AnalyticsService:
             return {}
     
     def get_team_performance(self, tenant_id, period='30d'):
-        """Retorna performance da equipe"""
+        """Retorna performance da equipe (a partir dos resumos diários de atividade)"""
         try:
+            days = int(period.rstrip('d')) if period.endswith('d') else 30
+            start_date = date.today() - timedelta(days=days - 1)
+            
+            team = activity_summary_service.get_team_performance(tenant_id, start_date)
+            users = {u.id: u for u in User.query.filter_by(tenant_id=tenant_id).all()}
+            deals = self._won_deals_by_owner(tenant_id, start_date)
+            
+            performers = []
+            for row in team['by_user']:
+                user = users.get(row['user_id'])
+                won = deals.get(row['user_id'], {})
+                performers.append(dict(
+                    row,
+                    name=f"{user.first_name} {user.last_name}" if user else row['user_id'],
+                    deals=won.get('deals', 0),
+                    revenue=won.get('revenue', 0.0)
+                ))
+            
+            top_performers = sorted(performers, key=lambda u: (u['revenue'], u['deals'], u['tasks_completed']), reverse=True)[:3]
+            
             return {
-                'total_users': 12,
-                'active_users': 10,
-                'top_performers': [
-                    {'name': 'João Silva', 'deals': 5, 'revenue': 75000},
-                    {'name': 'Maria Santos', 'deals': 3, 'revenue': 50000},
-                    {'name': 'Pedro Costa', 'deals': 2, 'revenue': 35000}
-                ],
-                'activities': {
-                    'calls': 156,
-                    'emails': 89,
-                    'meetings': 34,
-                    'tasks_completed': 78
-                }
+                'total_users': sum(1 for u in users.values() if u.is_active),
+                'active_users': team['active_users'],
+                'top_performers': top_performers,
+                'activities': team['totals'],
+                'by_user': performers
             }
         except Exception as e:
             self.logger.error(f"Erro ao obter performance da equipe: {e}")
             return {}
     
+    def _won_deals_by_owner(self, tenant_id, start_date):
+        """Oportunidades ganhas no período por responsável ({owner_id: {deals, revenue}})"""
+        # Tabela lida pela sessão compartilhada (o modelo Opportunity usa outra instância do SQLAlchemy)
+        opportunities = table('opportunities', column('owner_id'), column('value'), column('status'),
+                              column('tenant_id'), column('updated_at'))
+        try:
+            rows = db.session.query(
+                opportunities.c.owner_id,
+                func.count(),
+                func.coalesce(func.sum(opportunities.c.value), 0)
+            ).filter(
+                opportunities.c.tenant_id == tenant_id,
+                opportunities.c.status == 'won',
+                opportunities.c.updated_at >= datetime.combine(start_date, datetime.min.time())
+            ).group_by(opportunities.c.owner_id).all()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.warning(f"Oportunidades indisponíveis para a performance da equipe: {e}")
+            return {}
+        return {owner_id: {'deals': int(count), 'revenue': float(total)} for owner_id, count, total in rows}
+    
     def generate_report(self, tenant_id, report_type, filters=None):
         """Gera relatório específico"""
         try:
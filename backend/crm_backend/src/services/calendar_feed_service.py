@@ -0,0 +1,314 @@
+"""
+Feed iCalendar (.ics) das tarefas de cada usuário
+
+Cada usuário tem uma versão (CalendarFeedState.version) incrementada sempre
+que uma tarefa ou reunião dele é alterada. O ETag do feed é derivado dessa
+versão, então clientes de calendário que consultam o feed periodicamente
+recebem 304 enquanto nada mudar. Quando a versão muda, apenas os eventos das
+tarefas e reuniões alteradas (updated_at) são serializados novamente.
+
+Task não tem regra de recorrência: cada tarefa gera um único VEVENT.
+"""
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date, time as dt_time, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from src.models.task import Task, Activity, CalendarFeedState, db
+
+logger = logging.getLogger(__name__)
+
+PRODID = '-//JT Telecom//CRM JT Telecom//PT-BR'
+FEED_DAYS_BACK = 90  # Tarefas antigas ficam fora do feed
+
+
+def _escape(text: Optional[str]) -> str:
+    """Escapa texto conforme RFC 5545"""
+    if not text:
+        return ''
+    return (str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line: str) -> str:
+    """Quebra linhas maiores que 75 octetos"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+
+    parts = []
+    current = ''
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            current = ''
+            size = 0
+            limit = 74  # Linhas de continuação começam com espaço
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _format_datetime(value: datetime) -> str:
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _format_utc(value: datetime) -> str:
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+class CalendarFeedService:
+    """Geração e cache dos feeds iCalendar por usuário"""
+
+    def __init__(self, max_feeds: int = 2000, version_ttl_seconds: float = 5.0):
+        self.max_feeds = max_feeds
+        self.version_ttl_seconds = version_ttl_seconds
+        # user_id -> {'version', 'etag', 'last_modified', 'body', 'events': {key: (stamp, vevent)}}
+        self._feeds: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        # feed_token -> (user_id, version, changed_at, lido_em)
+        self._states: Dict[str, Tuple[str, int, datetime, float]] = {}
+        self._lock = threading.Lock()
+
+    # ==================== TOKEN E VERSÃO ====================
+
+    def get_or_create_state(self, user_id: str, rotate: bool = False) -> CalendarFeedState:
+        """Obtém (ou cria) o token do feed do usuário"""
+        state = CalendarFeedState.query.get(user_id)
+        if not state:
+            state = CalendarFeedState(user_id=user_id, feed_token=secrets.token_urlsafe(32), version=1,
+                                      changed_at=datetime.utcnow())
+            db.session.add(state)
+            db.session.commit()
+        elif rotate:
+            with self._lock:
+                self._states.pop(state.feed_token, None)
+            state.feed_token = secrets.token_urlsafe(32)
+            db.session.commit()
+        return state
+
+    def resolve_token(self, feed_token: str) -> Optional[Tuple[str, int, datetime]]:
+        """
+        Resolve token -> (user_id, version, changed_at)
+
+        A versão fica em memória por alguns segundos, então rajadas de
+        consultas ao feed não chegam ao banco.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._states.get(feed_token)
+            if cached and now - cached[3] < self.version_ttl_seconds:
+                return cached[0], cached[1], cached[2]
+
+        state = CalendarFeedState.query.filter_by(feed_token=feed_token).first()
+        if not state:
+            return None
+
+        with self._lock:
+            self._states[feed_token] = (state.user_id, state.version, state.changed_at, now)
+        return state.user_id, state.version, state.changed_at
+
+    def etag_for(self, user_id: str, version: int) -> str:
+        return hashlib.sha1(f"{user_id}:{version}".encode()).hexdigest()
+
+    # ==================== GERAÇÃO ====================
+
+    def get_feed(self, user_id: str, version: int, changed_at: datetime) -> Dict[str, Any]:
+        """Retorna o feed da versão informada, regenerando só o que mudou"""
+        with self._lock:
+            cached = self._feeds.get(user_id)
+            if cached and cached['version'] == version:
+                self._feeds.move_to_end(user_id)
+                return cached
+
+        events = dict(cached['events']) if cached else {}
+        events = self._refresh_events(user_id, events)
+
+        body = self._render_calendar(events)
+        feed = {
+            'version': version,
+            'etag': self.etag_for(user_id, version),
+            'last_modified': changed_at or datetime.utcnow(),
+            'body': body,
+            'events': events
+        }
+
+        with self._lock:
+            self._feeds[user_id] = feed
+            self._feeds.move_to_end(user_id)
+            while len(self._feeds) > self.max_feeds:
+                self._feeds.popitem(last=False)
+
+        return feed
+
+    def _refresh_events(self, user_id: str, events: Dict[str, Tuple[Any, str]]) -> Dict[str, Tuple[Any, str]]:
+        """Consulta só (id, updated_at) e serializa novamente as tarefas alteradas"""
+        since = datetime.utcnow() - timedelta(days=FEED_DAYS_BACK)
+
+        stamps = dict(
+            (f"task-{task_id}", updated_at) for task_id, updated_at in db.session.query(Task.id, Task.updated_at).filter(
+                Task.assigned_to == user_id,
+                Task.due_date.isnot(None),
+                Task.due_date >= since
+            )
+        )
+
+        changed_ids = [key[5:] for key, stamp in stamps.items() if key not in events or events[key][0] != stamp]
+        fresh = {key: value for key, value in events.items() if key in stamps and key not in changed_ids}
+
+        # Carrega em blocos para não estourar o limite de parâmetros do IN
+        for i in range(0, len(changed_ids), 500):
+            for task in Task.query.filter(Task.id.in_(changed_ids[i:i + 500])).all():
+                vevent = self._task_to_vevent(task)
+                if vevent:
+                    fresh[f"task-{task.id}"] = (task.updated_at, vevent)
+
+        # Reuniões registradas como atividades agendadas
+        meetings = Activity.query.filter(
+            Activity.user_id == user_id,
+            Activity.type == 'meeting',
+            Activity.scheduled_at.isnot(None),
+            Activity.scheduled_at >= since
+        ).all()
+        for meeting in meetings:
+            key = f"activity-{meeting.id}"
+            stamp = meeting.updated_at or meeting.created_at
+            if key in events and events[key][0] == stamp:
+                fresh[key] = events[key]
+            else:
+                fresh[key] = (stamp, self._activity_to_vevent(meeting))
+
+        return fresh
+
+    def _task_to_vevent(self, task: Task) -> Optional[str]:
+        if not task.due_date:
+            return None
+
+        status = getattr(task.status, 'value', task.status)
+        task_type = getattr(getattr(task, 'task_type', None), 'value', getattr(task, 'task_type', None))
+        due_time = getattr(task, 'due_time', None)
+        duration = getattr(task, 'duration_minutes', None) or (60 if task_type == 'meeting' else 30)
+
+        if isinstance(task.due_date, datetime):
+            start = task.due_date
+            all_day = due_time is None and start.time() == dt_time(0, 0)
+            if due_time:
+                start = datetime.combine(start.date(), due_time)
+        else:
+            all_day = due_time is None
+            start = datetime.combine(task.due_date, due_time or dt_time(0, 0))
+
+        lines = [
+            'BEGIN:VEVENT',
+            f"UID:task-{task.id}@crm.jttelecom.com.br",
+            f"DTSTAMP:{_format_utc(task.updated_at or datetime.utcnow())}",
+            f"SUMMARY:{_escape(task.title)}"
+        ]
+
+        if all_day:
+            lines.append(f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}")
+            lines.append(f"DTEND;VALUE=DATE:{(start + timedelta(days=1)).strftime('%Y%m%d')}")
+        else:
+            lines.append(f"DTSTART:{_format_datetime(start)}")
+            lines.append(f"DTEND:{_format_datetime(start + timedelta(minutes=duration))}")
+
+        if task.description:
+            lines.append(f"DESCRIPTION:{_escape(task.description)}")
+        if getattr(task, 'location', None):
+            lines.append(f"LOCATION:{_escape(task.location)}")
+        if status == 'completed':
+            lines.append('STATUS:CONFIRMED')
+        elif status == 'cancelled':
+            lines.append('STATUS:CANCELLED')
+        if task_type:
+            lines.append(f"CATEGORIES:{_escape(task_type)}")
+        if task.priority:
+            priority = getattr(task.priority, 'value', task.priority)
+            lines.append(f"PRIORITY:{ {'urgent': 1, 'high': 3, 'medium': 5, 'low': 9}.get(priority, 5) }")
+
+        reminder_minutes = getattr(task, 'reminder_minutes', None)
+        if reminder_minutes:
+            lines.extend([
+                'BEGIN:VALARM',
+                'ACTION:DISPLAY',
+                f"DESCRIPTION:{_escape(task.title)}",
+                f"TRIGGER:-PT{int(reminder_minutes)}M",
+                'END:VALARM'
+            ])
+
+        lines.append('END:VEVENT')
+        return '\r\n'.join(_fold(line) for line in lines)
+
+    def _activity_to_vevent(self, activity: Activity) -> str:
+        lines = [
+            'BEGIN:VEVENT',
+            f"UID:activity-{activity.id}@crm.jttelecom.com.br",
+            f"DTSTAMP:{_format_utc(activity.updated_at or activity.created_at or datetime.utcnow())}",
+            f"DTSTART:{_format_datetime(activity.scheduled_at)}",
+            f"DTEND:{_format_datetime(activity.scheduled_at + timedelta(hours=1))}",
+            f"SUMMARY:{_escape(activity.title)}",
+            'CATEGORIES:meeting'
+        ]
+        if activity.description:
+            lines.append(f"DESCRIPTION:{_escape(activity.description)}")
+        lines.append('END:VEVENT')
+        return '\r\n'.join(_fold(line) for line in lines)
+
+    def _render_calendar(self, events: Dict[str, Tuple[Any, str]]) -> str:
+        header = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            f"PRODID:{PRODID}",
+            'CALSCALE:GREGORIAN',
+            'METHOD:PUBLISH',
+            'X-WR-CALNAME:Tarefas CRM JT Telecom',
+            'X-PUBLISHED-TTL:PT5M'
+        ]
+        parts = header + [vevent for _, vevent in events.values()] + ['END:VCALENDAR']
+        return '\r\n'.join(parts) + '\r\n'
+
+
+# Instância global
+calendar_feed_service = CalendarFeedService()
+
+
+# ==================== VERSIONAMENTO ====================
+
+def _collect_calendar_users(session, flush_context, instances):
+    """Coleta os usuários cujas tarefas/reuniões mudaram neste flush"""
+    users = session.info.setdefault('calendar_feed_users', set())
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Task):
+            users.add(obj.assigned_to)
+            history = inspect(obj).attrs.assigned_to.history
+            users.update(u for u in history.deleted or [] if u)
+        elif isinstance(obj, Activity) and obj.type == 'meeting':
+            users.add(obj.user_id)
+
+
+def _bump_calendar_versions(session, flush_context):
+    """Incrementa a versão do feed na mesma transação da alteração"""
+    users = {u for u in session.info.pop('calendar_feed_users', set()) if u}
+    if not users:
+        return
+
+    session.connection().execute(
+        CalendarFeedState.__table__.update()
+        .where(CalendarFeedState.__table__.c.user_id.in_(users))
+        .values(version=CalendarFeedState.__table__.c.version + 1, changed_at=datetime.utcnow())
+    )
+
+
+event.listen(Session, 'before_flush', _collect_calendar_users)
+event.listen(Session, 'after_flush', _bump_calendar_versions)
@@ -0,0 +1,449 @@
+"""
+Eventos de chamada em tempo real (PABX -> CRM -> navegador dos atendentes)
+
+Os eventos do PABX (dialing, ringing, answered, hangup) chegam pelo webhook,
+atualizam o registro da chamada e são gravados no log compacto call_events,
+junto com os eventos de operador (login, logout, pause, unpause).
+Cada processo da aplicação tem um hub de pub/sub que entrega os eventos às
+conexões SSE abertas nele: os eventos gravados no próprio processo são
+publicados logo após o commit, e os gravados por outros processos são lidos do
+log em intervalos curtos (só enquanto há conexões ou ouvintes registrados,
+como o painel do call center).
+
+Cada conexão guarda apenas o último estado de cada chamada ainda não enviado:
+um cliente lento recebe o estado atual e perde os intermediários, e a fila
+tem tamanho máximo.
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Any, Optional
+
+from src.models.telephony import Call, CallEvent, TelephonyExtension, db
+from src.services.cdr_sync_service import DISPOSITION_STATUS, DIRECTIONS, parse_datetime
+from src.services.phone_index_service import phone_index, normalize_e164
+from src.services.validators import only_digits
+from src.services.activity_summary_service import activity_summary_service
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('dialing', 'ringing', 'answered', 'hold', 'unhold', 'transfer', 'hangup')
+
+AGENT_EVENT_TYPES = ('login', 'logout', 'pause', 'unpause')
+
+EVENT_ALIASES = {
+    'discando': 'dialing', 'chamando': 'ringing', 'ring': 'ringing', 'atendida': 'answered',
+    'answer': 'answered', 'espera': 'hold', 'transferida': 'transfer', 'desligada': 'hangup', 'hangup': 'hangup',
+    'logado': 'login', 'deslogado': 'logout', 'pausa': 'pause', 'despausa': 'unpause', 'retorno': 'unpause'
+}
+
+ACTIVE_CALL_HOURS = 12  # Chamadas "em andamento" mais antigas que isso ficam fora do snapshot
+
+
+def _first(payload: Dict[str, Any], *names) -> Any:
+    for name in names:
+        if payload.get(name) not in (None, ''):
+            return payload[name]
+    return None
+
+
+def _phone_number(value: Any) -> str:
+    """Número externo em E.164; ramais e números sem DDD ficam só com dígitos"""
+    return (normalize_e164(value) or only_digits(value))[:20]
+
+
+def parse_call_event(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Campos do evento do PABX. None se faltar o tipo, o ID da chamada ou o ramal do operador"""
+    raw_type = str(_first(payload, 'event', 'evento', 'event_type', 'type') or '').strip().lower()
+    event_type = raw_type if raw_type in EVENT_TYPES + AGENT_EVENT_TYPES else EVENT_ALIASES.get(raw_type)
+    external_id = _first(payload, 'uniqueid', 'call_id', 'external_call_id', 'id')
+    extension = str(_first(payload, 'ramal', 'extension', 'agent') or '')[:20] or None
+    if not event_type:
+        return None
+    if event_type in AGENT_EVENT_TYPES:
+        if not extension:
+            return None
+        external_id = None  # Evento do operador, sem chamada
+    elif not external_id:
+        return None
+
+    return {
+        'event_type': event_type,
+        'external_call_id': str(external_id)[:50] if external_id else None,
+        'extension': extension,
+        'queue': str(_first(payload, 'fila', 'queue') or '')[:50] or None,
+        'reason': str(_first(payload, 'motivo', 'reason') or '')[:100] or None,
+        'phone_number': _phone_number(_first(payload, 'numero', 'phone_number', 'from', 'src')),
+        'direction': DIRECTIONS.get(str(_first(payload, 'direction', 'sentido') or '').strip().lower()),
+        'status': DISPOSITION_STATUS.get(str(_first(payload, 'disposition', 'status') or '').strip().lower()),
+        'occurred_at': parse_datetime(_first(payload, 'timestamp', 'data_hora', 'occurred_at')) or datetime.utcnow()
+    }
+
+
+def _apply_to_call(tenant_id: str, event: Dict[str, Any], user_id: Optional[str]) -> Call:
+    """Cria ou atualiza o registro da chamada com o estado do evento (sem commit)"""
+    call = Call.query.filter_by(tenant_id=tenant_id, external_call_id=event['external_call_id']).first()
+    moment = event['occurred_at']
+    if call is None:
+        call = Call(
+            tenant_id=tenant_id,
+            external_call_id=event['external_call_id'],
+            phone_number=event['phone_number'] or 'desconhecido',
+            direction=event['direction'] or ('outbound' if event['event_type'] == 'dialing' else 'inbound'),
+            status='in_progress',
+            start_time=moment,
+            lead_id=phone_index.find_lead_id(tenant_id, event['phone_number'])
+        )
+        db.session.add(call)
+
+    if event['queue'] and not call.queue:
+        call.queue = event['queue']
+    if user_id and not call.user_id:
+        call.user_id = user_id
+    if event['event_type'] == 'answered' and not call.answered_at:
+        call.answered_at = moment
+        call.user_id = user_id or call.user_id  # Quem atendeu
+    elif event['event_type'] == 'hangup':
+        if call.end_time is None and call.user_id and (call.answered_at or call.direction == 'outbound'):
+            # Chamada atendida ou discada pelo usuário: conta uma vez, no encerramento
+            activity_summary_service.record_event('call', call.user_id, tenant_id, call.start_time)
+        call.end_time = moment
+        call.status = event['status'] or ('completed' if call.answered_at else 'missed')
+        if call.answered_at:
+            call.duration = max(int((moment - call.answered_at).total_seconds()), 0)
+    db.session.flush()
+    return call
+
+
+def ingest_call_events(tenant_id: str, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Grava os eventos do PABX e publica nas conexões abertas deste processo"""
+    try:
+        extensions = {}
+        events = []
+        for payload in payloads:
+            event = parse_call_event(payload or {})
+            if event is None:
+                continue
+
+            user_id = None
+            if event['extension']:
+                if event['extension'] not in extensions:
+                    mapping = TelephonyExtension.query.filter_by(tenant_id=tenant_id,
+                                                                 extension=event['extension']).first()
+                    extensions[event['extension']] = mapping.user_id if mapping else None
+                user_id = extensions[event['extension']]
+
+            if event['event_type'] in AGENT_EVENT_TYPES:
+                record = CallEvent(
+                    tenant_id=tenant_id,
+                    event_type=event['event_type'],
+                    user_id=user_id,
+                    extension=event['extension'],
+                    queue=event['queue'],
+                    reason=event['reason'] if event['event_type'] == 'pause' else None,
+                    occurred_at=event['occurred_at']
+                )
+                db.session.add(record)
+                events.append(record)
+                continue
+
+            call = _apply_to_call(tenant_id, event, user_id)
+            record = CallEvent(
+                tenant_id=tenant_id,
+                call_id=call.id,
+                external_call_id=event['external_call_id'],
+                event_type=event['event_type'],
+                user_id=user_id or call.user_id,  # Ramal do evento (ex.: fila tocando em vários atendentes)
+                extension=event['extension'],
+                phone_number=call.phone_number,
+                direction=call.direction,
+                queue=call.queue,
+                occurred_at=event['occurred_at']
+            )
+            db.session.add(record)
+            events.append(record)
+
+        db.session.commit()
+        published = [record.to_dict() for record in events]
+        for event in published:
+            call_event_hub.publish(event)
+        return {'success': True, 'accepted': len(published), 'ignored': len(payloads) - len(published)}
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao gravar eventos de chamada: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def record_operator_event(tenant_id: str, user_id: str, event_type: str, reason: str = None,
+                          extension: str = None) -> Dict[str, Any]:
+    """Grava login/logout/pausa do operador informado pelo CRM e publica no hub"""
+    if event_type not in AGENT_EVENT_TYPES:
+        return {'success': False, 'error': f'Evento de operador inválido: {event_type}'}
+    try:
+        record = CallEvent(
+            tenant_id=tenant_id,
+            event_type=event_type,
+            user_id=user_id,
+            extension=extension,
+            reason=((reason or '')[:100] or None) if event_type == 'pause' else None,
+            occurred_at=datetime.utcnow()
+        )
+        db.session.add(record)
+        db.session.commit()
+        event = record.to_dict()
+        call_event_hub.publish(event)
+        return {'success': True, 'event': event}
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao gravar evento do operador: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def active_calls(tenant_id: str, user_id: str = None) -> List[Dict[str, Any]]:
+    """Chamadas em andamento (estado inicial da conexão SSE)"""
+    query = Call.query.filter(
+        Call.tenant_id == tenant_id,
+        Call.status == 'in_progress',
+        Call.start_time >= datetime.utcnow() - timedelta(hours=ACTIVE_CALL_HOURS)
+    )
+    if user_id:
+        query = query.filter(Call.user_id == user_id)
+    calls = []
+    for call in query.order_by(Call.start_time.desc()).limit(500).all():
+        data = call.to_dict()
+        data['state'] = 'answered' if call.answered_at else 'ringing'
+        calls.append(data)
+    return calls
+
+
+def format_sse(event: str, data: Any, event_id: Any = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class CallEventSubscriber:
+    """Conexão SSE: último estado não enviado de cada chamada"""
+
+    def __init__(self, tenant_id: str, user_id: str = None, max_pending: int = 200):
+        self.tenant_id = tenant_id
+        self.user_id = user_id  # None: supervisor (todas as chamadas do tenant)
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.closed = False
+        self._pending: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._condition = threading.Condition()
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if not event.get('call_id'):
+            return False  # Eventos de operador ficam com os ouvintes (painel)
+        return self.user_id is None or event.get('user_id') == self.user_id
+
+    def offer(self, event: Dict[str, Any]):
+        key = event.get('call_id') or event.get('external_call_id')
+        with self._condition:
+            if key in self._pending:
+                self.dropped += 1  # Estado intermediário substituído pelo mais novo
+                del self._pending[key]
+            self._pending[key] = event
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._condition.notify()
+
+    def take(self, timeout: float) -> Optional[List[Dict[str, Any]]]:
+        """Eventos pendentes (espera até timeout). None quando a conexão foi encerrada"""
+        with self._condition:
+            if not self._pending and not self.closed:
+                self._condition.wait(timeout)
+            if self.closed:
+                return None
+            events = list(self._pending.values())
+            self._pending.clear()
+            return events
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class CallEventHub:
+    """Pub/sub em memória dos eventos de chamada para as conexões SSE do processo"""
+
+    def __init__(self, poll_seconds: float = 0.3, gap_window: int = 100, batch_size: int = 1000,
+                 max_pending: int = 200):
+        self.poll_seconds = poll_seconds
+        self.gap_window = gap_window  # IDs confirmados fora de ordem por transações concorrentes
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.app = None
+        self._subscribers: Dict[str, List[CallEventSubscriber]] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._seen = set()
+        self._seen_order = deque()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {'published': 0, 'delivered': 0}
+
+    # ==================== ASSINATURAS ====================
+
+    def subscribe(self, tenant_id: str, user_id: str = None) -> CallEventSubscriber:
+        """Abre a assinatura (antes de ler o estado inicial, para não perder eventos entre os dois)"""
+        subscriber = CallEventSubscriber(tenant_id, user_id, self.max_pending)
+        with self._lock:
+            if self._watermark is None:
+                self._watermark = db.session.query(db.func.max(CallEvent.id)).scalar() or 0
+            self._subscribers.setdefault(tenant_id, []).append(subscriber)
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber: CallEventSubscriber):
+        subscriber.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.tenant_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.tenant_id, None)
+
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        """Registra um ouvinte de todos os eventos de todos os tenants (chamado na thread de quem publica)"""
+        with self._lock:
+            if self._watermark is None:
+                self._watermark = db.session.query(db.func.max(CallEvent.id)).scalar() or 0
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+        self._wake.set()
+
+    def remove_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _mark_seen(self, event_id: int) -> bool:
+        """Registra o ID; False se o evento já foi publicado"""
+        with self._lock:
+            if event_id in self._seen:
+                return False
+            self._seen.add(event_id)
+            self._seen_order.append(event_id)
+            while len(self._seen_order) > self.gap_window * 50:
+                self._seen.discard(self._seen_order.popleft())
+            if self._watermark is None or event_id > self._watermark:
+                self._watermark = event_id
+            return True
+
+    def publish(self, event: Dict[str, Any]):
+        if event.get('id') is not None and not self._mark_seen(event['id']):
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(event['tenant_id'], ()))
+            listeners = list(self._listeners)
+            self._stats['published'] += 1
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Erro no ouvinte de eventos de chamada: {e}")
+        for subscriber in subscribers:
+            if subscriber.matches(event):
+                subscriber.offer(event)
+                self._stats['delivered'] += 1
+
+    # ==================== EVENTOS DE OUTROS PROCESSOS ====================
+
+    def poll_once(self) -> int:
+        """Publica os eventos do log ainda não vistos por este processo"""
+        if self._watermark is None:
+            self._watermark = db.session.query(db.func.max(CallEvent.id)).scalar() or 0
+            return 0
+        rows = CallEvent.query.filter(CallEvent.id > self._watermark - self.gap_window) \
+            .order_by(CallEvent.id.asc()).limit(self.batch_size).all()
+        published = 0
+        for row in rows:
+            if row.id not in self._seen:
+                self.publish(row.to_dict())
+                published += 1
+        return published
+
+    def start(self, app):
+        """Inicia a leitura do log em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='call-events', daemon=True)
+        self._thread.start()
+        logger.info("Hub de eventos de chamada iniciado")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        with self._lock:
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                idle = not self._subscribers and not self._listeners
+                if idle:
+                    # Sem conexões abertas: nada a ler; a posição é retomada a partir do fim do log
+                    self._watermark = None
+            if idle:
+                self._wake.wait(5)
+                self._wake.clear()
+                continue
+
+            with self.app.app_context():
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro ao ler eventos de chamada: {e}")
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        stats['connections'] = len(subscribers)
+        stats['listeners'] = len(self._listeners)
+        stats['dropped'] = sum(s.dropped for s in subscribers)
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+
+# Instância global
+call_event_hub = CallEventHub(
+    poll_seconds=int(os.getenv('CALL_EVENT_POLL_MS', '300')) / 1000.0,
+    max_pending=int(os.getenv('CALL_EVENT_MAX_PENDING', '200'))
+)
+
+
+def init_call_event_hub(app) -> bool:
+    """Inicia o hub de eventos de chamada se habilitado (CALL_EVENT_STREAM_ENABLED)"""
+    if os.getenv('CALL_EVENT_STREAM_ENABLED', 'true').lower() != 'true':
+        logger.info("Stream de eventos de chamada desabilitado")
+        return False
+
+    call_event_hub.start(app)
+    return True
@@ -0,0 +1,498 @@
+"""
+Importação em lote dos registros de chamadas (CDRs) do PABX JT Telecom
+
+O worker busca, por tenant, as páginas de CDRs a partir da posição já
+importada (high-watermark em cdr_sync_states.cursor_time), com uma sobreposição
+para pegar registros gravados com atraso pelo PABX. Cada página vira um único
+upsert em lote na tabela calls, pela chave (tenant_id, external_call_id), e os
+leads das chamadas são encontrados pelo índice de telefones (phone_index_service)
+e o atendente pelo mapeamento de ramais (TelephonyExtension). Arquivos CSV
+exportados do PABX passam pelo mesmo caminho (import_cdr_csv).
+
+Horários sem fuso vindos do PABX estão no horário local da central
+(PABX_TIMEZONE, padrão America/Sao_Paulo) e são gravados em UTC.
+"""
+import csv
+import io
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Iterable, Iterator
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func, or_
+
+from src.models.telephony import Call, CdrSyncState, TelephonyExtension, db
+from src.services.http_client import get_http_client
+from src.services.phone_index_service import phone_index, normalize_e164
+from src.services.validators import only_digits
+
+logger = logging.getLogger(__name__)
+
+# Campos do CDR e os nomes usados pela API e pelas exportações CSV do PABX
+FIELD_ALIASES = {
+    'external_call_id': ('external_call_id', 'uniqueid', 'call_id', 'id'),
+    'start_time': ('start_time', 'calldate', 'start', 'data_hora', 'data'),
+    'end_time': ('end_time', 'end', 'data_fim'),
+    'duration': ('billsec', 'duration', 'duracao'),
+    'status': ('status', 'disposition'),
+    'direction': ('direction', 'sentido', 'tipo'),
+    'source': ('src', 'origem', 'from'),
+    'destination': ('dst', 'destino', 'to'),
+    'queue': ('queue', 'fila'),
+    'recording_url': ('recording_url', 'recordingfile', 'gravacao')
+}
+
+DISPOSITION_STATUS = {
+    'answered': 'completed',
+    'completed': 'completed',
+    'atendida': 'completed',
+    'no answer': 'missed',
+    'noanswer': 'missed',
+    'missed': 'missed',
+    'nao atendida': 'missed',
+    'busy': 'busy',
+    'ocupado': 'busy',
+    'failed': 'failed',
+    'congestion': 'failed',
+    'falha': 'failed'
+}
+
+DIRECTIONS = {'inbound': 'inbound', 'entrada': 'inbound', 'in': 'inbound',
+              'outbound': 'outbound', 'saida': 'outbound', 'out': 'outbound'}
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+
+EXTENSION_MAX_DIGITS = 6  # Números curtos são ramais internos
+
+
+def _field(record: Dict[str, Any], name: str) -> Any:
+    for alias in FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def pabx_timezone():
+    """Fuso horário local do PABX (PABX_TIMEZONE)"""
+    name = os.getenv('PABX_TIMEZONE', 'America/Sao_Paulo')
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        logger.warning(f"PABX_TIMEZONE inválido ({name}); usando UTC")
+        return timezone.utc
+
+
+def to_pabx_time(moment: datetime) -> datetime:
+    """Horário UTC sem fuso convertido para o horário local do PABX (sem fuso)"""
+    return moment.replace(tzinfo=timezone.utc).astimezone(pabx_timezone()).replace(tzinfo=None)
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Data do CDR em UTC sem fuso (ISO 8601 ou formatos do PABX; sem fuso = horário do PABX)"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    else:
+        text = str(value).strip().replace('Z', '+00:00')
+        try:
+            moment = datetime.fromisoformat(text)
+        except ValueError:
+            for date_format in DATE_FORMATS:
+                try:
+                    moment = datetime.strptime(text, date_format)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=pabx_timezone())
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_cdr(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Converte um CDR do PABX nos campos de Call. None se faltar ID ou início"""
+    external_id = _field(record, 'external_call_id')
+    start_time = parse_datetime(_field(record, 'start_time'))
+    if not external_id or not start_time:
+        return None
+
+    source = only_digits(_field(record, 'source'))
+    destination = only_digits(_field(record, 'destination'))
+    direction = DIRECTIONS.get(str(_field(record, 'direction') or '').strip().lower())
+    if direction is None:
+        # Sem sentido informado: origem em ramal interno é chamada feita
+        direction = 'outbound' if 0 < len(source) <= EXTENSION_MAX_DIGITS else 'inbound'
+    external = destination if direction == 'outbound' else source
+    internal = source if direction == 'outbound' else destination
+
+    try:
+        duration = int(float(_field(record, 'duration') or 0))
+    except (TypeError, ValueError):
+        duration = 0
+
+    status = DISPOSITION_STATUS.get(str(_field(record, 'status') or '').strip().lower())
+    if status is None:
+        status = 'completed' if duration > 0 else 'missed'
+
+    end_time = parse_datetime(_field(record, 'end_time'))
+    if end_time is None and duration:
+        end_time = start_time + timedelta(seconds=duration)
+
+    return {
+        'external_call_id': str(external_id)[:50],
+        'phone_number': (normalize_e164(external) or external)[:20] or 'desconhecido',  # Ramais ficam só com dígitos
+        'direction': direction,
+        'duration': duration,
+        'status': status,
+        'start_time': start_time,
+        'end_time': end_time,
+        'queue': str(_field(record, 'queue') or '')[:50] or None,
+        'recording_url': (_field(record, 'recording_url') or None),
+        'extension': internal if 0 < len(internal) <= EXTENSION_MAX_DIGITS else None  # Ramal do atendente
+    }
+
+
+def read_cdr_csv(stream) -> Iterator[Dict[str, Any]]:
+    """Linhas de um CSV exportado do PABX (separador ; ou ,)"""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode('utf-8-sig'))
+    elif isinstance(stream, str):
+        stream = io.StringIO(stream)
+    sample = stream.read(4096)
+    stream.seek(0)
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    for row in csv.DictReader(stream, delimiter=delimiter):
+        yield {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+
+
+def find_leads_by_phone(tenant_id: str, phones: Iterable[str]) -> Dict[str, str]:
+    """Lead de cada número (só dígitos). Números sem lead e ramais ficam de fora"""
+    return phone_index.find_many(tenant_id, [phone for phone in phones if len(phone) > EXTENSION_MAX_DIGITS])
+
+
+def find_users_by_extension(tenant_id: str, extensions: Iterable[str]) -> Dict[str, str]:
+    """Usuário de cada ramal mapeado do tenant (uma consulta)"""
+    extensions = [extension for extension in set(extensions) if extension]
+    if not extensions:
+        return {}
+    return dict(db.session.query(TelephonyExtension.extension, TelephonyExtension.user_id).filter(
+        TelephonyExtension.tenant_id == tenant_id,
+        TelephonyExtension.extension.in_(extensions)
+    ).all())
+
+
+def upsert_calls(tenant_id: str, rows: List[Dict[str, Any]]) -> int:
+    """INSERT ... ON CONFLICT em lote por (tenant_id, external_call_id), sem commit"""
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    for row in rows:
+        row.update({'id': str(uuid.uuid4()), 'tenant_id': tenant_id, 'created_at': now, 'updated_at': now})
+    table = Call.__table__
+    dialect = db.session.get_bind().dialect.name
+    updated = ('status', 'duration', 'end_time', 'queue', 'recording_url', 'updated_at')
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(rows)
+        values = {name: statement.excluded[name] for name in updated}
+        # Lead escolhido manualmente no CRM não é trocado pela importação
+        values['lead_id'] = func.coalesce(table.c.lead_id, statement.excluded.lead_id)
+        values['user_id'] = func.coalesce(table.c.user_id, statement.excluded.user_id)
+        statement = statement.on_conflict_do_update(index_elements=['tenant_id', 'external_call_id'], set_=values)
+        db.session.execute(statement)
+        return len(rows)
+
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        values = {name: statement.inserted[name] for name in updated}
+        values['lead_id'] = func.coalesce(table.c.lead_id, statement.inserted.lead_id)
+        values['user_id'] = func.coalesce(table.c.user_id, statement.inserted.user_id)
+        db.session.execute(statement.on_duplicate_key_update(**values))
+        return len(rows)
+
+    existing = {call.external_call_id: call for call in Call.query.filter(
+        Call.tenant_id == tenant_id, Call.external_call_id.in_([row['external_call_id'] for row in rows])
+    ).all()}
+    for row in rows:
+        call = existing.get(row['external_call_id'])
+        if call is None:
+            db.session.add(Call(**row))
+            continue
+        for name in updated:
+            setattr(call, name, row[name])
+        call.lead_id = call.lead_id or row['lead_id']
+        call.user_id = call.user_id or row['user_id']
+    return len(rows)
+
+
+def ingest_cdrs(tenant_id: str, records: Iterable[Dict[str, Any]], batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Importa CDRs em lotes (upsert e vínculo com leads no mesmo passo), com commit por lote
+
+    Returns:
+        received, imported, skipped e latest (início da chamada mais recente)
+    """
+    stats = {'received': 0, 'imported': 0, 'skipped': 0, 'latest': None}
+
+    def flush(batch: Dict[str, Dict[str, Any]]):
+        rows = list(batch.values())
+        leads = find_leads_by_phone(tenant_id, {row['phone_number'] for row in rows})
+        users = find_users_by_extension(tenant_id, {row['extension'] for row in rows})
+        for row in rows:
+            row['lead_id'] = leads.get(row['phone_number'])
+            row['user_id'] = users.get(row.pop('extension'))
+        stats['imported'] += upsert_calls(tenant_id, rows)
+        db.session.commit()
+
+    batch: Dict[str, Dict[str, Any]] = {}  # Um registro por ID dentro do lote (o último vale)
+    for record in records:
+        stats['received'] += 1
+        row = parse_cdr(record)
+        if row is None:
+            stats['skipped'] += 1
+            continue
+        batch[row['external_call_id']] = row
+        if stats['latest'] is None or row['start_time'] > stats['latest']:
+            stats['latest'] = row['start_time']
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+    if batch:
+        flush(batch)
+    return stats
+
+
+def import_cdr_csv(tenant_id: str, stream, batch_size: int = 500) -> Dict[str, Any]:
+    """Importa um CSV exportado do PABX (não altera a posição da sincronização)"""
+    try:
+        result = ingest_cdrs(tenant_id, read_cdr_csv(stream), batch_size)
+        result['latest'] = result['latest'].isoformat() if result['latest'] else None
+        return {'success': True, **result}
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao importar CSV de CDRs: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+class PabxCdrClient:
+    """Leitura paginada dos CDRs na API do PABX"""
+
+    def __init__(self, api_url: str, auth_user: str, auth_token: str, timeout: float = 30.0):
+        self.api_url = api_url.rstrip('/')
+        self.auth_user = auth_user
+        self.auth_token = auth_token
+        self.timeout = timeout
+
+    def fetch_page(self, start: datetime, end: datetime, page: int, page_size: int) -> List[Dict[str, Any]]:
+        """CDRs com início em [start, end) (UTC), do mais antigo para o mais novo"""
+        response = get_http_client().get(
+            f"{self.api_url}/cdr",
+            params={
+                'auth_user': self.auth_user,
+                'auth_token': self.auth_token,
+                'data_inicio': to_pabx_time(start).strftime('%Y-%m-%d %H:%M:%S'),
+                'data_fim': to_pabx_time(end).strftime('%Y-%m-%d %H:%M:%S'),
+                'pagina': page,
+                'limite': page_size,
+                'ordem': 'asc'
+            },
+            rate_key='jttelecom-pabx',
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        if isinstance(data, dict):
+            data = data.get('data') or data.get('cdrs') or data.get('registros') or []
+        return data
+
+
+class CdrSyncWorker:
+    """Worker que importa os CDRs novos de cada tenant configurado"""
+
+    def __init__(self, interval_seconds: float = 60.0, page_size: int = 500, max_pages: int = 20,
+                 overlap_minutes: int = 10, initial_days: int = 7, lease_seconds: int = 600,
+                 poll_seconds: float = 5.0):
+        self.interval_seconds = interval_seconds
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.overlap = timedelta(minutes=overlap_minutes)
+        self.initial_days = initial_days
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'syncs': 0, 'imported': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def client_for(state: CdrSyncState) -> Optional[PabxCdrClient]:
+        api_url = state.api_url or os.getenv('JTTELECOM_PABX_URL')
+        if not api_url:
+            return None
+        return PabxCdrClient(api_url, state.auth_user or os.getenv('JTTELECOM_PABX_AUTH_USER', ''),
+                             state.auth_token or os.getenv('JTTELECOM_PABX_AUTH_TOKEN', ''))
+
+    def sync_state(self, state: CdrSyncState) -> Dict[str, Any]:
+        """Importa as páginas novas de um tenant e avança a posição após cada página"""
+        client = self.client_for(state)
+        if client is None:
+            state.last_error = 'URL da API do PABX não configurada'
+            state.last_sync_at = datetime.utcnow()
+            db.session.commit()
+            return {'success': False, 'error': state.last_error}
+
+        end = datetime.utcnow()
+        start = state.cursor_time - self.overlap if state.cursor_time else end - timedelta(days=self.initial_days)
+        imported = 0
+        try:
+            for page in range(1, self.max_pages + 1):
+                records = client.fetch_page(start, end, page, self.page_size)
+                result = ingest_cdrs(state.tenant_id, records, self.page_size)
+                imported += result['imported']
+                # Páginas em ordem crescente: o mais recente importado é a nova posição
+                if result['latest'] and (state.cursor_time is None or result['latest'] > state.cursor_time):
+                    state.cursor_time = result['latest']
+                state.imported_count = (state.imported_count or 0) + result['imported']
+                db.session.commit()
+                if len(records) < self.page_size or self._stop.is_set():
+                    break
+            state.last_error = None
+        except Exception as e:
+            # Qualquer falha (API, CDR inesperado, banco) fica registrada no estado
+            db.session.rollback()
+            state.last_error = str(e)[:500]
+            self._count('errors')
+            logger.error(f"Erro ao sincronizar CDRs do tenant {state.tenant_id}: {e}")
+
+        state.last_sync_at = datetime.utcnow()
+        db.session.commit()
+        self._count('syncs')
+        self._count('imported', imported)
+        if state.last_error:
+            return {'success': False, 'error': state.last_error, 'imported': imported}
+        return {'success': True, 'imported': imported, 'state': state.to_dict()}
+
+    def _claim(self, limit: int = 5) -> List[str]:
+        """Obtém lease das sincronizações vencidas"""
+        now = datetime.utcnow()
+        free = or_(CdrSyncState.lease_owner.is_(None), CdrSyncState.lease_expires_at < now)
+        due = or_(CdrSyncState.last_sync_at.is_(None),
+                  CdrSyncState.last_sync_at < now - timedelta(seconds=self.interval_seconds))
+        ids = [row[0] for row in db.session.query(CdrSyncState.id).filter(
+            CdrSyncState.is_active.is_(True), due, free
+        ).order_by(CdrSyncState.last_sync_at.asc()).limit(limit).all()]
+        if not ids:
+            return []
+
+        CdrSyncState.query.filter(CdrSyncState.id.in_(ids), free).update({
+            'lease_owner': self.worker_id,
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return [row[0] for row in db.session.query(CdrSyncState.id).filter(
+            CdrSyncState.id.in_(ids), CdrSyncState.lease_owner == self.worker_id
+        ).all()]
+
+    def process_once(self) -> int:
+        """Um ciclo do worker. Retorna quantas sincronizações foram feitas"""
+        state_ids = self._claim()
+        for state_id in state_ids:
+            try:
+                state = CdrSyncState.query.get(state_id)
+                if state:
+                    self.sync_state(state)
+            except Exception as e:
+                db.session.rollback()
+                self._count('errors')
+                logger.error(f"Erro na sincronização de CDRs {state_id}: {e}")
+            finally:
+                try:
+                    CdrSyncState.query.filter_by(id=state_id, lease_owner=self.worker_id).update(
+                        {'lease_owner': None, 'lease_expires_at': None}, synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro ao liberar a sincronização de CDRs {state_id}: {e}")
+        return len(state_ids)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    # ==================== CICLO DE VIDA ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cdr-sync', daemon=True)
+        self._thread.start()
+        logger.info(f"Worker de sincronização de CDRs iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+
+    def _run(self):
+        while not self._stop.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    processed = self.process_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no worker de sincronização de CDRs: {e}")
+                finally:
+                    db.session.remove()
+
+            if not processed:
+                self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            'worker_id': self.worker_id,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'counters': counters
+        }
+
+
+# Instância global do worker
+cdr_sync_worker = CdrSyncWorker(
+    interval_seconds=float(os.getenv('CDR_SYNC_INTERVAL_SECONDS', '60')),
+    page_size=int(os.getenv('CDR_SYNC_PAGE_SIZE', '500'))
+)
+
+
+def init_cdr_sync_worker(app) -> bool:
+    """Inicia o worker de sincronização de CDRs se habilitado (CDR_SYNC_WORKER_ENABLED)"""
+    if os.getenv('CDR_SYNC_WORKER_ENABLED', 'true').lower() != 'true':
+        logger.info("Worker de sincronização de CDRs desabilitado")
+        return False
+
+    cdr_sync_worker.start(app)
+    return True
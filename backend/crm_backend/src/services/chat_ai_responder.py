@@ -0,0 +1,144 @@
+"""
+Respostas da IA às conversas do chatbot
+
+O pedido de resposta é agendado no event loop do gateway de IA: a leitura do
+contexto e a gravação da resposta rodam no executor de threads do loop, e a
+chamada à OpenAI é assíncrona, então nenhum worker fica preso durante a
+latência do modelo. Mensagens que chegam enquanto a conversa está sendo
+respondida geram uma única nova resposta ao final. O histórico enviado é o
+resumo acumulado mais a janela recente (ver ai_context_service).
+"""
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+from src.models.chatbot import ChatAIConfig, ChatConversation, db
+from src.services.ai_context_service import ContextPlan, ConversationContextBuilder, store_summary
+from src.services.ai_gateway import AIGateway, get_ai_gateway
+
+logger = logging.getLogger(__name__)
+
+
+class ChatAIResponder:
+    """Gera e enfileira as respostas da IA sem bloquear quem pediu"""
+
+    def __init__(self, gateway: AIGateway = None):
+        self._gateway = gateway
+        self.app = None
+        self._active: Dict[str, Optional[str]] = {}  # conversa -> contexto da próxima rodada (só no loop)
+
+    @property
+    def gateway(self) -> AIGateway:
+        return self._gateway or get_ai_gateway()
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, conversation_id: str, context: str = None):
+        """Agenda a resposta da conversa (retorna imediatamente)"""
+        if self.app is None:
+            logger.warning("Respostas da IA não inicializadas; pedido ignorado")
+            return None
+        return asyncio.run_coroutine_threadsafe(self._run(conversation_id, context), self.gateway._ensure_loop())
+
+    async def _run(self, conversation_id: str, context: Optional[str]):
+        if conversation_id in self._active:
+            # Já em andamento: responde de novo ao final, com o histórico atualizado
+            self._active[conversation_id] = context or self._active[conversation_id] or ''
+            return
+
+        self._active[conversation_id] = None
+        try:
+            while True:
+                await self._reply(conversation_id, context)
+                context = self._active[conversation_id]
+                if context is None:
+                    break
+                self._active[conversation_id] = None
+        except Exception as e:
+            logger.error(f"Erro ao responder a conversa {conversation_id} com IA: {e}")
+        finally:
+            self._active.pop(conversation_id, None)
+
+    async def _reply(self, conversation_id: str, context: Optional[str]):
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(None, self._in_app, self._load_request, conversation_id, context)
+        if not loaded:
+            return
+        request, plan = loaded
+
+        if plan.needs_summary:
+            # Resume as mensagens que saíram da janela antes de responder
+            previous_until = plan.summary_until
+            summary = await self.gateway.complete_async(
+                **{**request, 'messages': plan.summary_messages(),
+                   'max_tokens': plan.builder.summary_max_tokens, 'temperature': 0.2}
+            )
+            if summary.get('success') and summary.get('response'):
+                plan.apply_summary(summary['response'])
+                await loop.run_in_executor(None, self._in_app, self._store_summary,
+                                           conversation_id, plan, previous_until)
+            else:
+                logger.warning(f"Resumo da conversa {conversation_id} não atualizado: {summary.get('error')}")
+
+        result = await self.gateway.complete_async(**{**request, 'messages': plan.messages()})
+        if not result.get('success'):
+            logger.warning(f"IA não respondeu a conversa {conversation_id}: {result.get('error')}")
+            return
+
+        await loop.run_in_executor(None, self._in_app, self._store_reply, conversation_id, result['response'])
+
+    def _in_app(self, func, *args):
+        with self.app.app_context():
+            try:
+                return func(*args)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _load_request(self, conversation_id: str, context: Optional[str]) -> Optional[Tuple[Dict[str, Any], ContextPlan]]:
+        """Parâmetros da chamada e contexto (resumo + janela recente) dentro do orçamento"""
+        conversation = ChatConversation.query.get(conversation_id)
+        if not conversation or conversation.human_takeover:
+            return None
+
+        config = ChatAIConfig.query.filter_by(is_active=True).order_by(ChatAIConfig.is_default.desc()).first()
+        if not config:
+            return None
+
+        system_prompt = config.system_prompt
+        flow_context = conversation.flow.ai_context if conversation.flow else None
+        for extra in (flow_context, context):
+            if extra:
+                system_prompt = f"{system_prompt}\n\n{extra}"
+
+        plan = ConversationContextBuilder.from_config(config).build(conversation, system_prompt)
+        request = {
+            'api_key': config.api_key,
+            'model': config.model,
+            'max_tokens': config.max_tokens,
+            'temperature': config.temperature,
+            'tenant_id': conversation.tenant_id,
+            'conversation_id': conversation_id,
+            'timeout': config.max_response_time
+        }
+        return request, plan
+
+    def _store_summary(self, conversation_id: str, plan: ContextPlan, previous_until):
+        if store_summary(conversation_id, plan, previous_until):
+            db.session.commit()
+
+    def _store_reply(self, conversation_id: str, content: str):
+        from src.services.chat_outbox_service import enqueue_chat_message
+
+        conversation = ChatConversation.query.get(conversation_id)
+        if not conversation or conversation.human_takeover:
+            return  # Atendente assumiu durante a chamada
+        enqueue_chat_message(conversation_id, content, sender_type='bot', is_ai_generated=True)
+        db.session.commit()
+
+
+# Instância global
+chat_ai_responder = ChatAIResponder()
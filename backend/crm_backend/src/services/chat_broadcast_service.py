@@ -0,0 +1,698 @@
+"""
+Envios em massa (broadcast) de templates do WhatsApp para segmentos de leads
+
+- Público: os leads do filtro (tags, status, origem, responsável) são lidos em
+  blocos por chave (id > cursor), sem carregar o segmento inteiro, e viram
+  destinatários, um por número. O cursor fica gravado no envio, então a seleção
+  continua de onde parou.
+- Envio: um worker pega os envios em andamento por lease (renovado a cada lote,
+  que cabe na metade do lease no ritmo configurado) e envia em lotes por
+  um token bucket por número de origem, respeitando o limite diário do tier da
+  Meta (contatos distintos em 24h) e um intervalo mínimo entre mensagens para o
+  mesmo contato. O resultado de cada lote é gravado ao final (checkpoint):
+  pausar e retomar não reenvia nem pula ninguém.
+- Recibos: entregue/lido atualizam o destinatário; os contadores do envio são
+  recalculados em lote a partir dos destinatários a cada poucos segundos.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, distinct, func, or_
+from sqlalchemy.exc import IntegrityError
+
+from src.models.chatbot import ChatBroadcast, ChatBroadcastRecipient, ChatIntegration, db
+from src.models.lead import Lead
+from src.services.chat_outbox_service import create_sender, extract_external_id
+from src.services.phone_index_service import normalize_e164
+from src.services.rate_limiter import TokenBucketLimiter
+from src.services.template_engine import render_template
+
+logger = logging.getLogger(__name__)
+
+# Contatos distintos por 24h em conversas iniciadas pela empresa, por tier da Meta
+TIER_LIMITS = {'tier_250': 250, 'tier_1k': 1000, 'tier_10k': 10000, 'tier_100k': 100000, 'unlimited': None}
+
+# Ordem dos status do destinatário (recibos não regridem)
+RECIPIENT_STATUS_ORDER = {'pending': 0, 'sent': 1, 'delivered': 2, 'read': 3}
+
+# Campos do lead disponíveis nos parâmetros do template ({name}, {company_name}...)
+LEAD_VARIABLES = ('name', 'email', 'company_name', 'city', 'state')
+
+# Transições de status pelas ações da API
+STATUS_TRANSITIONS = {
+    'start': (('draft',), 'running'),
+    'pause': (('running',), 'paused'),
+    'resume': (('paused',), 'running'),
+    'cancel': (('draft', 'running', 'paused'), 'cancelled')
+}
+ACTION_LABELS = {'start': 'iniciar', 'pause': 'pausar', 'resume': 'retomar', 'cancel': 'cancelar'}
+
+def recipient_phone(value: Optional[str]) -> Optional[str]:
+    """Número do destinatário no formato do WhatsApp (E.164 sem o +). None se inválido"""
+    e164 = normalize_e164(value)
+    return e164[1:] if e164 else None
+
+
+def parse_tags(raw) -> List[str]:
+    """Tags do lead (JSON ou texto separado por vírgulas)"""
+    if not raw:
+        return []
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raw = raw.split(',')
+    if isinstance(raw, str):
+        raw = [raw]
+    if not isinstance(raw, list):
+        return []
+    return [str(tag).strip() for tag in raw if str(tag).strip()]
+
+
+def _as_list(value) -> List[str]:
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+# ==================== PÚBLICO ====================
+
+def _audience_query(tenant_id: Optional[str], audience: Dict[str, Any]):
+    """Consulta dos leads do filtro (só as colunas usadas no envio)"""
+    query = db.session.query(
+        Lead.id, Lead.whatsapp, Lead.phone, Lead.tags, *[getattr(Lead, name) for name in LEAD_VARIABLES]
+    ).filter(Lead.tenant_id == tenant_id)
+
+    if _as_list(audience.get('status')):
+        query = query.filter(Lead.status.in_(_as_list(audience['status'])))
+    if _as_list(audience.get('source')):
+        query = query.filter(Lead.source.in_(_as_list(audience['source'])))
+    if audience.get('owner_id'):
+        query = query.filter(Lead.owner_id == audience['owner_id'])
+
+    tags = _as_list(audience.get('tags'))
+    if tags:
+        # Pré-filtro textual (tags em JSON, com ou sem escape de acentos); a conferência exata é feita depois
+        conditions = []
+        for tag in tags:
+            lowered = tag.lower()
+            conditions.append(or_(func.lower(Lead.tags).like(f'%{lowered}%'),
+                                  func.lower(Lead.tags).like(f'%{json.dumps(lowered)[1:-1]}%')))
+        query = query.filter(and_(*conditions) if audience.get('match') == 'all' else or_(*conditions))
+    return query
+
+
+def _matches_tags(raw_tags, audience: Dict[str, Any]) -> bool:
+    wanted = {tag.lower() for tag in _as_list(audience.get('tags'))}
+    if not wanted:
+        return True
+    tags = {tag.lower() for tag in parse_tags(raw_tags)}
+    return wanted <= tags if audience.get('match') == 'all' else bool(wanted & tags)
+
+
+def read_audience_chunk(tenant_id: Optional[str], audience: Dict[str, Any], after_id: str = None,
+                        chunk_size: int = 1000) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+    """
+    Próximo bloco do público, a partir do lead after_id
+
+    Returns:
+        (destinatários do bloco, último lead lido, se o público acabou)
+    """
+    query = _audience_query(tenant_id, audience or {})
+    if after_id:
+        query = query.filter(Lead.id > after_id)
+    rows = query.order_by(Lead.id.asc()).limit(chunk_size).all()
+
+    recipients = []
+    for row in rows:
+        if not _matches_tags(row.tags, audience or {}):
+            continue
+        phone = recipient_phone(row.whatsapp or row.phone)
+        if not phone:
+            continue
+        recipients.append({
+            'lead_id': row.id,
+            'phone_number': phone,
+            'variables': {name: getattr(row, name) for name in LEAD_VARIABLES}
+        })
+
+    last_id = rows[-1].id if rows else after_id
+    return recipients, last_id, len(rows) < chunk_size
+
+
+def count_audience(tenant_id: Optional[str], audience: Dict[str, Any], chunk_size: int = 5000) -> int:
+    """Quantidade de números distintos do público (leitura em blocos)"""
+    phones = set()
+    after_id = None
+    while True:
+        recipients, after_id, done = read_audience_chunk(tenant_id, audience, after_id, chunk_size)
+        phones.update(r['phone_number'] for r in recipients)
+        if done:
+            return len(phones)
+
+
+def _insert_recipients(rows: List[Dict[str, Any]]) -> int:
+    """INSERT em lote que ignora números já incluídos no envio"""
+    if not rows:
+        return 0
+    table = ChatBroadcastRecipient.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(rows).on_conflict_do_nothing(index_elements=['broadcast_id', 'phone_number'])
+        return db.session.execute(statement).rowcount
+
+    if dialect in ('mysql', 'mariadb'):
+        return db.session.execute(table.insert().prefix_with('IGNORE').values(rows)).rowcount
+
+    inserted = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(row))
+            inserted += 1
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def materialize_audience_chunk(broadcast: ChatBroadcast, chunk_size: int = 1000) -> int:
+    """Inclui o próximo bloco do público como destinatários (sem commit). Retorna quantos entraram"""
+    recipients, last_id, done = read_audience_chunk(broadcast.tenant_id, broadcast.audience,
+                                                    broadcast.audience_cursor, chunk_size)
+    now = datetime.utcnow()
+    inserted = _insert_recipients([{
+        'id': str(uuid.uuid4()),
+        'broadcast_id': broadcast.id,
+        'lead_id': recipient['lead_id'],
+        'phone_number': recipient['phone_number'],
+        'variables': recipient['variables'],
+        'status': 'pending',
+        'attempts': 0,
+        'created_at': now
+    } for recipient in recipients])
+
+    broadcast.audience_cursor = last_id
+    broadcast.audience_complete = done
+    broadcast.total_recipients = (broadcast.total_recipients or 0) + inserted
+    return inserted
+
+
+# ==================== RECIBOS E CONTADORES ====================
+
+def refresh_broadcast_counters(broadcast_ids) -> None:
+    """Recalcula os contadores dos envios a partir dos destinatários (sem commit)"""
+    broadcast_ids = list(broadcast_ids)
+    if not broadcast_ids:
+        return
+    totals: Dict[str, Counter] = {broadcast_id: Counter() for broadcast_id in broadcast_ids}
+    rows = db.session.query(
+        ChatBroadcastRecipient.broadcast_id, ChatBroadcastRecipient.status, func.count(ChatBroadcastRecipient.id)
+    ).filter(ChatBroadcastRecipient.broadcast_id.in_(broadcast_ids)) \
+        .group_by(ChatBroadcastRecipient.broadcast_id, ChatBroadcastRecipient.status).all()
+    for broadcast_id, status, count in rows:
+        totals[broadcast_id][status] = count
+
+    table = ChatBroadcast.__table__
+    db.session.execute(
+        table.update().where(table.c.id == bindparam('b_id')).values(
+            total_recipients=bindparam('b_total'),
+            sent_count=bindparam('b_sent'),
+            delivered_count=bindparam('b_delivered'),
+            read_count=bindparam('b_read'),
+            failed_count=bindparam('b_failed')
+        ),
+        [{
+            'b_id': broadcast_id,
+            'b_total': sum(counts.values()),
+            'b_sent': counts['sent'] + counts['delivered'] + counts['read'],  # Enviadas, inclusive já entregues
+            'b_delivered': counts['delivered'] + counts['read'],
+            'b_read': counts['read'],
+            'b_failed': counts['failed']
+        } for broadcast_id, counts in totals.items()]
+    )
+
+
+class BroadcastCounters:
+    """Envios com contadores desatualizados (recalculados em lote)"""
+
+    def __init__(self):
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def mark(self, broadcast_id: str):
+        with self._lock:
+            self._dirty.add(broadcast_id)
+
+    def flush(self) -> int:
+        """Recalcula e grava os contadores marcados. Retorna quantos envios"""
+        with self._lock:
+            broadcast_ids, self._dirty = self._dirty, set()
+        if not broadcast_ids:
+            return 0
+        try:
+            refresh_broadcast_counters(broadcast_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._dirty |= broadcast_ids
+            raise
+        return len(broadcast_ids)
+
+
+# Instância global
+broadcast_counters = BroadcastCounters()
+
+
+def record_broadcast_receipt(external_id: str, status: str, timestamp: datetime = None) -> bool:
+    """
+    Aplica um recibo de entrega/leitura a um destinatário de envio em massa (sem commit)
+
+    Os contadores do envio são atualizados depois, em lote.
+    """
+    if not external_id:
+        return False
+    recipient = ChatBroadcastRecipient.query.filter_by(external_id=external_id).first()
+    if not recipient:
+        return False
+
+    if status == 'failed':
+        recipient.status = 'failed'
+    elif RECIPIENT_STATUS_ORDER.get(status, -1) <= RECIPIENT_STATUS_ORDER.get(recipient.status, -1):
+        return False
+    else:
+        recipient.status = status
+        when = timestamp or datetime.utcnow()
+        if status in ('delivered', 'read') and not recipient.delivered_at:
+            recipient.delivered_at = when
+        if status == 'read':
+            recipient.read_at = when
+
+    broadcast_counters.mark(recipient.broadcast_id)
+    return True
+
+
+# ==================== GERENCIAMENTO ====================
+
+def create_broadcast(tenant_id: Optional[str], data: Dict[str, Any], user_id: str = None) -> Dict[str, Any]:
+    """Cria um envio em rascunho"""
+    try:
+        if not data.get('name') or not data.get('integration_id'):
+            return {'success': False, 'error': 'Nome e integração são obrigatórios'}
+        if not data.get('template_name') and not data.get('message_text'):
+            return {'success': False, 'error': 'Informe o template ou o texto da mensagem'}
+        if data.get('messaging_tier', 'tier_1k') not in TIER_LIMITS:
+            return {'success': False, 'error': f"Tier inválido. Opções: {', '.join(TIER_LIMITS)}"}
+
+        integration = ChatIntegration.query.filter_by(id=data['integration_id'], tenant_id=tenant_id).first()
+        if not integration or not integration.is_active:
+            return {'success': False, 'error': 'Integração não encontrada ou inativa'}
+        if data.get('template_name') and integration.provider != 'whatsapp_business' and not data.get('message_text'):
+            return {'success': False, 'error': 'Templates exigem a API oficial do WhatsApp; informe o texto'}
+
+        broadcast = ChatBroadcast(
+            tenant_id=tenant_id,
+            name=data['name'],
+            integration_id=integration.id,
+            template_name=data.get('template_name'),
+            template_language=data.get('template_language') or 'pt_BR',
+            template_parameters=data.get('template_parameters') or [],
+            message_text=data.get('message_text'),
+            audience=data.get('audience') or {},
+            messaging_tier=data.get('messaging_tier') or 'tier_1k',
+            rate_per_second=data.get('rate_per_second'),
+            created_by=user_id
+        )
+        db.session.add(broadcast)
+        db.session.commit()
+        return {'success': True, 'broadcast': broadcast.to_dict()}
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao criar envio em massa: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def change_broadcast_status(broadcast_id: str, tenant_id: Optional[str], action: str) -> Dict[str, Any]:
+    """Inicia, pausa, retoma ou cancela um envio (o worker segue o novo status no próximo lote)"""
+    if action not in STATUS_TRANSITIONS:
+        return {'success': False, 'error': f"Ação inválida. Opções: {', '.join(STATUS_TRANSITIONS)}"}
+    allowed, new_status = STATUS_TRANSITIONS[action]
+
+    try:
+        values = {'status': new_status}
+        if action == 'start':
+            values['started_at'] = datetime.utcnow()
+        updated = ChatBroadcast.query.filter(
+            ChatBroadcast.id == broadcast_id,
+            ChatBroadcast.tenant_id == tenant_id,
+            ChatBroadcast.status.in_(allowed)
+        ).update(values, synchronize_session=False)
+        db.session.commit()
+
+        broadcast = ChatBroadcast.query.filter_by(id=broadcast_id, tenant_id=tenant_id).first()
+        if not broadcast:
+            return {'success': False, 'error': 'Envio não encontrado'}
+        if not updated:
+            return {'success': False, 'error': f"Não é possível {ACTION_LABELS[action]} um envio com status '{broadcast.status}'"}
+        return {'success': True, 'broadcast': broadcast.to_dict()}
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro ao alterar o envio {broadcast_id}: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+# ==================== WORKER ====================
+
+class ChatBroadcastWorker:
+    """Worker que seleciona o público e envia os envios em andamento"""
+
+    def __init__(self, batch_size: int = 100, concurrency: int = 8, default_rate: float = 20.0,
+                 pair_interval_seconds: float = 6.0, slice_seconds: float = 10.0, lease_seconds: int = 120,
+                 max_attempts: int = 3, audience_chunk: int = 1000, counters_interval: float = 5.0,
+                 poll_seconds: float = 1.0):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.default_rate = default_rate
+        self.slice_seconds = slice_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.audience_chunk = audience_chunk
+        self.counters_interval = counters_interval
+        self.poll_seconds = poll_seconds
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._executor = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._limiters: Dict[str, TokenBucketLimiter] = {}  # número de origem -> token bucket
+        self._limiters_lock = threading.Lock()
+        # Intervalo mínimo entre mensagens para o mesmo contato (entre envios simultâneos)
+        self._pair_limiter = TokenBucketLimiter(1.0 / pair_interval_seconds, burst=1)
+        self._counters_flushed_at = 0.0
+        self._waiting: Dict[str, str] = {}  # envio -> motivo da espera (ex.: limite do tier)
+        self._stats = {'sent': 0, 'failed': 0, 'retried': 0, 'deferred': 0}
+        self._stats_lock = threading.Lock()
+
+    # ==================== LIMITES ====================
+
+    def _limiter(self, integration_id: str, rate: float) -> TokenBucketLimiter:
+        with self._limiters_lock:
+            limiter = self._limiters.get(integration_id)
+            if limiter is None or limiter.rate != float(rate):
+                limiter = TokenBucketLimiter(rate, burst=max(rate, 1))
+                self._limiters[integration_id] = limiter
+            return limiter
+
+    @staticmethod
+    def _remaining_quota(broadcast: ChatBroadcast) -> Optional[int]:
+        """Contatos que ainda podem ser alcançados nas últimas 24h pelo número de origem"""
+        limit = TIER_LIMITS.get(broadcast.messaging_tier or 'tier_1k')
+        if limit is None:
+            return None
+        reached = db.session.query(func.count(distinct(ChatBroadcastRecipient.phone_number))) \
+            .join(ChatBroadcast, ChatBroadcast.id == ChatBroadcastRecipient.broadcast_id) \
+            .filter(ChatBroadcast.integration_id == broadcast.integration_id,
+                    ChatBroadcastRecipient.sent_at >= datetime.utcnow() - timedelta(hours=24)).scalar() or 0
+        return max(limit - reached, 0)
+
+    # ==================== ENVIO ====================
+
+    def _send_one(self, message: Dict[str, Any], sender, recipient: Dict[str, Any]) -> Dict[str, Any]:
+        """Envia para um destinatário (thread do pool, sem acesso ao banco)"""
+        wait = self._pair_limiter.try_acquire(recipient['phone_number'])
+        if wait:
+            return {'deferred': wait}
+
+        # Não espera além do prazo do lote (o lease do envio precisa continuar válido)
+        limiter = self._limiter(message['integration_id'], message['rate'])
+        if not limiter.acquire(message['integration_id'], timeout=max(message['deadline'] - time.monotonic(), 0)):
+            return {'deferred': 1.0 / limiter.rate}
+        variables = recipient['variables'] or {}
+        try:
+            if message['template_name'] and hasattr(sender, 'send_template_message'):
+                parameters = [render_template(str(p), variables, none_as_empty=True)
+                              for p in message['template_parameters']]
+                result = sender.send_template_message(recipient['phone_number'], message['template_name'],
+                                                      message['template_language'], parameters)
+            else:
+                text = render_template(message['message_text'] or '', variables, none_as_empty=True)
+                result = sender.send_text_message(recipient['phone_number'], text)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            result['external_id'] = extract_external_id(result.get('data'))
+        return result
+
+    def _retry_delay(self, attempts: int) -> float:
+        """Backoff exponencial com jitter"""
+        return min(30 * (2 ** (attempts - 1)), 1800) * random.uniform(0.8, 1.2)
+
+    def _send_batch(self, broadcast: ChatBroadcast, sender, quota: Optional[int]) -> int:
+        """Envia um lote de destinatários pendentes e grava o resultado. Retorna quantos foram obtidos"""
+        now = datetime.utcnow()
+        rate = broadcast.rate_per_second or self.default_rate
+        # O lote precisa caber na metade do lease no ritmo do número de origem
+        limit = min(self.batch_size, max(int(rate * self.lease_seconds / 2), 1))
+        if quota is not None:
+            limit = min(limit, quota)
+        batch = ChatBroadcastRecipient.query.filter(
+            ChatBroadcastRecipient.broadcast_id == broadcast.id,
+            ChatBroadcastRecipient.status == 'pending',
+            or_(ChatBroadcastRecipient.next_attempt_at.is_(None), ChatBroadcastRecipient.next_attempt_at <= now)
+        ).order_by(ChatBroadcastRecipient.created_at.asc(), ChatBroadcastRecipient.id.asc()).limit(limit).all()
+        if not batch:
+            return 0
+
+        message = {
+            'integration_id': broadcast.integration_id,
+            'rate': rate,
+            'deadline': time.monotonic() + self.lease_seconds / 2,
+            'template_name': broadcast.template_name,
+            'template_language': broadcast.template_language or 'pt_BR',
+            'template_parameters': broadcast.template_parameters or [],
+            'message_text': broadcast.message_text
+        }
+        targets = [{'phone_number': r.phone_number, 'variables': r.variables} for r in batch]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='chat-broadcast')
+        results = list(self._executor.map(lambda target: self._send_one(message, sender, target), targets))
+
+        # Checkpoint do lote (as alterações vão em UPDATEs agrupados no flush)
+        now = datetime.utcnow()
+        for recipient, result in zip(batch, results):
+            if result.get('deferred'):
+                recipient.next_attempt_at = now + timedelta(seconds=result['deferred'])
+                self._count('deferred')
+                continue
+
+            recipient.attempts = (recipient.attempts or 0) + 1
+            if result.get('success'):
+                recipient.status = 'sent'
+                recipient.external_id = result.get('external_id')
+                recipient.sent_at = now
+                recipient.error = None
+                self._count('sent')
+            elif recipient.attempts < self.max_attempts:
+                recipient.next_attempt_at = now + timedelta(seconds=self._retry_delay(recipient.attempts))
+                recipient.error = result.get('error')
+                self._count('retried')
+            else:
+                recipient.status = 'failed'
+                recipient.error = result.get('error')
+                self._count('failed')
+        db.session.commit()
+        broadcast_counters.mark(broadcast.id)
+        return len(batch)
+
+    def _run_slice(self, broadcast_id: str) -> int:
+        """Trabalha em um envio por até slice_seconds (revezamento entre envios)"""
+        processed = 0
+        deadline = time.monotonic() + self.slice_seconds
+        try:
+            integration = None
+            sender = None
+            while time.monotonic() < deadline and not self._stop.is_set():
+                if not self._renew_lease(broadcast_id):
+                    logger.warning(f"Lease do envio em massa {broadcast_id} perdido; lote interrompido")
+                    break
+
+                # Relido a cada lote: pausa e cancelamento valem no próximo lote
+                broadcast = ChatBroadcast.query.get(broadcast_id)
+                if not broadcast or broadcast.status != 'running':
+                    break
+
+                if sender is None:
+                    integration = ChatIntegration.query.get(broadcast.integration_id)
+                    sender = create_sender(integration) if integration and integration.is_active else None
+                    if sender is None:
+                        broadcast.status = 'paused'
+                        broadcast.last_error = 'Integração não encontrada ou inativa'
+                        db.session.commit()
+                        break
+
+                if not broadcast.audience_complete:
+                    materialize_audience_chunk(broadcast, self.audience_chunk)
+                    db.session.commit()
+                    broadcast_counters.mark(broadcast_id)
+
+                quota = self._remaining_quota(broadcast)
+                if quota == 0:
+                    self._waiting[broadcast_id] = 'limite diário do tier de mensagens'
+                    break
+                self._waiting.pop(broadcast_id, None)
+
+                sent = self._send_batch(broadcast, sender, quota)
+                processed += sent
+                if sent:
+                    continue
+
+                if broadcast.audience_complete:
+                    pending = ChatBroadcastRecipient.query.filter_by(broadcast_id=broadcast_id, status='pending').count()
+                    if not pending:
+                        broadcast.status = 'completed'
+                        broadcast.completed_at = datetime.utcnow()
+                        refresh_broadcast_counters([broadcast_id])
+                        db.session.commit()
+                        logger.info(f"Envio em massa {broadcast_id} concluído")
+                    break  # Restam só destinatários aguardando nova tentativa
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro no envio em massa {broadcast_id}: {e}")
+        finally:
+            try:
+                ChatBroadcast.query.filter_by(id=broadcast_id, lease_owner=self.worker_id).update(
+                    {'lease_owner': None, 'lease_expires_at': None}, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao liberar o envio {broadcast_id}: {e}")
+        return processed
+
+    def _renew_lease(self, broadcast_id: str) -> bool:
+        """Estende o lease antes de cada lote. False se outro worker assumiu o envio"""
+        renewed = ChatBroadcast.query.filter_by(id=broadcast_id, lease_owner=self.worker_id).update(
+            {'lease_expires_at': datetime.utcnow() + timedelta(seconds=self.lease_seconds)},
+            synchronize_session=False)
+        db.session.commit()
+        return bool(renewed)
+
+    def _claim(self, limit: int = 5) -> List[str]:
+        """Obtém lease dos envios em andamento"""
+        now = datetime.utcnow()
+        free = or_(ChatBroadcast.lease_owner.is_(None), ChatBroadcast.lease_expires_at < now)
+        ids = [row[0] for row in db.session.query(ChatBroadcast.id).filter(
+            ChatBroadcast.status == 'running', free
+        ).order_by(ChatBroadcast.started_at.asc()).limit(limit).all()]
+        if not ids:
+            return []
+
+        ChatBroadcast.query.filter(ChatBroadcast.id.in_(ids), free).update({
+            'lease_owner': self.worker_id,
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return [row[0] for row in db.session.query(ChatBroadcast.id).filter(
+            ChatBroadcast.id.in_(ids), ChatBroadcast.lease_owner == self.worker_id
+        ).all()]
+
+    def process_once(self) -> int:
+        """Um ciclo do worker. Retorna quantos destinatários foram processados"""
+        processed = 0
+        for broadcast_id in self._claim():
+            processed += self._run_slice(broadcast_id)
+
+        if time.monotonic() - self._counters_flushed_at >= self.counters_interval:
+            self._counters_flushed_at = time.monotonic()
+            broadcast_counters.flush()
+            self._pair_limiter.prune()
+        return processed
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    # ==================== CICLO DE VIDA ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='chat-broadcast', daemon=True)
+        self._thread.start()
+        logger.info(f"Worker de envios em massa iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    processed = self.process_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no worker de envios em massa: {e}")
+                finally:
+                    db.session.remove()
+
+            if not processed:
+                self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            'worker_id': self.worker_id,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'counters': counters,
+            'waiting': dict(self._waiting)
+        }
+
+
+# Instância global do worker (criada sob demanda)
+chat_broadcast_worker = None
+
+
+def init_chat_broadcast_worker(app) -> bool:
+    """Inicia o worker de envios em massa se habilitado (CHAT_BROADCAST_WORKER_ENABLED)"""
+    global chat_broadcast_worker
+
+    if os.getenv('CHAT_BROADCAST_WORKER_ENABLED', 'true').lower() != 'true':
+        logger.info("Worker de envios em massa desabilitado")
+        return False
+
+    if chat_broadcast_worker is None:
+        chat_broadcast_worker = ChatBroadcastWorker(
+            default_rate=float(os.getenv('CHAT_BROADCAST_RATE_PER_SECOND', '20')),
+            concurrency=int(os.getenv('CHAT_BROADCAST_CONCURRENCY', '8'))
+        )
+    chat_broadcast_worker.start(app)
+    return True
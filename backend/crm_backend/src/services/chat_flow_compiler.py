@@ -0,0 +1,193 @@
+"""
+Compilação de fluxos de conversa (ChatFlow.flow_data)
+
+O flow_data é convertido uma única vez em um grafo imutável: botões indexados
+por id e título, validações e condições pré-compiladas, mensagens já
+compiladas pelo template_engine e arestas (next_step) verificadas.
+Os fluxos compilados ficam em um cache LRU por (id do fluxo, updated_at), então
+processar uma mensagem recebida se resume a algumas consultas em dicionários.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Callable
+
+from src.services.template_engine import compile_template
+from src.services.validators import get_validator
+
+logger = logging.getLogger(__name__)
+
+EDGE_KEYS = ('next_step', 'fallback_step', 'error_step')
+
+
+# ==================== VALIDAÇÕES E CONDIÇÕES ====================
+
+def compile_validator(validation: Dict) -> Optional[Callable[[str], Optional[str]]]:
+    """Retorna função que devolve a mensagem de erro (ou None se válido)"""
+    return get_validator(validation)
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_condition(condition: Dict) -> Callable[[Dict], bool]:
+    """Pré-processa o valor de comparação e devolve o predicado"""
+    variable = condition.get("variable")
+    operator = condition.get("operator")
+    value = condition.get("value")
+
+    text = str(value)
+    lowered = text.lower()
+    number = _to_float(value)
+
+    if operator == "equals":
+        test = lambda v: str(v) == text
+    elif operator == "not_equals":
+        test = lambda v: str(v) != text
+    elif operator == "contains":
+        test = lambda v: lowered in str(v).lower()
+    elif operator == "starts_with":
+        test = lambda v: str(v).lower().startswith(lowered)
+    elif operator == "ends_with":
+        test = lambda v: str(v).lower().endswith(lowered)
+    elif operator in ("greater_than", "less_than") and number is not None:
+        def test(v, greater=operator == "greater_than"):
+            current = _to_float(v)
+            if current is None:
+                return False
+            return current > number if greater else current < number
+    else:
+        return lambda variables: False
+
+    return lambda variables: variable in variables and test(variables[variable])
+
+
+# ==================== GRAFO ====================
+
+class CompiledStep:
+    """Etapa compilada (somente leitura)"""
+
+    __slots__ = ('step_id', 'type', 'raw', 'message', 'variable_name', 'validator', 'buttons_by_id',
+                 'buttons_by_title', 'conditions', 'next_step', 'fallback_step', 'error_step')
+
+    def __init__(self, step_id: str, step: Dict):
+        self.step_id = step_id
+        self.type = step.get("type", "text")
+        self.raw = step
+        self.message = compile_template(step.get("message", "") or "")
+        self.variable_name = step.get("variable_name")
+        self.validator = compile_validator(step.get("validation", {}))
+        self.next_step = step.get("next_step")
+        self.fallback_step = step.get("fallback_step")
+        self.error_step = step.get("error_step")
+
+        # Primeiro botão vence em caso de id/título repetido
+        self.buttons_by_id = {}
+        self.buttons_by_title = {}
+        for button in step.get("buttons", []) or []:
+            if button.get("id") is not None:
+                self.buttons_by_id.setdefault(button["id"], button)
+            if button.get("title") is not None:
+                self.buttons_by_title.setdefault(button["title"], button)
+
+        self.conditions = tuple(
+            (compile_condition(condition), condition.get("next_step"))
+            for condition in step.get("conditions", []) or []
+        )
+
+    def find_button(self, user_input: str) -> Optional[Dict]:
+        return self.buttons_by_id.get(user_input) or self.buttons_by_title.get(user_input)
+
+    def edges(self) -> List[str]:
+        """Etapas de destino referenciadas por esta etapa"""
+        targets = [getattr(self, key) for key in EDGE_KEYS]
+        targets.extend(next_step for _, next_step in self.conditions)
+        targets.extend(button.get("next_step") for button in self.buttons_by_id.values())
+        targets.extend(button.get("next_step") for button in self.buttons_by_title.values())
+        return [target for target in targets if target]
+
+
+class CompiledFlow:
+    """Fluxo compilado: etapas por id e erros de validação do grafo"""
+
+    __slots__ = ('flow_id', 'version', 'steps', 'start_step', 'errors')
+
+    def __init__(self, flow_id: Optional[str], version: Any, flow_data: Dict):
+        self.flow_id = flow_id
+        self.version = version
+        raw_steps = flow_data.get("steps", {}) or {}
+        self.steps = {step_id: CompiledStep(step_id, step) for step_id, step in raw_steps.items()}
+        self.start_step = flow_data.get("start_step") or next(iter(raw_steps), None)
+
+        errors = []
+        for step in self.steps.values():
+            for target in set(step.edges()):
+                if target not in self.steps:
+                    errors.append(f"Etapa '{step.step_id}' aponta para etapa inexistente '{target}'")
+        self.errors = tuple(errors)
+
+    def get(self, step_id: str) -> Optional[CompiledStep]:
+        return self.steps.get(step_id)
+
+
+def compile_flow(flow_data: Dict, flow_id: str = None, version: Any = None) -> CompiledFlow:
+    """Compila o flow_data e registra arestas inválidas"""
+    compiled = CompiledFlow(flow_id, version, flow_data or {})
+    for error in compiled.errors:
+        logger.warning(f"Fluxo {flow_id or '(sem id)'}: {error}")
+    return compiled
+
+
+class CompiledFlowCache:
+    """Cache LRU de fluxos compilados por (id do fluxo, versão)"""
+
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[tuple, CompiledFlow]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, flow_data: Dict, flow_id: str = None, version: Any = None) -> CompiledFlow:
+        """
+        Obtém o fluxo compilado
+
+        Sem flow_id/version, a chave é o hash do conteúdo (custa uma
+        serialização do flow_data, mas evita recompilar).
+        """
+        if flow_id is None or version is None:
+            digest = hashlib.sha1(json.dumps(flow_data, sort_keys=True, default=str).encode()).hexdigest()
+            key = ('content', digest)
+        else:
+            key = (flow_id, str(version))
+
+        with self._lock:
+            compiled = self._data.get(key)
+            if compiled is not None:
+                self._data.move_to_end(key)
+                return compiled
+
+        compiled = compile_flow(flow_data, flow_id, version)
+
+        with self._lock:
+            self._data[key] = compiled
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return compiled
+
+    def get_for_flow(self, flow) -> CompiledFlow:
+        """Fluxo compilado de um ChatFlow (versão = updated_at)"""
+        return self.get(flow.flow_data, flow.id, flow.updated_at.isoformat() if flow.updated_at else None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Instância global
+compiled_flow_cache = CompiledFlowCache()
@@ -0,0 +1,229 @@
+"""
+Avanço das conversas pelos fluxos do chatbot
+
+Recebe a entrada do contato, processa a etapa atual com o ChatFlowEngine e
+segue pelas etapas seguintes (textos, condições) até chegar a uma etapa que
+espera nova resposta. As mensagens geradas vão para a fila de saída. Etapas de
+webhook são executadas de forma assíncrona e a conversa continua quando a
+resposta chega.
+"""
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from src.models.chatbot import ChatConversation, ChatFlow
+from src.services.chat_flow_compiler import compiled_flow_cache
+from src.services.chat_outbox_service import enqueue_chat_message
+from src.services.chat_session_store import ConversationSession, chat_session_store
+from src.services.chatbot_service import ChatFlowEngine
+from src.services.flow_webhook_executor import flow_webhook_executor
+
+logger = logging.getLogger(__name__)
+
+# Etapas que param o fluxo até a próxima mensagem do contato
+WAITING_STEPS = ('input', 'buttons', 'ai')
+MAX_STEPS_PER_MESSAGE = 20  # Proteção contra ciclos no fluxo
+WEBHOOK_PENDING_SECONDS = 120  # Depois disso, um webhook sem retorno é refeito na próxima mensagem
+
+flow_engine = ChatFlowEngine()
+
+
+def _get_flow(flow_id: str) -> Optional[ChatFlow]:
+    return ChatFlow.query.get(flow_id) if flow_id else None
+
+
+def get_default_flow() -> Optional[ChatFlow]:
+    """Fluxo padrão ativo (maior prioridade)"""
+    return ChatFlow.query.filter_by(is_default=True, is_active=True).order_by(ChatFlow.priority.asc()).first()
+
+
+def _send(conversation: ChatConversation, text: str, step_id: str, payload: Dict = None) -> List[str]:
+    if not text:
+        return []
+    message = enqueue_chat_message(conversation.id, text, message_type='button' if payload else 'text',
+                                   sender_type='bot', payload=payload, flow_step=step_id)
+    return [message.id]
+
+
+def _prompt(conversation: ChatConversation, step, variables: Dict) -> List[str]:
+    """Envia a pergunta de uma etapa que aguarda resposta"""
+    text = step.message.render(variables)
+    if step.type == 'buttons':
+        buttons = [{'id': b.get('id'), 'title': b.get('title')} for b in step.raw.get('buttons', [])]
+        return _send(conversation, text, step.step_id, {'buttons': buttons})
+    return _send(conversation, text, step.step_id)
+
+
+def answer_from_knowledge_base(conversation: ChatConversation, text: Optional[str], step_id: str = None,
+                               threshold: float = None) -> Optional[Dict[str, Any]]:
+    """Responde pela base de conhecimento, sem IA, se houver entrada confiável"""
+    from src.services.knowledge_base_service import knowledge_base_service
+
+    if not text:
+        return None
+    hit = knowledge_base_service.answer(conversation.tenant_id, text, threshold)
+    if hit:
+        enqueue_chat_message(conversation.id, hit['answer'], sender_type='bot', flow_step=step_id,
+                             ai_confidence=hit['score'])
+    return hit
+
+
+def _schedule_webhook(session: ConversationSession, job: Dict[str, Any]):
+    """Agenda a chamada da etapa de webhook; a conversa fica aguardando o retorno"""
+    token = str(uuid.uuid4())
+    session.pending_token = token
+    session.pending_since = datetime.utcnow()
+    flow_webhook_executor.schedule(dict(job, conversation_id=session.conversation_id, token=token))
+
+
+def _run_steps(conversation: ChatConversation, session: ConversationSession, flow: ChatFlow, compiled,
+               step_id: Optional[str], pending_input: Optional[str]) -> Tuple[Optional[str], List[str], Optional[Dict]]:
+    """Executa as etapas a partir de step_id até uma que aguarde o contato (ou o webhook)"""
+    variables = session.variables
+    sent = []
+    ai_trigger = None
+
+    for _ in range(MAX_STEPS_PER_MESSAGE):
+        step = compiled.get(step_id) if step_id else None
+        if step is None:
+            # Fim do fluxo: a próxima mensagem recomeça do início
+            step_id = None
+            break
+
+        if step.type in WAITING_STEPS and pending_input is None:
+            if step.type == 'ai':
+                break
+            sent += _prompt(conversation, step, variables)
+            break
+
+        result = flow_engine.process_compiled_step(compiled, step_id, pending_input or '', variables)
+        result_type = result.get('type')
+
+        if not result_type and result.get('error'):
+            logger.warning(f"Fluxo {flow.id}, etapa {step_id}: {result['error']}")
+            break
+
+        if result_type == 'webhook_pending':
+            # Chamada externa fora do processamento da mensagem (ver resume_after_webhook)
+            _schedule_webhook(session, result['job'])
+            break
+
+        if result_type in ('validation_error', 'invalid_option'):
+            sent += _send(conversation, result.get('message'), step_id)
+            break
+
+        if result_type == 'ai_trigger':
+            # Perguntas frequentes são respondidas pela base; o restante vai para a IA
+            if step.raw.get('faq_enabled', True) and answer_from_knowledge_base(
+                    conversation, pending_input, step_id, step.raw.get('faq_threshold')):
+                break
+            ai_trigger = result
+            break
+
+        if result_type == 'text':
+            sent += _send(conversation, result.get('message'), step_id)
+
+        if step.type in WAITING_STEPS:
+            pending_input = None  # Entrada consumida
+
+        step_id = result.get('next_step')
+
+    return step_id, sent, ai_trigger
+
+
+def advance_conversation(conversation: ChatConversation, user_input: Optional[str]) -> Dict[str, Any]:
+    """
+    Processa a mensagem recebida no fluxo da conversa (sem commit)
+
+    O estado do fluxo é lido e gravado pelo chat_session_store.
+
+    Returns:
+        Etapa final, mensagens enfileiradas e se a IA deve responder
+    """
+    if conversation.human_takeover or conversation.status == 'transferred':
+        return {'handled': False, 'reason': 'human_takeover'}
+
+    session = chat_session_store.get(conversation)
+
+    if session.pending_token:
+        since = session.pending_since or datetime.min
+        if datetime.utcnow() - since < timedelta(seconds=WEBHOOK_PENDING_SECONDS):
+            return {'handled': True, 'reason': 'waiting_webhook', 'current_step': session.current_step,
+                    'queued_messages': [], 'ai_trigger': None}
+        # Webhook sem retorno (ex.: processo reiniciado): a etapa é executada de novo
+        session.pending_token = None
+        session.pending_since = None
+
+    flow = _get_flow(session.flow_id)
+    if not flow:
+        flow = get_default_flow()
+        if not flow:
+            return {'handled': False, 'reason': 'no_flow'}
+        session.flow_id = flow.id
+        session.current_step = None
+
+    compiled = compiled_flow_cache.get_for_flow(flow)
+
+    step_id = session.current_step
+    pending_input = user_input
+
+    if not step_id:
+        # Início do fluxo: a primeira mensagem só dispara as etapas iniciais
+        step_id = compiled.start_step
+        pending_input = None
+
+    step_id, sent, ai_trigger = _run_steps(conversation, session, flow, compiled, step_id, pending_input)
+
+    session.current_step = step_id
+    if step_id is None and not session.pending_token:
+        session.end()
+    chat_session_store.save(session, conversation)
+
+    return {
+        'handled': True,
+        'current_step': step_id,
+        'queued_messages': sent,
+        'ai_trigger': ai_trigger
+    }
+
+
+def resume_after_webhook(job: Dict[str, Any], result: Dict[str, Any]) -> bool:
+    """
+    Continua o fluxo com o retorno do webhook (sem commit)
+
+    Retornos atrasados (a conversa já mudou de etapa) são ignorados.
+    """
+    conversation = ChatConversation.query.get(job['conversation_id'])
+    if not conversation:
+        return False
+    session = chat_session_store.get(conversation)
+    if session.pending_token != job['token']:
+        return False
+
+    session.pending_token = None
+    session.pending_since = None
+
+    flow = _get_flow(session.flow_id)
+    compiled = compiled_flow_cache.get_for_flow(flow) if flow else None
+    step = compiled.get(job['step_id']) if compiled else None
+    if step is None:
+        session.current_step = None
+        session.end()
+        chat_session_store.save(session, conversation)
+        return False
+
+    if result.get('success'):
+        if step.raw.get('response_variable'):
+            session.variables[step.raw['response_variable']] = result.get('response')
+        next_step = step.next_step
+    else:
+        logger.warning(f"Webhook da etapa {step.step_id} (fluxo {flow.id}) falhou: {result.get('error')}")
+        next_step = step.error_step or step.next_step
+
+    step_id, _, _ = _run_steps(conversation, session, flow, compiled, next_step, None)
+    session.current_step = step_id
+    if step_id is None and not session.pending_token:
+        session.end()
+    chat_session_store.save(session, conversation)
+    return True
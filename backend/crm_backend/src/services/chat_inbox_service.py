@@ -0,0 +1,133 @@
+"""
+Caixa de entrada do chatbot com paginação por cursor (keyset)
+
+A listagem é ordenada por (last_activity DESC, id DESC) e o cursor guarda a
+última posição lida, então cada página é uma consulta por índice, sem OFFSET.
+O modo de alterações devolve as conversas modificadas depois de um token de
+sincronização (change_sequence, id), para o atendente atualizar a lista
+incrementalmente. A sequência é atribuída por tenant na ordem de commit
+(ver stamp_conversation_changes), então uma transação lenta não fica para
+trás de um token já entregue como aconteceria com o updated_at da aplicação.
+"""
+import logging
+from typing import Dict, Any
+
+from sqlalchemy import and_, or_
+
+from src.models.chatbot import ChatConversation, db
+from src.services.pagination import encode_cursor, decode_cursor, encode_sync_token, decode_sync_token
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 100
+
+
+class ChatInboxService:
+    """Consultas da caixa de entrada de conversas"""
+
+    def _apply_filters(self, query, filters: Dict[str, Any]):
+        if filters.get('status'):
+            statuses = filters['status'] if isinstance(filters['status'], list) else [filters['status']]
+            query = query.filter(ChatConversation.status.in_(statuses))
+        if filters.get('assigned_to'):
+            if filters['assigned_to'] == 'none':
+                query = query.filter(ChatConversation.assigned_to.is_(None))
+            else:
+                query = query.filter(ChatConversation.assigned_to == filters['assigned_to'])
+        if filters.get('human_takeover') is not None:
+            query = query.filter(ChatConversation.human_takeover == filters['human_takeover'])
+        if filters.get('unread') is not None:
+            if filters['unread']:
+                query = query.filter(ChatConversation.unread_count > 0)
+            else:
+                query = query.filter(ChatConversation.unread_count == 0)
+        return query
+
+    def list_inbox(self, tenant_id: str, filters: Dict[str, Any] = None, limit: int = 50,
+                   cursor: str = None) -> Dict[str, Any]:
+        """
+        Página da caixa de entrada, mais recentes primeiro
+
+        Args:
+            filters: status, assigned_to ('none' para sem atendente), human_takeover, unread
+            cursor: next_cursor da página anterior
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = ChatConversation.query.options(*ChatConversation.inbox_options()) \
+            .filter(ChatConversation.tenant_id == tenant_id)
+        query = self._apply_filters(query, filters or {})
+
+        if cursor:
+            last_activity, last_id = decode_cursor(cursor)
+            if last_activity is None:
+                query = query.filter(and_(ChatConversation.last_activity.is_(None), ChatConversation.id < last_id))
+            else:
+                query = query.filter(or_(
+                    ChatConversation.last_activity < last_activity,
+                    and_(ChatConversation.last_activity == last_activity, ChatConversation.id < last_id),
+                    ChatConversation.last_activity.is_(None)
+                ))
+
+        # Uma linha a mais indica se há próxima página
+        rows = query.order_by(
+            ChatConversation.last_activity.desc().nullslast(), ChatConversation.id.desc()
+        ).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'conversations': [conversation.to_dict() for conversation in rows],
+            'has_more': has_more,
+            'next_cursor': encode_cursor(rows[-1].last_activity, rows[-1].id) if has_more else None,
+            'sync_token': self._current_sync_token(tenant_id)
+        }
+
+    def list_changes(self, tenant_id: str, sync_token: str, filters: Dict[str, Any] = None,
+                     limit: int = 100) -> Dict[str, Any]:
+        """
+        Conversas alteradas depois do token de sincronização (mais antigas primeiro)
+
+        Conversas que deixaram de atender aos filtros também são devolvidas,
+        com matches_filters = False, para o cliente removê-las da lista.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        sequence, last_id = decode_sync_token(sync_token)
+
+        query = ChatConversation.query.options(*ChatConversation.inbox_options()) \
+            .filter(ChatConversation.tenant_id == tenant_id)
+        query = query.filter(or_(
+            ChatConversation.change_sequence > sequence,
+            and_(ChatConversation.change_sequence == sequence, ChatConversation.id > last_id)
+        ))
+
+        rows = query.order_by(ChatConversation.change_sequence.asc(), ChatConversation.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        matching = set()
+        if rows and filters:
+            matching = {row[0] for row in self._apply_filters(
+                db.session.query(ChatConversation.id).filter(ChatConversation.id.in_([r.id for r in rows])),
+                filters
+            ).all()}
+
+        changes = []
+        for conversation in rows:
+            data = conversation.to_dict()
+            data['matches_filters'] = conversation.id in matching if filters else True
+            changes.append(data)
+
+        next_token = encode_sync_token(rows[-1].change_sequence, rows[-1].id) if rows else sync_token
+        return {'changes': changes, 'has_more': has_more, 'sync_token': next_token}
+
+    def _current_sync_token(self, tenant_id: str) -> str:
+        """Token apontando para a alteração mais recente do tenant"""
+        row = db.session.query(ChatConversation.change_sequence, ChatConversation.id).filter(
+            ChatConversation.tenant_id == tenant_id
+        ).order_by(ChatConversation.change_sequence.desc(), ChatConversation.id.desc()).first()
+        return encode_sync_token(row[0], row[1]) if row else encode_sync_token(0, '')
+
+
+# Instância global
+chat_inbox_service = ChatInboxService()
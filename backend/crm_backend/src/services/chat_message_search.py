@@ -0,0 +1,405 @@
+"""
+Busca textual nas mensagens do chatbot, com índice particionado por mês
+
+O conteúdo de cada mensagem gravada (ou editada) é copiado, na mesma transação
+(after_flush), para um índice de busca separado da tabela chat_messages:
+
+- PostgreSQL: tabela chat_message_search particionada por mês (RANGE em
+  created_at), com tsvector gerado e índice GIN em cada partição. As partições
+  do mês atual e do seguinte são criadas na inicialização e diariamente, e o
+  backfill cria as dos meses que reindexa; uma partição DEFAULT recebe o que
+  cair fora delas.
+- SQLite: uma tabela FTS5 por mês (chat_message_search_AAAAMM).
+- Outros bancos: sem índice; a busca usa LIKE nas mensagens do período.
+
+As buscas são sempre por tenant e, por padrão, só nos meses recentes: o filtro
+de data faz o PostgreSQL ignorar as partições antigas, e no SQLite só os shards
+do período são consultados, do mais novo para o mais antigo, até completar o
+limite. O custo da busca não cresce com o histórico total.
+"""
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from src.models.chatbot import ChatConversation, ChatMessage, db
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'chat_message_search'
+TS_CONFIG = os.getenv('CHAT_SEARCH_TS_CONFIG', 'portuguese')
+DEFAULT_MONTHS = int(os.getenv('CHAT_SEARCH_DEFAULT_MONTHS', '3'))
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+_TS_CONFIG_RE = re.compile(r'^[a-z_]+$')
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def shard_name(value: datetime) -> str:
+    return f'{SEARCH_TABLE}_{value.year:04d}{value.month:02d}'
+
+
+class ChatMessageSearch:
+    """Índice de busca das mensagens e consultas por tenant"""
+
+    def __init__(self, default_months: int = DEFAULT_MONTHS, ts_config: str = TS_CONFIG):
+        if not _TS_CONFIG_RE.match(ts_config):
+            raise ValueError(f'Configuração de busca inválida: {ts_config}')
+        self.default_months = default_months
+        self.ts_config = ts_config
+        self.enabled = False
+        self.app = None
+        self._shards = set()  # Partições/shards já garantidos neste processo
+        self._tenants: 'OrderedDict[str, Optional[str]]' = OrderedDict()  # conversa -> tenant
+        self._lock = threading.Lock()
+        self._timer = None
+
+    # ==================== ESTRUTURA ====================
+
+    def _ensure_postgres_parent(self, connection):
+        connection.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+                message_id VARCHAR(36) NOT NULL,
+                conversation_id VARCHAR(36) NOT NULL,
+                tenant_id VARCHAR(36),
+                direction VARCHAR(20),
+                created_at TIMESTAMP NOT NULL,
+                content TEXT,
+                document TSVECTOR GENERATED ALWAYS AS (to_tsvector('{self.ts_config}', coalesce(content, ''))) STORED
+            ) PARTITION BY RANGE (created_at)
+        """))
+        # Índices no pai valem para todas as partições (existentes e futuras)
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin (document)"
+        ))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_tenant ON {SEARCH_TABLE} (tenant_id, created_at)"
+        ))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_message ON {SEARCH_TABLE} (message_id)"
+        ))
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE}_default PARTITION OF {SEARCH_TABLE} DEFAULT"
+        ))
+
+    def _ensure_shard(self, connection, month: datetime, remember: bool = True):
+        """
+        Cria a partição (PostgreSQL) ou o shard FTS5 (SQLite) do mês, se não existir
+
+        Args:
+            remember: guarda no cache de shards existentes; usar False quando a
+                criação ainda pode ser desfeita pelo rollback da transação
+        """
+        name = shard_name(month)
+        if name in self._shards:
+            return
+        dialect = connection.dialect.name
+        if dialect == 'postgresql':
+            upper = add_months(month, 1)
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {SEARCH_TABLE} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+            ))
+        elif dialect == 'sqlite':
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+                f"content, message_id UNINDEXED, conversation_id UNINDEXED, tenant_id UNINDEXED, "
+                f"direction UNINDEXED, created_at UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        else:
+            return
+        if remember:
+            with self._lock:
+                self._shards.add(name)
+
+    def ensure_partitions(self, months_ahead: int = 1, since: datetime = None):
+        """
+        Garante as partições do mês atual e dos próximos (antes de receberem mensagens)
+
+        Args:
+            since: também garante as dos meses desde esta data (backfill). No
+                PostgreSQL, as linhas desses meses que estavam na partição
+                DEFAULT são removidas para a partição do mês poder ser criada;
+                quem chama deve reindexá-las
+        """
+        with db.engine.begin() as connection:
+            dialect = connection.dialect.name
+            if dialect not in ('postgresql', 'sqlite'):
+                return
+            if dialect == 'postgresql':
+                self._ensure_postgres_parent(connection)
+            current = month_start(datetime.utcnow())
+            month = month_start(min(since, current)) if since else current
+            last = add_months(current, months_ahead)
+            while month <= last:
+                if dialect == 'postgresql' and since and shard_name(month) not in self._shards:
+                    connection.execute(text(
+                        f"DELETE FROM {SEARCH_TABLE}_default WHERE created_at >= :lower AND created_at < :upper"
+                    ), {'lower': month, 'upper': add_months(month, 1)})
+                self._ensure_shard(connection, month)
+                month = add_months(month, 1)
+
+    def _existing_sqlite_shards(self, connection) -> List[str]:
+        rows = connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB :pattern"
+        ), {'pattern': f'{SEARCH_TABLE}_[0-9][0-9][0-9][0-9][0-9][0-9]'}).all()
+        return sorted((row[0] for row in rows), reverse=True)
+
+    # ==================== INDEXAÇÃO ====================
+
+    def _tenant_ids(self, connection, conversation_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Tenant das conversas (cache LRU; o tenant de uma conversa não muda)"""
+        result = {}
+        missing = []
+        with self._lock:
+            for conversation_id in conversation_ids:
+                if conversation_id in self._tenants:
+                    result[conversation_id] = self._tenants[conversation_id]
+                else:
+                    missing.append(conversation_id)
+        if missing:
+            table = ChatConversation.__table__
+            rows = connection.execute(
+                table.select().with_only_columns(table.c.id, table.c.tenant_id).where(table.c.id.in_(missing))
+            ).all()
+            with self._lock:
+                for conversation_id, tenant_id in rows:
+                    result[conversation_id] = tenant_id
+                    self._tenants[conversation_id] = tenant_id
+                while len(self._tenants) > 50000:
+                    self._tenants.popitem(last=False)
+        return result
+
+    def index_rows(self, connection, messages: List[ChatMessage]):
+        """Grava as mensagens no índice (na conexão/transação informada)"""
+        dialect = connection.dialect.name
+        if dialect not in ('postgresql', 'sqlite') or not messages:
+            return
+
+        tenants = self._tenant_ids(connection, list({m.conversation_id for m in messages}))
+        by_month: Dict[datetime, List[Dict[str, Any]]] = {}
+        for message in messages:
+            created_at = message.created_at or datetime.utcnow()
+            by_month.setdefault(month_start(created_at), []).append({
+                'message_id': message.id,
+                'conversation_id': message.conversation_id,
+                'tenant_id': tenants.get(message.conversation_id),
+                'direction': message.direction,
+                'created_at': created_at if dialect == 'postgresql' else created_at.isoformat(sep=' '),
+                'content': message.content
+            })
+
+        for month, rows in by_month.items():
+            if dialect == 'postgresql':
+                target = SEARCH_TABLE  # A partição do mês (ou a DEFAULT) é escolhida pelo banco
+            else:
+                self._ensure_shard(connection, month, remember=False)
+                target = shard_name(month)
+            connection.execute(text(
+                f"INSERT INTO {target} (message_id, conversation_id, tenant_id, direction, created_at, content) "
+                f"VALUES (:message_id, :conversation_id, :tenant_id, :direction, :created_at, :content)"
+            ), rows)
+
+    def remove_rows(self, connection, messages: List[ChatMessage]):
+        dialect = connection.dialect.name
+        shards = set(self._existing_sqlite_shards(connection)) if dialect == 'sqlite' else set()
+        for message in messages:
+            if dialect == 'postgresql':
+                connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE message_id = :id AND created_at = :created_at"),
+                                   {'id': message.id, 'created_at': message.created_at})
+            elif dialect == 'sqlite' and message.created_at:
+                name = shard_name(month_start(message.created_at))
+                if name in shards:
+                    connection.execute(text(f"DELETE FROM {name} WHERE message_id = :id"), {'id': message.id})
+
+    def backfill(self, months: int = None, batch_size: int = 1000) -> int:
+        """Indexa as mensagens já existentes dos últimos meses. Retorna quantas foram indexadas"""
+        months = self.default_months if months is None else months
+        since = add_months(month_start(datetime.utcnow()), -(months - 1))
+        self.ensure_partitions(since=since)
+
+        indexed = 0
+        last = (since, '')
+        while True:
+            batch = ChatMessage.query.filter(
+                db.or_(ChatMessage.created_at > last[0],
+                       db.and_(ChatMessage.created_at == last[0], ChatMessage.id > last[1]))
+            ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).limit(batch_size).all()
+            if not batch:
+                break
+            connection = db.session.connection()
+            self.remove_rows(connection, batch)  # Reexecução não duplica
+            self.index_rows(connection, batch)
+            db.session.commit()
+            indexed += len(batch)
+            last = (batch[-1].created_at, batch[-1].id)
+        return indexed
+
+    # ==================== BUSCA ====================
+
+    @staticmethod
+    def _terms(query: str) -> List[str]:
+        return _TERM_RE.findall(query or '')[:10]
+
+    def search(self, tenant_id: Optional[str], query: str, months: int = None, limit: int = 50,
+               conversation_id: str = None, before: datetime = None) -> List[Dict[str, Any]]:
+        """
+        Mensagens do tenant que contêm os termos, das mais recentes para as mais antigas
+
+        Args:
+            months: meses consultados, contando o atual (padrão: CHAT_SEARCH_DEFAULT_MONTHS)
+            before: só mensagens anteriores (paginação)
+        """
+        terms = self._terms(query)
+        if not terms:
+            return []
+        months = max(1, months or self.default_months)
+        newest = before or datetime.utcnow()
+        since = add_months(month_start(newest), -(months - 1))
+        limit = max(1, min(int(limit), 200))
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            return self._search_postgres(tenant_id, terms, since, newest, limit, conversation_id)
+        if dialect == 'sqlite':
+            return self._search_sqlite(tenant_id, terms, since, newest, limit, conversation_id)
+        return self._search_like(tenant_id, terms, since, newest, limit, conversation_id)
+
+    def _search_postgres(self, tenant_id, terms, since, newest, limit, conversation_id) -> List[Dict[str, Any]]:
+        tenant_filter = 'tenant_id = :tenant_id' if tenant_id is not None else 'tenant_id IS NULL'
+        sql = (f"SELECT message_id, conversation_id, direction, created_at, content FROM {SEARCH_TABLE} "
+               f"WHERE {tenant_filter} AND created_at >= :since AND created_at < :newest "
+               f"AND document @@ plainto_tsquery('{self.ts_config}', :query)")
+        params = {'tenant_id': tenant_id, 'since': since, 'newest': newest, 'query': ' '.join(terms), 'limit': limit}
+        if conversation_id:
+            sql += " AND conversation_id = :conversation_id"
+            params['conversation_id'] = conversation_id
+        rows = db.session.execute(text(sql + " ORDER BY created_at DESC LIMIT :limit"), params).all()
+        return [self._as_result(row) for row in rows]
+
+    def _search_sqlite(self, tenant_id, terms, since, newest, limit, conversation_id) -> List[Dict[str, Any]]:
+        connection = db.session.connection()
+        lower = shard_name(since)
+        upper = shard_name(newest)
+        shards = [name for name in self._existing_sqlite_shards(connection) if lower <= name <= upper]
+
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        results = []
+        for name in shards:  # Do mês mais recente para o mais antigo
+            sql = (f"SELECT message_id, conversation_id, direction, created_at, content FROM {name} "
+                   f"WHERE {name} MATCH :match AND tenant_id IS :tenant_id AND created_at < :newest")
+            params = {'match': match, 'tenant_id': tenant_id, 'newest': newest.isoformat(sep=' '),
+                      'limit': limit - len(results)}
+            if conversation_id:
+                sql += " AND conversation_id = :conversation_id"
+                params['conversation_id'] = conversation_id
+            rows = connection.execute(text(sql + " ORDER BY created_at DESC LIMIT :limit"), params).all()
+            results.extend(self._as_result(row) for row in rows)
+            if len(results) >= limit:
+                break
+        return results
+
+    def _search_like(self, tenant_id, terms, since, newest, limit, conversation_id) -> List[Dict[str, Any]]:
+        query = db.session.query(
+            ChatMessage.id, ChatMessage.conversation_id, ChatMessage.direction, ChatMessage.created_at,
+            ChatMessage.content
+        ).join(ChatConversation, ChatConversation.id == ChatMessage.conversation_id).filter(
+            ChatConversation.tenant_id == tenant_id,
+            ChatMessage.created_at >= since,
+            ChatMessage.created_at < newest,
+            *[ChatMessage.content.ilike(f'%{term}%') for term in terms]
+        )
+        if conversation_id:
+            query = query.filter(ChatMessage.conversation_id == conversation_id)
+        rows = query.order_by(ChatMessage.created_at.desc()).limit(limit).all()
+        return [self._as_result(row) for row in rows]
+
+    @staticmethod
+    def _as_result(row) -> Dict[str, Any]:
+        created_at = row[3]
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        return {
+            'message_id': row[0],
+            'conversation_id': row[1],
+            'direction': row[2],
+            'created_at': created_at.isoformat() if created_at else None,
+            'content': row[4]
+        }
+
+    # ==================== MANUTENÇÃO ====================
+
+    def _schedule_maintenance(self, interval_seconds: float = 86400.0):
+        def run():
+            with self.app.app_context():
+                try:
+                    self.ensure_partitions()
+                except Exception as e:
+                    logger.error(f"Erro ao criar partições da busca de mensagens: {e}")
+            self._schedule_maintenance(interval_seconds)
+
+        self._timer = threading.Timer(interval_seconds, run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def init_app(self, app):
+        self.app = app
+        with app.app_context():
+            self.ensure_partitions()
+        self.enabled = True
+        self._schedule_maintenance()
+
+
+def _index_flushed_messages(session, flush_context):
+    """Indexa as mensagens novas do flush, reindexa as editadas e remove as excluídas"""
+    if not chat_message_search.enabled:
+        return
+    new = [obj for obj in session.new if isinstance(obj, ChatMessage) and obj.content]
+    edited = [obj for obj in session.dirty if isinstance(obj, ChatMessage)
+              and inspect(obj).attrs.content.history.has_changes()]
+    deleted = [obj for obj in session.deleted if isinstance(obj, ChatMessage)] + edited
+    new += [obj for obj in edited if obj.content]
+    if not new and not deleted:
+        return
+    connection = session.connection()
+    try:
+        if deleted:
+            chat_message_search.remove_rows(connection, deleted)
+        if new:
+            chat_message_search.index_rows(connection, new)
+    except DBAPIError as e:
+        # No PostgreSQL a transação já está abortada; o erro sobe para o rollback de quem gravou
+        logger.error(f"Erro ao indexar mensagens para busca: {e}")
+        raise
+
+
+event.listen(Session, 'after_flush', _index_flushed_messages)
+
+
+# Instância global
+chat_message_search = ChatMessageSearch()
+
+
+def init_chat_message_search(app) -> bool:
+    """Ativa a indexação das mensagens se habilitada (CHAT_MESSAGE_SEARCH_ENABLED)"""
+    if os.getenv('CHAT_MESSAGE_SEARCH_ENABLED', 'true').lower() != 'true':
+        logger.info("Busca de mensagens do chatbot desabilitada")
+        return False
+
+    chat_message_search.init_app(app)
+    return True
@@ -0,0 +1,394 @@
+"""
+Fila de saída de mensagens do chatbot (WhatsApp)
+
+As mensagens de saída são gravadas como ChatMessage com external_status
+'pending' e uma sequência por conversa. Um worker em segundo plano envia as
+mensagens em paralelo entre conversas, mas estritamente em ordem dentro de
+cada conversa: um lease por conversa garante que apenas um worker envie para o
+mesmo contato, e uma mensagem só sai depois que a anterior foi aceita pelo
+provedor (ou falhou definitivamente). O lease é renovado durante o envio; se
+outro worker assumiu a conversa, o envio para ali.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import or_
+
+from src.models.chatbot import ChatConversation, ChatMessage, ChatIntegration, db
+from src.services.activity_summary_service import activity_summary_service
+
+logger = logging.getLogger(__name__)
+
+# Ordem dos status reportados pelo provedor (não regride)
+EXTERNAL_STATUS_ORDER = {'pending': 0, 'sent': 1, 'delivered': 2, 'read': 3}
+
+
+def enqueue_chat_message(conversation_id: str, content: str, message_type: str = 'text',
+                         sender_type: str = 'bot', sender_id: str = None, payload: Dict = None,
+                         flow_step: str = None, is_ai_generated: bool = False,
+                         ai_confidence: float = None) -> ChatMessage:
+    """
+    Grava uma mensagem de saída pendente sem commit
+
+    A sequência é obtida incrementando o contador da conversa no banco; o
+    UPDATE bloqueia a linha até o commit, então mensagens concorrentes para o
+    mesmo contato recebem sequências distintas e crescentes.
+    """
+    conversations = ChatConversation.__table__
+    db.session.execute(
+        conversations.update()
+        .where(conversations.c.id == conversation_id)
+        .values(outbound_sequence=conversations.c.outbound_sequence + 1)
+    )
+    row = db.session.execute(
+        db.select(conversations.c.outbound_sequence, conversations.c.tenant_id).where(conversations.c.id == conversation_id)
+    ).first()
+    if row is None:
+        raise ValueError(f'Conversa {conversation_id} não encontrada')
+    sequence, tenant_id = row
+
+    message = ChatMessage(
+        id=str(uuid.uuid4()),
+        conversation_id=conversation_id,
+        message_type=message_type,
+        content=content,
+        direction='outgoing',
+        sender_type=sender_type,
+        sender_id=sender_id,
+        flow_step=flow_step,
+        is_ai_generated=is_ai_generated,
+        ai_confidence=ai_confidence,
+        payload=payload,
+        sequence=sequence,
+        external_status='pending',
+        send_attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(message)
+    if sender_type == 'human' and sender_id:
+        activity_summary_service.record_event('message', sender_id, tenant_id)
+    return message
+
+
+def apply_status_update(external_id: str, status: str, timestamp: datetime = None) -> bool:
+    """
+    Aplica um status de entrega recebido do provedor (sem commit)
+
+    Status fora de ordem (ex.: 'delivered' depois de 'read') são ignorados.
+    """
+    message = ChatMessage.query.filter_by(external_id=external_id).first()
+    if not message:
+        return False
+
+    if status == 'failed':
+        message.external_status = 'failed'
+        return True
+
+    if EXTERNAL_STATUS_ORDER.get(status, -1) <= EXTERNAL_STATUS_ORDER.get(message.external_status, -1):
+        return False
+
+    message.external_status = status
+    when = timestamp or datetime.utcnow()
+    if status in ('delivered', 'read') and not message.delivered_at:
+        message.delivered_at = when
+    if status == 'read':
+        message.read_at = when
+        message.is_read = True
+    return True
+
+
+def create_sender(integration: ChatIntegration):
+    """Serviço de envio da integração (WhatsApp Cloud API ou Evolution API)"""
+    from src.services.chatbot_service import WhatsAppBusinessService, EvolutionAPIService
+
+    settings = integration.settings or {}
+    if integration.provider == 'whatsapp_business':
+        return WhatsAppBusinessService(
+            access_token=integration.api_token,
+            phone_number_id=settings.get('phone_number_id') or integration.phone_number,
+            business_account_id=integration.business_account_id,
+            base_url=integration.api_url or None
+        )
+    if integration.provider == 'evolution_api':
+        return EvolutionAPIService(
+            api_url=integration.api_url,
+            api_key=integration.api_token,
+            instance_name=settings.get('instance_name', integration.name)
+        )
+    return None
+
+
+def extract_external_id(data: Optional[Dict]) -> Optional[str]:
+    """ID da mensagem na resposta do provedor"""
+    data = data or {}
+    if data.get('messages'):
+        return data['messages'][0].get('id')  # WhatsApp Cloud API
+    if isinstance(data.get('key'), dict):
+        return data['key'].get('id')  # Evolution API
+    return None
+
+
+class ChatOutboxWorker:
+    """Worker que envia as mensagens pendentes, em ordem por conversa"""
+
+    def __init__(self, concurrency: int = 8, batch_size: int = 200, lease_seconds: int = 120,
+                 max_attempts: int = 5, poll_seconds: float = 0.5, sender_ttl_seconds: int = 60):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.sender_ttl_seconds = sender_ttl_seconds
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._executor = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._senders: Dict[str, tuple] = {}  # integration_id -> (sender, carregado_em)
+        self._sender_lock = threading.Lock()
+        self._stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+
+    # ==================== PROVEDOR ====================
+
+    def _get_sender(self, integration_id: Optional[str]):
+        """Serviço de envio da integração da conversa (recarregado periodicamente)"""
+        if not integration_id:
+            return None
+
+        with self._sender_lock:
+            cached = self._senders.get(integration_id)
+            if cached and time.monotonic() - cached[1] < self.sender_ttl_seconds:
+                return cached[0]
+
+            integration = ChatIntegration.query.get(integration_id)
+            sender = create_sender(integration) if integration and integration.is_active else None
+
+            self._senders[integration_id] = (sender, time.monotonic())
+            return sender
+
+    def _deliver(self, sender, message: ChatMessage, to: str) -> Dict[str, Any]:
+        """Envia uma mensagem pelo provedor conforme o tipo"""
+        payload = message.payload or {}
+        buttons = payload.get('buttons')
+        sections = payload.get('sections')
+
+        if buttons and hasattr(sender, 'send_interactive_message'):
+            result = sender.send_interactive_message(to, message.content, buttons)
+        elif buttons and hasattr(sender, 'send_buttons_message'):
+            result = sender.send_buttons_message(to, message.content, buttons)
+        elif sections and hasattr(sender, 'send_list_message'):
+            result = sender.send_list_message(to, message.content, payload.get('button_text', 'Opções'), sections)
+        else:
+            result = sender.send_text_message(to, message.content)
+
+        if result.get('success'):
+            result['external_id'] = extract_external_id(result.get('data'))
+        return result
+
+    # ==================== FILA ====================
+
+    def _claim_conversations(self) -> List[str]:
+        """Obtém lease das conversas com mensagens prontas para envio"""
+        now = datetime.utcnow()
+
+        ids = [row[0] for row in db.session.query(ChatMessage.conversation_id).filter(
+            ChatMessage.direction == 'outgoing',
+            ChatMessage.external_status == 'pending',
+            ChatMessage.next_attempt_at <= now
+        ).distinct().limit(self.batch_size).all()]
+        if not ids:
+            return []
+
+        free = or_(ChatConversation.outbox_lease_owner.is_(None), ChatConversation.outbox_lease_expires_at < now)
+        ChatConversation.query.filter(ChatConversation.id.in_(ids), free).update({
+            'outbox_lease_owner': self.worker_id,
+            'outbox_lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return [row[0] for row in db.session.query(ChatConversation.id).filter(
+            ChatConversation.id.in_(ids),
+            ChatConversation.outbox_lease_owner == self.worker_id
+        ).all()]
+
+    def _retry_delay(self, attempts: int) -> float:
+        """Backoff exponencial com jitter"""
+        return min(5 * (2 ** (attempts - 1)), 900) * random.uniform(0.8, 1.2)
+
+    def _renew_lease(self, conversation_id: str) -> bool:
+        """Estende o lease da conversa. False se outro worker assumiu"""
+        renewed = ChatConversation.query.filter_by(
+            id=conversation_id, outbox_lease_owner=self.worker_id
+        ).update({'outbox_lease_expires_at': datetime.utcnow() + timedelta(seconds=self.lease_seconds)},
+                 synchronize_session=False)
+        db.session.commit()
+        return bool(renewed)
+
+    def _drain_conversation(self, conversation_id: str) -> int:
+        """Envia em ordem as mensagens pendentes de uma conversa (thread do pool)"""
+        sent = 0
+        with self.app.app_context():
+            try:
+                conversation = ChatConversation.query.get(conversation_id)
+                sender = self._get_sender(conversation.integration_id)
+                pending = ChatMessage.query.filter(
+                    ChatMessage.conversation_id == conversation_id,
+                    ChatMessage.direction == 'outgoing',
+                    ChatMessage.external_status == 'pending'
+                ).order_by(ChatMessage.sequence.asc()).all()
+
+                renewed_at = time.monotonic()
+                for message in pending:
+                    if message.next_attempt_at and message.next_attempt_at > datetime.utcnow():
+                        # A mensagem da vez aguarda nova tentativa: as seguintes esperam
+                        break
+
+                    # Renova com metade do lease consumida (conversas com muitas mensagens)
+                    if time.monotonic() - renewed_at >= self.lease_seconds / 2:
+                        if not self._renew_lease(conversation_id):
+                            logger.warning(f"Lease da conversa {conversation_id} perdido; envio interrompido")
+                            break
+                        renewed_at = time.monotonic()
+
+                    if sender is None:
+                        result = {'success': False, 'error': 'Integração de WhatsApp da conversa ausente ou inativa'}
+                    else:
+                        try:
+                            result = self._deliver(sender, message, conversation.phone_number)
+                        except Exception as e:
+                            result = {'success': False, 'error': str(e)}
+
+                    message.send_attempts = (message.send_attempts or 0) + 1
+                    if result.get('success'):
+                        message.external_status = 'sent'
+                        message.external_id = result.get('external_id')
+                        message.send_error = None
+                        sent += 1
+                        self._count('sent')
+                    elif message.send_attempts < self.max_attempts:
+                        message.next_attempt_at = datetime.utcnow() + timedelta(
+                            seconds=self._retry_delay(message.send_attempts))
+                        message.send_error = result.get('error')
+                        db.session.commit()
+                        self._count('retried')
+                        break
+                    else:
+                        # Falha definitiva não bloqueia o restante da conversa
+                        message.external_status = 'failed'
+                        message.send_error = result.get('error')
+                        self._count('failed')
+                        logger.error(f"Mensagem {message.id} da conversa {conversation_id} falhou: {message.send_error}")
+
+                    # Persiste cada envio antes do próximo (external_id disponível logo)
+                    db.session.commit()
+
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao enviar mensagens da conversa {conversation_id}: {e}")
+            finally:
+                try:
+                    ChatConversation.query.filter_by(
+                        id=conversation_id, outbox_lease_owner=self.worker_id
+                    ).update({'outbox_lease_owner': None, 'outbox_lease_expires_at': None},
+                             synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro ao liberar a conversa {conversation_id}: {e}")
+                db.session.remove()
+        return sent
+
+    def process_batch(self) -> int:
+        """Envia as mensagens de um lote de conversas. Retorna quantas conversas foram processadas"""
+        conversation_ids = self._claim_conversations()
+        db.session.remove()
+        if not conversation_ids:
+            return 0
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='chat-outbox')
+        list(self._executor.map(self._drain_conversation, conversation_ids))
+        return len(conversation_ids)
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    # ==================== WORKER ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='chat-outbox', daemon=True)
+        self._thread.start()
+        logger.info(f"Worker da fila de mensagens do chatbot iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    processed = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no worker da fila de mensagens: {e}")
+                finally:
+                    db.session.remove()
+
+            if processed < self.batch_size:
+                self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores do worker e mensagens de saída por status"""
+        rows = db.session.query(ChatMessage.external_status, db.func.count(ChatMessage.id)).filter(
+            ChatMessage.direction == 'outgoing'
+        ).group_by(ChatMessage.external_status).all()
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return {
+            'worker_id': self.worker_id,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'counters': counters,
+            'by_status': {status or 'unknown': count for status, count in rows}
+        }
+
+
+# Instância global do worker (criada sob demanda)
+chat_outbox_worker = None
+
+
+def init_chat_outbox_worker(app) -> bool:
+    """Inicia o worker da fila de mensagens se habilitado (CHAT_OUTBOX_WORKER_ENABLED)"""
+    global chat_outbox_worker
+
+    if os.getenv('CHAT_OUTBOX_WORKER_ENABLED', 'true').lower() != 'true':
+        logger.info("Worker da fila de mensagens do chatbot desabilitado")
+        return False
+
+    if chat_outbox_worker is None:
+        chat_outbox_worker = ChatOutboxWorker(concurrency=int(os.getenv('CHAT_OUTBOX_CONCURRENCY', '8')))
+    chat_outbox_worker.start(app)
+    return True
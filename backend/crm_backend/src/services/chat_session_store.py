@@ -0,0 +1,433 @@
+"""
+Estado das conversas em fluxo (etapa atual e variáveis) com gravação adiada
+
+Cada mensagem processada mudava a etapa e regravava o JSON de variáveis da
+conversa. Com o worker ativo, o estado das conversas ativas fica num cache LRU
+em memória e as alterações são gravadas em lote (um executemany) a cada
+fração de segundo, quando o fluxo termina e quando o worker para.
+
+Consistência:
+- as alterações ficam na sessão do banco até o commit; rollback (inclusive de
+  savepoint) descarta só o que foi alterado dentro dele
+- o banco guarda o último estado gravado (flow_state_version); após uma queda,
+  as conversas recomeçam desse estado
+- a gravação só vale se a versão não mudou; em conflito (outro processo gravou
+  antes) a conversa é relida do banco e as alterações feitas aqui (em relação
+  ao estado em que se basearam) são reaplicadas sobre ela e gravadas de novo
+
+Sem o worker (CHAT_SESSION_STORE_ENABLED=false) o estado é gravado na conversa
+dentro da própria transação, como antes.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.orm import Session
+
+from src.models.chatbot import ChatConversation, db
+
+logger = logging.getLogger(__name__)
+
+SESSION_STAGED_KEY = 'chat_flow_sessions'
+SESSION_SAVEPOINTS_KEY = 'chat_flow_sessions_savepoints'
+
+
+class ConversationSession:
+    """Estado do fluxo de uma conversa"""
+
+    __slots__ = ('conversation_id', 'flow_id', 'current_step', 'variables', 'pending_token', 'pending_since',
+                 'version', 'ended', 'base')
+
+    FIELDS = ('flow_id', 'current_step', 'pending_token', 'pending_since')
+
+    def __init__(self, conversation_id: str, flow_id: Optional[str] = None, current_step: Optional[str] = None,
+                 variables: Dict = None, pending_token: Optional[str] = None, pending_since: datetime = None,
+                 version: int = 0):
+        self.conversation_id = conversation_id
+        self.flow_id = flow_id
+        self.current_step = current_step
+        self.variables = dict(variables or {})
+        self.pending_token = pending_token
+        self.pending_since = pending_since
+        self.version = version  # flow_state_version da linha em que este estado se baseia
+        self.ended = False
+        self.base = None  # Estado lido antes das alterações (para reaplicá-las em conflito)
+
+    @classmethod
+    def from_conversation(cls, conversation: ChatConversation) -> 'ConversationSession':
+        return cls(conversation.id, conversation.flow_id, conversation.current_step, conversation.flow_variables,
+                   conversation.flow_pending_token, conversation.flow_pending_since,
+                   conversation.flow_state_version or 0)
+
+    def copy(self) -> 'ConversationSession':
+        session = ConversationSession(self.conversation_id, self.flow_id, self.current_step, self.variables,
+                                      self.pending_token, self.pending_since, self.version)
+        session.ended = self.ended
+        session.base = self.base
+        return session
+
+    def snapshot(self) -> 'ConversationSession':
+        return ConversationSession(self.conversation_id, self.flow_id, self.current_step, self.variables,
+                                   self.pending_token, self.pending_since, self.version)
+
+    def same_state(self, other: 'ConversationSession') -> bool:
+        return all(getattr(self, field) == getattr(other, field) for field in self.FIELDS) \
+            and (self.variables or {}) == (other.variables or {})
+
+    def rebase(self, current: 'ConversationSession') -> 'ConversationSession':
+        """Reaplica as alterações deste estado (em relação a base) sobre o estado atual do banco"""
+        merged = current.snapshot()
+        merged.ended = self.ended
+        base = self.base
+        if base is None:
+            # Sem estado de origem: este estado vale por inteiro
+            for field in self.FIELDS:
+                setattr(merged, field, getattr(self, field))
+            merged.variables = dict(self.variables)
+        else:
+            for field in self.FIELDS:
+                if getattr(self, field) != getattr(base, field):
+                    setattr(merged, field, getattr(self, field))
+            for key in set(base.variables) | set(self.variables):
+                if key not in self.variables:
+                    merged.variables.pop(key, None)
+                elif key not in base.variables or base.variables[key] != self.variables[key]:
+                    merged.variables[key] = self.variables[key]
+        merged.base = current.snapshot()
+        return merged
+
+    def end(self):
+        """Fluxo encerrado: grava na hora e libera o cache"""
+        self.ended = True
+
+    def apply_to(self, conversation: ChatConversation):
+        conversation.flow_id = self.flow_id
+        conversation.current_step = self.current_step
+        conversation.flow_variables = dict(self.variables)
+        conversation.flow_pending_token = self.pending_token
+        conversation.flow_pending_since = self.pending_since
+        conversation.flow_state_version = self.version + 1
+
+
+class ChatSessionStore:
+    """Cache LRU do estado das conversas com gravação em lote"""
+
+    def __init__(self, max_sessions: int = 10000, flush_interval: float = 0.3):
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+
+        self.app = None
+        self._sessions: 'OrderedDict[str, ConversationSession]' = OrderedDict()
+        self._dirty: Dict[str, ConversationSession] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'hits': 0, 'loads': 0, 'saves': 0, 'flushes': 0, 'written': 0, 'conflicts': 0, 'errors': 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    # ==================== LEITURA E ALTERAÇÃO ====================
+
+    def get(self, conversation: ChatConversation) -> ConversationSession:
+        """
+        Estado atual da conversa (cópia para alteração; grave com save)
+
+        Ordem: alteração ainda não confirmada nesta transação, cache e banco.
+        """
+        staged = db.session.info.get(SESSION_STAGED_KEY, {}).get(conversation.id)
+        if staged is not None:
+            return staged.copy()
+
+        if not self.running:
+            return ConversationSession.from_conversation(conversation)
+
+        with self._lock:
+            cached = self._sessions.get(conversation.id)
+            if cached is not None and cached.version >= (conversation.flow_state_version or 0):
+                self._sessions.move_to_end(conversation.id)
+                self._stats['hits'] += 1
+                session = cached.copy()
+                session.ended = False
+                session.base = cached.snapshot()
+                return session
+            self._stats['loads'] += 1
+
+        # Sem cache ou banco mais novo (gravado por outro processo)
+        session = ConversationSession.from_conversation(conversation)
+        session.base = session.snapshot()
+        return session
+
+    def save(self, session: ConversationSession, conversation: ChatConversation = None):
+        """Registra o novo estado na transação atual (vale a partir do commit)"""
+        if not self.running:
+            if conversation is None:
+                conversation = ChatConversation.query.get(session.conversation_id)
+            if conversation is not None:
+                session.apply_to(conversation)
+            return
+
+        db.session.info.setdefault(SESSION_STAGED_KEY, {})[session.conversation_id] = session.copy()
+
+    def invalidate(self, conversation_id: str = None):
+        """Descarta o estado em memória (ex.: conversa alterada diretamente no banco)"""
+        with self._lock:
+            if conversation_id is None:
+                self._sessions.clear()
+                self._dirty.clear()
+            else:
+                self._sessions.pop(conversation_id, None)
+                self._dirty.pop(conversation_id, None)
+
+    def _apply(self, staged: Dict[str, ConversationSession]):
+        """Estados confirmados pelo commit entram no cache para gravação"""
+        flush_now = False
+        with self._lock:
+            for conversation_id, session in staged.items():
+                current = self._sessions.get(conversation_id)
+                if current is not None and current.version > session.version:
+                    session.version = current.version  # Gravado por este processo depois da leitura
+                pending = self._dirty.get(conversation_id)
+                if pending is not None:
+                    session.base = pending.base  # Ainda não gravado: as alterações partem do mesmo estado
+                self._sessions[conversation_id] = session
+                self._sessions.move_to_end(conversation_id)
+                self._dirty[conversation_id] = session
+                flush_now = flush_now or session.ended
+            self._stats['saves'] += len(staged)
+            flush_now = flush_now or len(self._sessions) > self.max_sessions
+        if flush_now:
+            self._wakeup.set()
+
+    def _evict(self):
+        """Mantém o limite do cache (só sai quem já foi gravado)"""
+        with self._lock:
+            for conversation_id in [cid for cid, session in self._sessions.items()
+                                    if session.ended and cid not in self._dirty]:
+                del self._sessions[conversation_id]
+            excess = len(self._sessions) - self.max_sessions
+            for conversation_id in list(self._sessions.keys()):
+                if excess <= 0:
+                    break
+                if conversation_id not in self._dirty:
+                    del self._sessions[conversation_id]
+                    excess -= 1
+
+    # ==================== GRAVAÇÃO ====================
+
+    def flush(self) -> int:
+        """Grava os estados alterados em lote. Retorna quantas conversas foram gravadas"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._dirty.values())
+                self._dirty = {}
+            if not batch:
+                return 0
+
+            table = ChatConversation.__table__
+            statement = table.update().where(
+                table.c.id == bindparam('b_id'),
+                table.c.flow_state_version == bindparam('b_version')
+            ).values(
+                flow_id=bindparam('b_flow_id'),
+                current_step=bindparam('b_current_step'),
+                flow_variables=bindparam('b_variables'),
+                flow_pending_token=bindparam('b_pending_token'),
+                flow_pending_since=bindparam('b_pending_since'),
+                flow_state_version=bindparam('b_version') + 1
+            )
+            params = [{
+                'b_id': session.conversation_id,
+                'b_version': session.version,
+                'b_flow_id': session.flow_id,
+                'b_current_step': session.current_step,
+                'b_variables': session.variables,
+                'b_pending_token': session.pending_token,
+                'b_pending_since': session.pending_since
+            } for session in batch]
+
+            try:
+                with db.engine.begin() as connection:
+                    result = connection.execute(statement, params)
+                    # Sem rowcount confiável no executemany (sqlite, psycopg2) as linhas são conferidas abaixo
+                    written = result.rowcount if connection.dialect.supports_sane_multi_rowcount else None
+            except Exception as e:
+                with self._lock:
+                    for session in batch:
+                        self._dirty.setdefault(session.conversation_id, session)
+                    self._stats['errors'] += 1
+                logger.error(f"Erro ao gravar o estado de {len(batch)} conversas: {e}")
+                return 0
+
+            conflicts = {}
+            if written is None or written != len(batch):
+                # Outro processo gravou antes: essas conversas são relidas do banco
+                conflicts = self._find_conflicts(batch)
+
+            with self._lock:
+                for session in batch:
+                    if session.conversation_id in conflicts:
+                        self._rebase(session, conflicts[session.conversation_id])
+                        continue
+                    current = self._sessions.get(session.conversation_id)
+                    if current is not None and current.version == session.version:
+                        current.version += 1  # Inclui estados confirmados durante a gravação
+                self._stats['flushes'] += 1
+                self._stats['written'] += len(batch) - len(conflicts)
+                self._stats['conflicts'] += len(conflicts)
+            if conflicts:
+                logger.warning(f"Estado de {len(conflicts)} conversas alterado por outro processo; "
+                               f"alterações reaplicadas sobre o estado do banco")
+                self._wakeup.set()
+
+            self._evict()
+            return len(batch) - len(conflicts)
+
+    def _rebase(self, session: ConversationSession, current: Optional[ConversationSession]):
+        """Conflito: as alterações pendentes são reaplicadas sobre o banco e gravadas no próximo lote"""
+        conversation_id = session.conversation_id
+        latest = self._dirty.get(conversation_id)
+        if current is None:
+            # Conversa removida
+            self._sessions.pop(conversation_id, None)
+            self._dirty.pop(conversation_id, None)
+            return
+
+        if latest is None:
+            latest = session
+        else:
+            latest = latest.copy()
+            latest.base = session.base  # Cobre também as alterações do lote que conflitou
+        merged = latest.rebase(current)
+        self._sessions[conversation_id] = merged
+        self._sessions.move_to_end(conversation_id)
+        self._dirty[conversation_id] = merged
+
+    @staticmethod
+    def _find_conflicts(batch) -> Dict[str, Optional[ConversationSession]]:
+        """Estado atual no banco das conversas cuja gravação não valeu (None se não existem mais)"""
+        expected = {session.conversation_id: session for session in batch}
+        table = ChatConversation.__table__
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.flow_id, table.c.current_step, table.c.flow_variables,
+                       table.c.flow_pending_token, table.c.flow_pending_since, table.c.flow_state_version)
+                .where(table.c.id.in_(list(expected)))
+            ).all()
+        conflicts = {conversation_id: None for conversation_id in expected}
+        for row in rows:
+            current = ConversationSession(row.id, row.flow_id, row.current_step, row.flow_variables,
+                                          row.flow_pending_token, row.flow_pending_since, row.flow_state_version or 0)
+            session = expected[row.id]
+            if current.version == session.version + 1 and current.same_state(session):
+                del conflicts[row.id]
+            else:
+                conflicts[row.id] = current
+        return conflicts
+
+    # ==================== WORKER ====================
+
+    def start(self, app):
+        """Inicia a gravação periódica em thread daemon"""
+        if self.running:
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='chat-session-store', daemon=True)
+        self._thread.start()
+        logger.info("Cache de estado das conversas iniciado")
+
+    def stop(self):
+        """Para o worker gravando o que estiver pendente"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Erro na gravação do estado das conversas: {e}")
+            if self._stop.is_set():
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'running': self.running,
+                'cached': len(self._sessions),
+                'pending_writes': len(self._dirty),
+                'counters': dict(self._stats)
+            }
+
+
+# ==================== EVENTOS DA SESSÃO DO BANCO ====================
+
+def _mark_savepoint(session, transaction):
+    """Guarda os estados pendentes no início do savepoint"""
+    if transaction.nested:
+        session.info.setdefault(SESSION_SAVEPOINTS_KEY, {})[transaction] = \
+            dict(session.info.get(SESSION_STAGED_KEY, {}))
+
+
+def _rollback_savepoint(session, previous_transaction):
+    """Rollback de savepoint volta os estados ao início dele"""
+    if previous_transaction.nested:
+        snapshot = session.info.get(SESSION_SAVEPOINTS_KEY, {}).pop(previous_transaction, None)
+        if snapshot is not None:
+            session.info[SESSION_STAGED_KEY] = snapshot
+
+
+def _apply_staged_sessions(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop(SESSION_SAVEPOINTS_KEY, None)
+    staged: Dict[str, ConversationSession] = session.info.pop(SESSION_STAGED_KEY, None)
+    if staged:
+        chat_session_store._apply(staged)
+
+
+def _discard_staged_sessions(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop(SESSION_SAVEPOINTS_KEY, None)
+    session.info.pop(SESSION_STAGED_KEY, None)
+
+
+event.listen(Session, 'after_transaction_create', _mark_savepoint)
+event.listen(Session, 'after_soft_rollback', _rollback_savepoint)
+event.listen(Session, 'after_commit', _apply_staged_sessions)
+event.listen(Session, 'after_rollback', _discard_staged_sessions)
+
+
+# Instância global
+chat_session_store = ChatSessionStore(
+    max_sessions=int(os.getenv('CHAT_SESSION_CACHE_SIZE', '10000')),
+    flush_interval=float(os.getenv('CHAT_SESSION_FLUSH_MS', '300')) / 1000
+)
+
+
+def init_chat_session_store(app) -> bool:
+    """Inicia a gravação adiada do estado das conversas se habilitada (CHAT_SESSION_STORE_ENABLED)"""
+    if os.getenv('CHAT_SESSION_STORE_ENABLED', 'true').lower() != 'true':
+        logger.info("Cache de estado das conversas desabilitado; estado gravado a cada mensagem")
+        return False
+
+    chat_session_store.start(app)
+    atexit.register(chat_session_store.stop)  # Grava o que estiver pendente ao encerrar
+    return True
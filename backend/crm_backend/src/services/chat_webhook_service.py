@@ -0,0 +1,641 @@
+"""
+Recebimento dos webhooks do WhatsApp (Cloud API e Evolution API)
+
+A rota apenas verifica a assinatura, normaliza os eventos e grava os novos em
+chat_webhook_events com um único INSERT ... ON CONFLICT DO NOTHING: o índice
+único (provider, external_id) descarta reenvios do provedor, e um conjunto em
+memória de IDs recentes evita ir ao banco nas repetições mais comuns. O
+processamento (mensagens, fluxos, recibos de entrega) fica com um worker em
+segundo plano, que consome os eventos em lote e em ordem por contato.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from src.models.chatbot import ChatConversation, ChatIntegration, ChatMessage, ChatWebhookEvent, db
+from src.services.chat_session_store import chat_session_store
+from src.services.phone_index_service import phone_index
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('whatsapp_business', 'evolution_api')
+
+# Status de entrega da Evolution API -> status usados em ChatMessage.external_status
+EVOLUTION_STATUS_MAP = {
+    'SERVER_ACK': 'sent',
+    'DELIVERY_ACK': 'delivered',
+    'READ': 'read',
+    'PLAYED': 'read',
+    'ERROR': 'failed'
+}
+
+
+class RecentKeys:
+    """Conjunto LRU de chaves vistas recentemente, com expiração"""
+
+    def __init__(self, max_size: int = 100000, ttl_seconds: int = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: 'OrderedDict[tuple, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            seen_at = self._data.get(key)
+            if seen_at is None:
+                return False
+            if time.monotonic() - seen_at > self.ttl_seconds:
+                del self._data[key]
+                return False
+            return True
+
+    def add_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._data[key] = now
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _from_timestamp(value) -> Optional[datetime]:
+    try:
+        return datetime.utcfromtimestamp(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _jid_to_phone(jid: str) -> str:
+    return (jid or '').split('@')[0].split(':')[0]
+
+
+# ==================== NORMALIZAÇÃO ====================
+
+def parse_whatsapp_cloud(payload: Dict) -> List[Dict[str, Any]]:
+    """Eventos normalizados de um webhook da WhatsApp Cloud API"""
+    events = []
+    for entry in payload.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            names = {c.get('wa_id'): (c.get('profile') or {}).get('name') for c in value.get('contacts') or []}
+
+            for message in value.get('messages') or []:
+                message_type = message.get('type', 'text')
+                text = None
+                user_input = None
+                media_id = None
+
+                if message_type == 'text':
+                    text = (message.get('text') or {}).get('body')
+                elif message_type == 'interactive':
+                    interactive = message.get('interactive') or {}
+                    reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+                    text = reply.get('title')
+                    user_input = reply.get('id')
+                    message_type = 'button' if 'button_reply' in interactive else 'list'
+                elif message_type == 'button':
+                    button = message.get('button') or {}
+                    text = button.get('text')
+                    user_input = button.get('payload')
+                else:
+                    media = message.get(message_type) or {}
+                    text = media.get('caption') or f'[{message_type}]'
+                    media_id = media.get('id')
+
+                phone = message.get('from')
+                events.append({
+                    'external_id': message.get('id'),
+                    'event_type': 'message',
+                    'phone_number': phone,
+                    'occurred_at': _from_timestamp(message.get('timestamp')),
+                    'payload': {
+                        'text': text or '',
+                        'input': user_input or text or '',
+                        'message_type': message_type,
+                        'contact_name': names.get(phone),
+                        'media_id': media_id
+                    }
+                })
+
+            for status in value.get('statuses') or []:
+                events.append({
+                    # Cada transição de status é um evento distinto da mesma mensagem
+                    'external_id': f"{status.get('id')}:{status.get('status')}",
+                    'event_type': 'status',
+                    'phone_number': status.get('recipient_id'),
+                    'occurred_at': _from_timestamp(status.get('timestamp')),
+                    'payload': {
+                        'message_id': status.get('id'),
+                        'status': status.get('status'),
+                        'errors': status.get('errors')
+                    }
+                })
+
+    return [event for event in events if event['external_id'] and event['phone_number']]
+
+
+def _evolution_text(message: Dict) -> Tuple[str, Optional[str], str]:
+    """(texto, entrada para o fluxo, tipo) de uma mensagem da Evolution API"""
+    if 'conversation' in message:
+        return message['conversation'], None, 'text'
+    if 'extendedTextMessage' in message:
+        return (message['extendedTextMessage'] or {}).get('text', ''), None, 'text'
+    if 'buttonsResponseMessage' in message:
+        reply = message['buttonsResponseMessage'] or {}
+        return reply.get('selectedDisplayText', ''), reply.get('selectedButtonId'), 'button'
+    if 'listResponseMessage' in message:
+        reply = message['listResponseMessage'] or {}
+        return reply.get('title', ''), (reply.get('singleSelectReply') or {}).get('selectedRowId'), 'list'
+    for key, value in message.items():
+        if key.endswith('Message') and isinstance(value, dict):
+            media_type = key[:-len('Message')]
+            return value.get('caption') or f'[{media_type}]', None, media_type
+    return '', None, 'text'
+
+
+def parse_evolution(payload: Dict) -> List[Dict[str, Any]]:
+    """Eventos normalizados de um webhook da Evolution API"""
+    event_name = (payload.get('event') or '').lower().replace('_', '.')
+    data = payload.get('data') or []
+    items = data if isinstance(data, list) else [data]
+    events = []
+
+    if event_name == 'messages.upsert':
+        for item in items:
+            key = item.get('key') or {}
+            jid = key.get('remoteJid', '')
+            if key.get('fromMe') or jid.endswith('@g.us'):
+                continue  # Mensagens enviadas por nós ou de grupos
+            text, user_input, message_type = _evolution_text(item.get('message') or {})
+            events.append({
+                'external_id': key.get('id'),
+                'event_type': 'message',
+                'phone_number': _jid_to_phone(jid),
+                'occurred_at': _from_timestamp(item.get('messageTimestamp')),
+                'payload': {
+                    'text': text or '',
+                    'input': user_input or text or '',
+                    'message_type': message_type,
+                    'contact_name': item.get('pushName')
+                }
+            })
+
+    elif event_name == 'messages.update':
+        for item in items:
+            message_id = item.get('keyId') or (item.get('key') or {}).get('id')
+            status = EVOLUTION_STATUS_MAP.get(str(item.get('status', '')).upper())
+            if not message_id or not status:
+                continue
+            events.append({
+                'external_id': f"{message_id}:{status}",
+                'event_type': 'status',
+                'phone_number': _jid_to_phone(item.get('remoteJid') or (item.get('key') or {}).get('remoteJid')),
+                'occurred_at': _from_timestamp(item.get('dateTime') or item.get('messageTimestamp')),
+                'payload': {'message_id': message_id, 'status': status}
+            })
+
+    return [event for event in events if event['external_id'] and event['phone_number']]
+
+
+# ==================== RECEBIMENTO ====================
+
+class ChatWebhookIngestor:
+    """Validação e gravação idempotente dos eventos recebidos"""
+
+    def __init__(self, integration_ttl_seconds: int = 60, seen_ttl_seconds: int = 600):
+        self.integration_ttl_seconds = integration_ttl_seconds
+        self.seen = RecentKeys(ttl_seconds=seen_ttl_seconds)
+        self._integrations: Dict[str, Tuple[Optional[Dict[str, Any]], float]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'received': 0, 'accepted': 0, 'duplicates': 0}
+
+    def get_integration(self, integration_id: str) -> Optional[Dict[str, Any]]:
+        """Dados da integração usados na validação (cache com TTL, sem ir ao banco por requisição)"""
+        with self._lock:
+            cached = self._integrations.get(integration_id)
+            if cached and time.monotonic() - cached[1] < self.integration_ttl_seconds:
+                return cached[0]
+
+        integration = ChatIntegration.query.get(integration_id)
+        data = None
+        if integration and integration.is_active and integration.provider in PROVIDERS:
+            if not integration.tenant_id:
+                # Conversas sem tenant não aparecem em nenhuma caixa de entrada
+                logger.warning(f"Integração {integration_id} sem tenant: webhooks recusados")
+            else:
+                data = {
+                    'id': integration.id,
+                    'provider': integration.provider,
+                    'tenant_id': integration.tenant_id,
+                    'webhook_token': integration.webhook_token,
+                    'app_secret': integration.app_secret
+                }
+
+        with self._lock:
+            self._integrations[integration_id] = (data, time.monotonic())
+        return data
+
+    def invalidate(self, integration_id: str = None):
+        with self._lock:
+            if integration_id:
+                self._integrations.pop(integration_id, None)
+            else:
+                self._integrations.clear()
+
+    def verify_signature(self, integration: Dict[str, Any], raw_body: bytes, headers) -> bool:
+        """
+        Confere a origem do webhook
+
+        Cloud API: X-Hub-Signature-256 (HMAC-SHA256 do corpo com o app secret).
+        Evolution API: cabeçalho apikey igual ao token do webhook.
+        Sem segredo configurado na integração, o webhook é recusado.
+        """
+        if integration['provider'] == 'whatsapp_business':
+            secret = integration.get('app_secret')
+            if not secret:
+                logger.warning(f"Integração {integration['id']} sem app_secret: webhook recusado")
+                return False
+            signature = headers.get('X-Hub-Signature-256', '')
+            expected = 'sha256=' + hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(signature, expected)
+
+        token = integration.get('webhook_token')
+        if not token:
+            logger.warning(f"Integração {integration['id']} sem webhook_token: webhook recusado")
+            return False
+        return hmac.compare_digest(headers.get('apikey', ''), token)
+
+    def ingest(self, integration: Dict[str, Any], payload: Dict) -> Dict[str, Any]:
+        """
+        Normaliza e grava os eventos novos do webhook (com commit)
+
+        Returns:
+            Quantidade de eventos recebidos, aceitos e descartados como duplicados
+        """
+        provider = integration['provider']
+        parser = parse_whatsapp_cloud if provider == 'whatsapp_business' else parse_evolution
+        events = parser(payload or {})
+
+        # Duplicados dentro do próprio lote e vistos recentemente
+        unique = {}
+        for event in events:
+            key = (provider, event['external_id'])
+            if key not in unique and key not in self.seen:
+                unique[key] = event
+
+        accepted = 0
+        if unique:
+            now = datetime.utcnow()
+            rows = [{
+                'id': str(uuid.uuid4()),
+                'integration_id': integration['id'],
+                'tenant_id': integration.get('tenant_id'),
+                'provider': provider,
+                'external_id': event['external_id'][:255],
+                'event_type': event['event_type'],
+                'phone_number': event['phone_number'][:20],
+                'payload': event['payload'],
+                'occurred_at': event['occurred_at'],
+                'status': 'pending',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'received_at': now
+            } for event in unique.values()]
+
+            try:
+                accepted = self._insert_ignoring_duplicates(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            self.seen.add_many(unique.keys())
+
+        with self._lock:
+            self._stats['received'] += len(events)
+            self._stats['accepted'] += accepted
+            self._stats['duplicates'] += len(events) - accepted
+
+        return {'received': len(events), 'accepted': accepted, 'duplicates': len(events) - accepted}
+
+    def _insert_ignoring_duplicates(self, rows: List[Dict[str, Any]]) -> int:
+        """INSERT em lote que ignora (provider, external_id) já gravados"""
+        table = ChatWebhookEvent.__table__
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            statement = insert(table).values(rows).on_conflict_do_nothing(
+                index_elements=['provider', 'external_id']
+            )
+            return db.session.execute(statement).rowcount
+
+        if dialect in ('mysql', 'mariadb'):
+            return db.session.execute(table.insert().prefix_with('IGNORE').values(rows)).rowcount
+
+        # Outros bancos: uma linha por savepoint
+        inserted = 0
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(row))
+                inserted += 1
+            except IntegrityError:
+                pass
+        return inserted
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+# Instância global
+chat_webhook_ingestor = ChatWebhookIngestor()
+
+
+# ==================== PROCESSAMENTO ====================
+
+class ChatWebhookProcessor:
+    """Worker que processa os eventos recebidos, em ordem por contato"""
+
+    def __init__(self, batch_size: int = 500, lease_seconds: int = 120, max_attempts: int = 5,
+                 poll_seconds: float = 0.5):
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'processed': 0, 'retried': 0, 'failed': 0}
+        self._ai_requests: Dict[str, Optional[str]] = {}  # conversa -> contexto da etapa de IA
+
+    def _claim_batch(self) -> List[ChatWebhookEvent]:
+        """
+        Obtém lease dos eventos prontos, sempre de contatos inteiros
+
+        Contatos com eventos em processamento por outro worker ficam de fora,
+        para que as mensagens de uma mesma conversa nunca sejam processadas
+        fora de ordem.
+        """
+        now = datetime.utcnow()
+        expired = and_(ChatWebhookEvent.status == 'processing', ChatWebhookEvent.lease_expires_at < now)
+        ready = or_(and_(ChatWebhookEvent.status == 'pending', ChatWebhookEvent.next_attempt_at <= now), expired)
+        busy = db.session.query(ChatWebhookEvent.phone_number).filter(
+            ChatWebhookEvent.status == 'processing',
+            ChatWebhookEvent.lease_expires_at >= now
+        )
+
+        phones = [row[0] for row in db.session.query(ChatWebhookEvent.phone_number).filter(
+            ready, ChatWebhookEvent.phone_number.notin_(busy)
+        ).distinct().limit(self.batch_size).all()]
+        if not phones:
+            return []
+
+        ChatWebhookEvent.query.filter(
+            ChatWebhookEvent.phone_number.in_(phones),
+            or_(ChatWebhookEvent.status == 'pending', expired)
+        ).update({
+            'status': 'processing',
+            'lease_owner': self.worker_id,
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return ChatWebhookEvent.query.filter(
+            ChatWebhookEvent.phone_number.in_(phones),
+            ChatWebhookEvent.status == 'processing',
+            ChatWebhookEvent.lease_owner == self.worker_id
+        ).order_by(ChatWebhookEvent.received_at.asc()).all()
+
+    def _get_conversation(self, event: ChatWebhookEvent, contact_name: str = None) -> ChatConversation:
+        """Conversa mais recente do contato (criada se não existir)"""
+        query = ChatConversation.query.filter(ChatConversation.phone_number == event.phone_number)
+        if event.tenant_id:
+            query = query.filter(ChatConversation.tenant_id == event.tenant_id)
+        conversation = query.order_by(ChatConversation.started_at.desc()).first()
+
+        if conversation is None:
+            conversation = ChatConversation(
+                tenant_id=event.tenant_id,
+                integration_id=event.integration_id,
+                phone_number=event.phone_number,
+                contact_name=contact_name,
+                lead_id=phone_index.find_lead_id(event.tenant_id, event.phone_number)
+            )
+            db.session.add(conversation)
+            db.session.flush()  # A fila de saída atualiza a conversa por SQL
+        else:
+            if event.integration_id:
+                conversation.integration_id = event.integration_id  # Responde pelo número mais recente
+            if contact_name and not conversation.contact_name:
+                conversation.contact_name = contact_name
+            if not conversation.lead_id:
+                conversation.lead_id = phone_index.find_lead_id(event.tenant_id, event.phone_number)
+        return conversation
+
+    def _handle_message(self, event: ChatWebhookEvent):
+        from src.services.chat_flow_runner import advance_conversation, answer_from_knowledge_base
+
+        data = event.payload or {}
+        if ChatMessage.query.filter_by(external_id=event.external_id, direction='incoming').first():
+            return  # Já registrada (ex.: evento reenviado depois da limpeza da tabela)
+
+        conversation = self._get_conversation(event, data.get('contact_name'))
+        db.session.add(ChatMessage(
+            conversation_id=conversation.id,
+            message_type=data.get('message_type', 'text'),
+            content=data.get('text') or '',
+            direction='incoming',
+            sender_type='user',
+            external_id=event.external_id,
+            external_status='received'
+        ))
+        if conversation.status == 'completed':
+            conversation.status = 'active'
+
+        result = advance_conversation(conversation, data.get('input') or data.get('text'))
+        if result.get('ai_trigger'):
+            self._ai_requests[conversation.id] = result['ai_trigger'].get('context')
+        elif not result.get('handled') and conversation.is_ai_active and not conversation.human_takeover:
+            if not answer_from_knowledge_base(conversation, data.get('text')):
+                self._ai_requests[conversation.id] = None
+
+    def _handle_status(self, event: ChatWebhookEvent):
+        from src.services.chat_broadcast_service import record_broadcast_receipt
+        from src.services.chat_outbox_service import apply_status_update
+
+        data = event.payload or {}
+        if not apply_status_update(data.get('message_id'), data.get('status'), event.occurred_at):
+            # Não é mensagem de conversa: pode ser de um envio em massa
+            record_broadcast_receipt(data.get('message_id'), data.get('status'), event.occurred_at)
+
+    def _retry_delay(self, attempts: int) -> float:
+        """Backoff exponencial com jitter"""
+        return min(5 * (2 ** (attempts - 1)), 900) * random.uniform(0.8, 1.2)
+
+    def _process_contact(self, events: List[ChatWebhookEvent]) -> int:
+        """Processa os eventos de um contato em ordem; uma falha adia os seguintes"""
+        processed = 0
+        halted = False
+        events.sort(key=lambda e: (e.occurred_at or e.received_at, e.received_at))
+
+        for event in events:
+            if halted or (event.next_attempt_at and event.next_attempt_at > datetime.utcnow()):
+                halted = True
+                event.status = 'pending'
+                event.lease_owner = None
+                event.lease_expires_at = None
+                continue
+
+            try:
+                with db.session.begin_nested():
+                    if event.event_type == 'status':
+                        self._handle_status(event)
+                    else:
+                        self._handle_message(event)
+                event.status = 'processed'
+                event.processed_at = datetime.utcnow()
+                event.last_error = None
+                processed += 1
+                self._stats['processed'] += 1
+            except Exception as e:
+                event.attempts = (event.attempts or 0) + 1
+                event.last_error = str(e)
+                if event.attempts >= self.max_attempts:
+                    # Falha definitiva não bloqueia o restante da conversa
+                    event.status = 'failed'
+                    self._stats['failed'] += 1
+                    logger.error(f"Evento de webhook {event.id} falhou: {e}")
+                else:
+                    event.status = 'pending'
+                    event.next_attempt_at = datetime.utcnow() + timedelta(seconds=self._retry_delay(event.attempts))
+                    self._stats['retried'] += 1
+                    halted = True
+
+            event.lease_owner = None
+            event.lease_expires_at = None
+
+        return processed
+
+    def process_batch(self) -> int:
+        """Processa um lote de eventos. Retorna quantos eventos foram obtidos"""
+        events = self._claim_batch()
+        if not events:
+            return 0
+
+        by_phone: Dict[str, List[ChatWebhookEvent]] = OrderedDict()
+        for event in events:
+            by_phone.setdefault(event.phone_number, []).append(event)
+
+        for phone, contact_events in by_phone.items():
+            self._ai_requests = {}
+            try:
+                self._process_contact(contact_events)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao processar eventos do contato {phone}: {e}")
+                continue
+            self._request_ai_replies()
+
+        # Estado dos fluxos do lote gravado antes que outro worker possa pegar estes contatos
+        chat_session_store.flush()
+        return len(events)
+
+    def _request_ai_replies(self):
+        """Agenda as respostas da IA (assíncronas) das conversas do contato"""
+        if not self._ai_requests:
+            return
+        from src.services.chat_ai_responder import chat_ai_responder
+
+        for conversation_id, context in self._ai_requests.items():
+            chat_ai_responder.submit(conversation_id, context)
+        self._ai_requests = {}
+
+    # ==================== WORKER ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='chat-webhooks', daemon=True)
+        self._thread.start()
+        logger.info(f"Processador de webhooks do chatbot iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = 0
+            with self.app.app_context():
+                try:
+                    claimed = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no processador de webhooks: {e}")
+                finally:
+                    db.session.remove()
+
+            if claimed < self.batch_size:
+                self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores do worker e eventos por status"""
+        rows = db.session.query(ChatWebhookEvent.status, db.func.count(ChatWebhookEvent.id)) \
+            .group_by(ChatWebhookEvent.status).all()
+        return {
+            'worker_id': self.worker_id,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'counters': dict(self._stats),
+            'ingest': chat_webhook_ingestor.get_stats(),
+            'by_status': {status or 'unknown': count for status, count in rows}
+        }
+
+
+# Instância global do worker (criada sob demanda)
+chat_webhook_processor = None
+
+
+def init_chat_webhook_processor(app) -> bool:
+    """Inicia o processador de webhooks se habilitado (CHAT_WEBHOOK_PROCESSOR_ENABLED)"""
+    global chat_webhook_processor
+
+    if os.getenv('CHAT_WEBHOOK_PROCESSOR_ENABLED', 'true').lower() != 'true':
+        logger.info("Processador de webhooks do chatbot desabilitado")
+        return False
+
+    if chat_webhook_processor is None:
+        chat_webhook_processor = ChatWebhookProcessor(
+            batch_size=int(os.getenv('CHAT_WEBHOOK_BATCH_SIZE', '500'))
+        )
+    chat_webhook_processor.start(app)
+    return True
@@ -1,20 +1,33 @@
 import requests
 import json
-import openai
 import asyncio
+import os
 import time
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from flask import current_app
 
+from src.services.ai_context_service import fit_messages
+from src.services.ai_gateway import AIGateway, get_ai_gateway
+from src.services.http_client import get_http_client
+from src.services.chat_flow_compiler import (
+    CompiledFlow, CompiledFlowCache, CompiledStep, compiled_flow_cache, compile_condition, compile_validator
+)
+from src.services.template_engine import render_template
+
 class WhatsAppBusinessService:
     """Serviço para integração com WhatsApp Business API."""
     
-    def __init__(self, access_token: str, phone_number_id: str, business_account_id: str):
+    def __init__(self, access_token: str, phone_number_id: str, business_account_id: str, base_url: str = None):
         self.access_token = access_token
         self.phone_number_id = phone_number_id
         self.business_account_id = business_account_id
-        self.base_url = "https://graph.facebook.com/v18.0"
+        self.base_url = (base_url or os.getenv('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com/v18.0')).rstrip('/')
+
+        # Sessão compartilhada e limite de envio por número (Cloud API: 80 msg/s por padrão)
+        self.http = get_http_client()
+        self.rate_key = f"whatsapp:{phone_number_id}"
+        self.http.configure_rate_limit(self.rate_key, float(os.getenv('WHATSAPP_RATE_PER_SECOND', '80')))
         
     def send_text_message(self, to: str, message: str) -> Dict[str, Any]:
         """Envia mensagem de texto."""
@@ -33,7 +46,7 @@ class WhatsAppBusinessService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
@@ -70,7 +83,7 @@ class WhatsAppBusinessService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
@@ -115,12 +128,46 @@ class WhatsAppBusinessService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
             return {"success": False, "error": str(e)}
-    
+
+    def send_template_message(self, to: str, template_name: str, language_code: str = "pt_BR",
+                              body_parameters: List[str] = None) -> Dict[str, Any]:
+        """Envia template aprovado (mensagens iniciadas pela empresa)."""
+        url = f"{self.base_url}/{self.phone_number_id}/messages"
+
+        template = {
+            "name": template_name,
+            "language": {"code": language_code}
+        }
+        if body_parameters:
+            template["components"] = [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": value} for value in body_parameters]
+            }]
+
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": "template",
+            "template": template
+        }
+
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json"
+        }
+
+        try:
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
+            response.raise_for_status()
+            return {"success": True, "data": response.json()}
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "error": str(e)}
+
     def mark_as_read(self, message_id: str) -> Dict[str, Any]:
         """Marca mensagem como lida."""
         url = f"{self.base_url}/{self.phone_number_id}/messages"
@@ -137,7 +184,7 @@ class WhatsAppBusinessService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
@@ -150,6 +197,10 @@ class EvolutionAPIService:
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
         self.instance_name = instance_name
+
+        self.http = get_http_client()
+        self.rate_key = f"evolution:{instance_name}"
+        self.http.configure_rate_limit(self.rate_key, float(os.getenv('EVOLUTION_RATE_PER_SECOND', '20')))
         
     def send_text_message(self, to: str, message: str) -> Dict[str, Any]:
         """Envia mensagem de texto via Evolution API."""
@@ -166,7 +217,7 @@ class EvolutionAPIService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
@@ -195,7 +246,7 @@ class EvolutionAPIService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.http.post(url, json=payload, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
@@ -210,151 +261,144 @@ class EvolutionAPIService:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            response = self.http.get(url, headers=headers, rate_key=self.rate_key)
             response.raise_for_status()
             return {"success": True, "data": response.json()}
         except requests.exceptions.RequestException as e:
             return {"success": False, "error": str(e)}
 
 class OpenAIService:
-    """Serviço para integração com OpenAI GPT."""
+    """Serviço para integração com OpenAI GPT (via gateway assíncrono)."""
     
-    def __init__(self, api_key: str, model: str = "gpt-4o", max_tokens: int = 1000, temperature: float = 0.7):
-        self.client = openai.OpenAI(api_key=api_key)
+    def __init__(self, api_key: str, model: str = "gpt-4o", max_tokens: int = 1000, temperature: float = 0.7,
+                 base_url: str = None, gateway: AIGateway = None, context_token_budget: int = None):
+        self.api_key = api_key
+        self.base_url = base_url
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.gateway = gateway or get_ai_gateway()
+        self.context_token_budget = context_token_budget
+    
+    @classmethod
+    def from_config(cls, config, **kwargs) -> 'OpenAIService':
+        """Cria o serviço a partir de um ChatAIConfig"""
+        return cls(config.api_key, model=config.model, max_tokens=config.max_tokens,
+                   temperature=config.temperature, context_token_budget=config.context_token_budget, **kwargs)
+    
+    def _request_args(self, messages: List[Dict], system_prompt: str = None) -> Dict[str, Any]:
+        chat_messages = AIGateway.build_messages(messages, system_prompt)
+        if self.context_token_budget:
+            # Mantém o sistema e as mensagens mais recentes que couberem no orçamento
+            chat_messages = fit_messages(chat_messages, self.context_token_budget)
+        return {
+            "api_key": self.api_key,
+            "base_url": self.base_url,
+            "model": self.model,
+            "messages": chat_messages,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
+        }
     
-    def generate_response(self, messages: List[Dict], system_prompt: str = None) -> Dict[str, Any]:
-        """Gera resposta usando OpenAI."""
+    def generate_response(self, messages: List[Dict], system_prompt: str = None, tenant_id: str = None,
+                          conversation_id: str = None, timeout: float = None) -> Dict[str, Any]:
+        """Gera resposta usando OpenAI (bloqueia a thread atual até a resposta)."""
         try:
-            # Prepara as mensagens
-            chat_messages = []
-            
-            if system_prompt:
-                chat_messages.append({"role": "system", "content": system_prompt})
-            
-            # Adiciona mensagens da conversa
-            for msg in messages:
-                role = "user" if msg.get("direction") == "incoming" else "assistant"
-                chat_messages.append({"role": role, "content": msg.get("content", "")})
-            
-            # Chama a API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=chat_messages,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
-            )
-            
-            return {
-                "success": True,
-                "response": response.choices[0].message.content,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
-            
+            return self.gateway.complete(tenant_id=tenant_id, conversation_id=conversation_id, timeout=timeout,
+                                         **self._request_args(messages, system_prompt))
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def generate_response_async(self, messages: List[Dict], system_prompt: str = None) -> Dict[str, Any]:
+    async def generate_response_async(self, messages: List[Dict], system_prompt: str = None, tenant_id: str = None,
+                                      conversation_id: str = None, timeout: float = None) -> Dict[str, Any]:
         """Gera resposta de forma assíncrona."""
         try:
-            # Simula processamento assíncrono
-            await asyncio.sleep(0.1)
-            return self.generate_response(messages, system_prompt)
+            return await self.gateway.complete_async(tenant_id=tenant_id, conversation_id=conversation_id,
+                                                     timeout=timeout, **self._request_args(messages, system_prompt))
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             return {"success": False, "error": str(e)}
 
 class ChatFlowEngine:
     """Engine para processar fluxos de conversa."""
     
-    def __init__(self):
+    def __init__(self, flow_cache: CompiledFlowCache = None):
         self.current_step = None
         self.variables = {}
+        self.flow_cache = flow_cache or compiled_flow_cache
     
-    def process_flow_step(self, flow_data: Dict, current_step: str, user_input: str, variables: Dict) -> Dict[str, Any]:
-        """Processa uma etapa do fluxo."""
+    def process_flow_step(self, flow_data: Dict, current_step: str, user_input: str, variables: Dict,
+                          flow_id: str = None, version: Any = None) -> Dict[str, Any]:
+        """Processa uma etapa do fluxo (compilado uma vez por id + versão)."""
         try:
-            steps = flow_data.get("steps", {})
-            step = steps.get(current_step)
+            compiled = self.flow_cache.get(flow_data, flow_id, version)
+            return self.process_compiled_step(compiled, current_step, user_input, variables)
+        except Exception as e:
+            return {"error": str(e)}
+    
+    def process_chat_flow_step(self, flow, current_step: str, user_input: str, variables: Dict) -> Dict[str, Any]:
+        """Processa uma etapa de um ChatFlow (versão = updated_at)."""
+        try:
+            compiled = self.flow_cache.get_for_flow(flow)
+            return self.process_compiled_step(compiled, current_step, user_input, variables)
+        except Exception as e:
+            return {"error": str(e)}
+    
+    def process_compiled_step(self, compiled: CompiledFlow, current_step: str, user_input: str,
+                              variables: Dict) -> Dict[str, Any]:
+        """Processa uma etapa de um fluxo já compilado."""
+        try:
+            step = compiled.get(current_step)
             
             if not step:
                 return {"error": "Etapa não encontrada"}
             
-            step_type = step.get("type", "text")
+            handler = self._handlers.get(step.type)
+            if not handler:
+                return {"error": f"Tipo de etapa não suportado: {step.type}"}
             
-            if step_type == "text":
-                return self._process_text_step(step, variables)
-            elif step_type == "input":
-                return self._process_input_step(step, user_input, variables)
-            elif step_type == "buttons":
-                return self._process_buttons_step(step, user_input, variables)
-            elif step_type == "condition":
-                return self._process_condition_step(step, variables)
-            elif step_type == "webhook":
-                return self._process_webhook_step(step, variables)
-            elif step_type == "ai":
-                return self._process_ai_step(step, user_input, variables)
-            else:
-                return {"error": f"Tipo de etapa não suportado: {step_type}"}
+            return handler(self, step, user_input, variables)
                 
         except Exception as e:
             return {"error": str(e)}
     
-    def _process_text_step(self, step: Dict, variables: Dict) -> Dict[str, Any]:
+    def _process_text_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
         """Processa etapa de texto."""
-        message = self._replace_variables(step.get("message", ""), variables)
-        next_step = step.get("next_step")
-        
         return {
             "type": "text",
-            "message": message,
-            "next_step": next_step
+            "message": step.message.render(variables),
+            "next_step": step.next_step
         }
     
-    def _process_input_step(self, step: Dict, user_input: str, variables: Dict) -> Dict[str, Any]:
+    def _process_input_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
         """Processa etapa de entrada de dados."""
-        variable_name = step.get("variable_name")
-        validation = step.get("validation", {})
-        
         # Valida entrada
-        if validation:
-            validation_result = self._validate_input(user_input, validation)
-            if not validation_result["valid"]:
+        if step.validator:
+            error = step.validator(user_input)
+            if error:
                 return {
                     "type": "validation_error",
-                    "message": validation_result["message"],
+                    "message": error,
                     "retry": True
                 }
         
         # Salva variável
-        if variable_name:
-            variables[variable_name] = user_input
-        
-        next_step = step.get("next_step")
+        if step.variable_name:
+            variables[step.variable_name] = user_input
         
         return {
             "type": "input_saved",
-            "variable_name": variable_name,
+            "variable_name": step.variable_name,
             "value": user_input,
-            "next_step": next_step,
+            "next_step": step.next_step,
             "variables": variables
         }
     
-    def _process_buttons_step(self, step: Dict, user_input: str, variables: Dict) -> Dict[str, Any]:
+    def _process_buttons_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
         """Processa etapa de botões."""
-        buttons = step.get("buttons", [])
-        
-        # Encontra botão selecionado
-        selected_button = None
-        for button in buttons:
-            if button.get("id") == user_input or button.get("title") == user_input:
-                selected_button = button
-                break
+        # Encontra botão selecionado (por id ou título)
+        selected_button = step.find_button(user_input)
         
         if not selected_button:
             return {
@@ -364,147 +408,78 @@ class ChatFlowEngine:
             }
         
         # Salva variável se especificada
-        variable_name = step.get("variable_name")
-        if variable_name:
-            variables[variable_name] = selected_button.get("value", selected_button.get("title"))
-        
-        next_step = selected_button.get("next_step", step.get("next_step"))
+        if step.variable_name:
+            variables[step.variable_name] = selected_button.get("value", selected_button.get("title"))
         
         return {
             "type": "button_selected",
-            "selected": selected_button,
-            "next_step": next_step,
+            "selected": dict(selected_button),
+            "next_step": selected_button.get("next_step", step.next_step),
             "variables": variables
         }
     
-    def _process_condition_step(self, step: Dict, variables: Dict) -> Dict[str, Any]:
+    def _process_condition_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
         """Processa etapa condicional."""
-        conditions = step.get("conditions", [])
-        
-        for condition in conditions:
-            if self._evaluate_condition(condition, variables):
+        for predicate, next_step in step.conditions:
+            if predicate(variables):
                 return {
                     "type": "condition_met",
-                    "next_step": condition.get("next_step")
+                    "next_step": next_step
                 }
         
         # Fallback
         return {
             "type": "condition_fallback",
-            "next_step": step.get("fallback_step")
+            "next_step": step.fallback_step
         }
     
-    def _process_webhook_step(self, step: Dict, variables: Dict) -> Dict[str, Any]:
-        """Processa etapa de webhook."""
-        webhook_url = step.get("webhook_url")
-        method = step.get("method", "POST")
-        
-        try:
-            if method.upper() == "POST":
-                response = requests.post(webhook_url, json=variables, timeout=10)
-            else:
-                response = requests.get(webhook_url, params=variables, timeout=10)
-            
-            response.raise_for_status()
-            
-            return {
-                "type": "webhook_success",
-                "response": response.json() if response.content else {},
-                "next_step": step.get("next_step")
-            }
-            
-        except Exception as e:
-            return {
-                "type": "webhook_error",
-                "error": str(e),
-                "next_step": step.get("error_step", step.get("next_step"))
-            }
+    def _process_webhook_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
+        """Processa etapa de webhook (sem chamada: devolve o job, executado após o commit)."""
+        return {
+            "type": "webhook_pending",
+            "job": {
+                "step_id": step.step_id,
+                "url": step.raw.get("webhook_url"),
+                "method": step.raw.get("method", "POST"),
+                "payload": dict(variables),
+                "timeout": step.raw.get("timeout"),
+                "cache_seconds": step.raw.get("cache_seconds")
+            },
+            "next_step": step.next_step,
+            "error_step": step.error_step or step.next_step
+        }
     
-    def _process_ai_step(self, step: Dict, user_input: str, variables: Dict) -> Dict[str, Any]:
+    def _process_ai_step(self, step: CompiledStep, user_input: str, variables: Dict) -> Dict[str, Any]:
         """Processa etapa de IA."""
         return {
             "type": "ai_trigger",
-            "context": step.get("context", ""),
+            "context": step.raw.get("context", ""),
             "user_input": user_input,
             "variables": variables,
-            "next_step": step.get("next_step")
+            "next_step": step.next_step
         }
     
     def _replace_variables(self, text: str, variables: Dict) -> str:
         """Substitui variáveis no texto."""
-        for key, value in variables.items():
-            text = text.replace(f"{{{key}}}", str(value))
-        return text
+        return render_template(text, variables)
     
     def _validate_input(self, input_value: str, validation: Dict) -> Dict[str, Any]:
         """Valida entrada do usuário."""
-        validation_type = validation.get("type")
-        
-        if validation_type == "email":
-            import re
-            email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-            if not re.match(email_pattern, input_value):
-                return {"valid": False, "message": "Por favor, digite um e-mail válido."}
-        
-        elif validation_type == "phone":
-            import re
-            phone_pattern = r'^\(?[1-9]{2}\)?\s?9?\d{4}-?\d{4}$'
-            if not re.match(phone_pattern, input_value.replace(" ", "")):
-                return {"valid": False, "message": "Por favor, digite um telefone válido."}
-        
-        elif validation_type == "cnpj":
-            # Validação básica de CNPJ
-            cnpj = ''.join(filter(str.isdigit, input_value))
-            if len(cnpj) != 14:
-                return {"valid": False, "message": "Por favor, digite um CNPJ válido."}
-        
-        elif validation_type == "required":
-            if not input_value.strip():
-                return {"valid": False, "message": "Este campo é obrigatório."}
-        
-        elif validation_type == "min_length":
-            min_length = validation.get("value", 1)
-            if len(input_value) < min_length:
-                return {"valid": False, "message": f"Mínimo de {min_length} caracteres."}
-        
-        elif validation_type == "max_length":
-            max_length = validation.get("value", 255)
-            if len(input_value) > max_length:
-                return {"valid": False, "message": f"Máximo de {max_length} caracteres."}
-        
+        validator = compile_validator(validation)
+        error = validator(input_value) if validator else None
+        if error:
+            return {"valid": False, "message": error}
         return {"valid": True}
     
     def _evaluate_condition(self, condition: Dict, variables: Dict) -> bool:
         """Avalia condição."""
-        variable = condition.get("variable")
-        operator = condition.get("operator")
-        value = condition.get("value")
-        
-        if variable not in variables:
-            return False
-        
-        var_value = variables[variable]
-        
-        if operator == "equals":
-            return str(var_value) == str(value)
-        elif operator == "not_equals":
-            return str(var_value) != str(value)
-        elif operator == "contains":
-            return str(value).lower() in str(var_value).lower()
-        elif operator == "starts_with":
-            return str(var_value).lower().startswith(str(value).lower())
-        elif operator == "ends_with":
-            return str(var_value).lower().endswith(str(value).lower())
-        elif operator == "greater_than":
-            try:
-                return float(var_value) > float(value)
-            except:
-                return False
-        elif operator == "less_than":
-            try:
-                return float(var_value) < float(value)
-            except:
-                return False
-        
-        return False
-
+        return compile_condition(condition)(variables)
+    
+    _handlers = {
+        "text": _process_text_step,
+        "input": _process_input_step,
+        "buttons": _process_buttons_step,
+        "condition": _process_condition_step,
+        "webhook": _process_webhook_step,
+        "ai": _process_ai_step
+    }
@@ -0,0 +1,106 @@
+"""
+Circuit breaker em memória, um circuito por chave (URL, host, integração...)
+
+- fechado: chamadas liberadas; falhas consecutivas acima do limite abrem o circuito
+- aberto: chamadas recusadas na hora, sem esperar timeout, até o tempo de recuperação
+- meio-aberto: uma chamada de teste; sucesso fecha o circuito, falha reabre
+
+Quem chama deve chamar release() ao terminar (em finally): se a chamada de
+teste acabar sem sucesso nem falha registrados (ex.: exceção inesperada), a
+vaga de teste é devolvida em vez de deixar o circuito preso no meio-aberto.
+"""
+import threading
+import time
+from typing import Dict, Any
+
+
+class CircuitBreaker:
+    """Estado de um circuito"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Se a chamada pode ser feita agora"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """Devolve a vaga de teste do meio-aberto se a chamada não registrou resultado"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.recovery_seconds - (time.monotonic() - self.opened_at))
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'retry_in_seconds': round(retry_in, 1)
+            }
+
+
+class CircuitBreakerRegistry:
+    """Circuitos por chave, criados sob demanda"""
+
+    def __init__(self, failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(self.failure_threshold, self.recovery_seconds)
+                    self._breakers[key] = breaker
+        return breaker
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {key: breaker.to_dict() for key, breaker in breakers.items()}
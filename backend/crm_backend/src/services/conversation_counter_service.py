@@ -0,0 +1,185 @@
+"""
+Contadores desnormalizados das conversas do chatbot
+
+message_count, unread_count e a última mensagem são mantidos na própria
+linha de chat_conversations pelo listener de flush em models/chatbot.py. Este
+serviço marca conversas como lidas em lote e reconcilia periodicamente os
+contadores com as mensagens (alterações feitas fora do ORM, falhas, dados
+antigos).
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import and_, case, func
+
+from src.models.chatbot import ChatConversation, ChatMessage, MESSAGE_PREVIEW_LENGTH, db, stamp_conversation_changes
+
+logger = logging.getLogger(__name__)
+
+
+def mark_conversation_read(conversation_id: str) -> int:
+    """
+    Marca as mensagens recebidas da conversa como lidas (sem commit)
+
+    O UPDATE em lote não passa pelo listener, então o contador é zerado e a
+    sequência de alteração é gravada aqui.
+    """
+    now = datetime.utcnow()
+    updated = ChatMessage.query.filter(
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.direction == 'incoming',
+        ChatMessage.is_read == False
+    ).update({'is_read': True, 'read_at': now}, synchronize_session=False)
+
+    ChatConversation.query.filter_by(id=conversation_id).update({'unread_count': 0, 'updated_at': now},
+                                                               synchronize_session=False)
+    stamp_conversation_changes(db.session.connection(), [conversation_id])
+    return updated
+
+
+class ConversationCounterReconciler:
+    """Recalcula os contadores das conversas a partir das mensagens"""
+
+    def __init__(self, batch_size: int = 500, interval_seconds: int = 3600):
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _expected(self, conversation_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Contadores e última mensagem calculados das mensagens (duas consultas agrupadas)"""
+        expected = {cid: {'message_count': 0, 'unread_count': 0, 'last_message_id': None,
+                          'last_message_preview': None, 'last_message_direction': None,
+                          'last_message_at': None} for cid in conversation_ids}
+
+        unread = func.sum(case((and_(ChatMessage.direction == 'incoming', ChatMessage.is_read == False), 1), else_=0))
+        rows = db.session.query(
+            ChatMessage.conversation_id, func.count(ChatMessage.id), unread, func.max(ChatMessage.created_at)
+        ).filter(ChatMessage.conversation_id.in_(conversation_ids)).group_by(ChatMessage.conversation_id).all()
+
+        latest = {}
+        for conversation_id, count, unread_count, last_at in rows:
+            expected[conversation_id]['message_count'] = int(count)
+            expected[conversation_id]['unread_count'] = int(unread_count or 0)
+            latest[conversation_id] = last_at
+
+        if latest:
+            # Última mensagem de cada conversa: junta pelo (conversa, created_at máximo)
+            last_rows = db.session.query(
+                ChatMessage.conversation_id, ChatMessage.id, ChatMessage.content,
+                ChatMessage.direction, ChatMessage.created_at
+            ).filter(ChatMessage.conversation_id.in_(list(latest.keys()))).filter(
+                ChatMessage.created_at.in_([at for at in latest.values() if at is not None])
+            ).all()
+            for conversation_id, message_id, content, direction, created_at in last_rows:
+                if created_at != latest[conversation_id]:
+                    continue
+                expected[conversation_id].update({
+                    'last_message_id': message_id,
+                    'last_message_preview': (content or '')[:MESSAGE_PREVIEW_LENGTH],
+                    'last_message_direction': direction,
+                    'last_message_at': created_at
+                })
+
+        return expected
+
+    def reconcile(self, conversation_ids: Optional[List[str]] = None, tenant_id: str = None) -> Dict[str, Any]:
+        """
+        Corrige os contadores divergentes, em lotes de conversas
+
+        Args:
+            conversation_ids: Conversas a verificar (padrão: todas)
+            tenant_id: Restringe às conversas do tenant (padrão: todos)
+        """
+        checked = 0
+        fixed = 0
+        last_id = ''
+
+        try:
+            while True:
+                if conversation_ids is not None:
+                    batch_ids = conversation_ids[checked:checked + self.batch_size]
+                else:
+                    # Paginação por id para percorrer a tabela sem OFFSET
+                    query = db.session.query(ChatConversation.id).filter(ChatConversation.id > last_id)
+                    if tenant_id:
+                        query = query.filter(ChatConversation.tenant_id == tenant_id)
+                    batch_ids = [row[0] for row in query.order_by(ChatConversation.id.asc())
+                                 .limit(self.batch_size).all()]
+                if not batch_ids:
+                    break
+
+                expected = self._expected(batch_ids)
+                query = ChatConversation.query.filter(ChatConversation.id.in_(batch_ids))
+                if tenant_id:
+                    query = query.filter(ChatConversation.tenant_id == tenant_id)
+                conversations = query.all()
+                for conversation in conversations:
+                    values = expected[conversation.id]
+                    diverged = False
+                    for column, value in values.items():
+                        if getattr(conversation, column) != value:
+                            setattr(conversation, column, value)
+                            diverged = True
+                    if diverged:
+                        fixed += 1
+
+                db.session.commit()
+                checked += len(batch_ids)
+                last_id = batch_ids[-1]
+
+                if conversation_ids is not None and checked >= len(conversation_ids):
+                    break
+
+            if fixed:
+                logger.info(f"Contadores de {fixed} conversas corrigidos ({checked} verificadas)")
+            return {'success': True, 'checked': checked, 'fixed': fixed}
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao reconciliar contadores de conversas: {e}")
+            return {'success': False, 'message': str(e), 'checked': checked, 'fixed': fixed}
+
+    # ==================== JOB PERIÓDICO ====================
+
+    def start(self, app):
+        """Inicia a reconciliação periódica em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='conversation-counters', daemon=True)
+        self._thread.start()
+        logger.info(f"Reconciliação de contadores de conversas a cada {self.interval_seconds}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            with self.app.app_context():
+                try:
+                    self.reconcile()
+                finally:
+                    db.session.remove()
+
+
+# Instância global
+conversation_counter_reconciler = ConversationCounterReconciler(
+    interval_seconds=int(os.getenv('CHAT_COUNTER_RECONCILE_SECONDS', '3600'))
+)
+
+
+def init_conversation_counter_reconciler(app) -> bool:
+    """Inicia a reconciliação periódica se habilitada (CHAT_COUNTER_RECONCILE_ENABLED)"""
+    if os.getenv('CHAT_COUNTER_RECONCILE_ENABLED', 'true').lower() != 'true':
+        return False
+    conversation_counter_reconciler.start(app)
+    return True
@@ -0,0 +1,367 @@
+"""
+Outbox transacional de emails
+
+Os serviços apenas gravam a mensagem na tabela email_outbox, na mesma sessão
+da alteração de negócio. Um worker em segundo plano drena a fila usando um
+pool pequeno de conexões SMTP persistentes (STARTTLS e login uma única vez por
+conexão), com novas tentativas com backoff e limite de envio por tenant. Cada
+lote reveza os tenants (no máximo tenant_batch_size emails de cada), então a
+fila grande de um tenant não atrasa os emails dos demais.
+"""
+import logging
+import os
+import queue
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import and_, func, or_
+
+from src.models.email_outbox import EmailOutbox, db
+from src.services.activity_summary_service import activity_summary_service
+from src.services.rate_limiter import TokenBucketLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(to_email: str, subject: str, body: str, tenant_id: str = None,
+                  is_html: bool = True, sender: str = None, user_id: str = None) -> EmailOutbox:
+    """
+    Grava um email na outbox sem commit
+
+    O commit fica a cargo de quem chama, para que o email só exista se a
+    alteração de negócio for confirmada. Emails enviados em nome de um usuário
+    (user_id) entram no resumo de atividade dele.
+    """
+    message = EmailOutbox(
+        id=str(uuid.uuid4()),
+        tenant_id=tenant_id,
+        user_id=user_id,
+        to_email=to_email,
+        sender=sender,
+        subject=subject,
+        body=body,
+        is_html=is_html,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(message)
+    if user_id:
+        activity_summary_service.record_event('email', user_id, tenant_id)
+    return message
+
+
+class SMTPConnectionPool:
+    """Pool de conexões SMTP persistentes"""
+
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 size: int = 3, use_tls: bool = True, timeout: int = 30, max_idle_seconds: int = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+
+        self._pool = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._pool.put((None, 0.0))
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def acquire(self):
+        """Obtém uma conexão ativa (reconecta se necessário)"""
+        server, last_used = self._pool.get()
+
+        if server is not None and time.monotonic() - last_used > self.max_idle_seconds:
+            # Conexão ociosa há muito tempo: confirma que ainda está viva
+            try:
+                if server.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected()
+            except Exception:
+                self._close(server)
+                server = None
+
+        if server is None:
+            try:
+                server = self._connect()
+            except Exception:
+                self._pool.put((None, 0.0))
+                raise
+
+        return server
+
+    def release(self, server, broken: bool = False):
+        """Devolve a conexão ao pool"""
+        if broken:
+            self._close(server)
+            server = None
+        self._pool.put((server, time.monotonic()))
+
+    def _close(self, server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        """Fecha todas as conexões do pool"""
+        for _ in range(self.size):
+            server, _ = self._pool.get()
+            self._close(server)
+            self._pool.put((None, 0.0))
+
+
+class EmailOutboxWorker:
+    """Worker que drena a outbox de emails"""
+
+    def __init__(self, pool: SMTPConnectionPool = None, rate_limiter: TokenBucketLimiter = None,
+                 batch_size: int = 100, tenant_batch_size: int = 20, lease_seconds: int = 120,
+                 max_attempts: int = 5, poll_seconds: float = 1.0, default_sender: str = None):
+        self.pool = pool or SMTPConnectionPool(
+            host=os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+            port=int(os.getenv('SMTP_PORT', '587')),
+            username=os.getenv('SMTP_USERNAME'),
+            password=os.getenv('SMTP_PASSWORD'),
+            size=int(os.getenv('SMTP_POOL_SIZE', '3'))
+        )
+        # Limite de envios por tenant (por minuto)
+        rate_per_minute = int(os.getenv('EMAIL_TENANT_RATE_PER_MINUTE', '60'))
+        if rate_limiter is None:  # TokenBucketLimiter sem baldes tem len() 0
+            rate_limiter = TokenBucketLimiter(rate_per_minute / 60.0, burst=rate_per_minute)
+        self.rate_limiter = rate_limiter
+        self.batch_size = batch_size
+        self.tenant_batch_size = tenant_batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.default_sender = default_sender or os.getenv('SMTP_USERNAME') or 'suporte@jttelecom.com.br'
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ==================== FILA ====================
+
+    def _claim_batch(self) -> List[EmailOutbox]:
+        """Obtém lease de um lote de emails prontos para envio"""
+        now = datetime.utcnow()
+        ready = or_(
+            and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            and_(EmailOutbox.status == 'sending', EmailOutbox.lease_expires_at < now)
+        )
+
+        # Posição de cada email na fila do seu tenant: o lote pega os primeiros de cada tenant, alternando
+        position = func.row_number().over(
+            partition_by=EmailOutbox.tenant_id,
+            order_by=(EmailOutbox.next_attempt_at.asc(), EmailOutbox.id.asc())
+        ).label('position')
+        ranked = db.session.query(EmailOutbox.id, EmailOutbox.next_attempt_at, position).filter(ready).subquery()
+        ids = [row.id for row in db.session.query(ranked.c.id)
+               .filter(ranked.c.position <= self.tenant_batch_size)
+               .order_by(ranked.c.position.asc(), ranked.c.next_attempt_at.asc())
+               .limit(self.batch_size).all()]
+        if not ids:
+            return []
+
+        EmailOutbox.query.filter(EmailOutbox.id.in_(ids), ready).update({
+            'status': 'sending',
+            'lease_owner': self.worker_id,
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        claimed = EmailOutbox.query.filter(
+            EmailOutbox.id.in_(ids),
+            EmailOutbox.status == 'sending',
+            EmailOutbox.lease_owner == self.worker_id
+        ).all()
+        order = {message_id: index for index, message_id in enumerate(ids)}
+        return sorted(claimed, key=lambda message: order[message.id])
+
+    def _build_message(self, message: EmailOutbox) -> MIMEMultipart:
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = message.subject
+        msg['From'] = message.sender or self.default_sender
+        msg['To'] = message.to_email
+        msg.attach(MIMEText(message.body, 'html' if message.is_html else 'plain', 'utf-8'))
+        return msg
+
+    def _send_chunk(self, chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Envia vários emails sequencialmente pela mesma conexão do pool"""
+        results = []
+        server = None
+        broken = False
+
+        try:
+            server = self.pool.acquire()
+            for item in chunk:
+                try:
+                    server.send_message(item['mime'])
+                    results.append({'id': item['id'], 'success': True})
+                except smtplib.SMTPServerDisconnected as e:
+                    broken = True
+                    results.append({'id': item['id'], 'success': False, 'error': str(e)})
+                    # Reconecta para o restante do lote
+                    self.pool.release(server, broken=True)
+                    server = None
+                    server = self.pool.acquire()
+                    broken = False
+                except Exception as e:
+                    results.append({'id': item['id'], 'success': False, 'error': str(e)})
+        except Exception as e:
+            broken = True
+            done = {r['id'] for r in results}
+            results.extend({'id': item['id'], 'success': False, 'error': str(e)}
+                           for item in chunk if item['id'] not in done)
+        finally:
+            if server is not None:
+                self.pool.release(server, broken=broken)
+
+        return results
+
+    def _retry_delay(self, attempts: int) -> float:
+        """Backoff exponencial com jitter"""
+        return min(30 * (2 ** (attempts - 1)), 3600) * random.uniform(0.8, 1.2)
+
+    def process_batch(self) -> int:
+        """Processa um lote da outbox. Retorna a quantidade de emails enviados"""
+        messages = self._claim_batch()
+        if not messages:
+            return 0
+
+        now = datetime.utcnow()
+        by_id = {m.id: m for m in messages}
+        to_send = []
+
+        for message in messages:
+            wait = self.rate_limiter.try_acquire(message.tenant_id)
+            if wait:
+                # Limite do tenant atingido: devolve para a fila sem contar tentativa
+                message.status = 'pending'
+                message.next_attempt_at = now + timedelta(seconds=wait)
+                message.lease_owner = None
+                message.lease_expires_at = None
+                continue
+            to_send.append({'id': message.id, 'mime': self._build_message(message)})
+
+        # Divide o lote entre as conexões do pool
+        chunks = [to_send[i::self.pool.size] for i in range(self.pool.size)]
+        chunks = [c for c in chunks if c]
+        results = []
+        if chunks:
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                for chunk_results in executor.map(self._send_chunk, chunks):
+                    results.extend(chunk_results)
+
+        sent = 0
+        for result in results:
+            message = by_id[result['id']]
+            message.attempts = (message.attempts or 0) + 1
+            message.lease_owner = None
+            message.lease_expires_at = None
+
+            if result['success']:
+                message.status = 'sent'
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+                sent += 1
+            elif message.attempts < self.max_attempts:
+                message.status = 'pending'
+                message.next_attempt_at = datetime.utcnow() + timedelta(seconds=self._retry_delay(message.attempts))
+                message.last_error = result.get('error')
+            else:
+                message.status = 'failed'
+                message.last_error = result.get('error')
+                logger.error(f"Email {message.id} para {message.to_email} falhou definitivamente: {message.last_error}")
+
+        db.session.commit()
+        if sent:
+            logger.info(f"{sent} emails enviados pela outbox")
+        return sent
+
+    # ==================== WORKER ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+        logger.info(f"Worker da outbox de emails iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker e fecha as conexões SMTP"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.pool.close_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    processed = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no worker da outbox de emails: {e}")
+                finally:
+                    db.session.remove()
+
+            # Lote cheio: continua drenando sem esperar
+            if processed < self.batch_size:
+                self._stop.wait(self.poll_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contagem da outbox por status"""
+        rows = db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all()
+        return {
+            'worker_id': self.worker_id,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'by_status': {status: count for status, count in rows}
+        }
+
+
+# Instância global do worker (criada sob demanda)
+email_outbox_worker = None
+
+
+def init_email_outbox_worker(app) -> bool:
+    """Inicia o worker da outbox se habilitado (EMAIL_OUTBOX_WORKER_ENABLED)"""
+    global email_outbox_worker
+
+    if os.getenv('EMAIL_OUTBOX_WORKER_ENABLED', 'true').lower() != 'true':
+        logger.info("Worker da outbox de emails desabilitado")
+        return False
+
+    if email_outbox_worker is None:
+        email_outbox_worker = EmailOutboxWorker()
+    email_outbox_worker.start(app)
+    return True
@@ -2,44 +2,59 @@
 Serviço de email do CRM
 """
 
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from src.services.email_outbox_service import enqueue_email, db
+
+DEFAULT_SENDER = "suporte@jttelecom.com.br"
+
 class EmailService:
-    """Serviço para envio de emails"""
+    """Serviço para envio de emails (via outbox; o SMTP é usado pelo worker)"""
     
     def __init__(self):
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
-        self.default_sender = "suporte@jttelecom.com.br"
+        self.default_sender = DEFAULT_SENDER
     
     @staticmethod
-    def send_email(to_email, subject, body, sender_email=None):
-        """Envia um email"""
+    def send_email(to_email, subject, body, sender_email=None, tenant_id=None, commit=False, user_id=None):
+        """Envia um email. O email entra na transação de quem chama (commit=True confirma na hora)"""
         try:
-            # Implementação básica - pode ser expandida com SMTP real
-            print(f"📧 Email enviado para {to_email}")
-            print(f"De: {sender_email or 'suporte@jttelecom.com.br'}")
-            print(f"Assunto: {subject}")
-            print(f"Corpo: {body}")
+            message = enqueue_email(
+                to_email, subject, body,
+                tenant_id=tenant_id,
+                is_html=False,
+                sender=sender_email or DEFAULT_SENDER,
+                user_id=user_id
+            )
+            if commit:
+                db.session.commit()
             
-            return {'success': True, 'message': 'Email enviado com sucesso'}
+            return {'success': True, 'message': 'Email adicionado à fila de envio', 'outbox_id': message.id}
             
         except Exception as e:
+            if commit:
+                db.session.rollback()
             return {'success': False, 'message': f'Erro ao enviar email: {str(e)}'}
     
     @staticmethod
-    def send_html_email(to_email, subject, html_body, sender_email=None):
+    def send_html_email(to_email, subject, html_body, sender_email=None, tenant_id=None, commit=False, user_id=None):
         """Envia um email em formato HTML"""
         try:
-            print(f"📧 Email HTML enviado para {to_email}")
-            print(f"De: {sender_email or 'suporte@jttelecom.com.br'}")
-            print(f"Assunto: {subject}")
+            message = enqueue_email(
+                to_email, subject, html_body,
+                tenant_id=tenant_id,
+                is_html=True,
+                sender=sender_email or DEFAULT_SENDER,
+                user_id=user_id
+            )
+            if commit:
+                db.session.commit()
             
-            return {'success': True, 'message': 'Email HTML enviado com sucesso'}
+            return {'success': True, 'message': 'Email HTML adicionado à fila de envio', 'outbox_id': message.id}
             
         except Exception as e:
+            if commit:
+                db.session.rollback()
             return {'success': False, 'message': f'Erro ao enviar email HTML: {str(e)}'}
     
     @staticmethod
@@ -47,7 +62,7 @@ class EmailService:
         """Cria uma mensagem MIME"""
         try:
             msg = MIMEMultipart()
-            msg['From'] = sender_email or "suporte@jttelecom.com.br"
+            msg['From'] = sender_email or DEFAULT_SENDER
             msg['To'] = to_email
             msg['Subject'] = subject
             
@@ -57,4 +72,3 @@ class EmailService:
             
         except Exception as e:
             return {'success': False, 'message': f'Erro ao criar mensagem MIME: {str(e)}'}
-
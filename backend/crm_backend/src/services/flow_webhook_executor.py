@@ -0,0 +1,258 @@
+"""
+Execução das etapas de webhook dos fluxos do chatbot
+
+As chamadas usam o cliente HTTP compartilhado (conexões reaproveitadas), com
+timeout curto e sem retries, um circuit breaker por URL (endpoint fora do ar
+falha na hora em vez de segurar o worker) e cache com TTL para GETs.
+
+No processamento das mensagens a chamada é assíncrona: o fluxo para na etapa
+de webhook, o job é enviado ao pool de threads quando a transação que o
+agendou é confirmada, e a conversa continua (chat_flow_runner) quando a
+resposta chega.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.models.chatbot import db
+from src.services.circuit_breaker import CircuitBreakerRegistry
+from src.services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+SESSION_JOBS_KEY = 'flow_webhook_jobs'
+SESSION_SAVEPOINTS_KEY = 'flow_webhook_savepoints'
+
+
+class TTLCache:
+    """Cache LRU com expiração por item"""
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, value: Any, ttl_seconds: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FlowWebhookExecutor:
+    """Chamadas dos webhooks dos fluxos com circuit breaker, cache e pool"""
+
+    def __init__(self, max_workers: int = 16, connect_timeout: float = 2.0, read_timeout: float = 5.0,
+                 default_cache_seconds: float = 60.0, failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.max_workers = max_workers
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.default_cache_seconds = default_cache_seconds
+        self.breakers = CircuitBreakerRegistry(failure_threshold, recovery_seconds)
+        self.cache = TTLCache()
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'errors': 0, 'cache_hits': 0, 'rejected': 0, 'resumed': 0}
+
+    def init_app(self, app):
+        self.app = app
+
+    # ==================== CHAMADA ====================
+
+    @staticmethod
+    def _circuit_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+    @staticmethod
+    def _cache_key(url: str, payload: Optional[Dict]) -> str:
+        raw = json.dumps([url, payload], sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def execute(self, url: str, method: str = 'POST', payload: Dict = None, timeout: float = None,
+                cache_seconds: float = None) -> Dict[str, Any]:
+        """
+        Chama o webhook (bloqueante, com timeout curto)
+
+        Returns:
+            success, response (JSON ou texto) ou error; circuit_open quando recusado
+        """
+        method = (method or 'POST').upper()
+        if not url:
+            return {'success': False, 'error': 'URL do webhook não configurada'}
+
+        cache_key = None
+        if method == 'GET':
+            cache_seconds = self.default_cache_seconds if cache_seconds is None else cache_seconds
+            if cache_seconds:
+                cache_key = self._cache_key(url, payload)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._count('cache_hits')
+                    return {'success': True, 'response': cached, 'cached': True}
+
+        breaker = self.breakers.get(self._circuit_key(url))
+        if not breaker.allow():
+            self._count('rejected')
+            return {'success': False, 'error': 'Webhook indisponível (circuito aberto)', 'circuit_open': True}
+
+        self._count('calls')
+        try:
+            return self._call(breaker, url, method, payload, timeout, cache_key, cache_seconds)
+        finally:
+            breaker.release()
+
+    def _call(self, breaker, url: str, method: str, payload: Optional[Dict], timeout: Optional[float],
+              cache_key: Optional[str], cache_seconds: Optional[float]) -> Dict[str, Any]:
+        try:
+            kwargs = {'params': payload} if method == 'GET' else {'json': payload}
+            response = get_http_client().request(
+                method, url, timeout=(self.connect_timeout, timeout or self.read_timeout), retry=False, **kwargs
+            )
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            self._count('errors')
+            return {'success': False, 'error': str(e)}
+
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+            self._count('errors')
+            return {'success': False, 'error': f'Webhook respondeu {response.status_code}',
+                    'status_code': response.status_code}
+
+        # 4xx: o endpoint está no ar, o erro é da requisição
+        breaker.record_success()
+        if response.status_code >= 400:
+            self._count('errors')
+            return {'success': False, 'error': f'Webhook respondeu {response.status_code}',
+                    'status_code': response.status_code}
+
+        try:
+            data = response.json() if response.content else {}
+        except ValueError:
+            data = {'text': response.text[:2000]}
+
+        if cache_key:
+            self.cache.set(cache_key, data, cache_seconds)
+        return {'success': True, 'response': data, 'status_code': response.status_code}
+
+    # ==================== EXECUÇÃO ASSÍNCRONA ====================
+
+    def schedule(self, job: Dict[str, Any]):
+        """Agenda o job para depois do commit da sessão atual"""
+        db.session.info.setdefault(SESSION_JOBS_KEY, []).append(job)
+
+    def submit(self, job: Dict[str, Any]):
+        """Envia o job ao pool; a conversa é retomada quando a chamada termina"""
+        if self.app is None:
+            logger.warning("Executor de webhooks dos fluxos não inicializado; job descartado")
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='flow-webhooks')
+        return self._executor.submit(self._run, job)
+
+    def _run(self, job: Dict[str, Any]):
+        from src.services.chat_flow_runner import resume_after_webhook
+
+        result = self.execute(job['url'], job.get('method', 'POST'), job.get('payload'),
+                              job.get('timeout'), job.get('cache_seconds'))
+        with self.app.app_context():
+            try:
+                if resume_after_webhook(job, result):
+                    self._count('resumed')
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao retomar a conversa {job.get('conversation_id')} após webhook: {e}")
+            finally:
+                db.session.remove()
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['circuits'] = self.breakers.states()
+        return stats
+
+
+def _mark_savepoint(session, transaction):
+    """Guarda quantos jobs havia no início do savepoint"""
+    if transaction.nested:
+        session.info.setdefault(SESSION_SAVEPOINTS_KEY, {})[transaction] = len(session.info.get(SESSION_JOBS_KEY, ()))
+
+
+def _rollback_savepoint(session, previous_transaction):
+    """Rollback de savepoint descarta só os jobs agendados dentro dele"""
+    if previous_transaction.nested:
+        mark = session.info.get(SESSION_SAVEPOINTS_KEY, {}).pop(previous_transaction, None)
+        if mark is not None and SESSION_JOBS_KEY in session.info:
+            del session.info[SESSION_JOBS_KEY][mark:]
+
+
+def _dispatch_scheduled_jobs(session):
+    """Após o commit da transação externa, envia os jobs agendados na sessão"""
+    if session.in_nested_transaction():
+        return  # Liberação de savepoint: a transação ainda pode ser desfeita
+    session.info.pop(SESSION_SAVEPOINTS_KEY, None)
+    jobs: List[Dict[str, Any]] = session.info.pop(SESSION_JOBS_KEY, None)
+    for job in jobs or []:
+        flow_webhook_executor.submit(job)
+
+
+def _discard_scheduled_jobs(session, previous_transaction=None):
+    if session.in_nested_transaction():
+        return
+    session.info.pop(SESSION_SAVEPOINTS_KEY, None)
+    session.info.pop(SESSION_JOBS_KEY, None)
+
+
+event.listen(Session, 'after_transaction_create', _mark_savepoint)
+event.listen(Session, 'after_soft_rollback', _rollback_savepoint)
+event.listen(Session, 'after_commit', _dispatch_scheduled_jobs)
+event.listen(Session, 'after_rollback', _discard_scheduled_jobs)
+
+
+# Instância global
+flow_webhook_executor = FlowWebhookExecutor(
+    max_workers=int(os.getenv('FLOW_WEBHOOK_WORKERS', '16')),
+    read_timeout=float(os.getenv('FLOW_WEBHOOK_TIMEOUT', '5'))
+)
@@ -5,6 +5,8 @@ from datetime import datetime
 from typing import Optional, Dict, List, Any
 import logging
 
+from src.services.validators import format_document, is_valid_document
+
 logger = logging.getLogger(__name__)
 
 class FlyERPService:
@@ -267,15 +269,7 @@ class FlyERPService:
         Returns:
             Documento formatado
         """
-        # Remove caracteres não numéricos
-        clean_doc = ''.join(filter(str.isdigit, document))
-        
-        if len(clean_doc) == 11:  # CPF
-            return f"{clean_doc[:3]}.{clean_doc[3:6]}.{clean_doc[6:9]}-{clean_doc[9:]}"
-        elif len(clean_doc) == 14:  # CNPJ
-            return f"{clean_doc[:2]}.{clean_doc[2:5]}.{clean_doc[5:8]}/{clean_doc[8:12]}-{clean_doc[12:]}"
-        else:
-            return document
+        return format_document(document)
 
     def validate_contract_data(self, contract_data: Dict[str, Any]) -> List[str]:
         """
@@ -296,9 +290,8 @@ class FlyERPService:
         
         # Validar formato do documento
         cnpj_cpf = contract_data.get("client_cnpj_cpf", "")
-        clean_doc = ''.join(filter(str.isdigit, cnpj_cpf))
-        if len(clean_doc) not in [11, 14]:
-            errors.append("CNPJ/CPF deve ter 11 ou 14 dígitos")
+        if not is_valid_document(cnpj_cpf):
+            errors.append("CNPJ/CPF inválido")
         
         return errors
 
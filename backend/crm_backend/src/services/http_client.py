@@ -0,0 +1,233 @@
+"""
+Cliente HTTP compartilhado para integrações externas (WhatsApp, Evolution API...)
+
+- Uma requests.Session por URL base, com pool de conexões keep-alive
+- Timeout padrão em todas as chamadas
+- Novas tentativas com backoff exponencial e jitter em 429/5xx e falhas de conexão
+- Token bucket opcional por chave (phone_number_id, instância, ...), com espera
+  máxima: acima dela a chamada falha (RateLimitTimeout) em vez de segurar a thread
+- Métricas por host em memória
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.services.rate_limiter import TokenBucketLimiter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+# POST só é repetido quando a requisição certamente não foi processada,
+# para não duplicar mensagens enviadas
+POST_RETRY_STATUS = {429, 503}
+
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """Limite de taxa da chave não liberou a chamada dentro da espera máxima"""
+
+
+class IntegrationHTTPClient:
+    """Cliente HTTP com pool por URL base, retries e limite de taxa"""
+
+    def __init__(self, timeout: Tuple[float, float] = (5.0, 30.0), max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0, pool_maxsize: int = 20,
+                 throttle_timeout: float = 10.0):
+        self.timeout = timeout  # (conexão, leitura)
+        self.throttle_timeout = throttle_timeout  # Espera máxima pelo limite de taxa (segundos)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+
+        self._sessions: Dict[str, requests.Session] = {}
+        self._limiters: Dict[str, TokenBucketLimiter] = {}
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {
+            'requests': 0, 'errors': 0, 'retries': 0, 'throttled_seconds': 0.0, 'throttle_timeouts': 0,
+            'latency_total_ms': 0.0, 'status': defaultdict(int)
+        })
+
+    # ==================== SESSÕES E LIMITES ====================
+
+    def _base_of(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _session_for(self, url: str) -> requests.Session:
+        base = self._base_of(url)
+        session = self._sessions.get(base)
+        if session:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(base)
+            if not session:
+                session = requests.Session()
+                # Retries são feitos aqui para respeitar backoff, jitter e métricas
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[base] = session
+        return session
+
+    def configure_rate_limit(self, rate_key: str, rate_per_second: float, burst: float = None):
+        """Define o limite de chamadas por segundo para uma chave (mantém o balde se já existir)"""
+        with self._lock:
+            limiter = self._limiters.get(rate_key)
+            if limiter is not None and limiter.rate == float(rate_per_second):
+                return
+            self._limiters[rate_key] = TokenBucketLimiter(rate_per_second, burst)
+
+    def _throttle(self, rate_key: Optional[str], host: str, timeout: float = None):
+        if not rate_key:
+            return
+        limiter = self._limiters.get(rate_key)
+        if limiter is None:  # TokenBucketLimiter vazio tem len() 0
+            return
+
+        timeout = self.throttle_timeout if timeout is None else timeout
+        started = time.monotonic()
+        allowed = limiter.acquire(rate_key, timeout=timeout)
+        waited = time.monotonic() - started
+        if waited > 0.001 or not allowed:
+            with self._lock:
+                self._metrics[host]['throttled_seconds'] += waited
+                if not allowed:
+                    self._metrics[host]['throttle_timeouts'] += 1
+        if not allowed:
+            raise RateLimitTimeout(f"Limite de taxa de {rate_key} não liberou a chamada em {timeout:.1f}s")
+
+    # ==================== REQUISIÇÕES ====================
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                return min(float(response.headers['Retry-After']), self.backoff_max)
+            except ValueError:
+                pass
+        # Backoff exponencial com "full jitter"
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, url: str, rate_key: str = None, timeout=None,
+                retry: bool = True, throttle_timeout: float = None, **kwargs) -> requests.Response:
+        """
+        Executa a requisição com pool, timeout, limite de taxa e retries
+
+        Levanta requests.exceptions.RequestException quando as tentativas se
+        esgotam por falha de conexão ou quando o limite de taxa não libera a
+        chamada em throttle_timeout (RateLimitTimeout); respostas HTTP de erro
+        são devolvidas para o chamador decidir (raise_for_status).
+        """
+        method = method.upper()
+        host = urlsplit(url).netloc
+        session = self._session_for(url)
+        idempotent = method in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else POST_RETRY_STATUS
+        attempts = self.max_retries + 1 if retry else 1
+
+        for attempt in range(attempts):
+            self._throttle(rate_key, host, throttle_timeout)
+            started = time.monotonic()
+            response = None
+
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(host, None, started, error=True)
+                # Sem conexão estabelecida a requisição não chegou ao servidor
+                safe = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if attempt + 1 >= attempts or not safe:
+                    raise
+                self._record_retry(host)
+                delay = self._retry_delay(attempt, None)
+                logger.warning(f"Falha de conexão com {host} ({e}); nova tentativa em {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            self._record(host, response.status_code, started, error=response.status_code >= 400)
+
+            if response.status_code in retry_status and attempt + 1 < attempts:
+                self._record_retry(host)
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"{host} respondeu {response.status_code}; nova tentativa em {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+
+            return response
+
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    # ==================== MÉTRICAS ====================
+
+    def _record(self, host: str, status: Optional[int], started: float, error: bool = False):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            metrics = self._metrics[host]
+            metrics['requests'] += 1
+            metrics['latency_total_ms'] += elapsed_ms
+            metrics['status'][str(status) if status else 'connection_error'] += 1
+            if error:
+                metrics['errors'] += 1
+
+    def _record_retry(self, host: str):
+        with self._lock:
+            self._metrics[host]['retries'] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas acumuladas por host"""
+        with self._lock:
+            result = {}
+            for host, metrics in self._metrics.items():
+                result[host] = {
+                    'requests': metrics['requests'],
+                    'errors': metrics['errors'],
+                    'retries': metrics['retries'],
+                    'throttled_seconds': round(metrics['throttled_seconds'], 3),
+                    'throttle_timeouts': metrics['throttle_timeouts'],
+                    'avg_latency_ms': round(metrics['latency_total_ms'] / metrics['requests'], 2) if metrics['requests'] else 0,
+                    'status': dict(metrics['status'])
+                }
+            return result
+
+    def close(self):
+        """Fecha todas as sessões"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# Instância global compartilhada pelas integrações
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> IntegrationHTTPClient:
+    """Obtém o cliente HTTP compartilhado"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = IntegrationHTTPClient(
+                    timeout=(float(os.getenv('INTEGRATION_HTTP_CONNECT_TIMEOUT', '5')),
+                             float(os.getenv('INTEGRATION_HTTP_READ_TIMEOUT', '30'))),
+                    max_retries=int(os.getenv('INTEGRATION_HTTP_MAX_RETRIES', '3')),
+                    throttle_timeout=float(os.getenv('INTEGRATION_HTTP_THROTTLE_TIMEOUT', '10'))
+                )
+    return _http_client
@@ -0,0 +1,304 @@
+"""
+Base de conhecimento do chatbot com busca vetorial local
+
+Cada tenant tem um índice com um vetor por forma de pergunta (pergunta
+principal e alternativas). Os vetores vêm de um embedder local plugável — o
+padrão usa n-gramas de caracteres com hashing, sem modelo externo — e ficam
+numa matriz NumPy normalizada, então a similaridade de cosseno com a pergunta
+do contato é um único produto matriz-vetor. O índice é salvo em disco e
+reaberto com memory-map, compartilhando as páginas entre processos.
+
+Perguntas frequentes respondidas acima do limiar de confiança não chegam ao
+modelo de linguagem.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import func
+
+from src.models.chatbot import ChatKnowledgeEntry, db
+
+# Importação opcional do NumPy (matriz do índice e busca vetorizada)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = float(os.getenv('KNOWLEDGE_BASE_THRESHOLD', '0.6'))
+
+_SPACES_RE = re.compile(r'\s+')
+_NON_WORD_RE = re.compile(r'[^\w\s]', re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação"""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _SPACES_RE.sub(' ', _NON_WORD_RE.sub(' ', text)).strip()
+
+
+class HashedNgramEmbedder:
+    """
+    Vetores por hashing de n-gramas de caracteres e de palavras
+
+    Tolerante a erros de digitação e variações ("preco"/"preço", "boleto"/
+    "boletos"), sem vocabulário nem treinamento.
+    """
+
+    name = 'hashed_ngram'
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> Dict[int, float]:
+        features: Dict[int, float] = {}
+        normalized = normalize_text(text)
+        for word in normalized.split():
+            padded = f' {word} '
+            grams = [word] + [padded[i:i + n] for n in range(self.ngram_range[0], self.ngram_range[1] + 1)
+                              for i in range(max(len(padded) - n + 1, 1))]
+            for gram in grams:
+                h = zlib.crc32(gram.encode())
+                index = h % self.dim
+                # Sinal do hash reduz o viés das colisões
+                features[index] = features.get(index, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+        return features
+
+    def embed(self, text: str):
+        features = self._features(text)
+        if np is not None:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            if features:
+                vector[list(features.keys())] = list(features.values())
+                norm = np.linalg.norm(vector)
+                if norm:
+                    vector /= norm
+            return vector
+
+        norm = sum(v * v for v in features.values()) ** 0.5 or 1.0
+        return {index: value / norm for index, value in features.items()}
+
+    def embed_many(self, texts: List[str]):
+        if np is not None:
+            return np.vstack([self.embed(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        return [self.embed(text) for text in texts]
+
+    def signature(self) -> str:
+        return f'{self.name}:{self.dim}:{self.ngram_range[0]}-{self.ngram_range[1]}'
+
+
+# Embedders disponíveis (outros podem ser registrados, ex.: modelos locais de sentenças)
+EMBEDDERS: Dict[str, Callable[[], Any]] = {
+    'hashed_ngram': HashedNgramEmbedder
+}
+
+
+def register_embedder(name: str, factory: Callable[[], Any]):
+    """Registra um embedder (objeto com embed, embed_many e signature)"""
+    EMBEDDERS[name] = factory
+
+
+class KnowledgeIndex:
+    """Índice de um tenant: matriz de vetores e a entrada de cada linha"""
+
+    def __init__(self, version: str, matrix, row_entries: List[str], entries: Dict[str, Dict[str, str]]):
+        self.version = version
+        self.matrix = matrix  # n x dim, linhas normalizadas (ou lista de dicts esparsos sem NumPy)
+        self.row_entries = row_entries
+        self.entries = entries  # id -> pergunta/resposta
+
+    def __len__(self):
+        return len(self.row_entries)
+
+    def search(self, query_vector, k: int = 3) -> List[Tuple[str, float]]:
+        """Melhores entradas por similaridade de cosseno (uma por entrada)"""
+        if not self.row_entries:
+            return []
+
+        if np is not None:
+            scores = np.asarray(self.matrix @ query_vector)
+            top = min(len(scores), k * 4)  # Folga para entradas com várias alternativas
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            ranked = candidates[np.argsort(-scores[candidates])]
+            pairs = ((self.row_entries[i], float(scores[i])) for i in ranked)
+        else:
+            scores = [sum(value * query_vector.get(index, 0.0) for index, value in row.items())
+                      for row in self.matrix]
+            ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+            pairs = ((self.row_entries[i], scores[i]) for i in ranked)
+
+        results = []
+        seen = set()
+        for entry_id, score in pairs:
+            if entry_id in seen:
+                continue
+            seen.add(entry_id)
+            results.append((entry_id, score))
+            if len(results) >= k:
+                break
+        return results
+
+
+class KnowledgeBaseService:
+    """Índices por tenant, reconstruídos quando a base muda"""
+
+    def __init__(self, embedder: str = 'hashed_ngram', index_dir: str = None, check_seconds: float = 30.0):
+        self.embedder = EMBEDDERS[embedder]()
+        self.index_dir = index_dir or os.getenv('KNOWLEDGE_INDEX_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'crm_knowledge_index')
+        self.check_seconds = check_seconds
+        self._indexes: Dict[str, Tuple[KnowledgeIndex, float]] = {}
+        self._lock = threading.Lock()
+
+    # ==================== ÍNDICE ====================
+
+    def _version(self, tenant_id: Optional[str]) -> str:
+        """Assinatura da base do tenant (quantidade + última alteração + embedder)"""
+        count, last_update = db.session.query(
+            func.count(ChatKnowledgeEntry.id), func.max(ChatKnowledgeEntry.updated_at)
+        ).filter(ChatKnowledgeEntry.tenant_id == tenant_id).one()
+        raw = f'{count}:{last_update}:{self.embedder.signature()}'
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+    def _paths(self, tenant_id: Optional[str], version: str) -> Tuple[str, str]:
+        base = os.path.join(self.index_dir, tenant_id or '_global')
+        return os.path.join(base, f'{version}.npy'), os.path.join(base, f'{version}.json')
+
+    def _build(self, tenant_id: Optional[str], version: str) -> KnowledgeIndex:
+        entries = ChatKnowledgeEntry.query.filter_by(tenant_id=tenant_id, is_active=True).all()
+
+        texts, row_entries, data = [], [], {}
+        for entry in entries:
+            data[entry.id] = {'question': entry.question, 'answer': entry.answer}
+            for text in [entry.question] + list(entry.alternatives or []):
+                if text and text.strip():
+                    texts.append(text)
+                    row_entries.append(entry.id)
+
+        matrix = self.embedder.embed_many(texts)
+        index = KnowledgeIndex(version, matrix, row_entries, data)
+        if np is not None:
+            self._save(tenant_id, index)
+        logger.info(f"Índice da base de conhecimento {tenant_id or '_global'}: {len(entries)} entradas, {len(texts)} vetores")
+        return index
+
+    def _save(self, tenant_id: Optional[str], index: KnowledgeIndex):
+        matrix_path, meta_path = self._paths(tenant_id, index.version)
+        try:
+            os.makedirs(os.path.dirname(matrix_path), exist_ok=True)
+            # Grava em arquivo temporário e renomeia (leitores nunca veem arquivo parcial)
+            tmp_matrix = f'{matrix_path}.{os.getpid()}.tmp'
+            with open(tmp_matrix, 'wb') as fh:
+                np.save(fh, index.matrix)
+            os.replace(tmp_matrix, matrix_path)
+            tmp_meta = f'{meta_path}.{os.getpid()}.tmp'
+            with open(tmp_meta, 'w', encoding='utf-8') as fh:
+                json.dump({'row_entries': index.row_entries, 'entries': index.entries}, fh, ensure_ascii=False)
+            os.replace(tmp_meta, meta_path)
+            index.matrix = np.load(matrix_path, mmap_mode='r')
+            self._cleanup(os.path.dirname(matrix_path), index.version)
+        except OSError as e:
+            logger.warning(f"Índice da base de conhecimento mantido só em memória: {e}")
+
+    def _load(self, tenant_id: Optional[str], version: str) -> Optional[KnowledgeIndex]:
+        """Abre o índice salvo por outro processo (memory-map)"""
+        if np is None:
+            return None
+        matrix_path, meta_path = self._paths(tenant_id, version)
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as fh:
+                meta = json.load(fh)
+            return KnowledgeIndex(version, np.load(matrix_path, mmap_mode='r'), meta['row_entries'], meta['entries'])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Índice salvo inválido ({matrix_path}): {e}")
+            return None
+
+    @staticmethod
+    def _cleanup(directory: str, keep_version: str):
+        for name in os.listdir(directory):
+            if not name.startswith(keep_version) and not name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def get_index(self, tenant_id: Optional[str]) -> KnowledgeIndex:
+        """Índice atual do tenant (verifica alterações a cada check_seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._indexes.get(tenant_id)
+        if cached and now - cached[1] < self.check_seconds:
+            return cached[0]
+
+        version = self._version(tenant_id)
+        if cached and cached[0].version == version:
+            index = cached[0]
+        else:
+            index = self._load(tenant_id, version) or self._build(tenant_id, version)
+
+        with self._lock:
+            self._indexes[tenant_id] = (index, now)
+        return index
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        """Força nova verificação do índice na próxima busca"""
+        with self._lock:
+            if tenant_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(tenant_id, None)
+
+    # ==================== BUSCA ====================
+
+    def search(self, tenant_id: Optional[str], text: str, k: int = 3) -> List[Dict[str, Any]]:
+        """Entradas mais parecidas com o texto, com a similaridade (0 a 1)"""
+        if not text or not text.strip():
+            return []
+        index = self.get_index(tenant_id)
+        results = []
+        for entry_id, score in index.search(self.embedder.embed(text), k):
+            entry = index.entries[entry_id]
+            results.append({'entry_id': entry_id, 'question': entry['question'],
+                            'answer': entry['answer'], 'score': round(max(score, 0.0), 4)})
+        return results
+
+    def answer(self, tenant_id: Optional[str], text: str, threshold: float = None) -> Optional[Dict[str, Any]]:
+        """
+        Resposta da base se a melhor entrada passar do limiar de confiança
+
+        Conta o uso da entrada (sem commit).
+        """
+        threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+        try:
+            results = self.search(tenant_id, text, k=1)
+        except Exception as e:
+            logger.error(f"Erro na busca da base de conhecimento: {e}")
+            return None
+
+        if not results or results[0]['score'] < threshold:
+            return None
+
+        # updated_at mantido: o contador não deve invalidar o índice
+        ChatKnowledgeEntry.query.filter_by(id=results[0]['entry_id']).update(
+            {'hits': ChatKnowledgeEntry.hits + 1, 'updated_at': ChatKnowledgeEntry.updated_at},
+            synchronize_session=False
+        )
+        return results[0]
+
+
+# Instância global
+knowledge_base_service = KnowledgeBaseService()
@@ -0,0 +1,42 @@
+"""
+Cursores opacos para paginação por chave (keyset)
+
+O cursor guarda a última posição lida, (momento, id), e a próxima página é
+uma consulta por índice a partir dela, sem OFFSET. O token de sincronização
+usa a mesma ideia com (sequência de alteração, id).
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def encode_cursor(moment: Optional[datetime], row_id: str) -> str:
+    raw = json.dumps({'t': moment.isoformat() if moment else None, 'id': row_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    """Levanta ValueError se o cursor for inválido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        moment = datetime.fromisoformat(data['t']) if data.get('t') else None
+        return moment, str(data['id'])
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+
+def encode_sync_token(sequence: int, row_id: str) -> str:
+    raw = json.dumps({'seq': int(sequence or 0), 'id': row_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_sync_token(token: str) -> Tuple[int, str]:
+    """Levanta ValueError se o token for inválido"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return int(data['seq']), str(data['id'])
+    except Exception:
+        raise ValueError('Token de sincronização inválido')
@@ -0,0 +1,421 @@
+"""
+Identificação do lead pelo telefone (chamadas recebidas e conversas do WhatsApp)
+
+Os campos phone/whatsapp dos leads são texto livre ("(11) 99999-9999"). Cada
+gravação de lead mantém, na mesma transação, a tabela lead_phones com os
+números em E.164 e uma chave de comparação que ignora o 9º dígito dos
+celulares brasileiros. As consultas usam um mapa em memória por tenant
+(chave -> leads), carregado uma vez e atualizado após o commit das gravações
+de leads deste processo; números fora do mapa são procurados no banco pelo
+índice (tenant_id, match_key), o que cobre leads gravados por outros processos.
+
+Cada gravação também incrementa a versão do tenant (lead_phone_versions). O
+mapa guarda a versão em que foi carregado e, no máximo a cada check_seconds,
+compara com o banco: se outro processo excluiu ou renumerou leads, o mapa é
+recarregado em vez de responder com leads antigos até o fim do TTL.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Iterable, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from src.models.lead import Lead, LeadPhone, LeadPhoneVersion, db
+
+logger = logging.getLogger(__name__)
+
+SESSION_CHANGES_KEY = 'lead_phone_changes'
+DEFAULT_COUNTRY_CODE = os.getenv('PHONE_DEFAULT_COUNTRY_CODE', '55')
+PHONE_KINDS = ('phone', 'whatsapp')
+
+_NON_DIGITS_RE = re.compile(r'\D')
+
+
+def normalize_e164(value: Optional[str], country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """
+    Número em E.164 (+5511999999999). None se não for possível (ramal, número sem DDD)
+
+    Aceita máscaras, prefixo internacional 00, zero de discagem nacional e
+    código de operadora (0 XX DDD número).
+    """
+    if not value:
+        return None
+    value = str(value).split('@', 1)[0].strip()  # JID do WhatsApp: 5511999999999@s.whatsapp.net
+    international = value.startswith('+')
+    digits = _NON_DIGITS_RE.sub('', value)
+
+    if digits.startswith('00'):
+        digits = digits[2:]
+        international = True
+
+    if not international:
+        if digits.startswith('0'):
+            digits = digits.lstrip('0')
+            if len(digits) in (12, 13) and not digits.startswith(country_code):
+                digits = digits[2:]  # Código de operadora
+        if len(digits) in (10, 11):
+            digits = country_code + digits
+        elif not (len(digits) in (12, 13) and digits.startswith(country_code)) and len(digits) < 12:
+            return None
+
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def match_key(e164: Optional[str]) -> Optional[str]:
+    """Chave de comparação: celulares brasileiros sem o 9º dígito (com e sem o 9 coincidem)"""
+    if not e164:
+        return None
+    digits = e164.lstrip('+')
+    if digits.startswith('55') and len(digits) == 13 and digits[4] == '9':
+        return digits[:4] + digits[5:]
+    return digits
+
+
+def phone_key(value: Optional[str]) -> Optional[str]:
+    return match_key(normalize_e164(value))
+
+
+class _TenantPhones:
+    """Mapa de um tenant: chave -> leads (mais antigo primeiro) e lead -> chaves"""
+
+    __slots__ = ('keys', 'by_lead', 'loaded_at', 'version', 'checked_at')
+
+    def __init__(self, version: int = 0):
+        self.keys: Dict[str, List[str]] = {}
+        self.by_lead: Dict[str, Set[str]] = {}
+        self.loaded_at = time.monotonic()
+        self.version = version  # Versão do tenant no banco quando o mapa foi carregado
+        self.checked_at = self.loaded_at
+
+    def add(self, lead_id: str, key: str):
+        leads = self.keys.setdefault(key, [])
+        if lead_id not in leads:
+            leads.append(lead_id)
+        self.by_lead.setdefault(lead_id, set()).add(key)
+
+    def remove_lead(self, lead_id: str):
+        for key in self.by_lead.pop(lead_id, ()):
+            leads = self.keys.get(key)
+            if leads and lead_id in leads:
+                leads.remove(lead_id)
+                if not leads:
+                    del self.keys[key]
+
+
+class PhoneIndex:
+    """Consulta de leads por telefone com mapa em memória por tenant"""
+
+    def __init__(self, max_tenants: int = 200, ttl_seconds: float = 900.0, check_seconds: float = 5.0):
+        self.max_tenants = max_tenants
+        self.ttl_seconds = ttl_seconds
+        self.check_seconds = check_seconds
+        self._tenants: 'OrderedDict[str, _TenantPhones]' = OrderedDict()
+        self._versions: Dict[str, int] = {}  # tenant_id -> alterações recebidas (detecta mudança durante a carga)
+        self._load_locks: Dict[str, threading.Lock] = {}  # Uma carga por tenant de cada vez
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'db_hits': 0, 'loads': 0, 'invalidated': 0}
+
+    # ==================== ÍNDICE NO BANCO ====================
+
+    @staticmethod
+    def rows_for(lead) -> List[Dict[str, str]]:
+        """Linhas de lead_phones de um lead (objeto ou linha com id, tenant_id, phone, whatsapp)"""
+        rows = []
+        for kind in PHONE_KINDS:
+            number = normalize_e164(getattr(lead, kind, None))
+            if number:
+                rows.append({'tenant_id': lead.tenant_id, 'lead_id': lead.id, 'kind': kind,
+                             'number': number, 'match_key': match_key(number)})
+        return rows
+
+    @staticmethod
+    def write_rows(connection, leads: Iterable) -> int:
+        """Regrava o índice dos leads informados (na conexão/transação atual)"""
+        leads = list(leads)
+        if not leads:
+            return 0
+        table = LeadPhone.__table__
+        connection.execute(table.delete().where(table.c.lead_id.in_([lead.id for lead in leads])))
+        rows = [row for lead in leads for row in PhoneIndex.rows_for(lead)]
+        for row in rows:
+            row['id'] = str(uuid.uuid4())
+        if rows:
+            connection.execute(table.insert(), rows)
+        return len(rows)
+
+    def rebuild(self, tenant_id: str = None, batch_size: int = 1000) -> int:
+        """Recria o índice a partir dos leads (gravações fora do ORM, carga inicial)"""
+        indexed = 0
+        last_id = ''
+        while True:
+            query = db.session.query(Lead.id, Lead.tenant_id, Lead.phone, Lead.whatsapp).filter(Lead.id > last_id)
+            if tenant_id:
+                query = query.filter(Lead.tenant_id == tenant_id)
+            batch = query.order_by(Lead.id.asc()).limit(batch_size).all()
+            if not batch:
+                break
+            connection = db.session.connection()
+            indexed += self.write_rows(connection, batch)
+            bump_versions(connection, {lead.tenant_id for lead in batch})
+            db.session.commit()
+            last_id = batch[-1].id
+
+        with self._lock:
+            if tenant_id:
+                self._tenants.pop(tenant_id, None)
+            else:
+                self._tenants.clear()
+        return indexed
+
+    # ==================== MAPA EM MEMÓRIA ====================
+
+    @staticmethod
+    def _db_version(tenant_id: str) -> int:
+        return db.session.query(LeadPhoneVersion.version).filter_by(tenant_id=tenant_id).scalar() or 0
+
+    def _load(self, tenant_id: str) -> _TenantPhones:
+        # Versão lida antes dos telefones: alteração confirmada durante a carga provoca nova carga
+        phones = _TenantPhones(self._db_version(tenant_id))
+        rows = db.session.query(LeadPhone.lead_id, LeadPhone.match_key) \
+            .join(Lead, Lead.id == LeadPhone.lead_id) \
+            .filter(LeadPhone.tenant_id == tenant_id) \
+            .order_by(Lead.created_at.asc(), Lead.id.asc()).all()
+        for lead_id, key in rows:
+            phones.add(lead_id, key)
+        return phones
+
+    def _cached(self, tenant_id: str) -> Optional[_TenantPhones]:
+        """Mapa carregado e dentro do TTL (chamar com o lock)"""
+        phones = self._tenants.get(tenant_id)
+        if phones is not None and time.monotonic() - phones.loaded_at < self.ttl_seconds:
+            self._tenants.move_to_end(tenant_id)
+            return phones
+        return None
+
+    def _changed_elsewhere(self, tenant_id: str, phones: _TenantPhones) -> bool:
+        """Se a versão do tenant no banco mudou desde a carga (conferida a cada check_seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            if now - phones.checked_at < self.check_seconds:
+                return False
+            phones.checked_at = now
+        if self._db_version(tenant_id) == phones.version:
+            return False
+        with self._lock:
+            phones.loaded_at = 0.0  # Expira o mapa: a carga abaixo o substitui
+            self._stats['invalidated'] += 1
+        return True
+
+    def _tenant_map(self, tenant_id: str) -> _TenantPhones:
+        with self._lock:
+            phones = self._cached(tenant_id)
+        if phones is not None and not self._changed_elsewhere(tenant_id, phones):
+            return phones
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(tenant_id, threading.Lock())
+
+        # A consulta roda fora do lock global: consultas de outros tenants não esperam
+        with load_lock:
+            with self._lock:
+                phones = self._cached(tenant_id)  # Carregado por outra thread enquanto esperava
+                if phones is not None:
+                    return phones
+                version = self._versions.get(tenant_id, 0)
+
+            phones = self._load(tenant_id)
+
+            with self._lock:
+                if self._versions.get(tenant_id, 0) != version:
+                    phones.loaded_at = 0.0  # Leads alterados durante a carga: recarrega na próxima consulta
+                self._tenants[tenant_id] = phones
+                self._tenants.move_to_end(tenant_id)
+                while len(self._tenants) > self.max_tenants:
+                    evicted, _ = self._tenants.popitem(last=False)
+                    self._load_locks.pop(evicted, None)
+                self._stats['loads'] += 1
+            return phones
+
+    @staticmethod
+    def _query_keys(tenant_id: str, keys: List[str], chunk_size: int = 500) -> Dict[str, List[str]]:
+        """Leads de cada chave no banco (mais antigo primeiro), uma consulta IN por bloco"""
+        leads: Dict[str, List[str]] = {}
+        for i in range(0, len(keys), chunk_size):
+            rows = db.session.query(LeadPhone.match_key, LeadPhone.lead_id) \
+                .join(Lead, Lead.id == LeadPhone.lead_id) \
+                .filter(LeadPhone.tenant_id == tenant_id, LeadPhone.match_key.in_(keys[i:i + chunk_size])) \
+                .order_by(Lead.created_at.asc(), Lead.id.asc()).all()
+            for key, lead_id in rows:
+                if lead_id not in leads.setdefault(key, []):
+                    leads[key].append(lead_id)
+        return leads
+
+    def _lookup(self, tenant_id: str, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """Leads das chaves: mapa em memória e, para as ausentes, o índice no banco"""
+        keys = set(keys)
+        phones = self._tenant_map(tenant_id)
+        with self._lock:
+            found = {key: list(phones.keys[key]) for key in keys if phones.keys.get(key)}
+            self._stats['hits'] += len(found)
+        missing = [key for key in keys if key not in found]
+        if not missing:
+            return found
+
+        # Leads gravados por outro processo depois da carga do mapa
+        from_db = self._query_keys(tenant_id, missing)
+        with self._lock:
+            for key, leads in from_db.items():
+                for lead_id in leads:
+                    phones.add(lead_id, key)
+            self._stats['db_hits'] += len(from_db)
+            self._stats['misses'] += len(missing) - len(from_db)
+        found.update(from_db)
+        return found
+
+    def find_lead_ids(self, tenant_id: str, number: str) -> List[str]:
+        """Leads com o número (mais antigo primeiro)"""
+        key = phone_key(number)
+        if not key or not tenant_id:
+            return []
+        return self._lookup(tenant_id, [key]).get(key, [])
+
+    def find_lead_id(self, tenant_id: str, number: str) -> Optional[str]:
+        leads = self.find_lead_ids(tenant_id, number)
+        return leads[0] if leads else None
+
+    def find_many(self, tenant_id: str, numbers: Iterable[str]) -> Dict[str, str]:
+        """Lead de cada número informado (números sem lead ficam de fora)"""
+        keys = {number: phone_key(number) for number in set(numbers)}
+        keys = {number: key for number, key in keys.items() if key}
+        if not keys or not tenant_id:
+            return {}
+
+        leads = self._lookup(tenant_id, keys.values())
+        return {number: leads[key][0] for number, key in keys.items() if leads.get(key)}
+
+    def refresh_leads(self, changes: Iterable[Tuple[str, str]]):
+        """Relê do banco o índice dos leads alterados e atualiza os mapas carregados"""
+        changes = list(changes)
+        with self._lock:
+            for tenant_id in {tenant_id for tenant_id, _ in changes}:
+                self._versions[tenant_id] = self._versions.get(tenant_id, 0) + 1
+            changes = [(tenant_id, lead_id) for tenant_id, lead_id in changes if tenant_id in self._tenants]
+        if not changes:
+            return
+        table = LeadPhone.__table__
+        lead_ids = list({lead_id for _, lead_id in changes})
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                table.select().with_only_columns(table.c.tenant_id, table.c.lead_id, table.c.match_key)
+                .where(table.c.lead_id.in_(lead_ids))
+            ).all()
+
+        with self._lock:
+            for tenant_id, lead_id in changes:
+                phones = self._tenants.get(tenant_id)
+                if phones:
+                    phones.remove_lead(lead_id)
+            for tenant_id, lead_id, key in rows:
+                phones = self._tenants.get(tenant_id)
+                if phones:
+                    phones.add(lead_id, key)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tenants'] = len(self._tenants)
+            stats['numbers'] = sum(len(phones.keys) for phones in self._tenants.values())
+        return stats
+
+
+# Instância global
+phone_index = PhoneIndex(
+    max_tenants=int(os.getenv('PHONE_INDEX_CACHE_TENANTS', '200')),
+    ttl_seconds=float(os.getenv('PHONE_INDEX_TTL_SECONDS', '900')),
+    check_seconds=float(os.getenv('PHONE_INDEX_CHECK_SECONDS', '5'))
+)
+
+
+def bump_versions(connection, tenant_ids: Iterable[str]):
+    """Incrementa a versão do índice dos tenants na transação atual (ver PhoneIndex._changed_elsewhere)"""
+    table = LeadPhoneVersion.__table__
+    now = datetime.utcnow()
+    for tenant_id in sorted({tenant_id for tenant_id in tenant_ids if tenant_id}):
+        increment = table.update().where(table.c.tenant_id == tenant_id) \
+            .values(version=table.c.version + 1, changed_at=now)
+        if not connection.execute(increment).rowcount:
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(tenant_id=tenant_id, version=1, changed_at=now))
+            except IntegrityError:
+                connection.execute(increment)  # Criada por outra transação
+
+
+def _phones_changed(lead: Lead) -> bool:
+    state = inspect(lead)
+    return any(state.attrs[name].history.has_changes() for name in PHONE_KINDS + ('tenant_id',))
+
+
+def _stage(session, lead):
+    session.info.setdefault(SESSION_CHANGES_KEY, set()).add((lead.tenant_id, lead.id))
+
+
+def _remove_deleted_leads(session, flush_context, instances):
+    """O índice dos leads excluídos sai antes do DELETE do lead (chave estrangeira)"""
+    deleted = [obj for obj in session.deleted if isinstance(obj, Lead)]
+    if deleted:
+        table = LeadPhone.__table__
+        connection = session.connection()
+        connection.execute(table.delete().where(table.c.lead_id.in_([lead.id for lead in deleted])))
+        bump_versions(connection, {lead.tenant_id for lead in deleted})
+        for lead in deleted:
+            _stage(session, lead)
+
+
+def _index_flushed_leads(session, flush_context):
+    """Regrava o índice dos leads novos ou com telefone alterado, na mesma transação"""
+    leads = [obj for obj in session.new if isinstance(obj, Lead)]
+    leads += [obj for obj in session.dirty if isinstance(obj, Lead) and _phones_changed(obj)]
+    if leads:
+        connection = session.connection()
+        PhoneIndex.write_rows(connection, leads)
+        tenants = set()
+        for lead in leads:
+            _stage(session, lead)
+            tenants.add(lead.tenant_id)
+            for previous_tenant in inspect(lead).attrs.tenant_id.history.deleted:
+                session.info[SESSION_CHANGES_KEY].add((previous_tenant, lead.id))
+                tenants.add(previous_tenant)
+        bump_versions(connection, tenants)
+
+
+def _apply_committed_changes(session):
+    if session.in_nested_transaction():
+        return  # Liberação de savepoint: a transação ainda pode ser desfeita
+    changes = session.info.pop(SESSION_CHANGES_KEY, None)
+    if changes:
+        try:
+            phone_index.refresh_leads(changes)
+        except Exception as e:
+            logger.error(f"Erro ao atualizar o índice de telefones em memória: {e}")
+
+
+def _discard_changes(session, previous_transaction=None):
+    if not session.in_nested_transaction():
+        session.info.pop(SESSION_CHANGES_KEY, None)
+
+
+event.listen(Session, 'before_flush', _remove_deleted_leads)
+event.listen(Session, 'after_flush', _index_flushed_leads)
+event.listen(Session, 'after_commit', _apply_committed_changes)
+event.listen(Session, 'after_rollback', _discard_changes)
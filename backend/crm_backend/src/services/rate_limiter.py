@@ -0,0 +1,57 @@
+"""
+Token bucket em memória, com um balde por chave (tenant, número, instância...)
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class TokenBucketLimiter:
+    """Limitador token bucket por chave"""
+
+    def __init__(self, rate_per_second: float, burst: float = None):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst if burst is not None else max(rate_per_second, 1))
+        self._buckets: Dict[str, List[float]] = {}  # chave -> [tokens, atualizado_em]
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: Optional[str], tokens: float = 1) -> float:
+        """Consome tokens. Retorna 0 se permitido, ou os segundos de espera"""
+        key = key or '_global'
+        now = time.monotonic()
+
+        with self._lock:
+            available, updated_at = self._buckets.get(key, [self.capacity, now])
+            available = min(self.capacity, available + (now - updated_at) * self.rate)
+
+            if available >= tokens:
+                self._buckets[key] = [available - tokens, now]
+                return 0.0
+
+            self._buckets[key] = [available, now]
+            return (tokens - available) / self.rate
+
+    def acquire(self, key: Optional[str], tokens: float = 1, timeout: float = None) -> bool:
+        """Bloqueia até haver tokens (ou até o timeout). Retorna se conseguiu"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def prune(self, idle_seconds: float = 60.0) -> int:
+        """Remove baldes sem uso (já cheios de novo). Retorna quantos saíram"""
+        now = time.monotonic()
+        idle = max(idle_seconds, self.capacity / self.rate)
+        with self._lock:
+            stale = [key for key, (_, updated_at) in self._buckets.items() if now - updated_at >= idle]
+            for key in stale:
+                del self._buckets[key]
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -0,0 +1,386 @@
+"""
+Agendador persistente de lembretes de tarefas
+
+Os lembretes ficam indexados na tabela task_reminders (status, due_at). Cada
+processo mantém em memória um heap apenas com a próxima janela de lembretes e
+dispara os envios quando vencem. O lease gravado no banco garante que, com
+vários workers, cada lembrete seja enviado uma única vez.
+
+O vencimento da tarefa (due_date + due_time) está no horário local do tenant
+(Tenant.timezone); due_at é gravado em UTC, como o restante dos horários.
+"""
+import heapq
+import logging
+import os
+import socket
+import threading
+import time as _time
+import uuid
+from datetime import datetime, date, time, timedelta, timezone, tzinfo
+from typing import Dict, List, Any, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import and_, or_
+
+from src.models.task import Task, TaskReminder, db
+from src.models.tenant import Tenant
+
+logger = logging.getLogger(__name__)
+
+REMINDER_CHANNELS = ('email', 'sms')
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'America/Sao_Paulo')  # Tarefas sem tenant ou tenant sem fuso
+
+
+class ReminderScheduler:
+    """Agendador de lembretes com índice no banco e heap da janela atual"""
+
+    def __init__(self, window_seconds: int = 300, refresh_seconds: int = 5,
+                 lease_seconds: int = 120, batch_size: int = 500, max_attempts: int = 3):
+        self.window_seconds = window_seconds  # Janela carregada em memória
+        self.refresh_seconds = refresh_seconds  # Intervalo para buscar lembretes de outros processos
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.default_due_time = time(9, 0)  # Horário usado quando a tarefa não tem due_time
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+
+        self._heap: List[Tuple[datetime, str]] = []
+        self._entries: Dict[str, datetime] = {}  # reminder_id -> due_at válido no heap
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._notification_service = None
+        self._timezones: Dict[Optional[str], Tuple[tzinfo, float]] = {}  # tenant_id -> (fuso, expira_em)
+
+    # ==================== AGENDAMENTO ====================
+
+    def tenant_timezone(self, tenant_id: Optional[str]) -> tzinfo:
+        """Fuso do tenant (cache de 5 minutos); UTC se o nome for inválido"""
+        cached = self._timezones.get(tenant_id)
+        if cached and cached[1] > _time.monotonic():
+            return cached[0]
+
+        name = None
+        if tenant_id:
+            name = db.session.query(Tenant.timezone).filter(Tenant.id == tenant_id).scalar()
+        name = name or DEFAULT_TIMEZONE
+        try:
+            zone = ZoneInfo(name)
+        except Exception:
+            logger.warning(f"Fuso horário inválido ({name}) no tenant {tenant_id}; usando UTC")
+            zone = timezone.utc
+
+        self._timezones[tenant_id] = (zone, _time.monotonic() + 300)
+        return zone
+
+    def compute_due_at(self, task: Task) -> Optional[datetime]:
+        """Calcula o momento do lembrete (UTC, sem fuso) a partir do vencimento local da tarefa"""
+        if not task.due_date or not task.reminder_minutes:
+            return None
+
+        due_time = getattr(task, 'due_time', None)
+        if isinstance(task.due_date, datetime):
+            # due_date é gravado à meia-noite; o horário vem de due_time
+            if not due_time and task.due_date.time() != time(0, 0):
+                due_time = task.due_date.time()
+            due_date = task.due_date.date()
+        else:
+            due_date = task.due_date
+        due = datetime.combine(due_date, due_time or self.default_due_time)
+
+        zone = self.tenant_timezone(getattr(task, 'tenant_id', None))
+        due_utc = due.replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+        return due_utc - timedelta(minutes=int(task.reminder_minutes))
+
+    def schedule(self, task: Task) -> List[TaskReminder]:
+        """
+        Agenda (ou reagenda) os lembretes de uma tarefa
+
+        Grava na sessão atual sem commit, para que o lembrete seja persistido
+        junto com a alteração da tarefa.
+
+        Args:
+            task: Tarefa com reminder_minutes e canais configurados
+
+        Returns:
+            Lembretes ativos da tarefa
+        """
+        due_at = self.compute_due_at(task)
+        enabled = set()
+        if due_at:
+            if getattr(task, 'email_reminder', True):
+                enabled.add('email')
+            if getattr(task, 'sms_reminder', False):
+                enabled.add('sms')
+
+        existing = {r.channel: r for r in TaskReminder.query.filter_by(task_id=task.id).all()}
+        scheduled = []
+
+        for channel in REMINDER_CHANNELS:
+            reminder = existing.get(channel)
+
+            if channel not in enabled:
+                if reminder and reminder.status in ('pending', 'leased'):
+                    reminder.status = 'cancelled'
+                    self._untrack(reminder.id)
+                continue
+
+            if not reminder:
+                reminder = TaskReminder(
+                    id=str(uuid.uuid4()),
+                    task_id=task.id,
+                    tenant_id=getattr(task, 'tenant_id', None),
+                    channel=channel
+                )
+                db.session.add(reminder)
+
+            reminder.due_at = due_at
+            reminder.status = 'pending'
+            reminder.lease_owner = None
+            reminder.lease_expires_at = None
+            reminder.attempts = 0
+            reminder.last_error = None
+            reminder.sent_at = None
+
+            self._track(reminder.id, due_at)
+            scheduled.append(reminder)
+
+        return scheduled
+
+    def cancel(self, task_id: str) -> int:
+        """Cancela os lembretes pendentes de uma tarefa (sem commit)"""
+        reminders = TaskReminder.query.filter(
+            TaskReminder.task_id == task_id,
+            TaskReminder.status.in_(['pending', 'leased'])
+        ).all()
+
+        for reminder in reminders:
+            reminder.status = 'cancelled'
+            self._untrack(reminder.id)
+
+        return len(reminders)
+
+    # ==================== HEAP EM MEMÓRIA ====================
+
+    def _track(self, reminder_id: str, due_at: datetime):
+        """Insere no heap se o lembrete cair na janela carregada - O(log n)"""
+        horizon = datetime.utcnow() + timedelta(seconds=self.window_seconds)
+        if due_at > horizon:
+            self._untrack(reminder_id)
+            return
+
+        with self._lock:
+            # Entradas antigas do mesmo lembrete ficam obsoletas e são descartadas no pop
+            self._entries[reminder_id] = due_at
+            heapq.heappush(self._heap, (due_at, reminder_id))
+        self._wakeup.set()
+
+    def _untrack(self, reminder_id: str):
+        """Invalida a entrada do heap (remoção preguiçosa) - O(1)"""
+        with self._lock:
+            self._entries.pop(reminder_id, None)
+
+    def _pop_due(self, now: datetime) -> List[str]:
+        """Remove do heap os lembretes vencidos"""
+        due_ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due_ids) < self.batch_size:
+                due_at, reminder_id = heapq.heappop(self._heap)
+                if self._entries.get(reminder_id) != due_at:
+                    continue  # Entrada obsoleta (reagendada ou cancelada)
+                del self._entries[reminder_id]
+                due_ids.append(reminder_id)
+        return due_ids
+
+    def _next_due(self) -> Optional[datetime]:
+        with self._lock:
+            while self._heap and self._entries.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def refresh_window(self) -> int:
+        """Carrega do índice (status, due_at) os lembretes da próxima janela"""
+        now = datetime.utcnow()
+        horizon = now + timedelta(seconds=self.window_seconds)
+
+        rows = db.session.query(TaskReminder.id, TaskReminder.due_at).filter(
+            or_(
+                and_(TaskReminder.status == 'pending', TaskReminder.due_at <= horizon),
+                and_(TaskReminder.status == 'leased', TaskReminder.lease_expires_at < now)
+            )
+        ).order_by(TaskReminder.due_at.asc()).limit(self.batch_size).all()
+
+        loaded = 0
+        with self._lock:
+            for reminder_id, due_at in rows:
+                if self._entries.get(reminder_id) == due_at:
+                    continue
+                self._entries[reminder_id] = due_at
+                heapq.heappush(self._heap, (due_at, reminder_id))
+                loaded += 1
+
+        return loaded
+
+    # ==================== DISPARO ====================
+
+    def _claim(self, reminder_ids: List[str]) -> List[TaskReminder]:
+        """Obtém o lease dos lembretes; só o worker que vencer a atualização envia"""
+        now = datetime.utcnow()
+
+        TaskReminder.query.filter(
+            TaskReminder.id.in_(reminder_ids),
+            or_(
+                TaskReminder.status == 'pending',
+                and_(TaskReminder.status == 'leased', TaskReminder.lease_expires_at < now)
+            ),
+            TaskReminder.due_at <= now
+        ).update({
+            'status': 'leased',
+            'lease_owner': self.worker_id,
+            'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return TaskReminder.query.filter(
+            TaskReminder.id.in_(reminder_ids),
+            TaskReminder.status == 'leased',
+            TaskReminder.lease_owner == self.worker_id
+        ).all()
+
+    def _get_notification_service(self):
+        if self._notification_service is None:
+            # Importação tardia para evitar dependência circular com task_service
+            from src.services.task_service import NotificationService
+            self._notification_service = NotificationService()
+        return self._notification_service
+
+    def _dispatch(self, reminder: TaskReminder):
+        """Envia um lembrete e registra o resultado"""
+        task = Task.query.get(reminder.task_id)
+
+        if not task or task.status in ('completed', 'cancelled'):
+            reminder.status = 'cancelled'
+            reminder.lease_owner = None
+            reminder.lease_expires_at = None
+            return
+
+        reminder.attempts = (reminder.attempts or 0) + 1
+        result = self._get_notification_service().send_task_reminder(task, reminder.channel)
+
+        if result.get('success'):
+            reminder.status = 'sent'
+            reminder.sent_at = datetime.utcnow()
+            reminder.last_error = None
+            reminder.lease_owner = None
+            reminder.lease_expires_at = None
+        else:
+            self._retry_or_fail(reminder, result.get('message'))
+
+    def _retry_or_fail(self, reminder: TaskReminder, error: Optional[str]):
+        """Reagenda com backoff exponencial ou marca como falho após max_attempts"""
+        if (reminder.attempts or 0) < self.max_attempts:
+            reminder.status = 'pending'
+            reminder.due_at = datetime.utcnow() + timedelta(seconds=30 * (2 ** max((reminder.attempts or 1) - 1, 0)))
+            self._track(reminder.id, reminder.due_at)
+        else:
+            reminder.status = 'failed'
+        reminder.last_error = error
+        reminder.lease_owner = None
+        reminder.lease_expires_at = None
+
+    def run_pending(self) -> int:
+        """Dispara os lembretes vencidos do heap. Retorna a quantidade processada"""
+        due_ids = self._pop_due(datetime.utcnow())
+        if not due_ids:
+            return 0
+
+        processed = 0
+        try:
+            for reminder in self._claim(due_ids):
+                attempts = reminder.attempts or 0
+                try:
+                    self._dispatch(reminder)
+                    processed += 1
+                except Exception as e:
+                    logger.error(f"Erro ao enviar lembrete {reminder.id}: {e}")
+                    reminder.attempts = max(reminder.attempts or 0, attempts + 1)  # A exceção pode vir antes da contagem
+                    self._retry_or_fail(reminder, str(e))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao processar lembretes: {e}")
+
+        return processed
+
+    # ==================== WORKER ====================
+
+    def start(self, app):
+        """Inicia o worker em thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self.app = app
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Agendador de lembretes iniciado ({self.worker_id})")
+
+    def stop(self):
+        """Para o worker"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        next_refresh = datetime.utcnow()
+
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    if datetime.utcnow() >= next_refresh:
+                        self.refresh_window()
+                        next_refresh = datetime.utcnow() + timedelta(seconds=self.refresh_seconds)
+                    self.run_pending()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Erro no agendador de lembretes: {e}")
+                finally:
+                    db.session.remove()
+
+            # Dorme até o próximo vencimento ou a próxima atualização da janela
+            now = datetime.utcnow()
+            wake_at = next_refresh
+            next_due = self._next_due()
+            if next_due and next_due < wake_at:
+                wake_at = next_due
+
+            self._wakeup.clear()
+            self._wakeup.wait(timeout=max((wake_at - now).total_seconds(), 0.05))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estatísticas do agendador em memória"""
+        with self._lock:
+            return {
+                'worker_id': self.worker_id,
+                'in_memory': len(self._entries),
+                'heap_size': len(self._heap),
+                'running': bool(self._thread and self._thread.is_alive())
+            }
+
+
+# Instância global do agendador
+reminder_scheduler = ReminderScheduler()
+
+
+def init_reminder_scheduler(app) -> bool:
+    """Inicia o agendador de lembretes se habilitado (REMINDER_WORKER_ENABLED)"""
+    if os.getenv('REMINDER_WORKER_ENABLED', 'true').lower() != 'true':
+        logger.info("Agendador de lembretes desabilitado")
+        return False
+
+    reminder_scheduler.start(app)
+    return True
@@ -1,21 +1,46 @@
-import smtplib
 import os
 from datetime import datetime, date, time, timedelta
 from typing import Dict, List, Any, Optional
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
 import logging
+import requests
 from sqlalchemy import and_, or_, func
 
-from src.models.task import (
-    Task, TaskComment, TaskTimeLog, TaskTemplate, ActivitySummary,
-    TaskType, TaskStatus, TaskPriority, RecurrenceType, db
-)
+from src.models.task import Task, TaskComment, db
 from src.models.user import User
 from src.models.lead import Lead
+from src.services.reminder_service import reminder_scheduler
+from src.services.email_outbox_service import enqueue_email
+from src.services.activity_summary_service import activity_summary_service
+from src.services.timesheet_service import timesheet_service
+from src.services.calendar_feed_service import calendar_feed_service
 
 logger = logging.getLogger(__name__)
 
+TASK_STATUSES = ('pending', 'in_progress', 'completed', 'cancelled')
+TASK_PRIORITIES = ('low', 'medium', 'high', 'urgent')
+
+
+def task_to_dict(task: Task) -> Dict[str, Any]:
+    return {
+        'id': task.id,
+        'title': task.title,
+        'description': task.description,
+        'status': task.status,
+        'priority': task.priority,
+        'due_date': task.due_date.isoformat() if task.due_date else None,
+        'due_time': task.due_time.strftime('%H:%M') if task.due_time else None,
+        'completed_at': task.completed_at.isoformat() if task.completed_at else None,
+        'reminder_minutes': task.reminder_minutes,
+        'email_reminder': task.email_reminder,
+        'sms_reminder': task.sms_reminder,
+        'assigned_to': task.assigned_to,
+        'created_by': task.created_by,
+        'lead_id': task.lead_id,
+        'opportunity_id': task.opportunity_id,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'updated_at': task.updated_at.isoformat() if task.updated_at else None
+    }
+
 class TaskService:
     """Serviço para gerenciamento de tarefas e atividades"""
     
@@ -23,13 +48,14 @@ class TaskService:
         self.notification_service = NotificationService()
         self.calendar_service = CalendarService()
     
-    def create_task(self, task_data: Dict[str, Any], created_by: str) -> Dict[str, Any]:
+    def create_task(self, task_data: Dict[str, Any], created_by: str, tenant_id: str = None) -> Dict[str, Any]:
         """
         Cria uma nova tarefa
         
         Args:
             task_data: Dados da tarefa
             created_by: ID do usuário que está criando
+            tenant_id: Tenant da tarefa
             
         Returns:
             Resultado da criação
@@ -42,6 +68,10 @@ class TaskService:
             if not task_data.get('assigned_to'):
                 return {'success': False, 'message': 'Responsável é obrigatório'}
             
+            priority = task_data.get('priority', 'medium')
+            if priority not in TASK_PRIORITIES:
+                return {'success': False, 'message': f'Prioridade inválida: {priority}'}
+            
             # Verificar se usuário responsável existe
             assignee = User.query.get(task_data['assigned_to'])
             if not assignee:
@@ -51,48 +81,25 @@ class TaskService:
             due_date = None
             due_time = None
             if task_data.get('due_date'):
-                due_date = datetime.strptime(task_data['due_date'], '%Y-%m-%d').date()
+                due_date = datetime.strptime(task_data['due_date'], '%Y-%m-%d')
             if task_data.get('due_time'):
                 due_time = datetime.strptime(task_data['due_time'], '%H:%M').time()
             
-            start_date = None
-            start_time = None
-            if task_data.get('start_date'):
-                start_date = datetime.strptime(task_data['start_date'], '%Y-%m-%d').date()
-            if task_data.get('start_time'):
-                start_time = datetime.strptime(task_data['start_time'], '%H:%M').time()
-            
             # Criar tarefa
             task = Task(
                 title=task_data['title'],
                 description=task_data.get('description'),
-                task_type=TaskType(task_data.get('task_type', 'follow_up')),
-                category=task_data.get('category'),
-                priority=TaskPriority(task_data.get('priority', 'medium')),
+                priority=priority,
                 due_date=due_date,
                 due_time=due_time,
-                start_date=start_date,
-                start_time=start_time,
-                duration_minutes=task_data.get('duration_minutes'),
                 lead_id=task_data.get('lead_id'),
                 opportunity_id=task_data.get('opportunity_id'),
-                proposal_id=task_data.get('proposal_id'),
-                contract_id=task_data.get('contract_id'),
                 assigned_to=task_data['assigned_to'],
                 created_by=created_by,
+                tenant_id=tenant_id or task_data.get('tenant_id'),
                 reminder_minutes=task_data.get('reminder_minutes'),
                 email_reminder=task_data.get('email_reminder', True),
-                sms_reminder=task_data.get('sms_reminder', False),
-                location=task_data.get('location'),
-                address=task_data.get('address'),
-                contact_phone=task_data.get('contact_phone'),
-                contact_email=task_data.get('contact_email'),
-                tags=task_data.get('tags', []),
-                custom_fields=task_data.get('custom_fields', {}),
-                is_recurring=task_data.get('is_recurring', False),
-                recurrence_type=RecurrenceType(task_data.get('recurrence_type', 'none')),
-                recurrence_interval=task_data.get('recurrence_interval', 1),
-                recurrence_end_date=datetime.strptime(task_data['recurrence_end_date'], '%Y-%m-%d').date() if task_data.get('recurrence_end_date') else None
+                sms_reminder=task_data.get('sms_reminder', False)
             )
             
             db.session.add(task)
@@ -100,30 +107,26 @@ class TaskService:
             
             # Criar evento no calendário se configurado
             if task_data.get('create_calendar_event', False):
-                calendar_result = self.calendar_service.create_event(task)
-                if calendar_result.get('success'):
-                    task.calendar_event_id = calendar_result.get('event_id')
-                    task.calendar_provider = calendar_result.get('provider')
+                self.calendar_service.create_event(task)
             
             # Agendar notificações
             if task.reminder_minutes and task.due_date:
                 self.notification_service.schedule_reminder(task)
             
-            # Criar tarefas recorrentes se necessário
-            if task.is_recurring and task.recurrence_type != RecurrenceType.NONE:
-                self._create_recurring_tasks(task)
+            # Atualizar resumo de atividades
+            activity_summary_service.record_event('task_created', created_by, task.tenant_id)
             
-            db.session.commit()
-            
-            # Enviar notificação de atribuição
+            # Enviar notificação de atribuição (gravada na outbox no mesmo commit)
             if task.assigned_to != created_by:
                 self.notification_service.send_task_assignment_notification(task)
             
+            db.session.commit()
+            
             return {
                 'success': True,
                 'message': 'Tarefa criada com sucesso',
                 'task_id': task.id,
-                'task': task.to_dict()
+                'task': task_to_dict(task)
             }
             
         except Exception as e:
@@ -134,10 +137,11 @@ class TaskService:
                 'message': f'Erro ao criar tarefa: {str(e)}'
             }
     
-    def update_task(self, task_id: str, task_data: Dict[str, Any], updated_by: str) -> Dict[str, Any]:
+    def update_task(self, task_id: str, task_data: Dict[str, Any], updated_by: str,
+                    tenant_id: str = None) -> Dict[str, Any]:
         """Atualiza uma tarefa existente"""
         try:
-            task = Task.query.get(task_id)
+            task = self._get_task(task_id, tenant_id)
             if not task:
                 return {'success': False, 'message': 'Tarefa não encontrada'}
             
@@ -145,7 +149,7 @@ class TaskService:
             if task.assigned_to != updated_by and task.created_by != updated_by:
                 # Verificar se é admin/manager
                 user = User.query.get(updated_by)
-                if not user or user.role not in ['admin', 'manager']:
+                if not user or not user.role or user.role.name not in ['admin', 'manager']:
                     return {'success': False, 'message': 'Sem permissão para editar esta tarefa'}
             
             # Atualizar campos
@@ -153,24 +157,35 @@ class TaskService:
                 task.title = task_data['title']
             if 'description' in task_data:
                 task.description = task_data['description']
-            if 'task_type' in task_data:
-                task.task_type = TaskType(task_data['task_type'])
-            if 'category' in task_data:
-                task.category = task_data['category']
+            if 'status' in task_data:
+                if task_data['status'] not in TASK_STATUSES:
+                    return {'success': False, 'message': f"Status inválido: {task_data['status']}"}
+                task.status = task_data['status']
             if 'priority' in task_data:
-                old_priority = task.priority
-                task.priority = TaskPriority(task_data['priority'])
-                
-                # Notificar se prioridade mudou para alta/urgente
-                if old_priority != task.priority and task.priority in [TaskPriority.HIGH, TaskPriority.URGENT]:
-                    self.notification_service.send_priority_change_notification(task)
+                if task_data['priority'] not in TASK_PRIORITIES:
+                    return {'success': False, 'message': f"Prioridade inválida: {task_data['priority']}"}
+                priority_raised = task_data['priority'] != task.priority and task_data['priority'] in ['high', 'urgent']
+                task.priority = task_data['priority']
+            else:
+                priority_raised = False
             
             # Atualizar datas
             if 'due_date' in task_data:
-                task.due_date = datetime.strptime(task_data['due_date'], '%Y-%m-%d').date() if task_data['due_date'] else None
+                task.due_date = datetime.strptime(task_data['due_date'], '%Y-%m-%d') if task_data['due_date'] else None
             if 'due_time' in task_data:
                 task.due_time = datetime.strptime(task_data['due_time'], '%H:%M').time() if task_data['due_time'] else None
             
+            # Lembretes
+            for field in ['reminder_minutes', 'email_reminder', 'sms_reminder']:
+                if field in task_data:
+                    setattr(task, field, task_data[field])
+            
+            if any(field in task_data for field in ['due_date', 'due_time', 'reminder_minutes', 'email_reminder', 'sms_reminder']):
+                if task.reminder_minutes and task.due_date:
+                    self.notification_service.schedule_reminder(task)
+                else:
+                    self.notification_service.cancel_reminder(task)
+            
             # Atualizar responsável
             if 'assigned_to' in task_data and task_data['assigned_to'] != task.assigned_to:
                 old_assignee = task.assigned_to
@@ -183,8 +198,11 @@ class TaskService:
                 if old_assignee:
                     self.notification_service.send_task_unassignment_notification(task, old_assignee)
             
-            # Outros campos
-            for field in ['location', 'address', 'contact_phone', 'contact_email', 'tags', 'custom_fields']:
+            # Notificar (o responsável atual) se prioridade mudou para alta/urgente
+            if priority_raised:
+                self.notification_service.send_priority_change_notification(task)
+            
+            for field in ['lead_id', 'opportunity_id']:
                 if field in task_data:
                     setattr(task, field, task_data[field])
             
@@ -194,7 +212,7 @@ class TaskService:
             return {
                 'success': True,
                 'message': 'Tarefa atualizada com sucesso',
-                'task': task.to_dict()
+                'task': task_to_dict(task)
             }
             
         except Exception as e:
@@ -205,48 +223,51 @@ class TaskService:
                 'message': f'Erro ao atualizar tarefa: {str(e)}'
             }
     
-    def complete_task(self, task_id: str, completion_data: Dict[str, Any], completed_by: str) -> Dict[str, Any]:
+    def complete_task(self, task_id: str, completion_data: Dict[str, Any], completed_by: str,
+                      tenant_id: str = None) -> Dict[str, Any]:
         """Marca tarefa como completada"""
         try:
-            task = Task.query.get(task_id)
+            task = self._get_task(task_id, tenant_id)
             if not task:
                 return {'success': False, 'message': 'Tarefa não encontrada'}
             
-            if task.status == TaskStatus.COMPLETED:
+            if task.status == 'completed':
                 return {'success': False, 'message': 'Tarefa já está completada'}
             
             # Marcar como completada
-            task.mark_completed(
-                result=completion_data.get('result'),
-                outcome=completion_data.get('outcome'),
-                next_action=completion_data.get('next_action')
-            )
+            task.status = 'completed'
+            task.completed_at = datetime.utcnow()
+            
+            # Cancelar lembretes pendentes
+            self.notification_service.cancel_reminder(task)
+            
+            # Atualizar resumo de atividades
+            activity_summary_service.record_event('task_completed', task.assigned_to, task.tenant_id)
             
             # Adicionar comentário se fornecido
             if completion_data.get('comment'):
                 comment = TaskComment(
                     task_id=task.id,
                     content=completion_data['comment'],
-                    comment_type='completion',
-                    created_by=completed_by
+                    author_id=completed_by
                 )
                 db.session.add(comment)
             
-            # Criar próxima tarefa se sugerida
+            db.session.commit()
+            
+            # Criar próxima tarefa se sugerida (transação própria)
             if completion_data.get('create_next_task') and completion_data.get('next_task_data'):
                 next_task_data = completion_data['next_task_data']
                 next_task_data['lead_id'] = task.lead_id
                 next_task_data['opportunity_id'] = task.opportunity_id
                 next_task_data['assigned_to'] = next_task_data.get('assigned_to', task.assigned_to)
                 
-                self.create_task(next_task_data, completed_by)
-            
-            db.session.commit()
+                self.create_task(next_task_data, completed_by, task.tenant_id)
             
             return {
                 'success': True,
                 'message': 'Tarefa completada com sucesso',
-                'task': task.to_dict()
+                'task': task_to_dict(task)
             }
             
         except Exception as e:
@@ -257,27 +278,28 @@ class TaskService:
                 'message': f'Erro ao completar tarefa: {str(e)}'
             }
     
-    def reschedule_task(self, task_id: str, new_due_date: str, new_due_time: str = None, reason: str = None, rescheduled_by: str = None) -> Dict[str, Any]:
+    def reschedule_task(self, task_id: str, new_due_date: str, new_due_time: str = None, reason: str = None,
+                        rescheduled_by: str = None, tenant_id: str = None) -> Dict[str, Any]:
         """Reagenda uma tarefa"""
         try:
-            task = Task.query.get(task_id)
+            task = self._get_task(task_id, tenant_id)
             if not task:
                 return {'success': False, 'message': 'Tarefa não encontrada'}
             
-            # Converter datas
-            due_date = datetime.strptime(new_due_date, '%Y-%m-%d').date()
-            due_time = datetime.strptime(new_due_time, '%H:%M').time() if new_due_time else None
-            
             # Reagendar
-            task.reschedule(due_date, due_time)
+            task.due_date = datetime.strptime(new_due_date, '%Y-%m-%d')
+            task.due_time = datetime.strptime(new_due_time, '%H:%M').time() if new_due_time else None
+            
+            # Reagendar lembretes
+            if task.reminder_minutes:
+                self.notification_service.schedule_reminder(task)
             
             # Adicionar comentário sobre reagendamento
             if reason and rescheduled_by:
                 comment = TaskComment(
                     task_id=task.id,
-                    content=f"Tarefa reagendada para {due_date.strftime('%d/%m/%Y')}. Motivo: {reason}",
-                    comment_type='reschedule',
-                    created_by=rescheduled_by
+                    content=f"Tarefa reagendada para {task.due_date.strftime('%d/%m/%Y')}. Motivo: {reason}",
+                    author_id=rescheduled_by
                 )
                 db.session.add(comment)
             
@@ -286,7 +308,7 @@ class TaskService:
             return {
                 'success': True,
                 'message': 'Tarefa reagendada com sucesso',
-                'task': task.to_dict()
+                'task': task_to_dict(task)
             }
             
         except Exception as e:
@@ -297,81 +319,55 @@ class TaskService:
                 'message': f'Erro ao reagendar tarefa: {str(e)}'
             }
     
-    def add_time_log(self, task_id: str, time_data: Dict[str, Any], logged_by: str) -> Dict[str, Any]:
+    def add_time_log(self, task_id: str, time_data: Dict[str, Any], logged_by: str,
+                     tenant_id: str) -> Dict[str, Any]:
         """Adiciona log de tempo a uma tarefa"""
-        try:
-            task = Task.query.get(task_id)
-            if not task:
-                return {'success': False, 'message': 'Tarefa não encontrada'}
-            
-            # Processar horários
-            start_time = datetime.fromisoformat(time_data['start_time'])
-            end_time = datetime.fromisoformat(time_data['end_time']) if time_data.get('end_time') else None
-            
-            # Criar log
-            time_log = TaskTimeLog(
-                task_id=task.id,
-                start_time=start_time,
-                end_time=end_time,
-                description=time_data.get('description'),
-                logged_by=logged_by
-            )
-            
-            # Calcular duração
-            time_log.calculate_duration()
-            
-            db.session.add(time_log)
-            db.session.commit()
-            
-            return {
-                'success': True,
-                'message': 'Tempo registrado com sucesso',
-                'time_log': time_log.to_dict()
-            }
-            
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Erro ao registrar tempo: {e}")
-            return {
-                'success': False,
-                'message': f'Erro ao registrar tempo: {str(e)}'
-            }
+        entry = dict(time_data, task_id=task_id)
+        result = timesheet_service.bulk_add_time_logs([entry], logged_by, tenant_id)
+        
+        if not result.get('success'):
+            if result.get('errors'):
+                return {'success': False, 'message': result['errors'][0]['message']}
+            return result
+        
+        return {
+            'success': True,
+            'message': 'Tempo registrado com sucesso',
+            'time_log': result['time_logs'][0]
+        }
+    
+    def add_time_logs(self, entries: List[Dict[str, Any]], logged_by: str, tenant_id: str) -> Dict[str, Any]:
+        """Adiciona vários logs de tempo em uma única transação"""
+        return timesheet_service.bulk_add_time_logs(entries, logged_by, tenant_id)
     
     def get_user_tasks(self, user_id: str, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """Obtém tarefas de um usuário com filtros"""
         try:
-            query = Task.query.filter(Task.assigned_to == user_id, Task.is_active == True)
+            query = Task.query.filter(Task.assigned_to == user_id)
             
             if filters:
                 # Filtro por status
                 if 'status' in filters:
                     if isinstance(filters['status'], list):
-                        query = query.filter(Task.status.in_([TaskStatus(s) for s in filters['status']]))
-                    else:
-                        query = query.filter(Task.status == TaskStatus(filters['status']))
-                
-                # Filtro por tipo
-                if 'task_type' in filters:
-                    if isinstance(filters['task_type'], list):
-                        query = query.filter(Task.task_type.in_([TaskType(t) for t in filters['task_type']]))
+                        query = query.filter(Task.status.in_(filters['status']))
                     else:
-                        query = query.filter(Task.task_type == TaskType(filters['task_type']))
+                        query = query.filter(Task.status == filters['status'])
                 
                 # Filtro por prioridade
                 if 'priority' in filters:
                     if isinstance(filters['priority'], list):
-                        query = query.filter(Task.priority.in_([TaskPriority(p) for p in filters['priority']]))
+                        query = query.filter(Task.priority.in_(filters['priority']))
                     else:
-                        query = query.filter(Task.priority == TaskPriority(filters['priority']))
+                        query = query.filter(Task.priority == filters['priority'])
                 
                 # Filtro por data de vencimento
                 if 'due_date_from' in filters:
-                    due_date_from = datetime.strptime(filters['due_date_from'], '%Y-%m-%d').date()
+                    due_date_from = datetime.strptime(filters['due_date_from'], '%Y-%m-%d')
                     query = query.filter(Task.due_date >= due_date_from)
                 
                 if 'due_date_to' in filters:
-                    due_date_to = datetime.strptime(filters['due_date_to'], '%Y-%m-%d').date()
-                    query = query.filter(Task.due_date <= due_date_to)
+                    due_date_to = datetime.strptime(filters['due_date_to'], '%Y-%m-%d') + timedelta(days=1)
+                    query = query.filter(Task.due_date < due_date_to)
                 
                 # Filtro por lead
                 if 'lead_id' in filters:
@@ -381,25 +377,20 @@ class TaskService:
                 if 'opportunity_id' in filters:
                     query = query.filter(Task.opportunity_id == filters['opportunity_id'])
                 
-                # Filtro por tags
-                if 'tags' in filters:
-                    for tag in filters['tags']:
-                        query = query.filter(Task.tags.contains([tag]))
-                
                 # Filtro por vencimento
                 if 'overdue_only' in filters and filters['overdue_only']:
-                    today = date.today()
+                    today = datetime.combine(date.today(), time.min)
                     query = query.filter(
                         and_(
                             Task.due_date < today,
-                            Task.status.in_([TaskStatus.PENDING, TaskStatus.IN_PROGRESS])
+                            Task.status.in_(['pending', 'in_progress'])
                         )
                     )
                 
                 # Filtro por hoje
                 if 'today_only' in filters and filters['today_only']:
-                    today = date.today()
-                    query = query.filter(Task.due_date == today)
+                    today = datetime.combine(date.today(), time.min)
+                    query = query.filter(Task.due_date >= today, Task.due_date < today + timedelta(days=1))
             
             # Ordenação
             sort_by = filters.get('sort_by', 'due_date') if filters else 'due_date'
@@ -411,13 +402,6 @@ class TaskService:
                 else:
                     query = query.order_by(Task.due_date.asc().nullsfirst())
             elif sort_by == 'priority':
-                # Ordenar por prioridade (urgent > high > medium > low)
-                priority_order = {
-                    TaskPriority.URGENT: 4,
-                    TaskPriority.HIGH: 3,
-                    TaskPriority.MEDIUM: 2,
-                    TaskPriority.LOW: 1
-                }
                 if sort_order == 'desc':
                     query = query.order_by(Task.priority.desc())
                 else:
@@ -429,7 +413,7 @@ class TaskService:
                     query = query.order_by(Task.created_at.asc())
             
             tasks = query.all()
-            return [task.to_dict() for task in tasks]
+            return [task_to_dict(task) for task in tasks]
             
         except Exception as e:
             logger.error(f"Erro ao buscar tarefas do usuário: {e}")
@@ -438,12 +422,11 @@ class TaskService:
     def get_overdue_tasks(self, user_id: str = None) -> List[Dict[str, Any]]:
         """Obtém tarefas em atraso"""
         try:
-            today = date.today()
+            today = datetime.combine(date.today(), time.min)
             query = Task.query.filter(
                 and_(
                     Task.due_date < today,
-                    Task.status.in_([TaskStatus.PENDING, TaskStatus.IN_PROGRESS]),
-                    Task.is_active == True
+                    Task.status.in_(['pending', 'in_progress'])
                 )
             )
             
@@ -453,7 +436,7 @@ class TaskService:
             query = query.order_by(Task.due_date.asc())
             
             tasks = query.all()
-            return [task.to_dict() for task in tasks]
+            return [task_to_dict(task) for task in tasks]
             
         except Exception as e:
             logger.error(f"Erro ao buscar tarefas em atraso: {e}")
@@ -462,100 +445,52 @@ class TaskService:
     def get_upcoming_tasks(self, user_id: str, days_ahead: int = 7) -> List[Dict[str, Any]]:
         """Obtém tarefas dos próximos dias"""
         try:
-            today = date.today()
-            end_date = today + timedelta(days=days_ahead)
+            today = datetime.combine(date.today(), time.min)
+            end_date = today + timedelta(days=days_ahead + 1)
             
             query = Task.query.filter(
                 and_(
                     Task.due_date >= today,
-                    Task.due_date <= end_date,
+                    Task.due_date < end_date,
                     Task.assigned_to == user_id,
-                    Task.status.in_([TaskStatus.PENDING, TaskStatus.IN_PROGRESS]),
-                    Task.is_active == True
+                    Task.status.in_(['pending', 'in_progress'])
                 )
             ).order_by(Task.due_date.asc(), Task.due_time.asc().nullsfirst())
             
             tasks = query.all()
-            return [task.to_dict() for task in tasks]
+            return [task_to_dict(task) for task in tasks]
             
         except Exception as e:
             logger.error(f"Erro ao buscar próximas tarefas: {e}")
             return []
     
-    def _create_recurring_tasks(self, parent_task: Task):
-        """Cria tarefas recorrentes"""
-        if not parent_task.is_recurring or parent_task.recurrence_type == RecurrenceType.NONE:
-            return
-        
-        try:
-            current_date = parent_task.due_date
-            end_date = parent_task.recurrence_end_date or (current_date + timedelta(days=365))  # Máximo 1 ano
-            interval = parent_task.recurrence_interval or 1
-            
-            created_count = 0
-            max_tasks = 50  # Limite de segurança
-            
-            while current_date <= end_date and created_count < max_tasks:
-                # Calcular próxima data
-                if parent_task.recurrence_type == RecurrenceType.DAILY:
-                    current_date += timedelta(days=interval)
-                elif parent_task.recurrence_type == RecurrenceType.WEEKLY:
-                    current_date += timedelta(weeks=interval)
-                elif parent_task.recurrence_type == RecurrenceType.MONTHLY:
-                    # Aproximação para meses
-                    current_date += timedelta(days=30 * interval)
-                elif parent_task.recurrence_type == RecurrenceType.YEARLY:
-                    current_date += timedelta(days=365 * interval)
-                
-                if current_date > end_date:
-                    break
-                
-                # Criar tarefa recorrente
-                recurring_task = Task(
-                    title=parent_task.title,
-                    description=parent_task.description,
-                    task_type=parent_task.task_type,
-                    category=parent_task.category,
-                    priority=parent_task.priority,
-                    due_date=current_date,
-                    due_time=parent_task.due_time,
-                    duration_minutes=parent_task.duration_minutes,
-                    lead_id=parent_task.lead_id,
-                    opportunity_id=parent_task.opportunity_id,
-                    assigned_to=parent_task.assigned_to,
-                    created_by=parent_task.created_by,
-                    parent_task_id=parent_task.id,
-                    reminder_minutes=parent_task.reminder_minutes,
-                    email_reminder=parent_task.email_reminder,
-                    sms_reminder=parent_task.sms_reminder,
-                    location=parent_task.location,
-                    address=parent_task.address,
-                    contact_phone=parent_task.contact_phone,
-                    contact_email=parent_task.contact_email,
-                    tags=parent_task.tags.copy() if parent_task.tags else [],
-                    custom_fields=parent_task.custom_fields.copy() if parent_task.custom_fields else {}
-                )
-                
-                db.session.add(recurring_task)
-                created_count += 1
-            
-            logger.info(f"Criadas {created_count} tarefas recorrentes para a tarefa {parent_task.id}")
-            
-        except Exception as e:
-            logger.error(f"Erro ao criar tarefas recorrentes: {e}")
+    @staticmethod
+    def _get_task(task_id: str, tenant_id: str = None) -> Optional[Task]:
+        query = Task.query.filter(Task.id == task_id)
+        if tenant_id:
+            query = query.filter(Task.tenant_id == tenant_id)
+        return query.first()
 
 class NotificationService:
     """Serviço para notificações de tarefas"""
     
     def __init__(self):
-        self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-        self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
         self.smtp_username = os.getenv('SMTP_USERNAME')
-        self.smtp_password = os.getenv('SMTP_PASSWORD')
+    
+    @staticmethod
+    def _get_assignee(task: Task) -> Optional[User]:
+        """Responsável pela tarefa (Task.assigned_to)"""
+        return User.query.get(task.assigned_to) if task.assigned_to else None
+    
+    @staticmethod
+    def _lead_line(task: Task) -> str:
+        lead = Lead.query.get(task.lead_id) if task.lead_id else None
+        return f'<p><strong>Lead:</strong> {lead.name}</p>' if lead else ''
     
     def send_task_assignment_notification(self, task: Task):
         """Envia notificação de atribuição de tarefa"""
-        if not task.assignee or not task.assignee.email:
+        assignee = self._get_assignee(task)
+        if not assignee or not assignee.email:
             return
         
         try:
@@ -565,17 +500,15 @@ class NotificationService:
             <h2>Nova Tarefa Atribuída</h2>
             <p><strong>Título:</strong> {task.title}</p>
             <p><strong>Descrição:</strong> {task.description or 'Sem descrição'}</p>
-            <p><strong>Tipo:</strong> {task.task_type.value if task.task_type else 'N/A'}</p>
-            <p><strong>Prioridade:</strong> {task.priority.value if task.priority else 'N/A'}</p>
+            <p><strong>Prioridade:</strong> {task.priority or 'N/A'}</p>
             <p><strong>Vencimento:</strong> {task.due_date.strftime('%d/%m/%Y') if task.due_date else 'Sem data'}</p>
             
-            {f'<p><strong>Lead:</strong> {task.lead.name}</p>' if task.lead else ''}
-            {f'<p><strong>Localização:</strong> {task.location}</p>' if task.location else ''}
+            {self._lead_line(task)}
             
             <p>Acesse o CRM para mais detalhes.</p>
             """
             
-            self._send_email(task.assignee.email, subject, content)
+            self._send_email(assignee.email, subject, content, task.tenant_id)
             
         except Exception as e:
             logger.error(f"Erro ao enviar notificação de atribuição: {e}")
@@ -595,20 +528,21 @@ class NotificationService:
             <p>Se você tinha trabalho em andamento nesta tarefa, entre em contato com seu supervisor.</p>
             """
             
-            self._send_email(old_assignee.email, subject, content)
+            self._send_email(old_assignee.email, subject, content, task.tenant_id)
             
         except Exception as e:
             logger.error(f"Erro ao enviar notificação de remoção: {e}")
     
     def send_priority_change_notification(self, task: Task):
         """Envia notificação de mudança de prioridade"""
-        if not task.assignee or not task.assignee.email:
+        assignee = self._get_assignee(task)
+        if not assignee or not assignee.email:
             return
         
         try:
             subject = f"Prioridade alterada: {task.title}"
             
-            priority_text = "ALTA" if task.priority == TaskPriority.HIGH else "URGENTE"
+            priority_text = "ALTA" if task.priority == 'high' else "URGENTE"
             
             content = f"""
             <h2>Prioridade da Tarefa Alterada</h2>
@@ -617,40 +551,89 @@ class NotificationService:
             <p>Por favor, priorize esta tarefa em sua agenda.</p>
             """
             
-            self._send_email(task.assignee.email, subject, content)
+            self._send_email(assignee.email, subject, content, task.tenant_id)
             
         except Exception as e:
             logger.error(f"Erro ao enviar notificação de prioridade: {e}")
     
     def schedule_reminder(self, task: Task):
-        """Agenda lembrete para uma tarefa"""
-        # Por enquanto apenas log. Implementar com Celery ou similar
-        logger.info(f"Lembrete agendado para tarefa {task.id} em {task.reminder_minutes} minutos antes do vencimento")
+        """Agenda lembrete para uma tarefa (persistido no commit da tarefa)"""
+        reminders = reminder_scheduler.schedule(task)
+        logger.info(f"Lembrete agendado para tarefa {task.id} em {task.reminder_minutes} minutos antes do vencimento ({len(reminders)} canais)")
     
-    def _send_email(self, to_email: str, subject: str, content: str):
-        """Envia email"""
-        if not self.smtp_username or not self.smtp_password:
-            logger.warning("Configurações SMTP não encontradas")
-            return
+    def cancel_reminder(self, task: Task):
+        """Cancela lembretes pendentes de uma tarefa"""
+        cancelled = reminder_scheduler.cancel(task.id)
+        if cancelled:
+            logger.info(f"{cancelled} lembretes cancelados para tarefa {task.id}")
+    
+    def send_task_reminder(self, task: Task, channel: str) -> Dict[str, Any]:
+        """Envia lembrete de vencimento pelo canal informado (email ou sms)"""
+        assignee = self._get_assignee(task)
+        if not assignee:
+            return {'success': False, 'message': 'Tarefa sem responsável'}
+        
+        due_text = task.due_date.strftime('%d/%m/%Y') if task.due_date else 'Sem data'
+        if task.due_time:
+            due_text += f" {task.due_time.strftime('%H:%M')}"
+        
+        if channel == 'sms':
+            phone = getattr(assignee, 'phone', None)  # User ainda não tem telefone próprio
+            if not phone:
+                return {'success': False, 'message': 'Responsável sem telefone cadastrado'}
+            return self._send_sms(phone, f"Lembrete CRM: {task.title} vence em {due_text}")
+        
+        if not assignee.email:
+            return {'success': False, 'message': 'Responsável sem email cadastrado'}
+        
+        subject = f"Lembrete: {task.title}"
+        
+        content = f"""
+        <h2>Lembrete de Tarefa</h2>
+        <p><strong>Título:</strong> {task.title}</p>
+        <p><strong>Vencimento:</strong> {due_text}</p>
+        
+        {self._lead_line(task)}
+        
+        <p>Acesse o CRM para mais detalhes.</p>
+        """
+        
+        return self._send_email(assignee.email, subject, content, task.tenant_id)
+    
+    def _send_sms(self, phone: str, message: str) -> Dict[str, Any]:
+        """Envia SMS pelo gateway configurado (SMS_API_URL)"""
+        sms_api_url = os.getenv('SMS_API_URL')
+        if not sms_api_url:
+            logger.warning("Gateway SMS não configurado")
+            return {'success': False, 'message': 'Gateway SMS não configurado'}
         
         try:
-            msg = MimeMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.smtp_username
-            msg['To'] = to_email
+            response = requests.post(
+                sms_api_url,
+                json={'to': phone, 'message': message},
+                headers={'Authorization': f"Bearer {os.getenv('SMS_API_TOKEN', '')}"},
+                timeout=10
+            )
+            response.raise_for_status()
             
-            html_part = MimeText(content, 'html', 'utf-8')
-            msg.attach(html_part)
+            logger.info(f"SMS enviado para {phone}")
+            return {'success': True}
             
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg)
+        except Exception as e:
+            logger.error(f"Erro ao enviar SMS: {e}")
+            return {'success': False, 'message': str(e)}
+    
+    def _send_email(self, to_email: str, subject: str, content: str, tenant_id: str = None) -> Dict[str, Any]:
+        """Grava email na outbox (enviado pelo worker após o commit)"""
+        try:
+            message = enqueue_email(to_email, subject, content, tenant_id=tenant_id, sender=self.smtp_username)
             
-            logger.info(f"Email enviado para {to_email}")
+            logger.info(f"Email para {to_email} adicionado à outbox")
+            return {'success': True, 'outbox_id': message.id}
             
         except Exception as e:
-            logger.error(f"Erro ao enviar email: {e}")
+            logger.error(f"Erro ao enfileirar email: {e}")
+            return {'success': False, 'message': str(e)}
 
 class CalendarService:
     """Serviço para integração com calendários"""
@@ -667,6 +650,10 @@ class CalendarService:
             'message': 'Evento criado no calendário (simulado)'
         }
     
+    def get_feed_token(self, user_id: str) -> str:
+        """Token do feed iCalendar do usuário (tarefas, recorrências e reuniões)"""
+        return calendar_feed_service.get_or_create_state(user_id).feed_token
+    
     def update_event(self, task: Task) -> Dict[str, Any]:
         """Atualiza evento no calendário"""
         return {
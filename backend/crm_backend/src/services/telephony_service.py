@@ -3,10 +3,19 @@ Serviço de Telefonia e Integração PABX
 """
 import logging
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from src.models.telephony import Call, TelephonyExtension, db
+from src.services.pagination import encode_cursor, decode_cursor
+from src.services.activity_summary_service import activity_summary_service
+from src.services.phone_index_service import normalize_e164
 
 logger = logging.getLogger(__name__)
 
+MAX_PAGE_SIZE = 200
+
 class TelephonyService:
     """Serviço para integração telefônica"""
     
@@ -15,118 +24,168 @@ class TelephonyService:
         self.pabx_url = "https://pabx.jttelecom.com.br/api"  # URL do PABX
         self.api_key = "your-pabx-api-key"
     
-    def make_call(self, from_number, to_number, user_id, lead_id=None):
-        """Inicia uma chamada"""
+    def make_call(self, from_number, to_number, user_id, lead_id=None, tenant_id=None):
+        """Inicia uma chamada e grava o registro (CDR)"""
         try:
-            call_data = {
-                'from': from_number,
-                'to': to_number,
-                'user_id': user_id,
-                'lead_id': lead_id,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-            # Simulação de chamada para demonstração
-            call_id = f"call_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
-            
+            if not to_number:
+                return {'success': False, 'error': 'Número de destino é obrigatório'}
+
+            # Simulação de discagem para demonstração; o registro da chamada é real
+            call = Call(
+                tenant_id=tenant_id,
+                user_id=user_id,
+                lead_id=lead_id,
+                phone_number=to_number,
+                direction='outbound',
+                status='in_progress',
+                start_time=datetime.utcnow()
+            )
+            db.session.add(call)
+            activity_summary_service.record_event('call', user_id, tenant_id, call.start_time)
+            db.session.commit()
+
             return {
                 'success': True,
-                'call_id': call_id,
+                'call_id': call.id,
                 'status': 'initiated',
                 'message': 'Chamada iniciada com sucesso'
             }
-            
+
         except Exception as e:
+            db.session.rollback()
             self.logger.error(f"Erro ao iniciar chamada: {e}")
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def get_call_history(self, user_id, tenant_id, limit=50):
-        """Retorna histórico de chamadas"""
+
+    def get_call_history(self, tenant_id, filters=None, limit=50, cursor=None):
+        """
+        Histórico de chamadas do tenant, mais recentes primeiro, paginado por cursor
+
+        Args:
+            filters: start_date, end_date, status (lista), direction, user_id, phone_number
+            cursor: next_cursor da página anterior
+        """
         try:
-            # Simulação de histórico para demonstração
-            calls = []
-            for i in range(limit):
-                calls.append({
-                    'id': f"call_{i+1}",
-                    'from': '+5511999999999',
-                    'to': f'+551198888888{i}',
-                    'duration': 120 + (i * 10),
-                    'status': 'completed',
-                    'direction': 'outbound' if i % 2 == 0 else 'inbound',
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'recording_url': f"https://recordings.jttelecom.com.br/call_{i+1}.mp3"
-                })
-            
+            filters = filters or {}
+            limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+            query = Call.query.filter(Call.tenant_id == tenant_id)
+
+            if filters.get('user_id'):
+                query = query.filter(Call.user_id == filters['user_id'])
+            if filters.get('phone_number'):
+                # Chamadas do PABX gravam o número em E.164
+                numbers = {filters['phone_number'], normalize_e164(filters['phone_number'])} - {None}
+                query = query.filter(Call.phone_number.in_(numbers))
+            if filters.get('start_date'):
+                query = query.filter(Call.start_time >= filters['start_date'])
+            if filters.get('end_date'):
+                query = query.filter(Call.start_time < filters['end_date'])
+            if filters.get('status'):
+                query = query.filter(Call.status.in_(filters['status']))
+            if filters.get('direction'):
+                query = query.filter(Call.direction == filters['direction'])
+
+            if cursor:
+                start_time, last_id = decode_cursor(cursor)
+                query = query.filter(or_(
+                    Call.start_time < start_time,
+                    and_(Call.start_time == start_time, Call.id < last_id)
+                ))
+
+            # Uma linha a mais indica se há próxima página
+            rows = query.order_by(Call.start_time.desc(), Call.id.desc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+
             return {
                 'success': True,
-                'calls': calls,
-                'total': len(calls)
+                'calls': [call.to_dict() for call in rows],
+                'total': len(rows),
+                'has_more': has_more,
+                'next_cursor': encode_cursor(rows[-1].start_time, rows[-1].id) if has_more else None
+            }
+
+        except ValueError as e:
+            return {
+                'success': False,
+                'error': str(e)
             }
-            
         except Exception as e:
             self.logger.error(f"Erro ao obter histórico de chamadas: {e}")
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def get_call_details(self, call_id):
+
+    def get_call_details(self, call_id, tenant_id=None):
         """Retorna detalhes de uma chamada específica"""
         try:
-            # Simulação de detalhes para demonstração
+            call = Call.query.filter_by(id=call_id, tenant_id=tenant_id).first()
+            if not call:
+                return {
+                    'success': False,
+                    'error': 'Chamada não encontrada'
+                }
+
+            data = call.to_dict()
+            data['logs'] = [log.to_dict() for log in sorted(call.logs, key=lambda log: log.timestamp)]
             return {
                 'success': True,
-                'call': {
-                    'id': call_id,
-                    'from': '+5511999999999',
-                    'to': '+5511888888888',
-                    'duration': 180,
-                    'status': 'completed',
-                    'direction': 'outbound',
-                    'start_time': datetime.utcnow().isoformat(),
-                    'end_time': datetime.utcnow().isoformat(),
-                    'recording_url': f"https://recordings.jttelecom.com.br/{call_id}.mp3",
-                    'notes': 'Cliente interessado em nossos serviços'
-                }
+                'call': data
             }
-            
+
         except Exception as e:
             self.logger.error(f"Erro ao obter detalhes da chamada: {e}")
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def update_call_notes(self, call_id, notes, user_id):
+
+    def update_call_notes(self, call_id, notes, user_id, tenant_id=None):
         """Atualiza anotações de uma chamada"""
         try:
-            # Simulação de atualização para demonstração
+            call = Call.query.filter_by(id=call_id, tenant_id=tenant_id).first()
+            if not call:
+                return {
+                    'success': False,
+                    'error': 'Chamada não encontrada'
+                }
+
+            call.notes = notes
+            db.session.commit()
             return {
                 'success': True,
                 'message': 'Anotações atualizadas com sucesso'
             }
-            
+
         except Exception as e:
+            db.session.rollback()
             self.logger.error(f"Erro ao atualizar anotações: {e}")
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def get_phone_status(self, user_id):
-        """Retorna status do telefone do usuário"""
+
+    def get_phone_status(self, user_id, tenant_id=None):
+        """Retorna status do telefone do usuário (ramal e chamada em andamento)"""
         try:
-            # Simulação de status para demonstração
+            extension = TelephonyExtension.query.filter_by(tenant_id=tenant_id, user_id=user_id).first()
+            current_call = Call.query.filter(
+                Call.tenant_id == tenant_id,
+                Call.user_id == user_id,
+                Call.status == 'in_progress',
+                Call.start_time >= datetime.utcnow() - timedelta(hours=12)
+            ).order_by(Call.start_time.desc()).first()
+            
             return {
                 'success': True,
                 'status': {
-                    'online': True,
-                    'available': True,
-                    'extension': '1001',
-                    'current_call': None
+                    'online': extension is not None,
+                    'available': current_call is None,
+                    'extension': extension.extension if extension else None,
+                    'current_call': current_call.to_dict() if current_call else None
                 }
             }
             
@@ -136,4 +195,3 @@ class TelephonyService:
                 'success': False,
                 'error': str(e)
             }
-
@@ -0,0 +1,118 @@
+"""
+Renderização de templates com variáveis {nome}
+
+Usado pelos fluxos do chatbot e pelos templates de proposta e contrato. O
+texto é analisado uma única vez em uma lista de trechos fixos e variáveis; o
+template compilado fica em cache por conteúdo e a renderização é um único
+join, linear no tamanho da saída.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+
+class CompiledTemplate:
+    """Template analisado: trechos fixos (str) e variáveis (índices em names)"""
+
+    __slots__ = ('source', 'segments', 'variables')
+
+    def __init__(self, source: str):
+        self.source = source
+        segments = []
+        names = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            if match.start() > position:
+                segments.append(source[position:match.start()])
+            segments.append((match.group(1),))
+            names.append(match.group(1))
+            position = match.end()
+        if position < len(source):
+            segments.append(source[position:])
+
+        self.segments = tuple(segments)
+        self.variables = tuple(dict.fromkeys(names))  # Sem repetição, na ordem de uso
+
+    def render(self, variables: Dict[str, Any], none_as_empty: bool = False) -> str:
+        """
+        Substitui as variáveis em uma passada
+
+        Variáveis ausentes permanecem como {nome}. Com none_as_empty, valores
+        vazios (None, 0, '') viram string vazia, como nos templates de documentos.
+        """
+        parts = []
+        append = parts.append
+        for segment in self.segments:
+            if segment.__class__ is tuple:
+                name = segment[0]
+                if name in variables:
+                    value = variables[name]
+                    append(str(value or "") if none_as_empty else str(value))
+                else:
+                    append("{" + name + "}")
+            else:
+                append(segment)
+        return ''.join(parts)
+
+    def missing(self, variables: Dict[str, Any]) -> List[str]:
+        """Variáveis usadas no template que não foram informadas"""
+        return [name for name in self.variables if name not in variables]
+
+
+class TemplateCache:
+    """Cache LRU de templates compilados por conteúdo"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[str, CompiledTemplate]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> CompiledTemplate:
+        text = text or ""
+        with self._lock:
+            compiled = self._data.get(text)
+            if compiled is not None:
+                self._data.move_to_end(text)
+                return compiled
+
+        compiled = CompiledTemplate(text)
+
+        with self._lock:
+            self._data[text] = compiled
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return compiled
+
+
+# Cache global
+template_cache = TemplateCache()
+
+
+def compile_template(text: str) -> CompiledTemplate:
+    """Template compilado (do cache quando já visto)"""
+    return template_cache.get(text)
+
+
+def render_template(text: str, variables: Dict[str, Any], none_as_empty: bool = False) -> str:
+    """Compila (com cache) e renderiza"""
+    return template_cache.get(text).render(variables, none_as_empty)
+
+
+def render_fields(fields: Dict[str, Optional[str]], variables: Dict[str, Any],
+                  none_as_empty: bool = False) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Renderiza vários campos (conteúdo, título, rodapé...) com as mesmas variáveis
+
+    Returns:
+        (campos renderizados, variáveis ausentes em qualquer campo)
+    """
+    rendered = {}
+    missing = {}
+    for key, text in fields.items():
+        compiled = template_cache.get(text or "")
+        rendered[key] = compiled.render(variables, none_as_empty)
+        missing.update(dict.fromkeys(compiled.missing(variables)))
+    return rendered, list(missing)
@@ -10,6 +10,7 @@ from src.models.tenant import (
     SubscriptionPlan, TenantStatus, BillingCycle, db
 )
 from src.models.user import User
+from src.services.validators import is_valid_cnpj
 import logging
 
 logger = logging.getLogger(__name__)
@@ -553,9 +554,8 @@ class TenantService:
         
         # Validar CNPJ se fornecido
         if 'cnpj' in data and data['cnpj']:
-            cnpj = re.sub(r'[^0-9]', '', data['cnpj'])
-            if len(cnpj) != 14:
-                errors.append('CNPJ deve ter 14 dígitos')
+            if not is_valid_cnpj(data['cnpj']):
+                errors.append('CNPJ inválido')
         
         return {
             'valid': len(errors) == 0,
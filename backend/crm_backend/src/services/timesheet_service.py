@@ -0,0 +1,342 @@
+"""
+Serviço de timesheets sobre TaskTimeLog
+
+Ingestão de registros de tempo em lote, agregações calculadas no banco
+(GROUP BY por usuário, tarefa, lead ou semana) e timesheet semanal em cache,
+atualizado incrementalmente a cada novo registro.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import func
+
+from src.models.task import Task, TaskTimeLog, db
+from src.services.activity_summary_service import activity_summary_service
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION_COLUMNS = {
+    'user': TaskTimeLog.logged_by,
+    'task': TaskTimeLog.task_id,
+    'lead': TaskTimeLog.lead_id,
+    'day': TaskTimeLog.work_date
+}
+
+
+def week_start_of(day: date) -> date:
+    """Segunda-feira da semana do dia informado"""
+    return day - timedelta(days=day.weekday())
+
+
+def find_overlaps(intervals: List[Tuple[datetime, datetime, Any]]) -> List[Tuple[Any, Any]]:
+    """
+    Detecta sobreposições ordenando os intervalos por início - O(n log n)
+
+    Args:
+        intervals: Lista de (inicio, fim, identificador)
+
+    Returns:
+        Pares de identificadores que se sobrepõem com o intervalo anterior que
+        termina mais tarde
+    """
+    overlaps = []
+    latest_end = None
+    latest_id = None
+
+    for start, end, ident in sorted(intervals, key=lambda i: (i[0], i[1])):
+        if latest_end is not None and start < latest_end:
+            overlaps.append((latest_id, ident))
+        if latest_end is None or end > latest_end:
+            latest_end = end
+            latest_id = ident
+
+    return overlaps
+
+
+class TimesheetCache:
+    """Cache LRU de timesheets semanais por (tenant, usuário, semana)"""
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: int = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds  # Limita a defasagem entre processos
+        self._data: 'OrderedDict[tuple, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if not entry:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            sheet = entry[1]
+            return dict(sheet, days=dict(sheet['days']))
+
+    def set(self, key: tuple, value: Dict[str, Any]):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add_minutes(self, key: tuple, day: date, minutes: int):
+        """Atualização incremental de um timesheet já em cache"""
+        with self._lock:
+            entry = self._data.get(key)
+            if not entry:
+                return
+            sheet = entry[1]
+            day_key = day.isoformat()
+            sheet['days'][day_key] = sheet['days'].get(day_key, 0) + minutes
+            sheet['total_minutes'] += minutes
+            sheet['entries'] += 1
+
+    def invalidate(self, key: tuple):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class TimesheetService:
+    """Serviço de registros de tempo e timesheets"""
+
+    def __init__(self, cache: TimesheetCache = None):
+        self.cache = cache or TimesheetCache()
+
+    # ==================== INGESTÃO ====================
+
+    def bulk_add_time_logs(self, entries: List[Dict[str, Any]], logged_by: str, tenant_id: str,
+                           allow_overlap: bool = False, allow_other_users: bool = False) -> Dict[str, Any]:
+        """
+        Registra vários intervalos de tempo em uma única transação
+
+        Args:
+            entries: Itens com task_id, start_time, end_time (ISO) e description
+            logged_by: Usuário autenticado, dono dos registros
+            tenant_id: Tenant de quem registra; tarefas de outros tenants são rejeitadas
+            allow_overlap: Aceita intervalos sobrepostos do mesmo usuário
+            allow_other_users: Permite que cada item traga logged_by de outro usuário
+
+        Returns:
+            Registros criados ou erros de validação/sobreposição
+        """
+        try:
+            if not entries:
+                return {'success': False, 'message': 'Nenhum registro informado'}
+
+            # Busca todas as tarefas envolvidas em uma consulta
+            task_ids = {e.get('task_id') for e in entries}
+            tasks = {t.id: t for t in Task.query.filter(Task.id.in_(task_ids), Task.tenant_id == tenant_id).all()}
+
+            logs = []
+            errors = []
+            for index, entry in enumerate(entries):
+                task = tasks.get(entry.get('task_id'))
+                if not task:
+                    errors.append({'index': index, 'message': 'Tarefa não encontrada'})
+                    continue
+
+                owner = entry.get('logged_by') or logged_by
+                if owner != logged_by and not allow_other_users:
+                    errors.append({'index': index, 'message': 'Sem permissão para registrar tempo de outro usuário'})
+                    continue
+
+                try:
+                    start_time = datetime.fromisoformat(entry['start_time'])
+                    end_time = datetime.fromisoformat(entry['end_time']) if entry.get('end_time') else None
+                except (KeyError, ValueError):
+                    errors.append({'index': index, 'message': 'Horários inválidos'})
+                    continue
+
+                if end_time and end_time <= start_time:
+                    errors.append({'index': index, 'message': 'Fim deve ser posterior ao início'})
+                    continue
+
+                time_log = TaskTimeLog(
+                    task_id=task.id,
+                    tenant_id=task.tenant_id,
+                    lead_id=task.lead_id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    description=entry.get('description'),
+                    logged_by=owner
+                )
+                time_log.calculate_duration()
+                logs.append((index, time_log))
+
+            if errors:
+                return {'success': False, 'message': 'Registros inválidos', 'errors': errors}
+
+            if not allow_overlap:
+                overlaps = self._check_overlaps([log for _, log in logs])
+                if overlaps:
+                    return {'success': False, 'message': 'Intervalos sobrepostos', 'overlaps': overlaps}
+
+            db.session.add_all([log for _, log in logs])
+
+            # Um incremento no resumo de atividades por usuário e dia
+            minutes_by_day = defaultdict(int)
+            for _, log in logs:
+                minutes_by_day[(log.logged_by, log.tenant_id, log.work_date)] += log.duration_minutes or 0
+            for (user_id, tenant_id, work_date), minutes in minutes_by_day.items():
+                activity_summary_service.record_event(
+                    'time_logged', user_id, tenant_id,
+                    occurred_at=datetime.combine(work_date, datetime.min.time()), amount=minutes
+                )
+
+            db.session.commit()
+            self._apply_to_cache([log for _, log in logs])
+
+            return {
+                'success': True,
+                'message': f'{len(logs)} registros de tempo criados',
+                'time_logs': [log.to_dict() for _, log in logs]
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao registrar tempos em lote: {e}")
+            return {'success': False, 'message': f'Erro ao registrar tempos: {str(e)}'}
+
+    def _check_overlaps(self, logs: List[TaskTimeLog]) -> List[Dict[str, Any]]:
+        """Verifica sobreposição entre os novos registros e os já gravados, por usuário"""
+        by_user = defaultdict(list)
+        for i, log in enumerate(logs):
+            if log.end_time:
+                by_user[log.logged_by].append((log.start_time, log.end_time, ('new', i)))
+
+        if not by_user:
+            return []
+
+        # Registros existentes no período, para todos os usuários em uma consulta
+        span_start = min(i[0] for items in by_user.values() for i in items)
+        span_end = max(i[1] for items in by_user.values() for i in items)
+        existing = db.session.query(
+            TaskTimeLog.id, TaskTimeLog.logged_by, TaskTimeLog.start_time, TaskTimeLog.end_time
+        ).filter(
+            TaskTimeLog.logged_by.in_(list(by_user.keys())),
+            TaskTimeLog.start_time < span_end,
+            TaskTimeLog.end_time > span_start
+        ).all()
+        for log_id, user_id, start, end in existing:
+            by_user[user_id].append((start, end, ('existing', log_id)))
+
+        overlaps = []
+        for user_id, intervals in by_user.items():
+            for first, second in find_overlaps(intervals):
+                if first[0] == 'existing' and second[0] == 'existing':
+                    continue
+                overlaps.append({'user_id': user_id, 'first': first, 'second': second})
+        return overlaps
+
+    def _apply_to_cache(self, logs: List[TaskTimeLog]):
+        for log in logs:
+            if log.work_date and log.duration_minutes:
+                key = (log.tenant_id, log.logged_by, week_start_of(log.work_date))
+                self.cache.add_minutes(key, log.work_date, log.duration_minutes)
+
+    # ==================== AGREGAÇÕES ====================
+
+    def aggregate(self, tenant_id: str, start_date: date, end_date: date, group_by: str = 'user',
+                  user_ids: List[str] = None) -> Dict[str, Any]:
+        """
+        Soma minutos e registros agrupando no banco
+
+        Args:
+            group_by: user, task, lead, day ou week
+        """
+        if group_by not in AGGREGATION_COLUMNS and group_by != 'week':
+            return {'success': False, 'message': f'Agrupamento não suportado: {group_by}'}
+
+        key_column = TaskTimeLog.work_date if group_by == 'week' else AGGREGATION_COLUMNS[group_by]
+
+        query = db.session.query(
+            key_column,
+            func.coalesce(func.sum(TaskTimeLog.duration_minutes), 0),
+            func.count(TaskTimeLog.id)
+        ).filter(
+            TaskTimeLog.tenant_id == tenant_id,
+            TaskTimeLog.work_date >= start_date,
+            TaskTimeLog.work_date <= end_date
+        )
+        if user_ids:
+            query = query.filter(TaskTimeLog.logged_by.in_(user_ids))
+
+        rows = query.group_by(key_column).all()
+
+        groups = defaultdict(lambda: {'total_minutes': 0, 'entries': 0})
+        for key, minutes, count in rows:
+            if group_by == 'week':
+                # Dias agregados no banco; a semana é consolidada aqui (portável entre bancos)
+                key = week_start_of(key if isinstance(key, date) else date.fromisoformat(key))
+            if isinstance(key, date):
+                key = key.isoformat()
+            groups[key]['total_minutes'] += int(minutes)
+            groups[key]['entries'] += count
+
+        return {
+            'success': True,
+            'group_by': group_by,
+            'groups': [{'key': k, **v} for k, v in sorted(groups.items(), key=lambda i: str(i[0]))]
+        }
+
+    def get_weekly_timesheets(self, tenant_id: str, week_start: date, user_ids: List[str]) -> Dict[str, Any]:
+        """
+        Timesheets semanais de vários usuários
+
+        Usuários fora do cache são carregados juntos em uma única consulta
+        agrupada por (usuário, dia).
+        """
+        week_start = week_start_of(week_start)
+        week_end = week_start + timedelta(days=6)
+
+        sheets = {}
+        missing = []
+        for user_id in user_ids:
+            cached = self.cache.get((tenant_id, user_id, week_start))
+            if cached is not None:
+                sheets[user_id] = cached
+            else:
+                missing.append(user_id)
+
+        if missing:
+            rows = db.session.query(
+                TaskTimeLog.logged_by,
+                TaskTimeLog.work_date,
+                func.coalesce(func.sum(TaskTimeLog.duration_minutes), 0),
+                func.count(TaskTimeLog.id)
+            ).filter(
+                TaskTimeLog.tenant_id == tenant_id,
+                TaskTimeLog.logged_by.in_(missing),
+                TaskTimeLog.work_date >= week_start,
+                TaskTimeLog.work_date <= week_end
+            ).group_by(TaskTimeLog.logged_by, TaskTimeLog.work_date).all()
+
+            loaded = {user_id: {'user_id': user_id, 'week_start': week_start.isoformat(),
+                                'days': {}, 'total_minutes': 0, 'entries': 0} for user_id in missing}
+            for user_id, work_date, minutes, count in rows:
+                sheet = loaded[user_id]
+                day_key = work_date.isoformat() if isinstance(work_date, date) else str(work_date)
+                sheet['days'][day_key] = int(minutes)
+                sheet['total_minutes'] += int(minutes)
+                sheet['entries'] += count
+
+            for user_id, sheet in loaded.items():
+                self.cache.set((tenant_id, user_id, week_start), sheet)
+                sheets[user_id] = sheet
+
+        return {
+            'success': True,
+            'week_start': week_start.isoformat(),
+            'week_end': week_end.isoformat(),
+            'timesheets': [sheets[user_id] for user_id in user_ids]
+        }
+
+
+# Instância global
+timesheet_service = TimesheetService()
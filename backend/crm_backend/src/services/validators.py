@@ -0,0 +1,236 @@
+"""
+Validadores de dados de entrada (email, telefone, CPF, CNPJ...)
+
+Padrões pré-compilados e verificação dos dígitos verificadores de CPF/CNPJ.
+Usados pelos fluxos do chatbot, pela importação de leads e pela integração com
+o FlyERP. O modo em lote usa NumPy quando disponível para validar centenas de
+milhares de documentos de uma vez.
+"""
+import re
+from typing import Callable, Dict, List, Any, Optional, Iterable
+
+# Importação opcional do NumPy (modo em lote vetorizado)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+NON_DIGITS = re.compile(r'[^0-9]')
+
+CPF_WEIGHTS = ((10, 9, 8, 7, 6, 5, 4, 3, 2), (11, 10, 9, 8, 7, 6, 5, 4, 3, 2))
+CNPJ_WEIGHTS = ((5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2), (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2))
+
+
+def only_digits(value: Any) -> str:
+    """Remove tudo que não for dígito"""
+    return NON_DIGITS.sub('', str(value or ''))
+
+
+# ==================== DOCUMENTOS ====================
+
+def _check_digit(digits: str, weights: tuple) -> int:
+    remainder = sum(int(d) * w for d, w in zip(digits, weights)) % 11
+    return 0 if remainder < 2 else 11 - remainder
+
+
+def _valid_document(digits: str, weights: tuple) -> bool:
+    size = len(weights[1]) + 1
+    if len(digits) != size or digits == digits[0] * size:
+        return False
+    return (_check_digit(digits, weights[0]) == int(digits[-2])
+            and _check_digit(digits, weights[1]) == int(digits[-1]))
+
+
+def is_valid_cpf(value: Any) -> bool:
+    """CPF com 11 dígitos e dígitos verificadores corretos"""
+    return _valid_document(only_digits(value), CPF_WEIGHTS)
+
+
+def is_valid_cnpj(value: Any) -> bool:
+    """CNPJ com 14 dígitos e dígitos verificadores corretos"""
+    return _valid_document(only_digits(value), CNPJ_WEIGHTS)
+
+
+def is_valid_document(value: Any) -> bool:
+    """CPF ou CNPJ, conforme a quantidade de dígitos"""
+    digits = only_digits(value)
+    if len(digits) == 11:
+        return _valid_document(digits, CPF_WEIGHTS)
+    if len(digits) == 14:
+        return _valid_document(digits, CNPJ_WEIGHTS)
+    return False
+
+
+def format_document(value: str) -> str:
+    """Aplica a máscara de CPF/CNPJ; devolve o valor original se não tiver 11 ou 14 dígitos"""
+    digits = only_digits(value)
+    if len(digits) == 11:
+        return f"{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}"
+    if len(digits) == 14:
+        return f"{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}"
+    return value
+
+
+# ==================== TELEFONE ====================
+
+def normalize_phone_br(value: Any) -> Optional[str]:
+    """
+    Normaliza telefone brasileiro para E.164 (+55DDNNNNNNNNN)
+
+    Aceita com ou sem +55, zero de tronco e máscara. Celulares têm 9 dígitos
+    começando com 9; fixos têm 8 dígitos começando com 2 a 5.
+    """
+    digits = only_digits(value)
+    if len(digits) in (12, 13) and digits.startswith('55'):
+        digits = digits[2:]
+    elif len(digits) in (11, 12) and digits.startswith('0'):
+        digits = digits[1:]
+
+    if len(digits) not in (10, 11):
+        return None
+
+    area, number = digits[:2], digits[2:]
+    if area[0] == '0' or area[1] == '0':
+        return None
+    if len(number) == 9 and number[0] != '9':
+        return None
+    if len(number) == 8 and number[0] not in '2345':
+        return None
+
+    return f"+55{digits}"
+
+
+def is_valid_phone_br(value: Any) -> bool:
+    return normalize_phone_br(value) is not None
+
+
+def is_valid_email(value: Any) -> bool:
+    return bool(EMAIL_PATTERN.match(str(value or '')))
+
+
+# ==================== REGISTRO ====================
+
+def _simple(check: Callable[[str], bool], message: str) -> Callable[[Dict], Callable[[str], Optional[str]]]:
+    return lambda config: (lambda value: None if check(value) else message)
+
+
+def _min_length(config: Dict) -> Callable[[str], Optional[str]]:
+    min_length = config.get("value", 1)
+    message = f"Mínimo de {min_length} caracteres."
+    return lambda value: None if len(value) >= min_length else message
+
+
+def _max_length(config: Dict) -> Callable[[str], Optional[str]]:
+    max_length = config.get("value", 255)
+    message = f"Máximo de {max_length} caracteres."
+    return lambda value: None if len(value) <= max_length else message
+
+
+# tipo -> fábrica(config) -> validador(valor) -> mensagem de erro ou None
+VALIDATORS: Dict[str, Callable[[Dict], Callable[[str], Optional[str]]]] = {
+    'email': _simple(is_valid_email, "Por favor, digite um e-mail válido."),
+    'phone': _simple(is_valid_phone_br, "Por favor, digite um telefone válido."),
+    'cpf': _simple(is_valid_cpf, "Por favor, digite um CPF válido."),
+    'cnpj': _simple(is_valid_cnpj, "Por favor, digite um CNPJ válido."),
+    'cpf_cnpj': _simple(is_valid_document, "Por favor, digite um CPF ou CNPJ válido."),
+    'required': _simple(lambda value: bool(value.strip()), "Este campo é obrigatório."),
+    'min_length': _min_length,
+    'max_length': _max_length
+}
+
+
+def get_validator(validation: Dict) -> Optional[Callable[[str], Optional[str]]]:
+    """Validador para a configuração {"type": ..., "value": ...} (None se não houver)"""
+    if not validation:
+        return None
+    factory = VALIDATORS.get(validation.get("type"))
+    return factory(validation) if factory else None
+
+
+# ==================== LOTE ====================
+
+def _bulk_check_numpy(documents: List[str], weights: tuple) -> 'np.ndarray':
+    """Valida documentos de mesmo tamanho de uma vez (matriz n x tamanho)"""
+    size = len(weights[1]) + 1
+    matrix = (np.frombuffer(''.join(documents).encode('ascii'), dtype=np.uint8) - 48) \
+        .reshape(len(documents), size).astype(np.int32)
+
+    valid = ~(matrix == matrix[:, :1]).all(axis=1)
+    for position, w in ((size - 2, weights[0]), (size - 1, weights[1])):
+        remainder = matrix[:, :len(w)].dot(np.array(w, dtype=np.int32)) % 11
+        digit = np.where(remainder < 2, 0, 11 - remainder)
+        valid &= digit == matrix[:, position]
+    return valid
+
+
+def validate_documents_bulk(values: Iterable[Any], kind: str = 'cpf_cnpj') -> List[bool]:
+    """
+    Valida muitos CPFs/CNPJs de uma vez
+
+    Args:
+        values: Documentos com ou sem máscara
+        kind: cpf, cnpj ou cpf_cnpj
+
+    Returns:
+        Lista de booleanos na mesma ordem
+    """
+    cleaned = [only_digits(value) for value in values]
+    sizes = {'cpf': (11,), 'cnpj': (14,), 'cpf_cnpj': (11, 14)}[kind]
+    result = [False] * len(cleaned)
+
+    for size, weights in ((11, CPF_WEIGHTS), (14, CNPJ_WEIGHTS)):
+        if size not in sizes:
+            continue
+        indexes = [i for i, digits in enumerate(cleaned) if len(digits) == size]
+        if not indexes:
+            continue
+
+        if np is not None:
+            checks = _bulk_check_numpy([cleaned[i] for i in indexes], weights).tolist()
+        else:
+            checks = [_valid_document(cleaned[i], weights) for i in indexes]
+
+        for i, ok in zip(indexes, checks):
+            result[i] = ok
+
+    return result
+
+
+def validate_rows_bulk(rows: List[Dict[str, Any]], document_field: str = 'cnpj_cpf',
+                       phone_field: str = 'phone', email_field: str = 'email') -> Dict[str, Any]:
+    """
+    Valida e normaliza linhas de importação (ex.: leads)
+
+    Returns:
+        Linhas com telefone em E.164 e documento com máscara, e os erros por índice
+    """
+    documents = validate_documents_bulk(row.get(document_field) for row in rows)
+    normalized = []
+    errors = []
+
+    for index, (row, document_ok) in enumerate(zip(rows, documents)):
+        row_errors = []
+        row = dict(row)
+
+        if row.get(document_field):
+            if document_ok:
+                row[document_field] = format_document(row[document_field])
+            else:
+                row_errors.append(f'{document_field} inválido')
+
+        if row.get(phone_field):
+            phone = normalize_phone_br(row[phone_field])
+            if phone:
+                row[phone_field] = phone
+            else:
+                row_errors.append(f'{phone_field} inválido')
+
+        if row.get(email_field) and not is_valid_email(row[email_field]):
+            row_errors.append(f'{email_field} inválido')
+
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+        normalized.append(row)
+
+    return {'rows': normalized, 'errors': errors, 'valid': len(rows) - len(errors), 'invalid': len(errors)}
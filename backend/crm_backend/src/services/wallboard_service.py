@@ -0,0 +1,518 @@
+"""
+Painel do call center (wallboard) com métricas em tempo real por fila e operador
+
+As métricas ficam em memória e são atualizadas a cada evento do hub de eventos
+de chamada (call_event_hub), sem consultas de agregação ao banco: o banco só é
+lido uma vez na inicialização, para recompor a janela corrente. Cada processo
+recebe todos os eventos pelo hub (os de outros processos vêm do log
+call_events), então todos chegam ao mesmo estado.
+
+Janela deslizante (WALLBOARD_WINDOW_MINUTES): cada chamada encerrada entra na
+janela da fila e do operador com os totais já somados; quando sai da janela os
+totais são subtraídos. Pausas contam pela hora em que terminaram, como as
+chamadas; a pausa em curso é enviada como instante de início (status_since),
+assim como a espera mais longa da fila, para que o cliente some o tempo corrido
+e um delta só seja enviado quando algo muda de fato.
+
+Métricas:
+    waiting          chamadas recebidas tocando, ainda não atendidas
+    asr              % de chamadas atendidas sobre as encerradas na janela
+    acd              duração média (segundos) das chamadas atendidas
+    service_level    % das chamadas recebidas atendidas em até
+                     WALLBOARD_SERVICE_LEVEL_SECONDS
+    calls_per_hour   chamadas encerradas na janela, por hora
+"""
+import logging
+import os
+import threading
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from src.models.telephony import Call, CallEvent, db
+from src.models.user import User
+from src.services.call_event_service import AGENT_EVENT_TYPES, ACTIVE_CALL_HOURS, call_event_hub
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = 'geral'  # Chamadas sem fila informada pelo PABX
+
+_FinishedCall = namedtuple('_FinishedCall', 'ended_at inbound answered within_sl talk_seconds wait_seconds')
+_Pause = namedtuple('_Pause', 'ended_at seconds')
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class _Window:
+    """Chamadas encerradas na janela, com os totais mantidos a cada entrada e saída"""
+
+    __slots__ = ('entries', 'calls', 'answered', 'inbound', 'inbound_answered', 'within_sl',
+                 'talk_seconds', 'wait_seconds')
+
+    def __init__(self):
+        self.entries = deque()
+        self.calls = self.answered = self.inbound = self.inbound_answered = 0
+        self.within_sl = self.talk_seconds = self.wait_seconds = 0
+
+    def _apply(self, call: _FinishedCall, sign: int):
+        self.calls += sign
+        if call.answered:
+            self.answered += sign
+            self.talk_seconds += sign * call.talk_seconds
+        if call.inbound:
+            self.inbound += sign
+            if call.answered:
+                self.inbound_answered += sign
+                self.wait_seconds += sign * call.wait_seconds
+            if call.within_sl:
+                self.within_sl += sign
+
+    def add(self, call: _FinishedCall):
+        self.entries.append(call)
+        self._apply(call, 1)
+
+    def prune(self, cutoff: datetime) -> bool:
+        removed = False
+        while self.entries and self.entries[0].ended_at < cutoff:
+            self._apply(self.entries.popleft(), -1)
+            removed = True
+        return removed
+
+    def metrics(self, window_minutes: int) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'answered': self.answered,
+            'abandoned': self.inbound - self.inbound_answered,
+            'asr': round(self.answered * 100.0 / self.calls, 1) if self.calls else None,
+            'acd': round(self.talk_seconds / self.answered) if self.answered else None,
+            'asa': round(self.wait_seconds / self.inbound_answered) if self.inbound_answered else None,
+            'service_level': round(self.within_sl * 100.0 / self.inbound, 1) if self.inbound else None,
+            'calls_per_hour': round(self.calls * 60.0 / window_minutes, 1)
+        }
+
+
+class _Operator:
+    """Estado do operador (login, pausa, chamadas em curso) e suas chamadas na janela"""
+
+    __slots__ = ('user_id', 'extension', 'logged_in', 'paused_since', 'pause_reason', 'status', 'status_since',
+                 'calls', 'window', 'pauses', 'pause_seconds')
+
+    def __init__(self, user_id: Optional[str], extension: Optional[str], moment: datetime):
+        self.user_id = user_id
+        self.extension = extension
+        self.logged_in = True  # Operador visto em chamada sem login registrado
+        self.paused_since = None
+        self.pause_reason = None
+        self.status = 'available'
+        self.status_since = moment
+        self.calls = set()
+        self.window = _Window()
+        self.pauses = deque()
+        self.pause_seconds = 0
+
+    def end_pause(self, moment: datetime):
+        if self.paused_since:
+            pause = _Pause(moment, max(int((moment - self.paused_since).total_seconds()), 0))
+            self.pauses.append(pause)
+            self.pause_seconds += pause.seconds
+            self.paused_since = None
+            self.pause_reason = None
+
+    def refresh_status(self, moment: datetime):
+        if not self.logged_in:
+            status = 'offline'
+        elif self.paused_since:
+            status = 'paused'
+        elif self.calls:
+            status = 'on_call'
+        else:
+            status = 'available'
+        if status != self.status:
+            self.status = status
+            self.status_since = moment
+
+    def prune(self, cutoff: datetime) -> bool:
+        removed = self.window.prune(cutoff)
+        while self.pauses and self.pauses[0].ended_at < cutoff:
+            self.pause_seconds -= self.pauses.popleft().seconds
+            removed = True
+        return removed
+
+
+class _TenantBoard:
+    __slots__ = ('queues', 'operators', 'active', 'finished', 'version', 'cached_version', 'cached')
+
+    def __init__(self):
+        self.queues: Dict[str, _Window] = {}
+        self.operators: Dict[str, _Operator] = {}
+        self.active: Dict[str, Dict[str, Any]] = {}  # Chamadas em curso por ID
+        self.finished: Dict[str, datetime] = {}  # Chamadas já contadas (evita contar duas vezes)
+        self.version = 0
+        self.cached_version = -1
+        self.cached = None
+
+
+class WallboardEngine:
+    """Agregação incremental dos eventos de chamada por tenant, fila e operador"""
+
+    def __init__(self, window_minutes: int = 60, service_level_seconds: int = 20):
+        self.window_minutes = window_minutes
+        self.service_level_seconds = service_level_seconds
+        self.app = None
+        self.running = False
+        self._boards: Dict[str, _TenantBoard] = {}
+        self._names: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._stats = {'events': 0, 'snapshots': 0, 'warmed_calls': 0}
+
+    # ==================== EVENTOS ====================
+
+    def _board(self, tenant_id: str) -> _TenantBoard:
+        board = self._boards.get(tenant_id)
+        if board is None:
+            board = self._boards[tenant_id] = _TenantBoard()
+        return board
+
+    @staticmethod
+    def _operator_key(user_id: Optional[str], extension: Optional[str]) -> Optional[str]:
+        return user_id or (f"ramal:{extension}" if extension else None)  # Ramal sem usuário associado
+
+    def _operator(self, board: _TenantBoard, user_id: Optional[str], extension: Optional[str],
+                  moment: datetime) -> Optional[_Operator]:
+        key = self._operator_key(user_id, extension)
+        if key is None:
+            return None
+        operator = board.operators.get(key)
+        if operator is None:
+            operator = board.operators[key] = _Operator(user_id, extension, moment)
+        elif extension:
+            operator.extension = extension
+        return operator
+
+    def _apply_agent_event(self, board: _TenantBoard, event: Dict[str, Any], moment: datetime):
+        operator = self._operator(board, event.get('user_id'), event.get('extension'), moment)
+        if operator is None:
+            return
+        event_type = event['event_type']
+        if event_type == 'login':
+            operator.logged_in = True
+        elif event_type == 'logout':
+            operator.end_pause(moment)
+            operator.logged_in = False
+        elif event_type == 'pause':
+            operator.logged_in = True
+            if not operator.paused_since:
+                operator.paused_since = moment
+            operator.pause_reason = event.get('reason') or operator.pause_reason
+        elif event_type == 'unpause':
+            operator.end_pause(moment)
+        operator.refresh_status(moment)
+
+    def _finish_call(self, board: _TenantBoard, key: str, call: Dict[str, Any], moment: datetime):
+        answered_at = call['answered_at']
+        wait_seconds = max(int(((answered_at or moment) - call['started_at']).total_seconds()), 0)
+        finished = _FinishedCall(
+            ended_at=moment,
+            inbound=call['direction'] == 'inbound',
+            answered=answered_at is not None,
+            within_sl=answered_at is not None and wait_seconds <= self.service_level_seconds,
+            talk_seconds=max(int((moment - answered_at).total_seconds()), 0) if answered_at else 0,
+            wait_seconds=wait_seconds
+        )
+        board.queues.setdefault(call['queue'] or DEFAULT_QUEUE, _Window()).add(finished)
+        board.finished[key] = moment
+        operator = board.operators.get(call['operator']) if call['operator'] else None
+        if operator:
+            operator.window.add(finished)
+            operator.calls.discard(key)
+            operator.refresh_status(moment)
+
+    def _assign(self, board: _TenantBoard, key: str, call: Dict[str, Any], operator: Optional[_Operator],
+                moment: datetime):
+        operator_key = self._operator_key(operator.user_id, operator.extension) if operator else None
+        if operator_key == call['operator']:
+            return
+        previous = board.operators.get(call['operator']) if call['operator'] else None
+        if previous:
+            previous.calls.discard(key)
+            previous.refresh_status(moment)
+        call['operator'] = operator_key
+        if operator:
+            operator.calls.add(key)
+            operator.refresh_status(moment)
+
+    def _apply_call_event(self, board: _TenantBoard, event: Dict[str, Any], moment: datetime):
+        key = event.get('call_id') or event.get('external_call_id')
+        if not key or key in board.finished:
+            return
+        call = board.active.get(key)
+        if call is None:
+            call = board.active[key] = {
+                'started_at': moment, 'answered_at': None, 'operator': None,
+                'queue': event.get('queue'), 'direction': event.get('direction') or 'inbound'
+            }
+        call['queue'] = call['queue'] or event.get('queue')
+
+        event_type = event['event_type']
+        if event_type == 'answered' and not call['answered_at']:
+            call['answered_at'] = moment
+        if event_type == 'ringing':
+            return  # Chamada recebida tocando na fila: ainda sem operador (toca em vários ramais)
+
+        # Atendimento e transferência trocam o operador; os demais eventos só o preenchem
+        if event_type in ('answered', 'transfer', 'dialing') or not call['operator']:
+            if event_type != 'hangup' or call['answered_at'] or call['direction'] == 'outbound':
+                operator = self._operator(board, event.get('user_id'), event.get('extension'), moment)
+                if operator:
+                    self._assign(board, key, call, operator, moment)
+
+        if event_type == 'hangup':
+            del board.active[key]
+            self._finish_call(board, key, call, moment)
+
+    def on_event(self, event: Dict[str, Any]):
+        """Ouvinte do hub: aplica o evento ao painel do tenant"""
+        tenant_id = event.get('tenant_id')
+        if not tenant_id or not event.get('event_type'):
+            return
+        moment = _as_datetime(event.get('occurred_at'))
+        with self._lock:
+            board = self._board(tenant_id)
+            if event['event_type'] in AGENT_EVENT_TYPES:
+                self._apply_agent_event(board, event, moment)
+            else:
+                self._apply_call_event(board, event, moment)
+            board.version += 1
+            self._stats['events'] += 1
+            self._changed.notify_all()
+
+    # ==================== CARGA INICIAL ====================
+
+    def warm_up(self) -> int:
+        """Recompõe a janela corrente a partir do banco (uma vez, na inicialização)"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(minutes=self.window_minutes)
+        active_since = now - timedelta(hours=ACTIVE_CALL_HOURS)
+
+        finished = Call.query.filter(Call.end_time >= cutoff, Call.status != 'in_progress') \
+            .order_by(Call.end_time.asc()).all()
+        active = Call.query.filter(Call.status == 'in_progress', Call.start_time >= active_since) \
+            .order_by(Call.start_time.asc()).all()
+        agent_events = CallEvent.query.filter(CallEvent.event_type.in_(AGENT_EVENT_TYPES),
+                                              CallEvent.occurred_at >= active_since) \
+            .order_by(CallEvent.id.asc()).all()
+
+        with self._lock:
+            for row in agent_events:
+                self._apply_agent_event(self._board(row.tenant_id), row.to_dict(), row.occurred_at)
+            for call in finished + active:
+                board = self._board(call.tenant_id)
+                if call.id in board.finished:
+                    continue
+                state = {'started_at': call.start_time, 'answered_at': call.answered_at, 'operator': None,
+                         'queue': call.queue, 'direction': call.direction}
+                if call.answered_at is None and call.status == 'completed' and call.duration and call.end_time:
+                    # CDR importado sem o instante do atendimento
+                    state['answered_at'] = call.end_time - timedelta(seconds=call.duration)
+                if call.user_id and (state['answered_at'] or call.direction == 'outbound'):
+                    operator = self._operator(board, call.user_id, None, state['answered_at'] or call.start_time)
+                    self._assign(board, call.id, state, operator, state['answered_at'] or call.start_time)
+                if call.end_time and call.status != 'in_progress':
+                    self._finish_call(board, call.id, state, call.end_time)
+                else:
+                    board.active[call.id] = state
+                board.version += 1
+            self._stats['warmed_calls'] += len(finished) + len(active)
+        return len(finished) + len(active)
+
+    # ==================== SNAPSHOT E DELTAS ====================
+
+    def _prune(self, board: _TenantBoard, now: datetime):
+        cutoff = now - timedelta(minutes=self.window_minutes)
+        removed = False
+        for window in board.queues.values():
+            removed = window.prune(cutoff) or removed
+        for operator in board.operators.values():
+            removed = operator.prune(cutoff) or removed
+        for key in [key for key, ended_at in board.finished.items() if ended_at < cutoff]:
+            del board.finished[key]
+
+        stale = now - timedelta(hours=ACTIVE_CALL_HOURS)  # Desligamento perdido pelo PABX
+        for key in [key for key, call in board.active.items() if call['started_at'] < stale]:
+            call = board.active.pop(key)
+            operator = board.operators.get(call['operator']) if call['operator'] else None
+            if operator:
+                operator.calls.discard(key)
+                operator.refresh_status(now)
+            removed = True
+        if removed:
+            board.version += 1
+
+    def _user_names(self, user_ids: List[str]) -> Dict[str, str]:
+        """Nomes dos operadores (consulta só para usuários ainda não vistos)"""
+        missing = [user_id for user_id in user_ids if user_id not in self._names]
+        if missing:
+            try:
+                for user in User.query.filter(User.id.in_(missing)).all():
+                    self._names[user.id] = f"{user.first_name} {user.last_name}".strip()
+            except Exception as e:
+                logger.warning(f"Erro ao carregar nomes dos operadores: {e}")
+            for user_id in missing:
+                self._names.setdefault(user_id, None)
+        return self._names
+
+    def _build(self, board: _TenantBoard) -> Dict[str, Any]:
+        waiting: Dict[str, List[datetime]] = {}
+        talking: Dict[str, int] = {}
+        for call in board.active.values():
+            queue = call['queue'] or DEFAULT_QUEUE
+            if call['answered_at']:
+                talking[queue] = talking.get(queue, 0) + 1
+            elif call['direction'] == 'inbound':
+                waiting.setdefault(queue, []).append(call['started_at'])
+
+        totals = _Window()
+        queues = {}
+        for name in sorted(set(board.queues) | set(waiting) | set(talking)):
+            window = board.queues.get(name)
+            if window:
+                for field in _Window.__slots__[1:]:
+                    setattr(totals, field, getattr(totals, field) + getattr(window, field))
+            queue = (window or _Window()).metrics(self.window_minutes)
+            queue.update({
+                'queue': name,
+                'waiting': len(waiting.get(name, ())),
+                'oldest_waiting_since': _isoformat(min(waiting[name])) if name in waiting else None,
+                'talking': talking.get(name, 0)
+            })
+            queues[name] = queue
+
+        names = self._user_names([operator.user_id for operator in board.operators.values() if operator.user_id])
+        operators = {}
+        statuses = {'available': 0, 'on_call': 0, 'paused': 0, 'offline': 0}
+        for key, operator in board.operators.items():
+            statuses[operator.status] += 1
+            data = operator.window.metrics(self.window_minutes)
+            data.update({
+                'user_id': operator.user_id,
+                'name': names.get(operator.user_id) if operator.user_id else None,
+                'extension': operator.extension,
+                'status': operator.status,
+                'status_since': _isoformat(operator.status_since),
+                'pause_reason': operator.pause_reason,
+                'pause_seconds': operator.pause_seconds,  # Pausas encerradas na janela (a em curso: status_since)
+                'active_calls': len(operator.calls)
+            })
+            operators[key] = data
+
+        summary = totals.metrics(self.window_minutes)
+        summary.update({
+            'waiting': sum(len(moments) for moments in waiting.values()),
+            'talking': sum(talking.values()),
+            'operators': statuses
+        })
+        return {'totals': summary, 'queues': queues, 'operators': operators}
+
+    def snapshot(self, tenant_id: str) -> Dict[str, Any]:
+        """Estado atual do painel (recalculado só quando houve evento ou saída da janela)"""
+        with self._lock:
+            board = self._board(tenant_id)
+            self._prune(board, datetime.utcnow())
+            if board.cached_version != board.version:
+                board.cached = self._build(board)
+                board.cached_version = board.version
+                self._stats['snapshots'] += 1
+            return {
+                'version': board.version,
+                'window_minutes': self.window_minutes,
+                'service_level_seconds': self.service_level_seconds,
+                **board.cached
+            }
+
+    def wait_for_change(self, tenant_id: str, version: int, timeout: float) -> int:
+        """Espera um evento do tenant depois da versão informada (até timeout); retorna a versão atual"""
+        with self._changed:
+            board = self._board(tenant_id)
+            if board.version == version:
+                self._changed.wait(timeout)
+            return board.version
+
+    @staticmethod
+    def delta(previous: Dict[str, Any], current: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Diferença entre dois snapshots: só filas/operadores alterados (None: removido)"""
+        changes = {}
+        if previous.get('totals') != current['totals']:
+            changes['totals'] = current['totals']
+        for section in ('queues', 'operators'):
+            before = previous.get(section, {})
+            after = current[section]
+            changed = {key: value for key, value in after.items() if before.get(key) != value}
+            changed.update({key: None for key in before if key not in after})
+            if changed:
+                changes[section] = changed
+        if not changes:
+            return None
+        changes['version'] = current['version']
+        return changes
+
+    # ==================== CICLO DE VIDA ====================
+
+    def start(self, app):
+        """Carrega a janela corrente e passa a ouvir o hub de eventos de chamada"""
+        if self.running:
+            return
+        self.app = app
+        with app.app_context():
+            try:
+                call_event_hub.add_listener(self.on_event)  # Antes da carga: eventos repetidos são descartados
+                warmed = self.warm_up()
+                logger.info(f"Painel do call center iniciado ({warmed} chamadas na janela)")
+            finally:
+                db.session.remove()
+        self.running = True
+
+    def stop(self):
+        call_event_hub.remove_listener(self.on_event)
+        self.running = False
+        with self._changed:
+            self._changed.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tenants'] = len(self._boards)
+            stats['active_calls'] = sum(len(board.active) for board in self._boards.values())
+            stats['operators'] = sum(len(board.operators) for board in self._boards.values())
+        stats['running'] = self.running
+        return stats
+
+
+# Instância global
+wallboard = WallboardEngine(
+    window_minutes=int(os.getenv('WALLBOARD_WINDOW_MINUTES', '60')),
+    service_level_seconds=int(os.getenv('WALLBOARD_SERVICE_LEVEL_SECONDS', '20'))
+)
+
+
+def init_wallboard(app) -> bool:
+    """Inicia o painel do call center se habilitado (WALLBOARD_ENABLED)"""
+    if os.getenv('WALLBOARD_ENABLED', 'true').lower() != 'true':
+        logger.info("Painel do call center desabilitado")
+        return False
+
+    wallboard.start(app)
+    return True
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Testes do gateway de IA contra um servidor local de completions (stub HTTP)
+
+Não depende da OpenAI nem do servidor do CRM: o cliente do SDK aponta para um
+servidor que responde /v1/chat/completions com atraso configurável e conta
+quantas chamadas estão em andamento ao mesmo tempo.
+
+Execução: python test_ai_gateway.py (ou pytest test_ai_gateway.py)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+from src.models.user import db
+from src.models.chatbot import ChatAIUsage
+from src.services.ai_gateway import AIGateway, AIUsageRecorder
+
+
+class CompletionStub(BaseHTTPRequestHandler):
+    """API de chat completions: responde com eco da última mensagem após `delay` segundos"""
+
+    delay = 0.2
+    lock = threading.Lock()
+    requests = []
+    active = 0
+    max_active = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with CompletionStub.lock:
+            CompletionStub.requests.append(body)
+            CompletionStub.active += 1
+            CompletionStub.max_active = max(CompletionStub.max_active, CompletionStub.active)
+        try:
+            time.sleep(CompletionStub.delay)
+        finally:
+            with CompletionStub.lock:
+                CompletionStub.active -= 1
+
+        content = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': f"eco: {body['messages'][-1]['content']}"},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 12, 'completion_tokens': 5, 'total_tokens': 17}
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Cliente cancelou (timeout)
+
+    def log_message(self, *args):
+        pass
+
+
+class AIGatewayTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CompletionStub)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        CompletionStub.delay = 0.2
+        CompletionStub.requests = []
+        CompletionStub.active = 0
+        CompletionStub.max_active = 0
+        self.gateways = []
+
+    def tearDown(self):
+        for gateway in self.gateways:
+            gateway.shutdown()
+
+    def _gateway(self, **kwargs) -> AIGateway:
+        gateway = AIGateway(base_url=self.base_url, **kwargs)
+        self.gateways.append(gateway)
+        return gateway
+
+    @staticmethod
+    def _messages(text):
+        return [{'role': 'user', 'content': text}]
+
+    def _complete_all(self, gateway, calls):
+        """Executa as chamadas ao mesmo tempo, cada uma em uma thread"""
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            futures = [pool.submit(gateway.complete, 'sk-test', 'gpt-test', self._messages(text),
+                                   tenant_id=tenant_id) for text, tenant_id in calls]
+            return [future.result() for future in futures]
+
+    # ==================== COALESCÊNCIA ====================
+
+    def test_identical_requests_share_one_call(self):
+        gateway = self._gateway()
+        results = self._complete_all(gateway, [('oi', 't1')] * 5)
+
+        self.assertEqual(len(CompletionStub.requests), 1)
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual({result['response'] for result in results}, {'eco: oi'})
+        self.assertEqual(gateway.get_stats()['coalesced'], 4)
+
+    def test_requests_from_other_tenants_are_not_coalesced(self):
+        gateway = self._gateway()
+        self._complete_all(gateway, [('oi', 't1'), ('oi', 't2')])
+        self.assertEqual(len(CompletionStub.requests), 2)
+
+    # ==================== LIMITES DE CONCORRÊNCIA ====================
+
+    def test_tenant_semaphore_limits_concurrent_calls(self):
+        gateway = self._gateway(max_concurrency=10, tenant_concurrency=2)
+        results = self._complete_all(gateway, [(f"pedido {i}", 't1') for i in range(6)])
+
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(len(CompletionStub.requests), 6)
+        self.assertEqual(CompletionStub.max_active, 2)
+
+    def test_global_semaphore_limits_concurrent_calls(self):
+        gateway = self._gateway(max_concurrency=3, tenant_concurrency=3)
+        results = self._complete_all(gateway, [(f"pedido {i}", f"t{i}") for i in range(8)])
+
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(CompletionStub.max_active, 3)
+
+    def test_timeout_returns_error_and_releases_slot(self):
+        CompletionStub.delay = 1.0
+        gateway = self._gateway(tenant_concurrency=1)
+        result = gateway.complete('sk-test', 'gpt-test', self._messages('lento'), tenant_id='t1', timeout=0.2)
+        self.assertFalse(result['success'])
+        self.assertTrue(result['timeout'])
+
+        # A chamada cancelada libera o semáforo do tenant
+        CompletionStub.delay = 0.0
+        result = gateway.complete('sk-test', 'gpt-test', self._messages('rápido'), tenant_id='t1', timeout=5)
+        self.assertTrue(result['success'])
+        self.assertEqual(gateway.get_stats()['timeouts'], 1)
+
+    # ==================== CONSUMO ====================
+
+    def test_usage_is_recorded_in_batch(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            try:
+                gateway = self._gateway(recorder=AIUsageRecorder(batch_size=2))
+                self._complete_all(gateway, [('a', 't1'), ('b', 't1'), ('a', 't1')])
+                gateway.complete('sk-test', 'gpt-test', self._messages('c'), tenant_id='t2',
+                                 conversation_id='conv-1')
+
+                self.assertEqual(gateway.recorder.pending(), 3)  # Chamada coalescida grava uma vez
+                self.assertEqual(gateway.recorder.flush(), 3)
+
+                rows = ChatAIUsage.query.order_by(ChatAIUsage.tenant_id).all()
+                self.assertEqual([row.tenant_id for row in rows], ['t1', 't1', 't2'])
+                self.assertEqual(sum(row.total_tokens for row in rows), 51)
+                self.assertTrue(all(row.success and row.model == 'gpt-test' for row in rows))
+                self.assertEqual(rows[-1].conversation_id, 'conv-1')
+                self.assertEqual(gateway.recorder.pending(), 0)
+            finally:
+                db.session.remove()
+                db.drop_all()
+
+
+if __name__ == "__main__":
+    unittest.main()
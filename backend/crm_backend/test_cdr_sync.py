@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Testes da sincronização de CDRs com um PABX local (stub HTTP)
+
+Não depende do servidor do CRM: usa SQLite em memória e um servidor HTTP que
+responde /cdr como a API do PABX (paginação por pagina/limite e período
+data_inicio/data_fim).
+
+Execução: python test_cdr_sync.py (ou pytest test_cdr_sync.py)
+"""
+
+import json
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ['PABX_TIMEZONE'] = 'America/Sao_Paulo'  # Horários do stub no fuso do PABX (UTC-3)
+
+from flask import Flask
+
+from src.models.user import db
+from src.models.lead import Lead
+from src.models.user import User, Role
+from src.models.telephony import Call, CdrSyncState, TelephonyExtension
+from src.services.cdr_sync_service import (CdrSyncWorker, PabxCdrClient, ingest_cdrs, parse_cdr,
+                                           parse_datetime, to_pabx_time)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class PabxStub(BaseHTTPRequestHandler):
+    """API de CDRs do PABX: filtra o período e pagina a lista da classe"""
+
+    cdrs = []
+    requests = []
+    status = 200
+    payload = None  # Resposta fixa (ignora os CDRs)
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        PabxStub.requests.append(query)
+
+        if PabxStub.payload is not None:
+            body = PabxStub.payload
+        else:
+            start = datetime.strptime(query['data_inicio'], DATE_FORMAT)
+            end = datetime.strptime(query['data_fim'], DATE_FORMAT)
+            rows = [cdr for cdr in PabxStub.cdrs if start <= datetime.strptime(cdr['calldate'], DATE_FORMAT) < end]
+            page, limit = int(query['pagina']), int(query['limite'])
+            body = {'data': rows[(page - 1) * limit:page * limit]}
+
+        content = json.dumps(body).encode()
+        self.send_response(PabxStub.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_cdrs(count, start):
+    """CDRs alternando chamadas feitas (ramal 1001) e recebidas"""
+    cdrs = []
+    for i in range(count):
+        number = f"1198888{i % 10000:04d}"
+        outbound = i % 2 == 0
+        cdrs.append({
+            'uniqueid': f"cdr-{i}",
+            'calldate': (start + timedelta(minutes=i)).strftime(DATE_FORMAT),
+            'src': '1001' if outbound else number,
+            'dst': number if outbound else '1001',
+            'billsec': str(30 if i % 3 else 0),
+            'disposition': 'ANSWERED' if i % 3 else 'NO ANSWER'
+        })
+    return cdrs
+
+
+class CdrSyncTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), PabxStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        PabxStub.cdrs = []
+        PabxStub.requests = []
+        PabxStub.status = 200
+        PabxStub.payload = None
+
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.tenant_id = f"tenant-{self._testMethodName}"  # O índice de telefones é por tenant
+        self.worker = CdrSyncWorker(page_size=50, max_pages=10)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def _state(self):
+        state = CdrSyncState(tenant_id=self.tenant_id, api_url=self.api_url, auth_user='crm', auth_token='secret')
+        db.session.add(state)
+        db.session.commit()
+        return state
+
+    # ==================== PARSE ====================
+
+    def test_parse_cdr_outbound_from_extension(self):
+        row = parse_cdr({'uniqueid': 'a1', 'calldate': '2026-01-10 09:00:00', 'src': '1001',
+                         'dst': '(11) 98765-4321', 'billsec': '45', 'disposition': 'ANSWERED'})
+        self.assertEqual(row['external_call_id'], 'a1')
+        self.assertEqual(row['direction'], 'outbound')
+        self.assertEqual(row['phone_number'], '+5511987654321')
+        self.assertEqual(row['status'], 'completed')
+        self.assertEqual(row['duration'], 45)
+        self.assertEqual(row['extension'], '1001')
+        # Horário local do PABX gravado em UTC
+        self.assertEqual(row['start_time'], datetime(2026, 1, 10, 12, 0))
+        self.assertEqual(row['end_time'], datetime(2026, 1, 10, 12, 0, 45))
+        self.assertEqual(parse_datetime('2026-01-10T09:00:00Z'), datetime(2026, 1, 10, 9, 0))
+
+    def test_parse_cdr_inbound_and_missing_fields(self):
+        row = parse_cdr({'uniqueid': 'a2', 'calldate': '10/01/2026 09:00:00', 'src': '5511987654321',
+                         'dst': '1001', 'billsec': '0', 'disposition': 'NO ANSWER'})
+        self.assertEqual(row['direction'], 'inbound')
+        self.assertEqual(row['phone_number'], '+5511987654321')
+        self.assertEqual(row['status'], 'missed')
+        self.assertIsNone(parse_cdr({'calldate': '2026-01-10 09:00:00', 'src': '1001'}))
+        self.assertIsNone(parse_cdr({'uniqueid': 'a3', 'calldate': 'ontem'}))
+
+    # ==================== INGESTÃO ====================
+
+    def test_ingest_cdrs_upserts_and_links_leads(self):
+        db.session.add(Lead(name='Cliente', email='cliente@exemplo.com', phone='(11) 98888-0002',
+                            whatsapp='', tenant_id=self.tenant_id))
+        db.session.commit()
+
+        records = make_cdrs(5, datetime(2026, 1, 10, 9, 0))
+        records.append(dict(records[1], billsec='99'))  # Repetido no lote: vale o último
+        records.append({'uniqueid': '', 'calldate': '2026-01-10 10:00:00'})
+        result = ingest_cdrs(self.tenant_id, records, batch_size=2)
+
+        self.assertEqual(result['received'], 7)
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual(Call.query.filter_by(tenant_id=self.tenant_id).count(), 5)
+        self.assertEqual(Call.query.filter_by(external_call_id='cdr-1').one().duration, 99)
+        self.assertIsNotNone(Call.query.filter_by(external_call_id='cdr-2').one().lead_id)
+
+        # Reimportação atualiza sem duplicar e não troca o lead escolhido no CRM
+        call = Call.query.filter_by(external_call_id='cdr-2').one()
+        call.lead_id = None
+        call.notes = 'manual'
+        db.session.commit()
+        ingest_cdrs(self.tenant_id, [dict(records[2], billsec='12', disposition='ANSWERED')])
+        self.assertEqual(Call.query.filter_by(tenant_id=self.tenant_id).count(), 5)
+        call = Call.query.filter_by(external_call_id='cdr-2').one()
+        self.assertEqual(call.duration, 12)
+        self.assertEqual(call.notes, 'manual')
+
+    def test_ingest_cdrs_sets_agent_from_extension_and_updates_queue(self):
+        db.session.add(Role(id=1, name='agente'))
+        db.session.add(User(id='agent-1', email='agente@exemplo.com', password_hash='x', first_name='Ana',
+                            last_name='Lima', role_id=1))
+        db.session.add(TelephonyExtension(tenant_id=self.tenant_id, extension='1001', user_id='agent-1'))
+        db.session.commit()
+
+        records = make_cdrs(2, datetime(2026, 1, 10, 9, 0))
+        records.append(dict(make_cdrs(1, datetime(2026, 1, 10, 9, 0))[0], uniqueid='other', src='2002'))
+        ingest_cdrs(self.tenant_id, records)
+        self.assertEqual(Call.query.filter_by(external_call_id='cdr-0').one().user_id, 'agent-1')
+        self.assertEqual(Call.query.filter_by(external_call_id='cdr-1').one().user_id, 'agent-1')
+        self.assertIsNone(Call.query.filter_by(external_call_id='other').one().user_id)
+
+        ingest_cdrs(self.tenant_id, [dict(records[0], fila='suporte')])
+        call = Call.query.filter_by(external_call_id='cdr-0').one()
+        self.assertEqual(call.queue, 'suporte')
+        self.assertEqual(call.user_id, 'agent-1')
+
+    # ==================== SINCRONIZAÇÃO ====================
+
+    def test_client_sends_period_and_credentials(self):
+        PabxStub.cdrs = make_cdrs(3, datetime(2026, 1, 10, 9, 0))
+        client = PabxCdrClient(self.api_url, 'crm', 'secret')
+        rows = client.fetch_page(datetime(2026, 1, 10, 3), datetime(2026, 1, 11, 3), 1, 2)
+
+        self.assertEqual([row['uniqueid'] for row in rows], ['cdr-0', 'cdr-1'])
+        query = PabxStub.requests[-1]
+        self.assertEqual((query['auth_user'], query['auth_token']), ('crm', 'secret'))
+        self.assertEqual(query['data_inicio'], '2026-01-10 00:00:00')
+        self.assertEqual(query['ordem'], 'asc')
+
+    def test_sync_state_pages_and_advances_cursor(self):
+        PabxStub.cdrs = make_cdrs(120, to_pabx_time(datetime.utcnow()) - timedelta(hours=3))
+        state = self._state()
+
+        result = self.worker.sync_state(state)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['imported'], 120)
+        self.assertEqual(len(PabxStub.requests), 3)  # 50 + 50 + 20
+        self.assertEqual(state.cursor_time, parse_datetime(PabxStub.cdrs[-1]['calldate']))
+        self.assertIsNone(state.last_error)
+
+        # Próxima sincronização só relê a janela de sobreposição
+        PabxStub.cdrs.extend(make_cdrs(125, to_pabx_time(datetime.utcnow()) - timedelta(hours=3))[120:])
+        result = self.worker.sync_state(state)
+        self.assertTrue(result['success'])
+        self.assertLess(result['imported'], 50)
+        self.assertEqual(Call.query.filter_by(tenant_id=self.tenant_id).count(), 125)
+
+    def test_sync_state_records_http_errors(self):
+        PabxStub.status = 500
+        PabxStub.payload = {'error': 'indisponível'}
+        state = self._state()
+
+        result = self.worker.sync_state(state)
+        self.assertFalse(result['success'])
+        self.assertIn('500', state.last_error)
+        self.assertIsNotNone(state.last_sync_at)
+        self.assertIsNone(state.cursor_time)
+
+    def test_sync_state_records_unexpected_errors(self):
+        PabxStub.payload = {'data': ['registro inesperado']}  # Quebra o parse do CDR
+        state = self._state()
+
+        result = self.worker.sync_state(state)
+        self.assertFalse(result['success'])
+        self.assertTrue(state.last_error)
+        self.assertIsNotNone(state.last_sync_at)
+        self.assertEqual(self.worker.get_stats()['counters']['errors'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Testes do cliente HTTP das integrações contra um servidor local (stub HTTP)
+
+Não depende do WhatsApp nem da Evolution API: os serviços apontam para um
+servidor que responde com status configurável por caminho e registra cada
+requisição recebida (com a porta do cliente, para conferir o keep-alive).
+
+Execução: python test_http_client.py (ou pytest test_http_client.py)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from src.services.chatbot_service import EvolutionAPIService, WhatsAppBusinessService
+from src.services.http_client import IntegrationHTTPClient, RateLimitTimeout
+
+
+class IntegrationStub(BaseHTTPRequestHandler):
+    """API de mensagens: responde na ordem os status programados para o caminho (depois, 200)"""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+    lock = threading.Lock()
+    requests = []
+    statuses = {}
+    retry_after = None
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        with IntegrationStub.lock:
+            IntegrationStub.requests.append({
+                'method': self.command, 'path': self.path, 'body': body, 'port': self.client_address[1],
+                'headers': dict(self.headers), 'at': time.monotonic()
+            })
+            pending = IntegrationStub.statuses.get(self.path)
+            status = pending.pop(0) if pending else 200
+
+        content = json.dumps({'messages': [{'id': 'wamid.stub'}]} if status == 200 else {'error': status}).encode()
+        self.send_response(status)
+        if status in (429, 503) and IntegrationStub.retry_after is not None:
+            self.send_header('Retry-After', str(IntegrationStub.retry_after))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class IntegrationHTTPClientTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), IntegrationStub)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        IntegrationStub.requests = []
+        IntegrationStub.statuses = {}
+        IntegrationStub.retry_after = None
+        self.client = IntegrationHTTPClient(timeout=(2.0, 5.0), max_retries=2, backoff_base=0.01, backoff_max=1.0)
+
+    def tearDown(self):
+        self.client.close()
+
+    def _whatsapp(self, phone_number_id='123') -> WhatsAppBusinessService:
+        service = WhatsAppBusinessService('token', phone_number_id, 'waba', base_url=self.base_url + '/v18.0')
+        service.http = self.client
+        self.client.configure_rate_limit(service.rate_key, 1000)
+        return service
+
+    # ==================== POOL ====================
+
+    def test_connection_is_reused_for_the_same_base_url(self):
+        service = self._whatsapp()
+        for i in range(5):
+            self.assertTrue(service.send_text_message('5511999990000', f'oi {i}')['success'])
+
+        self.assertEqual(len(IntegrationStub.requests), 5)
+        self.assertEqual(len({request['port'] for request in IntegrationStub.requests}), 1)
+        request = IntegrationStub.requests[0]
+        self.assertEqual(request['path'], '/v18.0/123/messages')
+        self.assertEqual(request['headers']['Authorization'], 'Bearer token')
+        self.assertEqual(request['body']['text'], {'body': 'oi 0'})
+
+    # ==================== RETRIES ====================
+
+    def test_post_is_retried_on_429_honouring_retry_after(self):
+        IntegrationStub.statuses['/v18.0/123/messages'] = [429, 503]
+        IntegrationStub.retry_after = 0.2
+        service = self._whatsapp()
+
+        started = time.monotonic()
+        self.assertTrue(service.send_text_message('5511999990000', 'oi')['success'])
+        self.assertEqual(len(IntegrationStub.requests), 3)
+        self.assertGreaterEqual(time.monotonic() - started, 0.4)
+
+        metrics = self.client.get_metrics()[f"127.0.0.1:{self.server.server_port}"]
+        self.assertEqual(metrics['retries'], 2)
+        self.assertEqual(metrics['status'], {'429': 1, '503': 1, '200': 1})
+
+    def test_post_is_not_retried_on_500(self):
+        # O servidor pode ter processado a mensagem: repetir duplicaria o envio
+        IntegrationStub.statuses['/v18.0/123/messages'] = [500]
+        result = self._whatsapp().send_text_message('5511999990000', 'oi')
+
+        self.assertFalse(result['success'])
+        self.assertEqual(len(IntegrationStub.requests), 1)
+
+    def test_get_is_retried_until_attempts_run_out(self):
+        IntegrationStub.statuses['/instance/connectionState/loja'] = [502, 502, 502]
+        service = EvolutionAPIService(self.base_url, 'key', 'loja')
+        service.http = self.client
+
+        result = service.get_instance_status()
+        self.assertFalse(result['success'])
+        self.assertEqual(len(IntegrationStub.requests), 3)  # 1 + max_retries
+
+    def test_connection_error_raises_after_retries(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get('http://127.0.0.1:1/indisponivel')
+
+    # ==================== LIMITE DE TAXA ====================
+
+    def test_rate_limit_spaces_calls_per_number(self):
+        service = self._whatsapp()
+        self.client.configure_rate_limit(service.rate_key, 10, burst=1)
+
+        for i in range(4):
+            self.assertTrue(service.send_text_message('5511999990000', f'oi {i}')['success'])
+        times = [request['at'] for request in IntegrationStub.requests]
+        self.assertGreaterEqual(times[-1] - times[0], 0.25)  # 3 intervalos de 0,1s
+
+        # Outro número tem o próprio balde
+        other = self._whatsapp('456')
+        self.client.configure_rate_limit(other.rate_key, 10, burst=1)
+        started = time.monotonic()
+        self.assertTrue(other.send_text_message('5511999990000', 'oi')['success'])
+        self.assertLess(time.monotonic() - started, 0.09)
+
+    def test_rate_limit_wait_is_bounded(self):
+        service = self._whatsapp()
+        self.client.configure_rate_limit(service.rate_key, 0.5, burst=1)
+        self.assertTrue(service.send_text_message('5511999990000', 'primeira')['success'])
+
+        started = time.monotonic()
+        with self.assertRaises(RateLimitTimeout):
+            self.client.post(f"{self.base_url}/v18.0/123/messages", json={}, rate_key=service.rate_key,
+                             throttle_timeout=0.1)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        # O serviço devolve o erro em vez de segurar a thread
+        self.client.throttle_timeout = 0.1
+        result = service.send_text_message('5511999990000', 'segunda')
+        self.assertFalse(result['success'])
+        self.assertEqual(len(IntegrationStub.requests), 1)
+
+        metrics = self.client.get_metrics()[f"127.0.0.1:{self.server.server_port}"]
+        self.assertEqual(metrics['throttle_timeouts'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()